@@ -2,30 +2,31 @@
 """
 Batch clustering analysis.
 
+The files are analyzed in-process by a pool of workers (see
+sa_library/batch_pool.py).
+
 Hazen 01/12
 """
 
 import glob
-import os
 
-import storm_analysis.sa_library.batch_run as batchRun
+import storm_analysis.sa_library.batch_pool as batchPool
 
-def batchAnalysis(input_directory, channel, eps = 40, mc = 10, min_size = 50):
+import storm_analysis.dbscan.dbscan_analysis as dbscanAnalysis
 
-    src_dir = os.path.dirname(__file__)
-    if not (src_dir == ""):
-        src_dir += "/"
-    
-    clusters_exe = src_dir + "dbscan_analysis.py"
 
+def batchAnalysis(input_directory, channel, eps = 40, mc = 10, min_size = 50, image_size = None, max_processes = 2):
+    """
+    Returns a batch_pool.BatchSummary object.
+    """
     # Find appropriate bin files.
     bin_files = glob.glob(input_directory + "*_alist.bin")
     if(len(bin_files)==0):
         bin_files = glob.glob(input_directory + "*_list.bin")
 
-    # Generate command line.
-    cmd_lines = []
-    for filename in bin_files:
+    # Generate jobs.
+    jobs = []
+    for filename in sorted(bin_files):
 
         # skip clustering related bin files
         if ("clusters" in filename) or ("srt" in filename):
@@ -33,14 +34,35 @@ def batchAnalysis(input_directory, channel, eps = 40, mc = 10, min_size = 50):
 
         print("Found:", filename)
 
-        cmd_lines.append(['python', clusters_exe,
-                          "--bin", filename,
-                          "--channel", str(channel),
-                          "--eps", str(eps),
-                          "--mc", str(mc),
-                          "--min_size", str(min_size)])
+        jobs.append([filename,
+                     dbscanJob,
+                     [filename, channel],
+                     {"eps" : eps,
+                      "mc" : mc,
+                      "min_size" : min_size,
+                      "image_size" : image_size}])
+
+    summary = batchPool.batchPool(jobs, max_processes = max_processes)
+    print(summary)
+    return summary
+
 
-    batchRun.batchRun(cmd_lines)
+def dbscanJob(bin_file, channel, eps = 40, mc = 10, min_size = 50, image_size = None):
+    """
+    Cluster a single file, and optionally make the cluster images.
+    """
+    dbscanAnalysis.dbscanAnalysis(bin_file, channel, eps = eps, mc = mc, min_size = min_size)
+
+    if image_size is not None:
+        import storm_analysis.dbscan.cluster_images as clusterImages
+
+        clist_name = bin_file[:-8] + "clusters_size_list.bin"
+        clusterImages.clusterImages(clist_name,
+                                    "DBSCAN Clustering",
+                                    min_size,
+                                    20,
+                                    bin_file[:-8] + "clusters",
+                                    [image_size, image_size])
 
 
 if (__name__ == "__main__"):
@@ -59,8 +81,17 @@ if (__name__ == "__main__"):
                         help = "The DBSCAN mc parameter. The default is 10.")
     parser.add_argument('--min_size', dest='min_size', type=int, required=False, default=50,
                         help = "The minimum cluster size to include when calculating cluster statistics. The default is 50.")
+    parser.add_argument('--image_size', dest='image_size', type=int, required=False,
+                        help = "The size of the original STORM image in pixels. If this is specified cluster images will also be made.")
+    parser.add_argument('--processes', dest='processes', type=int, required=False, default=2,
+                        help = "The number of worker processes to use. The default is 2.")
 
     args = parser.parse_args()
 
-    batchAnalysis(args.directory, args.channel, args.epsilon, args.mc, args.min_size)
-
+    batchAnalysis(args.directory,
+                  args.channel,
+                  eps = args.epsilon,
+                  mc = args.mc,
+                  min_size = args.min_size,
+                  image_size = args.image_size,
+                  max_processes = args.processes)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Compare the throughput of serial and threaded multi-plane fitting
+(see the 'fit_threads' parameter) for different numbers of planes.
+
+This uses a simulated Gaussian PSF with the PSF FFT fitter, so it
+doesn't need any other files. The peaks are fit to the images of
+the PSFs plus Poisson noise.
+
+Hazen 10/26
+"""
+import numpy
+import os
+import pickle
+import tempfile
+import time
+
+import storm_analysis.sa_library.ia_utilities_c as utilC
+
+import storm_analysis.multi_plane.mp_fit_c as mpFitC
+import storm_analysis.psf_fft.psf_fn as psfFn
+
+
+def makePSF(filename, psf_size = 21, z_size = 21, z_range = 0.5):
+    """
+    Make a PSF FFT PSF file with a Gaussian PSF whose width changes with z.
+    """
+    zv = numpy.linspace(-z_range, z_range, z_size)
+    xv = numpy.arange(psf_size) - 0.5*(psf_size - 1)
+    [xx, yy] = numpy.meshgrid(xv, xv, indexing = "ij")
+
+    psf = numpy.zeros((z_size, psf_size, psf_size))
+    for i, z in enumerate(zv):
+        sigma = 1.5 + 2.0 * z * z
+        psf[i,:,:] = numpy.exp(-(xx*xx + yy*yy)/(2.0*sigma*sigma))
+
+    psf_dict = {"psf" : psf/numpy.max(psf),
+                "pixel_size" : 0.1,
+                "zmin" : -1000.0 * z_range,
+                "zmax" : 1000.0 * z_range}
+    with open(filename, "wb") as fp:
+        pickle.dump(psf_dict, fp)
+
+def makePeaks(n_planes, n_peaks, im_size, margin, background):
+    """
+    Make the (per plane) peak array, the peaks are on a grid.
+    """
+    n_side = int(numpy.ceil(numpy.sqrt(n_peaks)))
+    spacing = float(im_size - 2*margin)/float(n_side)
+
+    peaks = numpy.zeros((n_peaks, utilC.getNPeakPar()))
+    for i in range(n_peaks):
+        peaks[i,utilC.getHeightIndex()] = 1000.0
+        peaks[i,utilC.getXCenterIndex()] = margin + spacing * (0.5 + (i % n_side))
+        peaks[i,utilC.getYCenterIndex()] = margin + spacing * (0.5 + (i // n_side))
+        peaks[i,utilC.getXWidthIndex()] = 1.0
+        peaks[i,utilC.getYWidthIndex()] = 1.0
+        peaks[i,utilC.getBackgroundIndex()] = background
+
+    return numpy.tile(peaks, (n_planes, 1))
+
+def fitPlanes(psf_filename, n_planes, n_threads, n_peaks = 400, im_size = 256, reps = 3):
+    """
+    Fit n_peaks in each of n_planes images using n_threads threads.
+
+    Returns [best time, fit results, number of threads used].
+    """
+    background = 10.0
+    psf_objects = []
+    for i in range(n_planes):
+        psf_objects.append(psfFn.PSFFn(psf_filename = psf_filename))
+    margin = psf_objects[0].getMargin()
+    size = im_size + 2*margin
+
+    # Create the images from the PSFs at random (per peak) z values.
+    numpy.random.seed(1)
+    peaks = makePeaks(n_planes, n_peaks, im_size, margin, background)
+    z_values = numpy.random.uniform(low = -0.2, high = 0.2, size = n_peaks)
+
+    images = []
+    for i in range(n_planes):
+        image = background * numpy.ones((size, size))
+        for j in range(n_peaks):
+            psf = psf_objects[i].getPSF(1000.0 * (z_values[j] + 0.1 * i))
+            hs = psf.shape[0]//2
+            x = int(round(peaks[j,utilC.getXCenterIndex()]))
+            y = int(round(peaks[j,utilC.getYCenterIndex()]))
+            image[y-hs:y+hs+1,x-hs:x+hs+1] += 1000.0 * psf/numpy.max(psf)
+        images.append(numpy.random.poisson(image).astype(numpy.float64))
+
+    # The planes are all registered with each other.
+    xt = numpy.tile(numpy.array([0.0, 1.0, 0.0]), (n_planes, 1))
+    yt = numpy.tile(numpy.array([0.0, 0.0, 1.0]), (n_planes, 1))
+
+    mfitter = mpFitC.MPPSFFnFit(independent_heights = 0,
+                                psf_objects = psf_objects,
+                                scmos_cals = None)
+    for i in range(n_planes):
+        mfitter.setVariance(numpy.zeros((size, size)), i)
+    mfitter.setMapping(xt, yt, xt, yt)
+    mfitter.setWeights(None)
+    n_threads = mfitter.setThreads(n_threads)
+
+    best_time = None
+    for i in range(reps):
+        for j in range(n_planes):
+            mfitter.newImage(images[j], j)
+
+        start_time = time.time()
+        results = mfitter.doFit(numpy.copy(peaks))
+        elapsed = time.time() - start_time
+        if (best_time is None) or (elapsed < best_time):
+            best_time = elapsed
+
+    mfitter.cleanup(verbose = False)
+    return [best_time, results, n_threads]
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Multi-plane fitting threads benchmark.')
+
+    parser.add_argument('--planes', dest='planes', type=int, nargs = '*', required=False, default = [2, 4, 8],
+                        help = "The number(s) of planes to test, the default is 2, 4 and 8.")
+    parser.add_argument('--threads', dest='threads', type=int, required=False, default = 0,
+                        help = "The number of threads for threaded fitting, the default (0) is all the cores.")
+    parser.add_argument('--peaks', dest='peaks', type=int, required=False, default = 400,
+                        help = "The number of peaks per plane, the default is 400.")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        psf_filename = os.path.join(tmp_dir, "psf.psf")
+        makePSF(psf_filename)
+
+        print("planes  serial (s)  threaded (s)  threads  speed-up  same results")
+        for n_planes in args.planes:
+            # The results should be identical as the peaks are fit in the same order.
+            [t_serial, r_serial, n_serial] = fitPlanes(psf_filename, n_planes, 1, n_peaks = args.peaks)
+            [t_threaded, r_threaded, n_threaded] = fitPlanes(psf_filename, n_planes, args.threads, n_peaks = args.peaks)
+            print("{0:6d}  {1:10.3f}  {2:12.3f}  {3:7d}  {4:8.2f}  {5}".format(n_planes,
+                                                                             t_serial,
+                                                                             t_threaded,
+                                                                             n_threaded,
+                                                                             t_serial/t_threaded,
+                                                                             numpy.array_equal(r_serial, r_threaded, equal_nan = True)))
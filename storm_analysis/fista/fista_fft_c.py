@@ -9,11 +9,15 @@ import ctypes
 import numpy
 from numpy.ctypeslib import ndpointer
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.loadclib as loadclib
 import storm_analysis.sa_library.recenter_psf as recenterPSF
 
 import storm_analysis.fista.fista_3d as fista3D
 
+# Apply the FFTW threads setting from the environment.
+fftwThreadsC.initialize()
+
 fista_fft = loadclib.loadCLibrary("storm_analysis.fista", "fista_fft")
 
 # C interface definition
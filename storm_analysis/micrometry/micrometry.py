@@ -19,11 +19,10 @@ import matplotlib
 import matplotlib.pyplot as pyplot
 import numpy
 import pickle
-import scipy
-import scipy.spatial
 
 import storm_analysis.sa_library.i3dtype as i3dtype
 import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.spatial_index as spatialIndex
 
 import storm_analysis.micrometry.quads as quads
 
@@ -56,7 +55,7 @@ def makeTreeAndQuads(x, y, min_size = None, max_size = None, max_neighbors = 10)
     """
     Make a KD tree and a list of quads from x, y points.
     """
-    kd = scipy.spatial.KDTree(numpy.stack((x, y), axis = -1))
+    kd = spatialIndex.SpatialIndex(x = x, y = y)
     m_quads = quads.makeQuads(kd,
                               min_size = min_size,
                               max_size = max_size,
@@ -85,7 +85,7 @@ def makeQuads(kd, min_size = None, max_size = None, max_neighbors = 10):
           proportional to the number of points times max_neighbors 
           to the 3rd power.
 
-    kd - A scipy.spatial.KDTree object.
+    kd - A sa_library.spatial_index.SpatialIndex object.
     min_size - A,B points must be at least this distance from each
                other.
     max_size - A,B points must be at most this distance from each 
@@ -228,14 +228,13 @@ if (__name__ == "__main__"):
 
         import time
 
-        import scipy
-        import scipy.spatial
+        import storm_analysis.sa_library.spatial_index as spatialIndex
 
         numpy.random.seed(0)
         xp = numpy.random.uniform(low = 0.0, high = 10.0, size = 300)
         yp = numpy.random.uniform(low = 0.0, high = 10.0, size = 300)
     
-        kd = scipy.spatial.KDTree(numpy.stack((xp, yp), axis = -1))
+        kd = spatialIndex.SpatialIndex(x = xp, y = yp)
 
         start_time = time.time()
         quads = makeQuads(kd)
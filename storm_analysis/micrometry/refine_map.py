@@ -10,11 +10,9 @@ Hazen 07/17
 
 import numpy
 import pickle
-import scipy
-import scipy.spatial
 
 import storm_analysis.sa_library.i3dtype as i3dtype
-import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.spatial_index as spatialIndex
 
 import storm_analysis.micrometry.micrometry as micrometry
 
@@ -66,7 +64,7 @@ def refineTransform(kd1, kd2, transform):
     """
     Refines the transform.
 
-    kd1 and kd2 are scipy.spatial.KDTree objects.
+    kd1 and kd2 are sa_library.spatial_index.SpatialIndex objects.
     transform is an initial guess for the transform.
     
     Returns the refined transform and it's inverse.
@@ -101,12 +99,10 @@ if (__name__ == "__main__"):
     args = parser.parse_args()
 
     # Load locs1.
-    i3_data1 = readinsight3.loadI3File(args.locs1)
-    kd1 = scipy.spatial.KDTree(numpy.stack((i3_data1['xc'], i3_data1['yc']), axis = -1))
+    [i3_data1, kd1] = spatialIndex.loadI3Index(args.locs1)
 
     # Load locs2.
-    i3_data2 = readinsight3.loadI3File(args.locs2)
-    kd2 = scipy.spatial.KDTree(numpy.stack((i3_data2['xc'], i3_data2['yc']), axis = -1))
+    [i3_data2, kd2] = spatialIndex.loadI3Index(args.locs2)
 
     # Load 'first guess' transform.
     with open(args.mm_map, 'rb') as fp:
@@ -4,89 +4,201 @@ Analysis IO specialized for multiplane fitting.
 
 Hazen 09/17
 """
+import concurrent.futures
 import numpy
+import os
 
+import storm_analysis.multi_plane.channel_join as channelJoin
 import storm_analysis.multi_plane.mp_utilities_c as mpUtilC
 
 import storm_analysis.sa_library.analysis_io as analysisIO
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.static_background as static_background
 import storm_analysis.sa_library.writeinsight3 as writeinsight3
 
 
 class MPDataWriter(analysisIO.DataWriter):
     """
     Data writer specialized for multi-plane data.
-    """
-    def __init__(self, parameters = None, **kwds):
-        kwds["parameters"] = parameters
-        super(MPDataWriter, self).__init__(**kwds)
 
-        self.offsets = []
+    The localizations for all the planes are buffered and written in
+    large blocks, either to one file per plane or, if the parameter
+    'combined_channels' is set, to a single combined file (see
+    multi_plane/channel_join.py for the combined file layout).
 
-        # Figure out how many planes there are.
+    If the localization file(s) already exist the analysis is resumed,
+    only the headers and a few localizations are read to figure out
+    where.
+    """
+    def __init__(self, data_file = None, parameters = None, **kwds):
+
+        # These are needed by openFile(), which is called by the
+        # base class __init__().
+        self.combined = (parameters.getAttr("combined_channels", 0) != 0)
         self.n_planes = len(mpUtilC.getExtAttrs(parameters))
+        self.offsets = list(map(parameters.getAttr, mpUtilC.getOffsetAttrs(parameters)))
 
-        # Save frame offsets for each plane.
-        for offset in mpUtilC.getOffsetAttrs(parameters):
-            self.offsets.append(parameters.getAttr(offset))        
+        if self.combined:
+            self.filenames = [data_file]
+        else:
+            self.filenames = [data_file]
+            for i in range(1, self.n_planes):
+                self.filenames.append(data_file[:-4] + "_ch" + str(i) + ".bin")
 
-        # Adjust starting frame based on channel 0 offset.
-        if (self.start_frame > 0) and (self.offsets[0] != 0):
-            self.start_frame += self.offsets[0]
-            print("Adjusted start frame to", self.start_frame, "based on channel 0 offset.")
-        
-        # Create writers for the other planes.
-        #
-        # FIXME: This won't work for existing I3 files.
-        #
-        assert(self.start_frame == 0)        
-        self.i3_writers = [self.i3data]
-        for i in range(1, self.n_planes):
-            fname = self.filename[:-4] + "_ch" + str(i) + ".bin"
-            self.i3_writers.append(writeinsight3.I3Writer(fname))
+        kwds["data_file"] = data_file
+        kwds["parameters"] = parameters
+        super(MPDataWriter, self).__init__(**kwds)
+
+        self.buffer = []
+        self.buffered = 0
+        self.write_buffer = parameters.getAttr("write_buffer", 20000)
 
     def addPeaks(self, peaks, movie_reader):
         assert((peaks.shape[0] % self.n_planes) == 0)
 
         self.n_added = int(peaks.shape[0]/self.n_planes)
-        for i in range(self.n_planes):
-            start = i * self.n_added
-            stop = (i+1) * self.n_added
-            self.i3_writers[i].addMultiFitMolecules(peaks[start:stop,:],
-                                                    movie_reader.getMovieX(),
-                                                    movie_reader.getMovieY(),
-                                                    movie_reader.getCurrentFrameNumber() + self.offsets[i],
-                                                    self.pixel_size,
-                                                    self.inverted)
+
+        # The peaks are ordered by plane, convert them all at once then
+        # correct the frame numbers for the plane offsets.
+        i3_data = i3dtype.createFromMultiFit(peaks,
+                                             movie_reader.getMovieX(),
+                                             movie_reader.getMovieY(),
+                                             movie_reader.getCurrentFrameNumber(),
+                                             self.pixel_size,
+                                             self.inverted).reshape(self.n_planes, self.n_added)
+        i3_data['fr'] += numpy.array(self.offsets, dtype = numpy.int32)[:,None]
+
+        self.buffer.append(i3_data)
+        self.buffered += self.n_added
+        if (self.buffered >= self.write_buffer):
+            self.flush()
 
         self.total_peaks += self.n_added
 
     def close(self, metadata = None):
+        self.flush()
         for i3w in self.i3_writers:
             if metadata is None:
                 i3w.close()
             else:
                 i3w.closeWithMetadata(metadata)
 
+    def flush(self):
+        """
+        Write out the buffered localizations.
+        """
+        if (len(self.buffer) == 0):
+            return
+
+        i3_data = numpy.concatenate(self.buffer, axis = 1)
+        if self.combined:
+            self.i3_writers[0].addMolecules(channelJoin.combineChannels(list(i3_data)))
+        else:
+            for i in range(self.n_planes):
+                self.i3_writers[i].addMolecules(i3_data[i])
+
+        self.buffer = []
+        self.buffered = 0
+
+    def openFile(self):
+        [self.start_frame, self.total_peaks] = self.resumePoint()
+
+        if (self.total_peaks > 0):
+            print("Found", self.filename)
+            print(" Starting analysis at frame:", self.start_frame)
+            stride = self.n_planes if self.combined else 1
+            self.i3_writers = []
+            for fname in self.filenames:
+                self.i3_writers.append(writeinsight3.I3Appender(fname, self.total_peaks * stride))
+        elif self.combined:
+            self.i3_writers = [channelJoin.combinedWriter(self.filenames[0], self.n_planes)]
+        else:
+            self.i3_writers = [writeinsight3.I3Writer(fname) for fname in self.filenames]
+
+    def resumePoint(self):
+        """
+        Returns [start frame, number of localizations to keep] for the
+        existing localization file(s).
+
+        The last frame in the file(s) may be incomplete, for example if
+        the analysis was stopped while the buffer was being written, so
+        the localizations in this frame are discarded and the analysis
+        restarts at this frame.
+        """
+        for fname in self.filenames:
+            if not os.path.exists(fname):
+                return [0, 0]
+
+        if self.combined:
+            if (channelJoin.combinedChannels(self.filenames[0]) != self.n_planes):
+                raise channelJoin.ChannelJoinException(self.filenames[0] + " is not a combined file with " + str(self.n_planes) + " channels.")
+            stride = self.n_planes
+            n_locs = readinsight3.countLocalizations(self.filenames[0])//stride
+        else:
+            stride = 1
+            n_locs = min(map(readinsight3.countLocalizations, self.filenames))
+
+        if (n_locs == 0):
+            return [0, 0]
+
+        # Binary search for the start of the last frame, the localizations
+        # are in frame order. Using a memory map means that we only read
+        # the parts of the file that we need.
+        fr = numpy.memmap(self.filenames[0],
+                          dtype = i3dtype.i3DataType(),
+                          mode = "r",
+                          offset = 16,
+                          shape = (n_locs * stride,))['fr']
+        last_frame = fr[(n_locs - 1) * stride]
+        low = 0
+        high = n_locs - 1
+        while (low < high):
+            mid = (low + high)//2
+            if (fr[mid * stride] < last_frame):
+                low = mid + 1
+            else:
+                high = mid
+        del fr
+
+        # 'fr' is one based and includes the channel 0 offset.
+        return [int(last_frame) - 1 - self.offsets[0], low]
+
     
 class MPMovieReader(object):
     """
     analysisIO.MovieReader like object for multi-plane data.
 
+    The planes are loaded (and calibrated) in parallel, one thread per
+    plane, into a pre-allocated (plane, y, x) buffer. If prefetch is True
+    the next frame is loaded while the current frame is being analyzed.
+
     Note: This uses channel 0 as the reference length and assumes
           that the movies for all the other channels are at least
           this length or longer.
+
+    Note: The frames returned by getFrame() are views into a buffer that
+          will be re-used, so they are only valid until the next call
+          to nextFrame().
     """
-    def __init__(self, base_name = None, parameters = None, **kwds):
+    def __init__(self, base_name = None, parameters = None, prefetch = True, **kwds):
         super(MPMovieReader, self).__init__(**kwds)
 
         self.backgrounds = []
         self.bg_estimators = []
+        self.buffer_index = 0
+        self.buffers = None
         self.cur_frame = 0
         self.frames = []
+        self.load_executor = None
         self.max_frame = 0
         self.offsets = []
         self.parameters = parameters
         self.planes = []
+        self.prefetch = prefetch
+        self.prefetch_executor = None
+        self.prefetch_frame = None
+        self.prefetch_future = None
 
         #
         # Load the movies and offsets for each plane/channel. At present
@@ -110,6 +222,17 @@ class MPMovieReader(object):
             assert(self.movie_x == self.planes[i].filmSize()[0])
             assert(self.movie_y == self.planes[i].filmSize()[1])
         
+    def close(self):
+        """
+        Stop the loading threads.
+        """
+        self.waitForPrefetch()
+        for executor in [self.load_executor, self.prefetch_executor]:
+            if executor is not None:
+                executor.shutdown()
+        self.load_executor = None
+        self.prefetch_executor = None
+
     def getBackground(self, plane):
         if (len(self.backgrounds) > 0):
             return self.backgrounds[plane]
@@ -132,24 +255,64 @@ class MPMovieReader(object):
         return self.movie_y
     
     def hashID(self):
+        self.waitForPrefetch()
         return self.planes[0].hashID()
 
+    def loadFrames(self, frame_number, buffer_index):
+        """
+        Load all of the planes of a frame into one of the buffers, one
+        thread per plane.
+
+        Returns [frames, backgrounds].
+        """
+        frames = self.buffers[buffer_index]
+
+        def loadPlane(i):
+
+            # Update background estimate. This is done in the same thread
+            # as the frame loading as both read from the same movie.
+            bg = None
+            if (len(self.bg_estimators) > 0):
+                bg = self.bg_estimators[i].estimateBG(frame_number + self.offsets[i])
+
+            # Load plane & remove all values less than 1.0 as we are doing MLE fitting.
+            self.planes[i].loadAFrameInto(frame_number + self.offsets[i], frames[i])
+            numpy.maximum(frames[i], 1.0, out = frames[i])
+            return bg
+
+        backgrounds = list(self.load_executor.map(loadPlane, range(len(self.planes))))
+        if (len(self.bg_estimators) == 0):
+            backgrounds = []
+        return [frames, backgrounds]
+        
     def nextFrame(self):
         if (self.cur_frame < self.max_frame):
 
-            # Update background estimate.
-            self.backgrounds = []
-            for i, bg_estimator in enumerate(self.bg_estimators):
-                self.backgrounds.append(bg_estimator.estimateBG(self.cur_frame + self.offsets[i]))
+            if self.load_executor is None:
+                self.load_executor = concurrent.futures.ThreadPoolExecutor(max_workers = len(self.planes))
+                if self.prefetch:
+                    self.prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
 
-            # Load planes & remove all values less than 1.0 as we are doing MLE fitting.
-            self.frames = []
-            for i, plane in enumerate(self.planes):
-                frame = plane.loadAFrame(self.cur_frame + self.offsets[i])
-                mask = (frame < 1.0)
-                if (numpy.sum(mask) > 0):
-                    frame[mask] = 1.0
-                self.frames.append(frame)
+            if self.buffers is None:
+                self.buffers = numpy.zeros((2, len(self.planes), self.movie_y, self.movie_x))
+
+            # Use the prefetched frame if we have it, otherwise load it now.
+            if (self.prefetch_frame == self.cur_frame):
+                [frames, self.backgrounds] = self.prefetch_future.result()
+                self.prefetch_frame = None
+                self.prefetch_future = None
+            else:
+                self.waitForPrefetch()
+                [frames, self.backgrounds] = self.loadFrames(self.cur_frame, self.buffer_index)
+            self.frames = list(frames)
+
+            # Start loading the next frame into the other buffer.
+            self.buffer_index = 1 - self.buffer_index
+            if self.prefetch and ((self.cur_frame + 1) < self.max_frame):
+                self.prefetch_frame = self.cur_frame + 1
+                self.prefetch_future = self.prefetch_executor.submit(self.loadFrames,
+                                                                     self.prefetch_frame,
+                                                                     self.buffer_index)
 
             self.cur_frame += 1
             return True
@@ -158,6 +321,9 @@ class MPMovieReader(object):
         
     def setup(self, start_frame):
 
+        # Make sure we are not still loading a frame.
+        self.waitForPrefetch()
+        
         # Figure out where to start.
         self.cur_frame = start_frame
         if self.parameters.hasAttr("start_frame"):
@@ -189,8 +355,18 @@ class MPMovieReader(object):
         if (self.parameters.getAttr("static_background_estimate", 0) > 0):
             print("Using static background estimator.")
             s_size = self.parameters.getAttr("static_background_estimate")
+            self.bg_estimators = []
             for i in range(len(self.planes)):
                 bg_est = static_background.StaticBGEstimator(self.planes[i],
                                                              start_frame = self.cur_frame + self.offsets[i],
                                                              sample_size = s_size)
                 self.bg_estimators.append(bg_est)
+
+    def waitForPrefetch(self):
+        """
+        Wait for the prefetch (if any) to finish and discard it.
+        """
+        if self.prefetch_future is not None:
+            self.prefetch_future.result()
+        self.prefetch_frame = None
+        self.prefetch_future = None
@@ -3,9 +3,15 @@
 Performs all the steps necessary to create the merged
 heights file.
 
+If the localizations are in a combined file this is first split
+into per channel files, then the channel 0 localizations are tracked,
+averaged and (optionally) drift corrected as standardAnalysis() would
+have done for per channel files.
+
 Hazen 08/17
 """
 
+import storm_analysis.multi_plane.channel_join as channelJoin
 import storm_analysis.multi_plane.copy_tracking as copyTracking
 import storm_analysis.multi_plane.merge_heights as mergeHeights
 import storm_analysis.multi_plane.mp_utilities_c as mpUtilC
@@ -13,12 +19,35 @@ import storm_analysis.multi_plane.mp_utilities_c as mpUtilC
 import storm_analysis.sa_library.parameters as params
 
 import storm_analysis.sa_utilities.avemlist_c as avemlistC
+import storm_analysis.sa_utilities.std_analysis as stdAnalysis
 
 
-def measureColor(basename, n_planes):
-
+def measureColor(basename, n_planes, parameters = None):
+    """
+    parameters are only needed for combined files, these are used
+    for tracking, averaging and drift correcting channel 0.
+    """
     ref_name = basename + "mlist.bin"
+    ch_names = [basename + "mlist_ch" + str(i) + ".bin" for i in range(n_planes)]
     ch_alist_names = [basename + "alist.bin"]
+
+    if (channelJoin.combinedChannels(ref_name) > 0):
+        if parameters is None:
+            raise ValueError("Analysis parameters are required for the combined file " + ref_name)
+
+        print("Splitting combined file.")
+        channelJoin.splitChannels(ref_name, ch_names)
+
+        ref_name = ch_names[0]
+        ch_alist_names = [basename + "alist_ch0.bin"]
+        stdAnalysis.tracking(ref_name, parameters)
+        avemlistC.avemlist(ref_name, ch_alist_names[0])
+
+        if (parameters.getAttr("drift_correction", 0) != 0):
+            print("Drift Correction")
+            stdAnalysis.driftCorrection([ref_name, ch_alist_names[0]],
+                                        parameters,
+                                        drift_name = basename + "drift.txt")
     
     for i in range(1, n_planes):
         print("Processing plane", i)
@@ -27,7 +56,7 @@ def measureColor(basename, n_planes):
         # 1. Create localization files for the other channels with
         #    channel 0 tracking information.
         #
-        ch_name = basename + "mlist_ch" + str(i) + ".bin"
+        ch_name = ch_names[i]
         tracked_name = basename + "ch" + str(i) + "_tracked.bin"
         copyTracking.copyTracking(ref_name, ch_name, tracked_name)
 
@@ -64,4 +93,4 @@ if (__name__ == "__main__"):
 
     parameters = params.ParametersMultiplane().initFromFile(args.xml)
 
-    measureColor(args.basename, mpUtilC.getNChannels(parameters))
+    measureColor(args.basename, mpUtilC.getNChannels(parameters), parameters = parameters)
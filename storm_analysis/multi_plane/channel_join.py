@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Streaming join of the (aligned) per channel localization files
+of a multi-plane analysis.
+
+The localization files for the different channels of a multi-plane
+analysis have the same number of localizations in the same order,
+i.e. localization i in each file is the same molecule. ChannelJoin
+reads them block by block in lockstep, so the blocks always line up,
+and removes the bad localizations from all the channels at once.
+
+The localizations can also be saved in a single combined file. In
+this file the localizations for the different channels follow each
+other, i.e. localization i of channel c is record i * n_channels + c,
+and the 'lk' field is the channel number. Combined files are marked
+by storing minus the number of channels in the 'frames' field of the
+file header, see combinedWriter(). The tracking programs do not work
+with these files, use splitChannels() to create the per channel files
+first.
+
+Hazen 10/26
+"""
+import numpy
+
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.writeinsight3 as writeinsight3
+
+
+class ChannelJoinException(Exception):
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+class ChannelJoin(object):
+    """
+    Reads several aligned localization files in lockstep.
+    """
+    def __init__(self, filenames, block_size = 400000, good_only = True, **kwds):
+        """
+        filenames - The localization file names, one for each channel, or
+                    the name of a single combined file.
+        block_size - The number of localizations to read at a time.
+        good_only - Only return the localizations that are not in category
+                    9 in any of the channels.
+        """
+        super(ChannelJoin, self).__init__(**kwds)
+
+        self.block_size = block_size
+        self.good_only = good_only
+
+        # Check for a combined file.
+        self.n_combined = 0
+        if (len(filenames) == 1):
+            self.n_combined = combinedChannels(filenames[0])
+
+        # max_to_load = 0 so the readers don't load the whole file.
+        self.i3_readers = []
+        for filename in filenames:
+            self.i3_readers.append(readinsight3.I3Reader(filename, max_to_load = 0))
+
+        if (self.n_combined > 0):
+            self.molecules = self.i3_readers[0].getNumberMolecules()//self.n_combined
+            if ((self.molecules * self.n_combined) != self.i3_readers[0].getNumberMolecules()):
+                self.close()
+                raise ChannelJoinException("Incomplete localizations in " + filenames[0])
+        else:
+            self.molecules = self.i3_readers[0].getNumberMolecules()
+            for i3_reader in self.i3_readers:
+                if (i3_reader.getNumberMolecules() != self.molecules):
+                    self.close()
+                    raise ChannelJoinException("Different number of localizations in " + i3_reader.getFilename() + " and " + filenames[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        self.reset()
+        while True:
+            i3_data = self.nextBlock()
+            if i3_data is False:
+                return
+            yield i3_data
+
+    def close(self):
+        for i3_reader in self.i3_readers:
+            i3_reader.close()
+
+    def getNumberChannels(self):
+        if (self.n_combined > 0):
+            return self.n_combined
+        else:
+            return len(self.i3_readers)
+
+    def getNumberMolecules(self):
+        return self.molecules
+
+    def nextBlock(self):
+        """
+        Returns a list with the next block of localizations for each
+        channel, or False if all the localizations have been read.
+        """
+        if (self.n_combined > 0):
+            data = self.i3_readers[0].nextBlock(block_size = self.block_size * self.n_combined, good_only = False)
+            if data is False:
+                return False
+            data = data.reshape(-1, self.n_combined)
+            i3_data = [numpy.ascontiguousarray(data[:,i]) for i in range(self.n_combined)]
+
+        else:
+            i3_data = []
+            for i3_reader in self.i3_readers:
+                i3_data.append(i3_reader.nextBlock(block_size = self.block_size, good_only = False))
+
+            if i3_data[0] is False:
+                return False
+
+        if self.good_only:
+            mask = numpy.ones(i3_data[0].size, dtype = bool)
+            for elt in i3_data:
+                mask = mask & (elt['c'] != 9)
+            if not numpy.all(mask):
+                i3_data = [i3dtype.maskData(elt, mask) for elt in i3_data]
+
+        return i3_data
+
+    def reset(self):
+        for i3_reader in self.i3_readers:
+            i3_reader.resetFp()
+
+
+def combineChannels(i3_data):
+    """
+    Returns the combined file version of a list of (aligned) per channel
+    localizations, with the channel number in the 'lk' field.
+    """
+    n_channels = len(i3_data)
+    combined = numpy.empty((i3_data[0].size, n_channels), dtype = i3dtype.i3DataType())
+    for i, elt in enumerate(i3_data):
+        combined[:,i] = elt
+        combined[:,i]['lk'] = i
+    return combined.reshape(-1)
+
+def combinedChannels(filename):
+    """
+    Returns the number of channels if filename is a combined file,
+    otherwise 0. Only the file header is read, so this also works
+    for files that were not closed properly.
+    """
+    with open(filename, "rb") as fp:
+        [frames, molecules, version, status] = readinsight3.readHeader(fp, False)
+    return max(0, -frames)
+
+def combinedWriter(filename, n_channels):
+    """
+    Returns an I3Writer for a combined file with n_channels channels.
+    """
+    return writeinsight3.I3Writer(filename, frames = -n_channels)
+
+def joinField(i3_data, field):
+    """
+    Returns a (n_localizations, n_channels) array with the values
+    of field in each channel.
+    """
+    return numpy.stack([elt[field] for elt in i3_data], axis = 1)
+
+def splitChannels(combined_filename, channel_filenames, block_size = 400000):
+    """
+    Splits a combined file into per channel files in a single pass.
+    """
+    with ChannelJoin([combined_filename], block_size = block_size, good_only = False) as join:
+        assert (join.getNumberChannels() == len(channel_filenames)), "Expected " + str(join.getNumberChannels()) + " file names."
+        i3_writers = [writeinsight3.I3Writer(filename) for filename in channel_filenames]
+        for i3_data in join:
+            for i, elt in enumerate(i3_data):
+                elt['lk'] = -1
+                i3_writers[i].addMolecules(elt)
+
+    for i3_writer in i3_writers:
+        i3_writer.close()
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Split a combined multi-plane localization file.')
+
+    parser.add_argument('--bin', dest='combined', type=str, required=True,
+                        help = "The name of the combined localization file.")
+    parser.add_argument('--channels', dest='channels', type=str, required=True, nargs = '*',
+                        help = "The names of the per channel localization files to create.")
+
+    args = parser.parse_args()
+
+    splitChannels(args.combined, args.channels)
@@ -10,6 +10,11 @@ common in the images from the different cameras.
 Note: This assumes Poisson statistics when estimating
       the background.
 
+The frames are loaded and background subtracted in blocks. Each
+frame is only processed once, the FFT of each frame is re-used in
+all the iterations of the background estimation, and the scores
+for all the offsets in the search range are calculated together.
+
 Hazen 08/17
 """
 import numpy
@@ -20,14 +25,80 @@ import storm_analysis.multi_plane.mp_utilities_c as mpUtilC
 
 import storm_analysis.sa_library.affine_transform_c as affineTransformC
 import storm_analysis.sa_library.datareader as datareader
-import storm_analysis.sa_library.matched_filter_c as matchedFilterC
 import storm_analysis.sa_library.parameters as params
+import storm_analysis.sa_library.recenter_psf as recenterPSF
 
 import storm_analysis.simulator.draw_gaussians_c as dg
 
 import storm_analysis.spliner.spline_to_psf as splineToPSF
 
 
+class FindOffsetsException(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+class StackBackgroundEstimator(object):
+    """
+    Does the same background estimation as estimateBackground() but on
+    a stack of frames (n, x, y) at once, using numpy's FFT. The FFTs of
+    the filters and of the frames are calculated once and re-used.
+    """
+    def __init__(self, bg_psf = None, fg_psf = None, reps = 5, threshold = 2.0, **kwds):
+        """
+        bg_psf - The PSF for estimating the background.
+        fg_psf - The PSF for estimating the foreground.
+        reps - Number of iterations of estimation improvement.
+        threshold - Foreground versus background significance in units of sigma.
+        """
+        super(StackBackgroundEstimator, self).__init__(**kwds)
+
+        self.reps = reps
+        self.shape = bg_psf.shape
+        self.threshold = threshold
+
+        self.bg_fft = numpy.fft.rfft2(recenterPSF.recenterPSF(bg_psf))
+        self.fg_fft = numpy.fft.rfft2(recenterPSF.recenterPSF(fg_psf))
+        self.var_fft = numpy.fft.rfft2(recenterPSF.recenterPSF(fg_psf*fg_psf))
+
+    def estimateBackground(self, frames):
+        """
+        frames - A (n, x, y) numpy array of images.
+
+        Returns the (n, x, y) background estimates.
+        """
+        frames_fft = numpy.fft.rfft2(frames)
+
+        # Smooth image as an initial estimate of the background.
+        bg_estimate_fft = frames_fft * self.bg_fft
+        bg_estimate = numpy.fft.irfft2(bg_estimate_fft, s = self.shape)
+
+        # Smooth background subtracted image as initial
+        # estimation of the foreground.
+        fg_estimate = numpy.fft.irfft2((frames_fft - bg_estimate_fft) * self.fg_fft, s = self.shape)
+
+        # Iterative update of the background estimate.
+        for i in range(self.reps):
+
+            # Calculate variance of the background estimate.
+            bg_variance = numpy.fft.irfft2(bg_estimate_fft * self.var_fft, s = self.shape)
+
+            # Replace regions that are likely foreground with the
+            # current background estimate.
+            mask = (fg_estimate/numpy.sqrt(bg_variance) > self.threshold)
+            bg_frames = numpy.where(mask, bg_estimate, frames)
+
+            # Update foreground and background estimates.
+            bg_estimate_fft = numpy.fft.rfft2(bg_frames) * self.bg_fft
+            bg_estimate = numpy.fft.irfft2(bg_estimate_fft, s = self.shape)
+            fg_estimate = numpy.fft.irfft2((frames_fft - bg_estimate_fft) * self.fg_fft, s = self.shape)
+
+        return bg_estimate
+
+    def subtractBackground(self, frames):
+        return frames - self.estimateBackground(frames)
+
+
 def estimateBackground(frame, bg_filter, fg_filter, var_filter, reps = 5, threshold = 2.0):
     """
     frame - numpy array containing the image to perform background estimation on.
@@ -70,6 +141,24 @@ def estimateBackground(frame, bg_filter, fg_filter, var_filter, reps = 5, thresh
 
     return bg_estimate
 
+def limitTests(movie_lengths, n_tests, search_range):
+    """
+    Returns the number of (reference) frames to test, limited by the
+    length of the shortest movie.
+
+    movie_lengths - The length of each movie in frames.
+    n_tests - The requested number of tests.
+    search_range - The offsets are -search_range to search_range.
+    """
+    max_tests = min(movie_lengths) - 2*search_range
+    if (max_tests <= 0):
+        raise FindOffsetsException("The movies must be at least " + str(2*search_range + 1) + " frames long to search offsets -" + str(search_range) + " to " + str(search_range) + ".")
+
+    if (n_tests > max_tests):
+        print("Limiting the number of tests to", max_tests)
+        n_tests = max_tests
+    return n_tests
+
 def loadImage(movie, frame, offset, gain, transform = None):
     """
     Load a single frame, apply sCMOS correction and remove
@@ -89,9 +178,63 @@ def loadImage(movie, frame, offset, gain, transform = None):
         image[mask] = 1.0
 
     return image
-    
 
-def findOffsets(base_name, params_file, background_scale = 4.0, foreground_scale = 1.0):
+def loadImages(movie, start, n_frames, offset, gain, transform = None):
+    """
+    Load a block of n_frames frames starting at start as a (n_frames, x, y) array.
+    """
+    images = None
+    for i in range(n_frames):
+        image = loadImage(movie, start + i, offset, gain, transform = transform)
+        if images is None:
+            images = numpy.zeros((n_frames, image.shape[0], image.shape[1]))
+        images[i,:,:] = image
+    return images
+
+def scoreOffsets(ref_frames, test_frames, search_range):
+    """
+    Calculate the correlation scores for all the offsets in the search range.
+
+    ref_frames - A (n, x, y) array of background subtracted reference frames.
+    test_frames - A (n + 2*search_range, x, y) array of background subtracted
+                  test frames. The test frame for ref_frames[i] at offset k
+                  is test_frames[i + k + search_range].
+    search_range - The offsets are -search_range to search_range.
+
+    Returns a (n, 2*search_range + 1) array of scores.
+    """
+    n = ref_frames.shape[0]
+    n_offsets = 2*search_range + 1
+    assert (test_frames.shape[0] == (n + n_offsets - 1))
+
+    ref_frames = numpy.ascontiguousarray(ref_frames.reshape(n, -1))
+    test_frames = numpy.ascontiguousarray(test_frames.reshape(test_frames.shape[0], -1))
+
+    # (n, n_offsets, pixels) view of the test frames for each reference frame.
+    windows = numpy.lib.stride_tricks.as_strided(test_frames,
+                                                 shape = (n, n_offsets, test_frames.shape[1]),
+                                                 strides = (test_frames.strides[0],) + test_frames.strides,
+                                                 writeable = False)
+
+    test_sums = numpy.sum(test_frames, axis = 1)
+    windows_sums = numpy.lib.stride_tricks.as_strided(test_sums,
+                                                      shape = (n, n_offsets),
+                                                      strides = (test_sums.strides[0], test_sums.strides[0]),
+                                                      writeable = False)
+
+    return numpy.einsum("ip,ikp->ik", ref_frames, windows)/windows_sums
+
+def voteOffsets(scores):
+    """
+    Returns the index of the best (positive) score for each reference
+    frame, or 0 if none of the scores are positive.
+    """
+    best = numpy.argmax(scores, axis = 1)
+    best[(numpy.max(scores, axis = 1) <= 0.0)] = 0
+    return best
+
+
+def findOffsets(base_name, params_file, background_scale = 4.0, foreground_scale = 1.0, n_tests = 10, search_range = 5, block_size = 20):
     """
     The 'main' function of this module.
 
@@ -100,14 +243,14 @@ def findOffsets(base_name, params_file, background_scale = 4.0, foreground_scale
     background_scale - Features in the background change on this scale (in pixels)
                        or more slowly.
     foreground_scale - Features that change on this scale are likely foreground.
+    n_tests - The number of (reference) frames to test.
+    search_range - Offsets from -search_range to search_range are tested.
+    block_size - The number of reference frames to process at once.
 
     Notes: 
       1. This only checks a limited range of offsets between the two channels.
-      2. This assumes that the movies are longer than just a few frames.
+      2. The movies must be at least 2*search_range + 1 frames long.
     """
-    n_tests = 10
-    search_range = 5
-    
     # Load parameters.
     parameters = params.ParametersMultiplane().initFromFile(params_file)
 
@@ -121,6 +264,9 @@ def findOffsets(base_name, params_file, background_scale = 4.0, foreground_scale
 
     print("Found", n_channels, "movies.")
 
+    # Limit the number of tests to the length of the shortest movie.
+    n_tests = limitTests([movie.filmSize()[2] for movie in movies], n_tests, search_range)
+
     # Load sCMOS calibration data.
     offsets = []
     gains = []
@@ -153,49 +299,39 @@ def findOffsets(base_name, params_file, background_scale = 4.0, foreground_scale
                              numpy.array([0.5*x_size]),
                              numpy.array([0.5*y_size]),
                              sigma = background_scale)
-    psf = psf/numpy.sum(psf)
-    bg_filter = matchedFilterC.MatchedFilter(psf)
+    bg_psf = psf/numpy.sum(psf)
 
     psf = dg.drawGaussiansXY((x_size, y_size),
                              numpy.array([0.5*x_size]),
                              numpy.array([0.5*y_size]),
                              sigma = foreground_scale)
-    psf = psf/numpy.sum(psf)
-    fg_filter = matchedFilterC.MatchedFilter(psf)
-    var_filter = matchedFilterC.MatchedFilter(psf*psf)
+    fg_psf = psf/numpy.sum(psf)
+    bg_estimator = StackBackgroundEstimator(bg_psf = bg_psf, fg_psf = fg_psf)
 
     # Check background estimation.
     if False:
-        frame = loadImage(movies[0], 0, offsets[0], gain[0])
-        frame_bg = estimateBackground(frame, bg_filter, fg_filter, var_filter)
+        frame = loadImages(movies[0], 0, 1, offsets[0], gains[0])
+        frame_bg = bg_estimator.estimateBackground(frame)
         with tifffile.TiffWriter("bg_estimate.tif") as tif:
-            tif.save(frame.astype(numpy.float32))
-            tif.save(frame_bg.astype(numpy.float32))
-            tif.save((frame - frame_bg).astype(numpy.float32))
+            tif.save(frame[0].astype(numpy.float32))
+            tif.save(frame_bg[0].astype(numpy.float32))
+            tif.save((frame - frame_bg)[0].astype(numpy.float32))
 
     votes = numpy.zeros((n_channels - 1, 2*search_range+1))
-    for i in range(n_tests):
-        print("Test", i)
+    for i in range(0, n_tests, block_size):
+        n = min(block_size, n_tests - i)
+        print("Tests", i, "to", i + n - 1)
         
-        # Load reference frame.
-        ref_frame = loadImage(movies[0], search_range + i, offsets[0], gain[0])
-        ref_frame_bg = estimateBackground(ref_frame, bg_filter, fg_filter, var_filter)
-        ref_frame -= ref_frame_bg
+        # Load reference frames.
+        ref_frames = loadImages(movies[0], search_range + i, n, offsets[0], gains[0])
+        ref_frames = bg_estimator.subtractBackground(ref_frames)
 
-        # Load test frames and measure correlation.
+        # Load the test frames for all the offsets and measure correlation.
         for j in range(n_channels - 1):
-            best_corr = 0.0
-            best_offset = 0
-            for k in range(-search_range, search_range + 1):
-                test_frame = loadImage(movies[j+1], search_range + i + k, offsets[j+1], gain[j+1], transform = atrans[j])
-                test_frame_bg = estimateBackground(test_frame, bg_filter, fg_filter, var_filter)
-                test_frame -= test_frame_bg
-                test_frame_corr = numpy.sum(ref_frame*test_frame)/numpy.sum(test_frame)
-                if (test_frame_corr > best_corr):
-                    best_corr = test_frame_corr
-                    best_offset = k + search_range
-
-            votes[j, best_offset] += 1
+            test_frames = loadImages(movies[j+1], i, n + 2*search_range, offsets[j+1], gains[j+1], transform = atrans[j])
+            test_frames = bg_estimator.subtractBackground(test_frames)
+            best_offsets = voteOffsets(scoreOffsets(ref_frames, test_frames, search_range))
+            votes[j,:] += numpy.bincount(best_offsets, minlength = 2*search_range+1)
 
     # Print results.
     print("Offset votes:")
@@ -211,21 +347,19 @@ def findOffsets(base_name, params_file, background_scale = 4.0, foreground_scale
     print("Saving image stacks.")
     for i in range(n_channels):
         with tifffile.TiffWriter("find_offsets_ch" + str(i) + ".tif") as tif:
-            for j in range(5):
-                if (i == 0):
-                    frame = loadImage(movies[i],
-                                      search_range + frame_offsets[i] + j,
-                                      offsets[i],
-                                      gain[i])
-                else:
-                    frame = loadImage(movies[i],
-                                      search_range + frame_offsets[i] + j,
-                                      offsets[i],
-                                      gain[i],
-                                      transform = atrans[i-1])
-                frame_bg = estimateBackground(frame, bg_filter, fg_filter, var_filter)
-                frame -= frame_bg
-                tif.save(frame.astype(numpy.float32))
+            if (i == 0):
+                transform = None
+            else:
+                transform = atrans[i-1]
+            frames = loadImages(movies[i],
+                                search_range + frame_offsets[i],
+                                5,
+                                offsets[i],
+                                gains[i],
+                                transform = transform)
+            frames = bg_estimator.subtractBackground(frames)
+            for j in range(frames.shape[0]):
+                tif.save(frames[j].astype(numpy.float32))
     
 
 if (__name__ == "__main__"):
@@ -238,8 +372,15 @@ if (__name__ == "__main__"):
                         help = "The base name of the movie to analyze.")
     parser.add_argument('--xml', dest='settings', type=str, required=True,
                         help = "The name of the settings xml file.")
+    parser.add_argument('--tests', dest='tests', type=int, required=False, default = 10,
+                        help = "The number of frames to test, the default is 10.")
+    parser.add_argument('--range', dest='search_range', type=int, required=False, default = 5,
+                        help = "The offset search range, the default is 5 (i.e. -5 to 5).")
 
     args = parser.parse_args()
     
-    findOffsets(args.basename, args.settings)
+    findOffsets(args.basename,
+                args.settings,
+                n_tests = args.tests,
+                search_range = args.search_range)
     
@@ -24,6 +24,7 @@ import pickle
 import numpy
 import tifffile
 
+import storm_analysis.multi_plane.finder_cache as finderCache
 import storm_analysis.multi_plane.mp_fit_c as mpFitC
 import storm_analysis.multi_plane.mp_utilities_c as mpUtilC
 
@@ -56,6 +57,7 @@ class MPPeakFinder(fitting.PeakFinder):
         super(MPPeakFinder, self).__init__(**kwds)
 
         self.atrans = [None]
+        self.atrans_stack = None
         self.backgrounds = []
         self.height_rescale = []
         self.images = []
@@ -135,6 +137,10 @@ class MPPeakFinder(fitting.PeakFinder):
         
     def cleanUp(self):
         self.mpu.cleanup()
+        for mfilter in self.mfilters + self.vfilters:
+            mfilter.cleanup()
+        if self.atrans_stack is not None:
+            self.atrans_stack.cleanup()
         for at in self.atrans:
             if at is not None:
                 at.cleanup()
@@ -169,6 +175,13 @@ class MPPeakFinder(fitting.PeakFinder):
         for i in range(len(self.mfilters_z)):
             self.taken.append(numpy.zeros(new_images[0].shape, dtype=numpy.int32))
 
+        #
+        # Reset incremental mode state.
+        #
+        self.last_maxima = {}
+        for mfilter in self.incremental_filters:
+            mfilter.reset()
+
         #
         # Save references to images & create empty list for the background estimates.
         #
@@ -206,7 +219,6 @@ class MPPeakFinder(fitting.PeakFinder):
         # The estimated background and variance should both be > 0.0,
         # or there is going to be trouble.
         #
-        bg_variances = []
 
         # Save fit images for debugging purposes.
         if self.check_mode:
@@ -214,28 +226,24 @@ class MPPeakFinder(fitting.PeakFinder):
                 for fi in fit_images:
                     tf.save(numpy.transpose(fi.astype(numpy.float32)))
 
-        # Iterate over z values.
-        for i in range(len(self.vfilters)):
-            bg_variance = numpy.zeros(fit_images[0].shape)
-
-            # Iterate over channels / planes.
-            for j in range(len(self.vfilters[i])):
+        # (z value, channel / plane) stack of convolved images.
+        conv_stack = numpy.zeros((len(self.mfilters_z), self.n_channels) + fit_images[0].shape)
 
-                # Convolve fit image + background with the appropriate variance filter.
-                #
-                # I believe that this is correct, the variance of the weighted average
-                # of independent processes is calculated using the square of the weights.
-                #
-                conv_var = self.vfilters[i][j].convolve(fit_images[j] + self.backgrounds[j])
+        # Iterate over channels / planes.
+        for j in range(self.n_channels):
 
-                # Transform variance to the channel 0 frame.
-                if self.atrans[j] is None:
-                    bg_variance += conv_var
-                else:
-                    bg_variance += self.atrans[j].transform(conv_var)
+            # Convolve fit image + background with the appropriate variance filters.
+            #
+            # I believe that this is correct, the variance of the weighted average
+            # of independent processes is calculated using the square of the weights.
+            #
+            conv_stack[:,j] = self.vfilters[j].convolve(fit_images[j] + self.backgrounds[j])
 
-            # Camera variances are already convolved and transformed so we just add them on.
-            bg_variances.append(bg_variance + self.variances[i])
+        # Transform variances to the channel 0 frame and sum over the planes.
+        #
+        # Camera variances are already convolved and transformed so we just add them on.
+        #
+        bg_variances = list(self.atrans_stack.transform(conv_stack) + numpy.array(self.variances))
 
         # Check for problematic values.
         if self.check_mode:
@@ -253,30 +261,20 @@ class MPPeakFinder(fitting.PeakFinder):
         #
         # Calculate foreground for each z plane.
         #
-        fg_averages = []  # This is the average foreground across all the planes for each z value.
-        foregrounds = []  # This is the foreground for each plane and z value.
+        conv_stack = numpy.zeros(conv_stack.shape)
 
-        # Iterate over z values.
-        for i in range(len(self.mfilters)):
-            foreground = numpy.zeros(fit_images[0].shape)
-            foregrounds.append([])
+        # Iterate over channels / planes.
+        for j in range(self.n_channels):
 
-            # Iterate over channels / planes.
-            for j in range(len(self.mfilters[i])):
-
-                # Convolve image / background with the appropriate PSF.
-                conv_fg = self.mfilters[i][j].convolve(self.images[j] - fit_images[j] - self.backgrounds[j])
+            # Convolve image / background with the appropriate PSFs.
+            conv_stack[:,j] = self.mfilters[j].convolve(self.images[j] - fit_images[j] - self.backgrounds[j])
 
-                # Store convolved image in foregrounds.
-                foregrounds[i].append(conv_fg)
-
-                # Transform image to the channel 0 frame.
-                if self.atrans[j] is None:
-                    foreground += conv_fg
-                else:
-                    foreground += self.atrans[j].transform(conv_fg)
+        # This is the foreground for each z value and plane.
+        foregrounds = [list(conv_stack[i]) for i in range(conv_stack.shape[0])]
 
-            fg_averages.append(foreground)
+        # Transform images to the channel 0 frame and sum over the planes, this
+        # is the average foreground across all the planes for each z value.
+        fg_averages = list(self.atrans_stack.transform(conv_stack))
 
         # Normalize average foreground by background standard deviation.
         fg_bg_ratios = []
@@ -299,7 +297,7 @@ class MPPeakFinder(fitting.PeakFinder):
         #
         all_new_peaks = None
         zero_array = numpy.zeros(fg_bg_ratios[0].shape)
-        for i in range(len(self.mfilters)):
+        for i in range(len(self.mfilters_z)):
 
             #
             # Mask the image so that peaks are only found in the AOI. Ideally the
@@ -309,11 +307,7 @@ class MPPeakFinder(fitting.PeakFinder):
             masked_image = fg_bg_ratios[i] * self.peak_mask
         
             # Identify local maxima in the masked image.
-            [new_peaks, taken] = utilC.findLocalMaxima(masked_image,
-                                                       self.taken[i],
-                                                       self.cur_threshold,
-                                                       self.find_max_radius,
-                                                       self.margin)
+            [new_peaks, taken] = self.findLocalMaxima(masked_image, self.taken[i], index = i)
 
             #
             # Initialize peaks with normalized height value. We'll split these
@@ -341,7 +335,7 @@ class MPPeakFinder(fitting.PeakFinder):
         # FIXME: If the planes are far enough apart in z we should allow
         #        peaks with a similar x,y.
         #
-        if (len(self.mfilters) > 1):
+        if (len(self.mfilters_z) > 1):
             all_new_peaks = utilC.removeClosePeaks(all_new_peaks,                                               
                                                    self.find_max_radius,
                                                    self.find_max_radius)
@@ -453,18 +447,18 @@ class MPPeakFinder(fitting.PeakFinder):
             self.peak_locations = self.mpu.splitPeaks(self.peak_locations)
 
         #
-        # Create "foreground" and "variance" filters, as well as the
-        # height rescaling array.
+        # Create the PSFs for the "foreground" and "variance" filters,
+        # as well as the height rescaling array.
         #
         # These are stored in a list indexed by z value, then by
-        # channel / plane. So self.mfilters[1][2] is the filter
-        # for z value 1, plane 2.
+        # channel / plane. So psfs[1][2] is the PSF for z value 1,
+        # plane 2.
         #
+        psfs = []
         for i, mfilter_z in enumerate(self.mfilters_z):
             self.height_rescale.append([])
-            self.mfilters.append([])
-            self.vfilters.append([])
-                
+            psfs.append([])
+
             for j, psf_object in enumerate(self.psf_objects):
                 psf = psf_object.getPSF(mfilter_z,
                                         shape = variances[0].shape,
@@ -475,8 +469,7 @@ class MPPeakFinder(fitting.PeakFinder):
                 # or if it does that they are very small.
                 #
                 psf_norm = psf/numpy.sum(psf)
-                self.mfilters[i].append(matchedFilterC.MatchedFilter(psf_norm))
-                self.vfilters[i].append(matchedFilterC.MatchedFilter(psf_norm * psf_norm))
+                psfs[i].append(psf_norm)
 
                 #
                 # This is used to convert the height measured in the
@@ -499,6 +492,34 @@ class MPPeakFinder(fitting.PeakFinder):
                     filename = "psf_z{0:.3f}_c{1:d}.tif".format(mfilter_z, j)
                     tifffile.imsave(filename, numpy.transpose(psf.astype(numpy.float32)))
 
+        #
+        # Check the cache for the results of a previous initialization
+        # with the same calibration, mapping and PSFs. This also loads
+        # the FFTW plans, so it needs to happen before we create the
+        # filters.
+        #
+        finder_cache = None
+        cached = None
+        if self.parameters.hasAttr("finder_cache"):
+            finder_cache = finderCache.FinderCache(directory = self.parameters.getAttr("finder_cache"),
+                                                   key = finderCache.finderKey(variances,
+                                                                               self.xt,
+                                                                               self.yt,
+                                                                               psfs,
+                                                                               self.margin))
+            cached = finder_cache.load()
+
+        #
+        # Create "foreground" and "variance" filters. There is one
+        # filter bank for each channel / plane that convolves with
+        # the PSFs for all the z values. So self.mfilters[2] is
+        # the filter bank for plane 2.
+        #
+        for j in range(self.n_channels):
+            z_psfs = [psfs[i][j] for i in range(len(psfs))]
+            self.mfilters.append(self.createFilter(z_psfs))
+            self.vfilters.append(self.createFilter([psf * psf for psf in z_psfs]))
+
         # Create matched filter for background.
         bg_psf = fitting.gaussianPSF(variances[0].shape, self.parameters.getAttr("background_sigma"))
         self.bg_filter = matchedFilterC.MatchedFilter(bg_psf)
@@ -508,8 +529,7 @@ class MPPeakFinder(fitting.PeakFinder):
         # to frame.
         #
         # This initializes the self.variances array with a list
-        # of lists with the same organization as foreground and
-        # psf / variance filters.
+        # indexed by z value.
         #
         # Use variance filter. I now think this is correct as this is
         # also what we are doing with the image background term. In
@@ -521,23 +541,31 @@ class MPPeakFinder(fitting.PeakFinder):
         # we are applying to the foreground.
         #
             
-        # Iterate over z values.
-        for i in range(len(self.mfilters)):
-            variance = numpy.zeros(variances[0].shape)
+        self.atrans_stack = affineTransformC.AffineTransformStack(atrans = self.atrans,
+                                                                 shape = variances[0].shape)
+
+        if cached is not None:
+            self.variances = list(cached["variances"])
+
+        else:
+            conv_stack = numpy.zeros((len(self.mfilters_z), self.n_channels) + variances[0].shape)
 
             # Iterate over channels / planes.
-            for j in range(len(self.mfilters[i])):
+            for j in range(self.n_channels):
 
-                # Convolve variance with the appropriate variance filter.
-                conv_var = self.vfilters[i][j].convolve(variances[j])
+                # Convolve variance with the appropriate variance filters.
+                conv_stack[:,j] = self.vfilters[j].convolve(variances[j])
 
-                # Transform variance to the channel 0 frame.
-                if self.atrans[j] is None:
-                    variance += conv_var
-                else:
-                    variance += self.atrans[j].transform(conv_var)
+            # Transform variances to the channel 0 frame and sum over the planes.
+            self.variances = list(self.atrans_stack.transform(conv_stack))
 
-            self.variances.append(variance)
+            if finder_cache is not None:
+                finder_cache.save(variances = numpy.array(self.variances))
+
+        # Reset incremental filters, as we don't want to compare the next
+        # image to the camera variance.
+        for mfilter in self.incremental_filters:
+            mfilter.reset()
 
         # Save results if needed for debugging purposes.
         if self.check_mode:
@@ -766,6 +794,11 @@ def initFitter(margin, parameters, psf_objects, variances):
     for i in range(len(variances)):
         mfitter.setVariance(variances[i], i)
 
+    # Set the number of threads to use for fitting.
+    #
+    if parameters.hasAttr("fit_threads"):
+        mfitter.setThreads(parameters.getAttr("fit_threads"))
+
     # Load mappings.
     #
     if parameters.hasAttr("mapping"):
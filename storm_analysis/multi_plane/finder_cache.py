@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+On-disk cache for the static part of the multi-plane peak finder
+initialization.
+
+The convolved and affine transformed camera variances (one for each
+z value) only depend on the camera calibration, the mapping and the
+PSFs. The same is true of the FFTW plans for the matched filters. The
+cache saves the variances and FFTW's wisdom in a directory, keyed by
+a hash of these inputs, so that when analyzing many movies with the
+same setup they only have to be calculated once.
+
+Hazen 10/26
+"""
+
+import hashlib
+import numpy
+import os
+
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
+
+
+class FinderCache(object):
+    """
+    A single entry in the cache.
+    """
+    def __init__(self, directory = None, key = None, **kwds):
+        """
+        directory - The cache directory.
+        key - The key for this entry, usually from finderKey().
+        """
+        super(FinderCache, self).__init__(**kwds)
+
+        self.directory = directory
+        self.data_filename = os.path.join(directory, "mp_finder_" + key + ".npz")
+        self.wisdom_filename = os.path.join(directory, "mp_finder_" + key + ".wisdom")
+
+    def load(self):
+        """
+        Returns a dictionary with the cached arrays, or None if this entry
+        is not in the cache. This also loads the FFTW wisdom, so it should
+        be called before creating the filters.
+        """
+        if not os.path.exists(self.data_filename):
+            return None
+
+        if os.path.exists(self.wisdom_filename):
+            fftwThreadsC.importWisdom(self.wisdom_filename)
+
+        with numpy.load(self.data_filename) as data:
+            return dict(data)
+
+    def save(self, **arrays):
+        """
+        Save the arrays and the current FFTW wisdom. This should be called
+        after creating the filters.
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        # Write to temporary files that are renamed when complete so that
+        # other processes never see a partially written entry. The data
+        # file is renamed last as this is what load() checks for.
+        tmp_ext = "." + str(os.getpid()) + ".tmp"
+        if fftwThreadsC.exportWisdom(self.wisdom_filename + tmp_ext):
+            os.replace(self.wisdom_filename + tmp_ext, self.wisdom_filename)
+
+        with open(self.data_filename + tmp_ext, "wb") as fp:
+            numpy.savez(fp, **arrays)
+        os.replace(self.data_filename + tmp_ext, self.data_filename)
+
+
+def finderKey(variances, xt, yt, psfs, margin):
+    """
+    Returns a key for the cache.
+
+    variances - The (padded) camera variances, one for each plane.
+    xt, yt - The plane to plane mappings (margin corrected).
+    psfs - The (normalized) PSFs, indexed by z value then by plane.
+    margin - The image margin.
+    """
+    hasher = hashlib.sha1()
+    hasher.update(str([margin, len(variances), len(psfs), variances[0].shape]).encode())
+    for elt in [variances, xt, yt]:
+        for arr in elt:
+            hasher.update(numpy.ascontiguousarray(arr, dtype = numpy.float64).tobytes())
+    for z_psfs in psfs:
+        for psf in z_psfs:
+            hasher.update(numpy.ascontiguousarray(psf, dtype = numpy.float64).tobytes())
+    return hasher.hexdigest()
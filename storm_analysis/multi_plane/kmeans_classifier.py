@@ -11,73 +11,87 @@ import numpy
 import scipy
 import scipy.cluster
 
-import storm_analysis.sa_library.readinsight3 as readinsight3
 import storm_analysis.sa_library.writeinsight3 as writeinsight3
 
-def KMeansClassifier(codebook, input_basename, output_name, extensions = [".bin", "_ch1.bin", "_ch2.bin", "_ch3.bin"], max_distance = 80):
+import storm_analysis.multi_plane.channel_join as channelJoin
+
+
+def normalizeFeatures(heights):
+    """
+    Normalize the (n_localizations, n_channels) heights by the total height.
+    """
+    return heights/numpy.sum(heights, axis = 1)[:,None]
+
+def KMeansClassifier(codebook, input_basename, output_name, extensions = [".bin", "_ch1.bin", "_ch2.bin", "_ch3.bin"], max_distance = 80, block_size = 400000):
     """
     Note: 
       1. The default is that there are 4 color channels / cameras.
       2. The maximum distance is in percent, so '80' means that the 20%
          of the localizations that most distant from a cluster center
          will put in category 9.
+      3. The whitening and the maximum distance are calculated using
+         all the localizations, not block by block.
     """
     n_channels = codebook.shape[1]
     assert (n_channels == len(extensions)), "Codebook size does not match data."
 
-    # Create a reader for each file.
-    i3_readers = []
+    # Read all the channels in lockstep.
+    i3_names = []
     for ext in extensions:
-        i3_name = input_basename + ext
-        print(i3_name)
-        i3_readers.append(readinsight3.I3Reader(i3_name))
-
-    # Create writer for the results.
-    i3_out = writeinsight3.I3Writer(output_name)
-
-    # Read first block of the first channel data.
-    i3_data = [i3_readers[0].nextBlock()]
-    while (i3_data[0] is not False):
+        i3_names.append(input_basename + ext)
+        print(i3_names[-1])
+    join = channelJoin.ChannelJoin(i3_names, block_size = block_size)
+
+    # Pass 1, calculate the standard deviation of the features for whitening.
+    n_total = 0
+    f_sum = numpy.zeros(n_channels)
+    f_sum_sqr = numpy.zeros(n_channels)
+    for i3_data in join:
+        features = normalizeFeatures(channelJoin.joinField(i3_data, 'h').astype(numpy.float64))
+        n_total += features.shape[0]
+        f_sum += numpy.sum(features, axis = 0)
+        f_sum_sqr += numpy.sum(features * features, axis = 0)
+
+    if (n_total == 0):
+        print("No localizations found.")
+        join.close()
+        return
+
+    f_mean = f_sum/n_total
+    f_std = numpy.sqrt(numpy.maximum(f_sum_sqr/n_total - f_mean * f_mean, 0.0))
+
+    # This is what scipy.cluster.vq.whiten() does with zero variance features.
+    f_std[(f_std == 0.0)] = 1.0
+
+    # Pass 2, classify using codebook.
+    categories = []
+    distances = []
+    for i3_data in join:
         print("working..")
-
-        # Read the data from the other channels.
-        for i in range(1,len(i3_readers)):
-            i3_data.append(i3_readers[i].nextBlock())
-
-        # Load height data for each channel.
-        features = numpy.zeros((i3_data[0].size, n_channels))
-        for i in range(len(i3_readers)):
-            features[:,i] = i3_data[i]['h']
-
-        # Normalize by total height.
-        total = numpy.sum(features, axis = 1)
-        for i in range(features.shape[0]):
-            features[i,:] = features[i,:]/total[i]
-    
-        # Whiten the features as recommended by Scipy.
-        features = scipy.cluster.vq.whiten(features)
-
-        # Classify using codebook.
-        [category, distance] = scipy.cluster.vq.vq(features, codebook)
-        dist_max = numpy.percentile(distance, max_distance)
-
-        # Put top XX% in distance in category 9 (the discard category).
-        mask = (distance > dist_max)
-        category[mask] = 9
-            
-        #
-        # Store category and distance in the 'c' and 'i' field respectively.
-        #
-        i3_data[0]['c'] = category
-        i3_data[0]['i'] = distance
-
-        i3_out.addMolecules(i3_data[0])
-
-        # Load the next block of data.
-        i3_data = [i3_readers[0].nextBlock()]
-
-    # Close output file
-    i3_out.close()
+        features = normalizeFeatures(channelJoin.joinField(i3_data, 'h').astype(numpy.float64))
+        [category, distance] = scipy.cluster.vq.vq(features/f_std, codebook)
+        categories.append(category)
+        distances.append(distance)
+
+    category = numpy.concatenate(categories)
+    distance = numpy.concatenate(distances)
+
+    # Put top XX% in distance in category 9 (the discard category).
+    dist_max = numpy.percentile(distance, max_distance)
+    category[(distance > dist_max)] = 9
+
+    # Pass 3, store category and distance in the 'c' and 'i' field
+    # respectively of the first channel's localizations.
+    with writeinsight3.I3Writer(output_name) as i3_out:
+        start = 0
+        for i3_data in join:
+            end = start + i3_data[0].size
+            i3_data[0]['c'] = category[start:end]
+            i3_data[0]['i'] = distance[start:end]
+            i3_out.addMolecules(i3_data[0])
+            start = end
+
+    join.close()
 
     
 if (__name__ == "__main__"):
@@ -27,9 +27,7 @@ def KMeansMeasureVectors(height_fnames, n_categories):
             features = numpy.concatenate((features, h_data), axis = 0)
 
     # Normalize by total height.
-    total = numpy.sum(features, axis = 1)
-    for i in range(features.shape[0]):
-        features[i,:] = features[i,:]/total[i]
+    features = features/numpy.sum(features, axis = 1)[:,None]
     
     # Whiten the features as recommended by Scipy.
     features = scipy.cluster.vq.whiten(features)
@@ -10,6 +10,10 @@ identified with a tool like 3D-DAOSTORM.
 This only identifies a first order mapping between the
 channels.
 
+The localizations in each frame are found with the spatial index
+and drawn as a single (cached) painter path per channel, so changing
+frames and clicking stay fast even with many localizations.
+
 Hazen 05/17
 """
 
@@ -22,7 +26,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 
 import storm_analysis.sa_library.datareader as datareader
 import storm_analysis.visualizer.qtRangeSlider as qtRangeSlider
-import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.spatial_index as spatialIndex
 
 
 import storm_analysis.multi_plane.mapper_ui as mapperUi
@@ -46,14 +50,21 @@ class Channel(object):
         self.fr_width = None
         self.image = None
         self.locs = None
+        self.locs_frame = None
         self.locs_name = locs_name
+        self.locs_path = None
+        self.mapped_key = None
+        self.mapped_path = None
         self.movie_name = movie_name
         self.number = number
         self.offset_x = 0
         self.offset_y = 0
         self.pixmap = None
+        self.pixmap_key = None
 
-        self.locs_i3 = readinsight3.I3Reader(locs_name)
+        # Only the good localizations are drawn, so these are the only ones that
+        # we want to find with findNearest().
+        [self.locs_data, self.locs_index] = spatialIndex.loadI3Index(locs_name, good_only = True, xy_fields = ["x", "y"])
         self.movie_fp = datareader.inferReader(movie_name)
         self.movie_len = self.movie_fp.filmSize()[2]
 
@@ -61,54 +72,80 @@ class Channel(object):
         """
         Add a frame to a graphics scene.
         """
-        frame = self.movie_fp.loadAFrame(self.cur_frame).astype(numpy.float)
-        frame = numpy.transpose(frame)
-
-        # Scale image.
-        frame = 255.0*(frame-fmin)/(fmax-fmin)
-        frame[(frame > 255.0)] = 255.0
-        frame[(frame < 0.0)] = 0.0
+        pixmap_key = [self.cur_frame, fmin, fmax, self.flip_lr, self.flip_ud]
+        if (self.pixmap_key != pixmap_key):
+            frame = self.movie_fp.loadAFrame(self.cur_frame).astype(numpy.float64)
+            frame = numpy.transpose(frame)
+
+            # Scale image.
+            frame = 255.0*(frame-fmin)/(fmax-fmin)
+            frame[(frame > 255.0)] = 255.0
+            frame[(frame < 0.0)] = 0.0
         
-        # Convert to QImage.
-        frame = numpy.ascontiguousarray(frame.astype(numpy.uint8))
-        self.fr_height, self.fr_width = frame.shape
-        frame_RGB = numpy.zeros((frame.shape[0], frame.shape[1], 4), dtype = numpy.uint8)
-        frame_RGB[:,:,0] = frame
-        frame_RGB[:,:,1] = frame
-        frame_RGB[:,:,2] = frame
-        frame_RGB[:,:,3] = 255
-
-        self.image = QtGui.QImage(frame_RGB.data,
-                                  self.fr_width,
-                                  self.fr_height,
-                                  QtGui.QImage.Format_RGB32)
-        self.image.ndarray1 = frame
-        self.image.ndarray2 = frame_RGB
+            # Convert to QImage.
+            frame = numpy.ascontiguousarray(frame.astype(numpy.uint8))
+            self.fr_height, self.fr_width = frame.shape
+            frame_RGB = numpy.zeros((frame.shape[0], frame.shape[1], 4), dtype = numpy.uint8)
+            frame_RGB[:,:,0] = frame
+            frame_RGB[:,:,1] = frame
+            frame_RGB[:,:,2] = frame
+            frame_RGB[:,:,3] = 255
+
+            self.image = QtGui.QImage(frame_RGB.data,
+                                      self.fr_width,
+                                      self.fr_height,
+                                      QtGui.QImage.Format_RGB32)
+            self.image.ndarray1 = frame
+            self.image.ndarray2 = frame_RGB
+
+            self.pixmap = QtGui.QPixmap.fromImage(self.image.mirrored(self.flip_lr, self.flip_ud))
+            self.pixmap_key = pixmap_key
     
         # Add to scene
-        self.pixmap = QtGui.QPixmap.fromImage(self.image.mirrored(self.flip_lr, self.flip_ud))
         pixmap_item = QtWidgets.QGraphicsPixmapItem(self.pixmap)
         pixmap_item.setOffset(self.offset_x, self.offset_y)
         scene.addItem(pixmap_item)
 
     def addLocs(self, scene, mappings):
-        [x, y] = self.getLocs()
-        
-        for i in range(x.size):
-            loc_item = LocalizationItem(i, x[i], y[i], 6.0, self.color)
-            scene.addItem(loc_item)
+        """
+        Add the localizations in the current frame to a graphics scene.
+
+        The localizations are drawn (in their original coordinates) as a
+        single painter path which is only re-created when the frame changes.
+        Flipping and offsetting are done with the path item's transform.
+        """
+        if (self.locs_frame != self.cur_frame):
+            self.locs = self.getFrameLocs()
+            self.locs_frame = self.cur_frame
+            self.locs_path = localizationsPath(self.locs["x"], self.locs["y"], 6.0)
+
+        # The -0.5 pixel offset is applied after flipping.
+        locs_item = QtWidgets.QGraphicsPathItem(self.locs_path)
+        pen = QtGui.QPen(self.color)
+        pen.setWidthF(0.6)
+        locs_item.setPen(pen)
+        locs_item.setTransform(self.getTransform())
+        locs_item.setPos(-0.5, -0.5)
+        scene.addItem(locs_item)
 
         m_name = str(self.number) + "_0_"
         if (m_name + "x") in mappings:
-            rx = self.locs["x"]
-            ry = self.locs["y"]
             mx = mappings[m_name + "x"]
             my = mappings[m_name + "y"]
-            for i in range(rx.size):
-                xf = mx[0] + mx[1]*rx[i] + mx[2]*ry[i]
-                yf = my[0] + my[1]*rx[i] + my[2]*ry[i]
-                mapped_item = MappedItem(xf, yf)
-                scene.addItem(mapped_item)
+            mapped_key = [self.cur_frame, mx.tobytes(), my.tobytes()]
+            if (self.mapped_key != mapped_key):
+                rx = self.locs["x"]
+                ry = self.locs["y"]
+                xf = mx[0] + mx[1]*rx + mx[2]*ry
+                yf = my[0] + my[1]*rx + my[2]*ry
+                self.mapped_key = mapped_key
+                self.mapped_path = mappedPath(xf - 0.5, yf - 0.5, 2.0)
+
+            mapped_item = QtWidgets.QGraphicsPathItem(self.mapped_path)
+            pen = QtGui.QPen(QtGui.QColor(255, 255, 255))
+            pen.setWidthF(0.2)
+            mapped_item.setPen(pen)
+            scene.addItem(mapped_item)
 
     def changeFrame(self, frame_no):
         if (frame_no < 0):
@@ -120,22 +157,33 @@ class Channel(object):
         return self.cur_frame
 
     def findNearest(self, xp, yp, max_d):
-        [x, y] = self.getLocs()
-        if (x.size > 0):
-            dx = xp - x[0]
-            dy = yp - y[0]
-            min_d = dx*dx + dy*dy
-            min_i = 0
-            for i in range(x.size):
-                dx = xp - x[i]
-                dy = yp - y[i]
-                dd = dx*dx + dy*dy
-                if (dd < min_d):
-                    min_d = dd
-                    min_i = i
-            if (min_d < (max_d * max_d)):
-                return [[x[min_i], y[min_i]],
-                        [self.locs["x"][min_i], self.locs["y"][min_i]]]
+
+        # Convert to the original coordinate system, the distances are the same.
+        if self.flip_lr:
+            rx = self.fr_width + 1 + self.offset_x - xp
+        else:
+            rx = xp - self.offset_x
+
+        if self.flip_ud:
+            ry = self.fr_height + 1 + self.offset_y - yp
+        else:
+            ry = yp - self.offset_y
+
+        [dist, index] = self.locs_index.queryFrame(self.cur_frame+1, [rx, ry], distance_upper_bound = max_d)
+        if (index < self.locs_index.n):
+            i = int(index)
+            [rx, ry] = self.locs_index.data[i,:]
+            if self.flip_lr:
+                x = self.fr_width - rx + 1 + self.offset_x
+            else:
+                x = rx + self.offset_x
+
+            if self.flip_ud:
+                y = self.fr_height - ry + 1 + self.offset_y
+            else:
+                y = ry + self.offset_y
+
+            return [[x, y], [self.locs_data["x"][i], self.locs_data["y"][i]]]
 
     def flipLR(self):
         self.flip_lr = not self.flip_lr
@@ -146,22 +194,26 @@ class Channel(object):
     def getCurrentFrameNumber(self):
         return self.cur_frame
 
-    def getLocs(self):
-        self.locs = self.locs_i3.getMoleculesInFrame(self.cur_frame+1)
-        x = self.locs["x"].copy()
-        y = self.locs["y"].copy()
+    def getFrameLocs(self):
+        """
+        Returns the (good) localizations in the current frame.
+        """
+        return self.locs_data[self.locs_index.getFrameIndices(self.cur_frame+1)]
 
+    def getTransform(self):
+        """
+        Returns the transform from the original localization coordinates
+        to the (flipped and offset) display coordinates.
+        """
+        [sx, dx] = [1.0, float(self.offset_x)]
         if self.flip_lr:
-            x = self.fr_width - x + 1 + self.offset_x
-        else:
-            x += self.offset_x
-            
+            [sx, dx] = [-1.0, float(self.fr_width + 1 + self.offset_x)]
+
+        [sy, dy] = [1.0, float(self.offset_y)]
         if self.flip_ud:
-            y = self.fr_height - y + 1 + self.offset_y
-        else:
-            y += self.offset_y
+            [sy, dy] = [-1.0, float(self.fr_height + 1 + self.offset_y)]
 
-        return [x, y]
+        return QtGui.QTransform(sx, 0.0, 0.0, sy, dx, dy)
         
     def getMovieLength(self):
         return self.movie_len
@@ -219,41 +271,6 @@ class GroupItem(QtWidgets.QGraphicsLineItem):
         self.setPen(pen)
         
 
-class LocalizationItem(QtWidgets.QGraphicsEllipseItem):
-    """
-    Localization item for a graphics scene.
-    """
-    def __init__(self, loc_index, x, y, d, color):
-        self.loc_index = loc_index
-
-        self.default_pen = QtGui.QPen(color)        
-        self.default_pen.setWidthF(0.6)
-
-        x = x - 0.5*d - 0.5
-        y = y - 0.5*d - 0.5
-        QtWidgets.QGraphicsEllipseItem.__init__(self, x, y, d, d)
-        self.setPen(self.default_pen)
-
-
-class MappedItem(QtWidgets.QGraphicsItem):
-    """
-    (Mapped) localization item for a graphics scene.
-    """
-    def __init__(self, x, y):
-        super().__init__()
-        self.setPos(x - 0.5, y - 0.5)
-
-    def boundingRect(self):
-        return QtCore.QRectF(-2, -2, 5, 5)
-
-    def paint(self, painter, option, widget):
-        pen = QtGui.QPen(QtGui.QColor(255, 255, 255))
-        pen.setWidthF(0.2)
-        painter.setPen(pen)
-        painter.drawLine(-2, 0, 2, 0)
-        painter.drawLine(0, -2, 0, 2)
-    
-                 
 class MapperScene(QtWidgets.QGraphicsScene):
 
     def __init__(self, **kwds):
@@ -563,6 +580,29 @@ class Window(QtWidgets.QMainWindow):
                                         self.ui.maxSpinBox.value())
 
 
+def localizationsPath(x, y, d):
+    """
+    Returns a painter path with a circle of diameter d at each localization.
+    """
+    path = QtGui.QPainterPath()
+    for i in range(x.size):
+        path.addEllipse(QtCore.QRectF(float(x[i]) - 0.5*d, float(y[i]) - 0.5*d, d, d))
+    return path
+
+def mappedPath(x, y, size):
+    """
+    Returns a painter path with a cross at each (mapped) localization.
+    """
+    path = QtGui.QPainterPath()
+    for i in range(x.size):
+        [xi, yi] = [float(x[i]), float(y[i])]
+        path.moveTo(xi - size, yi)
+        path.lineTo(xi + size, yi)
+        path.moveTo(xi, yi - size)
+        path.lineTo(xi, yi + size)
+    return path
+
+
 if (__name__ == "__main__"):
     app = QtWidgets.QApplication(sys.argv)
     window = Window()
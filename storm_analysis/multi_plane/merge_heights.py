@@ -11,25 +11,34 @@ Hazen 08/17
 """
 import numpy
 
-import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.multi_plane.channel_join as channelJoin
 
-def mergeHeights(height_filename, channel_filenames):
+
+def mergeHeights(height_filename, channel_filenames, block_size = 400000):
     """
     channel_filenames is a list in order from shortest wavelength
-    to the longest wavelength.
-    """
-    #
-    # FIXME: We are just loading all the data at once, which could
-    #        problematic for really large files.
-    #
-    height_data = None
-    for i, elt in enumerate(channel_filenames):
-        i3_data = readinsight3.loadI3File(elt)
+    to the longest wavelength, or the name of a single combined file.
 
-        if height_data is None:
-            height_data = numpy.zeros((i3_data.size, len(channel_filenames)), dtype = numpy.float32)
+    The localization files are read block by block and the heights are
+    written directly into a memory mapped .npy file, so this works with
+    files that are larger than the available memory.
+
+    Like numpy.save(), this adds the .npy extension to height_filename if
+    it is not already present.
+    """
+    if not height_filename.endswith(".npy"):
+        height_filename += ".npy"
 
-        height_data[:,i] = i3_data['h']
+    with channelJoin.ChannelJoin(channel_filenames, block_size = block_size, good_only = False) as join:
+        height_data = numpy.lib.format.open_memmap(height_filename,
+                                                   mode = "w+",
+                                                   dtype = numpy.float32,
+                                                   shape = (join.getNumberMolecules(), join.getNumberChannels()))
+        start = 0
+        for i3_data in join:
+            end = start + i3_data[0].size
+            height_data[start:end,:] = channelJoin.joinField(i3_data, 'h')
+            start = end
 
     # User feedback.
     if (height_data.shape[0] > 5):
@@ -37,7 +46,8 @@ def mergeHeights(height_filename, channel_filenames):
             print(height_data[i,:])
 
     # Save the heights.
-    numpy.save(height_filename, height_data)
+    height_data.flush()
+    del height_data
 
 
 if (__name__ == "__main__"):
@@ -49,7 +59,7 @@ if (__name__ == "__main__"):
     parser.add_argument('--output', dest='output', type=str, required=True,
                         help = "The name of the (numpy) file to save the height data in.")
     parser.add_argument('--channels', dest='channels', type=str, required=True, nargs = '*',
-                        help = "The names of the channel localization files in order from shortest to longest wavelength.")
+                        help = "The names of the channel localization files in order from shortest to longest wavelength, or the name of a combined file.")
 
     args = parser.parse_args()
 
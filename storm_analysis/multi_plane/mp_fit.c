@@ -28,12 +28,27 @@
  *       z value to the correct index in the weighting array.
  *
  * Hazen 10/17
+ *
+ * If OpenMP is available the per channel steps of fitting a peak
+ * (Jacobian / Hessian calculation, solving for the update, adding
+ * and subtracting the peak, etc.) are done in parallel. Each channel
+ * only touches it's own fitData structure so these are independent,
+ * the steps that combine the channels are still serial. The peaks
+ * are still fit one at a time, in order, so the results are the same
+ * as for serial fitting. Use mpSetThreads() to set the number of
+ * threads, the default is 1.
+ *
+ * Hazen 10/26
  */
 
 #include <stdlib.h>
 #include <stdio.h>
 #include <math.h>
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
 #include "../psf_fft/fft_fit.h"
 #include "../pupilfn/pupil_fit.h"
 #include "../spliner/cubic_fit.h"
@@ -49,6 +64,8 @@ typedef struct mpFit
   int nfit;                     /* The number of peaks to fit per channel. The total 
 				   number of peaks is n_channels * nfit. */
 
+  int n_threads;                /* The number of threads to use for the per channel calculations. */
+
   double w_z_offset;            /* Offset value to convert peak z to a weight index. */
   double w_z_scale;             /* Scale value to convert peak z to a weight index. */
 
@@ -86,6 +103,7 @@ typedef struct mpFit
 } mpFit;
 
 
+void mpCalcJHAndSubtract(mpFit *, int, int);
 void mpCleanup(mpFit *);
 void mpCopyFromWorking(mpFit *, int, int);
 //void mpCopyToWorking(mpFit *, int);
@@ -100,14 +118,40 @@ void mpIterateOriginal(mpFit *);
 void mpNewImage(mpFit *, double *, int);
 void mpNewPeaks(mpFit *, double *, int);
 void mpResetWorkingPeaks(mpFit *, int);
+int mpSetThreads(mpFit *, int);
 void mpSetTransforms(mpFit *, double *, double *, double *, double *);
 void mpSetWeights(mpFit *, double *, double *, double *, double *, double *, int);
 void mpSetWeightsIndexing(mpFit *, double, double);
+int mpSolveChannel(mpFit *, int, int);
 void mpUpdate(mpFit *);
 void mpUpdateFixed(mpFit *);
 void mpUpdateIndependent(mpFit *);
 
 
+/*
+ * mpCalcJHAndSubtract()
+ *
+ * Copy the indicated peak to the working peak, calculate the
+ * Jacobian and Hessian and subtract the peak from the fit image
+ * for a single channel.
+ */
+void mpCalcJHAndSubtract(mpFit *mp_fit, int index, int channel)
+{
+  fitData *fit_data;
+
+  fit_data = mp_fit->fit_data[channel];
+
+  /* Copy current peak into working peak. */
+  fit_data->fn_copy_peak(&fit_data->fit[index], fit_data->working_peak);
+
+  /* Calculate Jacobian and Hessian. This is expected to use 'working_peak'. */
+  fit_data->fn_calc_JH(fit_data, mp_fit->jacobian[channel], mp_fit->hessian[channel]);
+    
+  /* Subtract current peak out of image. This is expected to use 'working_peak'. */
+  fit_data->fn_subtract_peak(fit_data);
+}
+
+
 /*
  * mpCleanup()
  *
@@ -260,6 +304,7 @@ mpFit *mpInitialize(double *clamp, double tolerance, int n_channels, int indepen
   mp_fit->im_size_x = im_size_x;
   mp_fit->im_size_y = im_size_y;
   mp_fit->n_channels = n_channels;
+  mp_fit->n_threads = 1;
   mp_fit->w_z_offset = 0.0;
   mp_fit->w_z_scale = 0.0;
   mp_fit->tolerance = tolerance;
@@ -412,12 +457,15 @@ void mpInitializeSplineChannel(mpFit *mp_fit, splineData *spline_data, double *v
  */
 void mpIterateLM(mpFit *mp_fit)
 {
-  int i,j,k,l,m,n;
-  int info,is_bad,is_converged;
+  int i,j,k,nc,nt;
+  int is_bad,is_converged;
   int n_add;
   double error, error_old;
   fitData *fit_data;
 
+  nc = mp_fit->n_channels;
+  nt = mp_fit->n_threads;
+
   if(VERBOSE){
     printf("mpILM, nfit = %d\n", mp_fit->nfit);
   }
@@ -442,19 +490,11 @@ void mpIterateLM(mpFit *mp_fit)
     /*
      * Copy peak, calculate jacobian and hessian and subtract.
      */
-    for(j=0;j<mp_fit->n_channels;j++){
-      fit_data = mp_fit->fit_data[j];
-      
-      /* Copy current peak into working peak. */
-      fit_data->fn_copy_peak(&fit_data->fit[i], fit_data->working_peak);
-
-      /* Calculate Jacobian and Hessian. This is expected to use 'working_peak'. */
-      fit_data->fn_calc_JH(fit_data, mp_fit->jacobian[j], mp_fit->hessian[j]);
-    
-      /* Subtract current peak out of image. This is expected to use 'working_peak'. */
-      fit_data->fn_subtract_peak(fit_data);
-      n_add--;
+    #pragma omp parallel for num_threads(nt) if(nt > 1)
+    for(j=0;j<nc;j++){
+      mpCalcJHAndSubtract(mp_fit, i, j);
     }
+    n_add -= nc;
     
     /*
      * Try and improve paired peak parameters.
@@ -469,38 +509,9 @@ void mpIterateLM(mpFit *mp_fit)
       }
       
       /* 2. Solve for the update vectors. */
-      for(k=0;k<mp_fit->n_channels;k++){
-	fit_data = mp_fit->fit_data[k];
-    
-	/* Update total fitting iterations counter. */
-	fit_data->n_iterations++;
-
-	/* Copy Jacobian and Hessian. */
-	for(l=0;l<fit_data->jac_size;l++){
-	  mp_fit->w_jacobian[k][l] = mp_fit->jacobian[k][l];
-	  m = l*fit_data->jac_size;
-	  for(n=0;n<fit_data->jac_size;n++){
-	    if (l == n){
-	      mp_fit->w_hessian[k][m+n] = (1.0 + fit_data->working_peak->lambda) * mp_fit->hessian[k][m+n];
-	    }
-	    else{
-	      mp_fit->w_hessian[k][m+n] = mp_fit->hessian[k][m+n];
-	    }
-	  }
-	}
-      
-	/*  Solve for update. Note that this also changes jacobian. */
-	info = mFitSolve(mp_fit->w_hessian[k], mp_fit->w_jacobian[k], fit_data->jac_size);
-	
-	/* If the solver failed, set is_bad = 1 and exit this loop. */
-	if(info!=0){
-	  is_bad = 1;
-	  fit_data->n_dposv++;
-	  if(VERBOSE){
-	    printf(" mFitSolve() failed %d %d\n", i, info);
-	  }
-	  break;
-	}
+      #pragma omp parallel for num_threads(nt) if(nt > 1) reduction(|:is_bad)
+      for(k=0;k<nc;k++){
+	is_bad |= mpSolveChannel(mp_fit, i, k);
       }
 
       /* If the solver failed then start over again with a higher lambda for all paired peaks. */
@@ -517,9 +528,9 @@ void mpIterateLM(mpFit *mp_fit)
       mp_fit->fn_update(mp_fit);
       
       /* 4. Check that the peaks are still in the image, etc.. */
-      for(k=0;k<mp_fit->n_channels;k++){
-	fit_data = mp_fit->fit_data[k];
-	if(fit_data->fn_check(fit_data)){
+      #pragma omp parallel for num_threads(nt) if(nt > 1) reduction(|:is_bad)
+      for(k=0;k<nc;k++){
+	if(mp_fit->fit_data[k]->fn_check(mp_fit->fit_data[k])){
 	  is_bad = 1;
 	  if(VERBOSE){
 	    printf(" fn_check() failed %d\n", i);
@@ -533,33 +544,28 @@ void mpIterateLM(mpFit *mp_fit)
 	continue;
       }
 
-      /* 5. Add working peaks back to the fit image. */
-      for(k=0;k<mp_fit->n_channels;k++){
-	fit_data = mp_fit->fit_data[k];
-	fit_data->fn_add_peak(fit_data);
-	n_add++;
-      }
-
-      /* 6. Calculate updated error. */
-      for(k=0;k<mp_fit->n_channels;k++){
-	fit_data = mp_fit->fit_data[k];
-	if(mFitCalcErr(fit_data)){
+      /* 5. Add working peaks back to the fit image and 6. calculate updated error. */
+      #pragma omp parallel for num_threads(nt) if(nt > 1) reduction(|:is_bad)
+      for(k=0;k<nc;k++){
+	mp_fit->fit_data[k]->fn_add_peak(mp_fit->fit_data[k]);
+	if(mFitCalcErr(mp_fit->fit_data[k])){
 	  is_bad = 1;
 	  if(VERBOSE){
 	    printf(" mFitCalcErr() failed\n");
 	  }
 	}
       }
+      n_add += nc;
 
       /* If the peak error calculation failed start over again with a higher lambda for all paired peaks. */
       if(is_bad){
 	
 	/* Undo peak addition. */
-	for(k=0;k<mp_fit->n_channels;k++){
-	  fit_data = mp_fit->fit_data[k];
-	  fit_data->fn_subtract_peak(fit_data);
-	  n_add--;
+	#pragma omp parallel for num_threads(nt) if(nt > 1)
+	for(k=0;k<nc;k++){
+	  mp_fit->fit_data[k]->fn_subtract_peak(mp_fit->fit_data[k]);
 	}
+	n_add -= nc;
 	
 	/* Reset working peaks. */
 	mpResetWorkingPeaks(mp_fit, i);
@@ -603,12 +609,12 @@ void mpIterateLM(mpFit *mp_fit)
 	  }
 	  
 	  /* Undo peak addition, and increment counter. */
-	  for(k=0;k<mp_fit->n_channels;k++){
-	    fit_data = mp_fit->fit_data[k];
-	    fit_data->n_non_decr++;
-	    fit_data->fn_subtract_peak(fit_data);
-	    n_add--;
+	  #pragma omp parallel for num_threads(nt) if(nt > 1)
+	  for(k=0;k<nc;k++){
+	    mp_fit->fit_data[k]->n_non_decr++;
+	    mp_fit->fit_data[k]->fn_subtract_peak(mp_fit->fit_data[k]);
 	  }
+	  n_add -= nc;
 	
 	  /* Reset working peaks. */
 	  mpResetWorkingPeaks(mp_fit, i);
@@ -661,10 +667,13 @@ void mpIterateLM(mpFit *mp_fit)
  */
 void mpIterateOriginal(mpFit *mp_fit)
 {
-  int i,j;
+  int i,j,nc,nt;
   int info,is_bad,is_converged;
   fitData *fit_data;
 
+  nc = mp_fit->n_channels;
+  nt = mp_fit->n_threads;
+
   if(VERBOSE){
     printf("mpIO %d\n", mp_fit->nfit);
   }
@@ -691,7 +700,8 @@ void mpIterateOriginal(mpFit *mp_fit)
      * Calculate update vector for each channel.
      */
     is_bad = 0;
-    for(j=0;j<mp_fit->n_channels;j++){
+    #pragma omp parallel for num_threads(nt) if(nt > 1) private(fit_data,info) reduction(|:is_bad)
+    for(j=0;j<nc;j++){
       fit_data = mp_fit->fit_data[j];
       
       /* Copy current peak into working peak. */
@@ -709,14 +719,13 @@ void mpIterateOriginal(mpFit *mp_fit)
       /*  Solve for update. Note that this also changes jacobian. */
       info = mFitSolve(mp_fit->w_hessian[j], mp_fit->w_jacobian[j], fit_data->jac_size);
 
-      /* If the solver failed, set is_bad = 1 and exit this loop. */
+      /* If the solver failed, set is_bad = 1. */
       if(info!=0){
 	is_bad = 1;
 	fit_data->n_dposv++;
 	if(VERBOSE){
 	  printf(" mFitSolve() failed %d %d\n", i, info);
 	}
-	break;
       }
     }
 
@@ -739,9 +748,9 @@ void mpIterateOriginal(mpFit *mp_fit)
      * Check that peaks are still in the image, etc.. The fn_check function
      * should return 0 if everything is okay.
      */    
-    for(j=0;j<mp_fit->n_channels;j++){
-      fit_data = mp_fit->fit_data[j];
-      if(fit_data->fn_check(fit_data)){
+    #pragma omp parallel for num_threads(nt) if(nt > 1) reduction(|:is_bad)
+    for(j=0;j<nc;j++){
+      if(mp_fit->fit_data[j]->fn_check(mp_fit->fit_data[j])){
 	is_bad = 1;
 	if(VERBOSE){
 	  printf(" fn_check() failed %d\n", i);
@@ -759,10 +768,10 @@ void mpIterateOriginal(mpFit *mp_fit)
     }
 
     /* Add working peaks back to image and copy back to current peak. */
-    for(j=0;j<mp_fit->n_channels;j++){
-      fit_data = mp_fit->fit_data[j];
-      fit_data->fn_add_peak(fit_data);
-      fit_data->fn_copy_peak(fit_data->working_peak, &fit_data->fit[i]);
+    #pragma omp parallel for num_threads(nt) if(nt > 1)
+    for(j=0;j<nc;j++){
+      mp_fit->fit_data[j]->fn_add_peak(mp_fit->fit_data[j]);
+      mp_fit->fit_data[j]->fn_copy_peak(mp_fit->fit_data[j]->working_peak, &mp_fit->fit_data[j]->fit[i]);
     }
   }
     
@@ -779,7 +788,8 @@ void mpIterateOriginal(mpFit *mp_fit)
     /*  Calculate errors for the working peaks. */
     is_bad = 0;
     is_converged = 1;
-    for(j=0;j<mp_fit->n_channels;j++){
+    #pragma omp parallel for num_threads(nt) if(nt > 1) private(fit_data) reduction(|:is_bad) reduction(&:is_converged)
+    for(j=0;j<nc;j++){
       fit_data = mp_fit->fit_data[j];
       fit_data->fn_copy_peak(&fit_data->fit[i], fit_data->working_peak);
       if(mFitCalcErr(fit_data)){
@@ -883,6 +893,32 @@ void mpResetWorkingPeaks(mpFit *mp_fit, int index)
 }
 
 
+/*
+ * mpSetThreads()
+ *
+ * Set the number of threads to use for the per channel calculations.
+ *
+ * Returns the number of threads that will actually be used, this
+ * is always 1 if the library was built without OpenMP.
+ */
+int mpSetThreads(mpFit *mp_fit, int n_threads)
+{
+#ifdef _OPENMP
+  if(n_threads < 1){
+    n_threads = omp_get_num_procs();
+  }
+  if(n_threads > mp_fit->n_channels){
+    n_threads = mp_fit->n_channels;
+  }
+#else
+  n_threads = 1;
+#endif
+  mp_fit->n_threads = n_threads;
+  
+  return n_threads;
+}
+
+
 /*
  * mpSetTransforms()
  *
@@ -960,6 +996,59 @@ void mpSetWeightsIndexing(mpFit *mp_fit, double z_offset, double z_scale)
   mp_fit->w_z_scale = z_scale;
 }
 
+/*
+ * mpSolveChannel()
+ *
+ * Solve for the update vector for a single channel using the
+ * Levenberg-Marquardt lambda of the working peak. The update is
+ * stored in w_jacobian. This is used by mpIterateLM().
+ *
+ * Returns 1 if the solver failed.
+ */
+int mpSolveChannel(mpFit *mp_fit, int index, int channel)
+{
+  int i,j,m,info;
+  double *hessian,*jacobian,*w_hessian,*w_jacobian;
+  fitData *fit_data;
+
+  fit_data = mp_fit->fit_data[channel];
+  hessian = mp_fit->hessian[channel];
+  jacobian = mp_fit->jacobian[channel];
+  w_hessian = mp_fit->w_hessian[channel];
+  w_jacobian = mp_fit->w_jacobian[channel];
+  
+  /* Update total fitting iterations counter. */
+  fit_data->n_iterations++;
+
+  /* Copy Jacobian and Hessian. */
+  for(i=0;i<fit_data->jac_size;i++){
+    w_jacobian[i] = jacobian[i];
+    m = i*fit_data->jac_size;
+    for(j=0;j<fit_data->jac_size;j++){
+      if (i == j){
+	w_hessian[m+j] = (1.0 + fit_data->working_peak->lambda) * hessian[m+j];
+      }
+      else{
+	w_hessian[m+j] = hessian[m+j];
+      }
+    }
+  }
+      
+  /*  Solve for update. Note that this also changes jacobian. */
+  info = mFitSolve(w_hessian, w_jacobian, fit_data->jac_size);
+	
+  /* Check if the solver failed. */
+  if(info!=0){
+    fit_data->n_dposv++;
+    if(VERBOSE){
+      printf(" mFitSolve() failed %d %d\n", index, info);
+    }
+    return 1;
+  }
+  return 0;
+}
+
+
 /*
  * mpUpdate()
  *
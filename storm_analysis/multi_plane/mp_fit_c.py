@@ -12,11 +12,16 @@ import os
 import sys
 
 import storm_analysis.sa_library.dao_fit_c as daoFitC
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.ia_utilities_c as utilC
 import storm_analysis.sa_library.loadclib as loadclib
 
 import storm_analysis.spliner.spline3D as spline3D
 
+# Apply the FFTW threads setting from the environment.
+fftwThreadsC.initialize()
+
+
 class mpFitData(ctypes.Structure):
     _fields_ = [('im_size_x', ctypes.c_int),
                 ('im_size_y', ctypes.c_int),
@@ -25,6 +30,8 @@ class mpFitData(ctypes.Structure):
                 ('n_weights', ctypes.c_int),
                 
                 ('nfit', ctypes.c_int),
+
+                ('n_threads', ctypes.c_int),
                 
                 ('w_z_offset', ctypes.c_double),
                 ('w_z_scale', ctypes.c_double),
@@ -110,6 +117,10 @@ def loadMPFitC():
                                   ndpointer(dtype=numpy.float64),
                                   ctypes.c_int]
 
+    mp_fit.mpSetThreads.argtypes = [ctypes.c_void_p,
+                                    ctypes.c_int]
+    mp_fit.mpSetThreads.restype = ctypes.c_int
+
     mp_fit.mpSetTransforms.argtypes = [ctypes.c_void_p,
                                        ndpointer(dtype=numpy.float64),
                                        ndpointer(dtype=numpy.float64),
@@ -286,6 +297,16 @@ class MPFit(daoFitC.MultiFitterBase):
                                   numpy.ascontiguousarray(xt_Nto0),
                                   numpy.ascontiguousarray(yt_Nto0))
 
+    def setThreads(self, n_threads):
+        """
+        Set the number of threads to use for the per channel / plane
+        calculations, 0 = the number of cores. This is limited to the
+        number of channels.
+
+        Returns the number of threads that will actually be used.
+        """
+        return self.clib.mpSetThreads(self.mfit, n_threads)
+
     def setVariance(self, variance, channel):
         #
         # This is a little different than 3D-DAOSTORM, sCMOS and Spliner
@@ -365,7 +386,7 @@ class MPPSFFnFit(MPFit):
                        "x" : numpy.ones((1, self.n_channels))/float(self.n_channels),
                        "y" : numpy.ones((1, self.n_channels))/float(self.n_channels),
                        "z" : numpy.ones((1, self.n_channels))/float(self.n_channels)}
-            super(MPSFFnFit, self).setWeights(weights, 0.0, 0.0)
+            super(MPPSFFnFit, self).setWeights(weights, 0.0, 0.0)
 
         else:
             zmax = self.psf_objects[0].getZMax() * 1.0e-3
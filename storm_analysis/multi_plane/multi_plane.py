@@ -27,11 +27,22 @@ def analyze(base_name, mlist_name, settings_name):
     # Create multiplane localization file(s) writer.
     data_writer = analysisIO.MPDataWriter(data_file = mlist_name,
                                           parameters = parameters)
+
+    # Tracking, etc. don't work with a combined localization file, it
+    # needs to be split with multi_plane/channel_join.py first.
+    if (parameters.getAttr("combined_channels", 0) != 0):
+        print("Peak finding")
+        stdAnalysis.peakFinding(finder,
+                                reader,
+                                data_writer,
+                                parameters)
+        print("Analysis complete")
     
-    stdAnalysis.standardAnalysis(finder,
-                                 reader,
-                                 data_writer,
-                                 parameters)
+    else:
+        stdAnalysis.standardAnalysis(finder,
+                                     reader,
+                                     data_writer,
+                                     parameters)
 
 
 if (__name__ == "__main__"):
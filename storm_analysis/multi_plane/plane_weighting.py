@@ -8,6 +8,10 @@ each peak at each update given it's current parameters, but
 I think this would make things even slower for only a fairly
 minor improvement in fitting performance.
 
+The PSFs and their derivatives can be cached (see the --cache
+option), in which case re-calculating the weights for a different
+background or number of photons only needs the Fisher matrices.
+
 Hazen 10/17
 """
 import math
@@ -23,7 +27,7 @@ import storm_analysis.pupilfn.cramer_rao as pupilFnCramerRao
 import storm_analysis.spliner.cramer_rao as splinerCramerRao
 
 
-def planeVariances(cr_psf_objects, background, photons):
+def planeVariances(cr_psf_objects, background, photons, cache_dir = None):
     """
     Calculates the variances for different image planes as a function of z.
 
@@ -37,6 +41,9 @@ def planeVariances(cr_psf_objects, background, photons):
           for each plane (in photons). If only one value is specified
           it will be used for all of the planes. The photons parameter 
           is the total number of photons in all of the planes.
+
+       3. If cache_dir is not None the PSFs and their derivatives are
+          cached in this directory.
     """
     n_planes = len(cr_psf_objects)
     
@@ -66,19 +73,15 @@ def planeVariances(cr_psf_objects, background, photons):
     v_y = numpy.zeros((n_zvals, n_planes))
     v_z = numpy.zeros((n_zvals, n_planes))
 
-    for i in range(z_vals.size):
-        z = z_vals[i]
-        print("z {0:.1f}".format(z))
-        for j in range(n_planes):
-            crbs = splinerCramerRao.calcCRBound3D(cr_psf_objects[j],
-                                                  background[j],
-                                                  photons,
-                                                  z)
-            v_bg[i,j] = crbs[4]
-            v_h[i,j] = crbs[0]
-            v_x[i,j] = crbs[1]
-            v_y[i,j] = crbs[2]
-            v_z[i,j] = crbs[3]
+    for j in range(n_planes):
+        print("plane", j)
+        cr_stack = splinerCramerRao.loadCRStack(cr_psf_objects[j], z_vals, cache_dir = cache_dir)
+        crbs = cr_stack.calcCRBounds([background[j]], [photons])[:,0,0,:]
+        v_bg[:,j] = crbs[:,4]
+        v_h[:,j] = crbs[:,0]
+        v_x[:,j] = crbs[:,1]
+        v_y[:,j] = crbs[:,2]
+        v_z[:,j] = crbs[:,3]
 
     return [v_bg, v_h, v_x, v_y, v_z]
 
@@ -92,9 +95,11 @@ def planeWeights(variances):
         weights[i,:] = weights[i,:]/numpy.sum(weights[i,:])
     return weights
 
-def planeWeighting(parameters, background, photons):
+def planeWeighting(parameters, background, photons, cache_dir = None):
     """
     This calculates and return the weights to use for each parameter at each z value.
+
+    cache_dir - A directory to cache the PSFs and their derivatives in, optional.
     """
     pixel_size = parameters.getAttr("pixel_size")
     cr_psf_objects = []
@@ -139,7 +144,8 @@ def planeWeighting(parameters, background, photons):
     print("Calculating Cramer-Rao bounds.")
     variances = planeVariances(cr_psf_objects,
                                background,
-                               photons)
+                               photons,
+                               cache_dir = cache_dir)
 
     # Clean up Cramer-Rao PSF objects (some use C libraries).
     #
@@ -212,13 +218,15 @@ if (__name__ == "__main__"):
                         help = "An estimate of the average number of photons in the localization.")
     parser.add_argument('--xml', dest='xml', type=str, required=True,
                         help = "The name of the settings xml file.")
+    parser.add_argument('--cache', dest='cache', type=str, required=False, default=None,
+                        help = "A directory to cache the PSFs and their derivatives in.")
     parser.add_argument('--no_plots', dest='no_plots', type=bool, required=False, default=False,
                         help = "Don't show plot of the results.")
     
     args = parser.parse_args()
 
     parameters = params.ParametersMultiplane().initFromFile(args.xml)
-    [weights, variances] = planeWeighting(parameters, args.background, args.photons)
+    [weights, variances] = planeWeighting(parameters, args.background, args.photons, cache_dir = args.cache)
 
     with open(args.output, 'wb') as fp:
         pickle.dump(weights, fp)
@@ -67,38 +67,18 @@ def psfLocalizations(i3_filename, mapping_filename, frame = 1, aoi_size = 8, mov
     # Remove localizations that are too close to the edge or
     # outside of the image in any of the channels.
     #
-    is_good = numpy.ones(xf.size, dtype = numpy.bool)
-    for i in range(xf.size):
-
-        # Check in Channel 0.
-        if (xf[i] < aoi_size) or (xf[i] + aoi_size >= movie_x):
-            is_good[i] = False
-            continue
-        
-        if (yf[i] < aoi_size) or (yf[i] + aoi_size >= movie_y):
-            is_good[i] = False
-            continue
-
-        # Check other channels.
-        for key in mappings:
-            if not is_good[i]:
-                break
-            
-            coeffs = mappings[key]
-            [ch1, ch2, axis] = key.split("_")
-            if (ch1 == "0"):
-
-                if (axis == "x"):
-                    xm = coeffs[0] + coeffs[1]*xf[i] + coeffs[2]*yf[i]
-                    if (xm < aoi_size) or (xm + aoi_size >= movie_x):
-                        is_good[i] = False
-                        break
-
-                elif (axis == "y"):
-                    ym = coeffs[0] + coeffs[1]*xf[i] + coeffs[2]*yf[i]
-                    if (ym < aoi_size) or (ym + aoi_size >= movie_y):
-                        is_good[i] = False
-                        break
+    is_good = (xf >= aoi_size) & (xf + aoi_size < movie_x) & (yf >= aoi_size) & (yf + aoi_size < movie_y)
+
+    # Check other channels.
+    for key in mappings:
+        coeffs = mappings[key]
+        [ch1, ch2, axis] = key.split("_")
+        if (ch1 == "0"):
+            m = coeffs[0] + coeffs[1]*xf + coeffs[2]*yf
+            if (axis == "x"):
+                is_good = is_good & (m >= aoi_size) & (m + aoi_size < movie_x)
+            elif (axis == "y"):
+                is_good = is_good & (m >= aoi_size) & (m + aoi_size < movie_y)
 
     #
     # Save localizations for each channel.
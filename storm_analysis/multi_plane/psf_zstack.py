@@ -12,21 +12,69 @@ FIXME: Averaging should be done with weighting by pixel
 FIXME: Drift correction, if specified, is not corrected for 
        the channel to channel mapping.
 
+The movie is processed in blocks of frames. The calibration and the
+background subtraction are applied to the whole block, the AOIs for
+all the localizations in all the frames of the block are extracted
+together, and the results are written to a memory mapped .npy file,
+so the whole movie and z stack are never in memory.
+
 Hazen 05/17
 """
 
 import numpy
-import scipy
-import scipy.ndimage
 import tifffile
 
 import storm_analysis.sa_library.datareader as datareader
 import storm_analysis.sa_library.readinsight3 as readinsight3
 
+import storm_analysis.spliner.measure_psf_utils as measurePSFUtils
+
 
-def psfZStack(movie_name, i3_filename, zstack_name, scmos_cal = None, aoi_size = 8, driftx = 0.0, drifty = 0.0):
+def aoiSums(frames, frame_numbers, x, y, aoi_size, driftx = 0.0, drifty = 0.0):
+    """
+    Returns the sum of the 2x up-sampled and re-centered AOIs around
+    each localization in each frame as a (n_frames, 4*aoi_size, 4*aoi_size)
+    array, and the number of AOIs in each sum. AOIs that are not completely
+    inside the frame are ignored.
+
+    frames - A block of (calibrated) frames, (n_frames, x, y).
+    frame_numbers - The frame number (in the movie) of each frame.
+    x, y - The localization positions in the first frame of the movie.
+    aoi_size - The AOI half-size.
+    driftx, drifty - Drift in pixels per frame.
+    """
+    frame_numbers = numpy.asarray(frame_numbers, dtype = numpy.float64)
+    xf = (x[None,:] + driftx * frame_numbers[:,None]).flatten()
+    yf = (y[None,:] + drifty * frame_numbers[:,None]).flatten()
+    fi = numpy.repeat(numpy.arange(frames.shape[0]), x.size)
+    xi = xf.astype(numpy.int64)
+    yi = yf.astype(numpy.int64)
+
+    a = aoi_size
+    mask = (xi >= a) & (xi + a <= frames.shape[1]) & (yi >= a) & (yi + a <= frames.shape[2])
+
+    sums = numpy.zeros((frames.shape[0], 4*a, 4*a))
+    counts = numpy.bincount(fi[mask], minlength = frames.shape[0])
+    if (numpy.count_nonzero(mask) == 0):
+        return [sums, counts]
+
+    [xf, yf, fi, xi, yi] = [xf[mask], yf[mask], fi[mask], xi[mask], yi[mask]]
+
+    # Gather all the AOIs with a strided view of the frames.
+    size = 2*a
+    view = numpy.lib.stride_tricks.as_strided(frames,
+                                              shape = (frames.shape[0], frames.shape[1] - size + 1, frames.shape[2] - size + 1, size, size),
+                                              strides = frames.strides + frames.strides[1:],
+                                              writeable = False)
+    aois = view[fi, xi - a, yi - a]
+
+    numpy.add.at(sums, fi, measurePSFUtils.upsampleAndShift(aois, xf - xi, yf - yi, 2))
+    return [sums, counts]
+
+def psfZStack(movie_name, i3_filename, zstack_name, scmos_cal = None, aoi_size = 8, driftx = 0.0, drifty = 0.0, block_size = 50):
     """
     driftx, drifty are in units of pixels per frame, (bead x last frame - bead x first frame)/n_frames.
+    block_size is the number of frames to process at once.
     """
 
     # Load movie.
@@ -35,8 +83,8 @@ def psfZStack(movie_name, i3_filename, zstack_name, scmos_cal = None, aoi_size =
     
     # Load localizations.
     i3_data = readinsight3.loadI3File(i3_filename)
-    x = i3_data["x"]
-    y = i3_data["y"]
+    x = i3_data["x"].astype(numpy.float64)
+    y = i3_data["y"].astype(numpy.float64)
 
     # Load sCMOS calibration data.
     gain = numpy.ones((movie_y, movie_x))
@@ -44,52 +92,53 @@ def psfZStack(movie_name, i3_filename, zstack_name, scmos_cal = None, aoi_size =
     if scmos_cal is not None:
         [offset, variance, gain] = numpy.load(scmos_cal)
         gain = 1.0/gain
-    
-    z_stack = numpy.zeros((4*aoi_size, 4*aoi_size, movie_len))
 
-    for i in range(movie_len):
-        if ((i%50) == 0):
-            print("Processing frame", i)
+    # The z stack is saved in Fortran order so that each frame is
+    # contiguous in the file.
+    z_stack = numpy.lib.format.open_memmap(zstack_name + ".npy",
+                                           mode = "w+",
+                                           dtype = numpy.float64,
+                                           shape = (4*aoi_size, 4*aoi_size, movie_len),
+                                           fortran_order = True)
+
+    max_intensity = None
+    for i in range(0, movie_len, block_size):
+        n = min(block_size, movie_len - i)
+        print("Processing frames", i, "to", i + n - 1)
 
         #
         # Subtract pixel offset and convert to units of photo-electrons.
         #
-        frame = (movie_data.loadAFrame(i) - offset) * gain
+        frames = numpy.zeros((n, movie_y, movie_x))
+        for j in range(n):
+            frames[j,:,:] = movie_data.loadAFrame(i + j)
+        frames = (frames - offset[None,:,:]) * gain[None,:,:]
 
         #
         # Subtract estimated background. This assumes that the image is
         # mostly background and that the background is uniform.
         #
-        frame = frame - numpy.median(frame)
+        frames -= numpy.median(frames.reshape(n, -1), axis = 1)[:,None,None]
 
-        for j in range(x.size):
-            xf = x[j] + driftx * float(i)
-            yf = y[j] + drifty * float(i)
-            xi = int(xf)
-            yi = int(yf)
+        # Normalize by the number of localizations that were inside each frame.
+        [sums, counts] = aoiSums(frames, numpy.arange(i, i + n), x, y, aoi_size, driftx = driftx, drifty = drifty)
+        sums = sums/numpy.maximum(counts, 1)[:,None,None]
+        z_stack[:,:,i:i+n] = numpy.transpose(sums, (1, 2, 0))
 
-            im_slice = frame[xi - aoi_size:xi + aoi_size,
-                             yi - aoi_size:yi + aoi_size]
-
-            im_slice_up = scipy.ndimage.interpolation.zoom(im_slice, 2.0)
-            im_slice_up = scipy.ndimage.interpolation.shift(im_slice_up, (-2.0*(xf-xi), -2.0*(yf-yi)), mode='nearest')
-
-            z_stack[:,:,i] += im_slice_up
-
-    # Normalize by the number of localizations.
-    z_stack = z_stack/float(x.size)
+        if max_intensity is None:
+            max_intensity = numpy.amax(sums)
+        else:
+            max_intensity = max(max_intensity, numpy.amax(sums))
     
-    print("max intensity", numpy.amax(z_stack))
-
-    # Save z_stack.
-    numpy.save(zstack_name + ".npy", z_stack)
+    print("max intensity", max_intensity)
+    z_stack.flush()
 
     # Save (normalized) z_stack as tif for inspection purposes.
-    z_stack = z_stack/numpy.amax(z_stack)
-    z_stack = z_stack.astype(numpy.float32)
     with tifffile.TiffWriter(zstack_name + ".tif") as tf:
         for i in range(movie_len):
-            tf.save(z_stack[:,:,i])
+            tf.save((z_stack[:,:,i]/max_intensity).astype(numpy.float32))
+
+    del z_stack
 
             
 if (__name__ == "__main__"):
@@ -112,6 +161,8 @@ if (__name__ == "__main__"):
                         help = "Drift in x in pixels per frame. The default is 0.0.")
     parser.add_argument('--drifty', dest='drifty', type=float, required=False, default=0.0,
                         help = "Drift in y in pixels per frame. The default is 0.0.")
+    parser.add_argument('--block_size', dest='block_size', type=int, required=False, default=50,
+                        help = "The number of frames to process at once. The default is 50.")
 
     args = parser.parse_args()
     
@@ -121,4 +172,5 @@ if (__name__ == "__main__"):
               scmos_cal = args.scmos_cal,
               aoi_size = args.aoi_size,
               driftx = args.driftx,
-              drifty = args.drifty)
+              drifty = args.drifty,
+              block_size = args.block_size)
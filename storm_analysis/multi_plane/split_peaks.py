@@ -3,8 +3,9 @@
 This is mostly for debugging. It takes the original molecule
 list and creates one for each channel.
 
-Note: This is not designed to be used with really large
-      molecule list files.
+The original molecule list can also be a combined file, in
+which case channel 0 of this file is used and it is also saved
+as a separate file.
 
 Hazen 07/17
 """
@@ -12,15 +13,14 @@ import numpy
 import os
 import pickle
 
-import storm_analysis.sa_library.i3dtype as i3dtype
 import storm_analysis.sa_library.parameters as params
-import storm_analysis.sa_library.readinsight3 as readinsight3
 import storm_analysis.sa_library.writeinsight3 as writeinsight3
 
+import storm_analysis.multi_plane.channel_join as channelJoin
 import storm_analysis.multi_plane.mp_utilities_c as mpUtilC
 
 
-def splitPeaks(mlist_filename, params_filename):
+def splitPeaks(mlist_filename, params_filename, block_size = 400000):
 
     parameters = params.ParametersMultiplane().initFromFile(params_filename)
     
@@ -38,32 +38,51 @@ def splitPeaks(mlist_filename, params_filename):
     frame_offsets = list(map(parameters.getAttr, mpUtilC.getOffsetAttrs(parameters)))
     print(frame_offsets)
                   
-    # Load the molecule list.
-    ch0_data = readinsight3.loadI3File(mlist_filename)
-
-    # Map to other channels.
+    # Figure out how many channels we can map to.
     basename = mlist_filename[:-4]
-    channel = 1
-    m_key = "0_1_"
-    while (m_key + "x") in mappings:
-        chn_data = ch0_data.copy()
-
-        # Map x.
-        tx = mappings[m_key + "x"]
-        chn_data['x'] = tx[0] + ch0_data['x']*tx[1] + ch0_data['y']*tx[2]
-
-        # Map y.
-        ty = mappings[m_key + "y"]
-        chn_data['y'] = ty[0] + ch0_data['x']*ty[1] + ch0_data['y']*ty[2]
-
-        # Map frame.
-        chn_data['fr'] = ch0_data['fr'] - frame_offsets[0] + frame_offsets[channel]
-
-        with writeinsight3.I3Writer(basename + "_ch" + str(channel) + ".bin") as i3w:
-            i3w.addMolecules(chn_data)
-                                    
-        channel += 1
-        m_key = "0_" + str(channel) + "_"
+    n_channels = 1
+    while ("0_" + str(n_channels) + "_x") in mappings:
+        n_channels += 1
+
+    # Write the channel 0 localizations separately if the molecule list
+    # is a combined file.
+    combined = (channelJoin.combinedChannels(mlist_filename) > 0)
+    i3_writers = []
+    for channel in range(n_channels):
+        if (channel > 0) or combined:
+            i3_writers.append(writeinsight3.I3Writer(basename + "_ch" + str(channel) + ".bin"))
+        else:
+            i3_writers.append(None)
+
+    # Load the molecule list (channel 0) a block at a time.
+    with channelJoin.ChannelJoin([mlist_filename], block_size = block_size, good_only = False) as join:
+        for i3_data in join:
+            ch0_data = i3_data[0]
+            if combined:
+                ch0_data['lk'] = -1
+                i3_writers[0].addMolecules(ch0_data)
+
+            # Map to other channels.
+            for channel in range(1, n_channels):
+                m_key = "0_" + str(channel) + "_"
+                chn_data = ch0_data.copy()
+
+                # Map x.
+                tx = mappings[m_key + "x"]
+                chn_data['x'] = tx[0] + ch0_data['x']*tx[1] + ch0_data['y']*tx[2]
+
+                # Map y.
+                ty = mappings[m_key + "y"]
+                chn_data['y'] = ty[0] + ch0_data['x']*ty[1] + ch0_data['y']*ty[2]
+
+                # Map frame.
+                chn_data['fr'] = ch0_data['fr'] - frame_offsets[0] + frame_offsets[channel]
+
+                i3_writers[channel].addMolecules(chn_data)
+
+    for i3w in i3_writers:
+        if i3w is not None:
+            i3w.close()
         
 
 if (__name__ == "__main__"):
@@ -73,7 +92,7 @@ if (__name__ == "__main__"):
     parser = argparse.ArgumentParser(description = 'Split peaks')
 
     parser.add_argument('--bin', dest='mlist', type=str, required=True,
-                        help = "The name of the localizations output file to split.")
+                        help = "The name of the localizations output file to split. This can also be a combined file.")
     parser.add_argument('--xml', dest='settings', type=str, required=True,
                         help = "The name of the settings xml file.")
 
@@ -7,6 +7,7 @@ Note: Tested against Spliner and Pupil function with
 
 Hazen 10/17
 """
+import numpy
 import pickle
 
 import storm_analysis.spliner.cramer_rao as cramerRao
@@ -82,6 +83,15 @@ class CRPSFFn(cramerRao.CRPSFObject):
     def getPSF(self, z_value):
         self.translate(z_value)
         return self.psf_fft_c.getPSF()
+
+    def getPSFAndDerivatives(self, z_values):
+        """
+        Calculate the PSF and it's derivatives at all the z values at once.
+        """
+        scaled_z = numpy.asarray(z_values, dtype = numpy.float64) * self.scale_gSZ
+        zeros = numpy.zeros(scaled_z.size)
+        [psfs, dxs, dys, dzs] = self.psf_fft_c.getPSFs(zeros, zeros, scaled_z, derivatives = True)
+        return [psfs, -dxs, -dys, dzs]
     
     def getZMax(self):
         return self.zmax
@@ -22,9 +22,6 @@
  */
 void ftFitAddPeak(fitData *fit_data)
 {
-  int j,k,l,m,n;
-  double bg,height;
-  double *psf;
   peakData *peak;
   psfFFTPeak *psf_fft_peak;
   psfFFTFit *psf_fft_fit;
@@ -45,6 +42,29 @@ void ftFitAddPeak(fitData *fit_data)
 
   /* Get PSF values, save with the peak. */
   pFTGetPSF(psf_fft_fit->psf_fft_data, psf_fft_peak->psf);
+
+  ftFitAddPSF(fit_data);
+}
+
+
+/*
+ * ftFitAddPSF()
+ *
+ * Add the working peak to the foreground and background data arrays
+ * using the current (already calculated) peak shape.
+ *
+ * fit_data - pointer to a fitData structure.
+ */
+void ftFitAddPSF(fitData *fit_data)
+{
+  int j,k,l,m,n;
+  double bg,height;
+  double *psf;
+  peakData *peak;
+  psfFFTPeak *psf_fft_peak;
+
+  peak = fit_data->working_peak;
+  psf_fft_peak = (psfFFTPeak *)peak->peak_model;
   
   /* 
    * Add peak to the foreground and background arrays. 
@@ -103,9 +123,7 @@ void ftFitCalcJH3D(fitData *fit_data, double *jacobian, double *hessian)
   /* Translate PF by dx, dy, dz. */
   pFTTranslate(psf_fft_fit->psf_fft_data, psf_fft_peak->dx, psf_fft_peak->dy, psf_fft_peak->dz);
 
-  pFTGetPSFdx(psf_fft_fit->psf_fft_data, psf_fft_fit->dx);
-  pFTGetPSFdy(psf_fft_fit->psf_fft_data, psf_fft_fit->dy);
-  pFTGetPSFdz(psf_fft_fit->psf_fft_data, psf_fft_fit->dz);
+  pFTGetPSFDerivatives(psf_fft_fit->psf_fft_data, psf_fft_fit->dx, psf_fft_fit->dy, psf_fft_fit->dz);
   
   /* 
    * Calculate jacobian and hessian. 
@@ -285,9 +303,11 @@ fitData* ftFitInitialize(psfFFT *psf_fft_data, double *scmos_calibration, double
  */
 void ftFitNewPeaks(fitData *fit_data, double *peak_params, int n_peaks)
 {
-  int i;
+  int i,j,psf_size;
+  double *psfs,*pdx,*pdy,*pdz;
   peakData *peak;
   psfFFTPeak *psf_fft_peak;
+  psfFFTFit *psf_fft_fit;
 
   /*
    * Free old peaks, if necessary.
@@ -342,11 +362,51 @@ void ftFitNewPeaks(fitData *fit_data, double *peak_params, int n_peaks)
     peak->xi = (int)round(peak->params[XCENTER]);
     peak->yi = (int)round(peak->params[YCENTER]);
 
-    /*
-     * Add the peak to the fit. 
-     */
+    psf_fft_peak->dx = peak->params[XCENTER] - (double)peak->xi;
+    psf_fft_peak->dy = peak->params[YCENTER] - (double)peak->yi; 
+    psf_fft_peak->dz = peak->params[ZCENTER];
+  }
+
+  /*
+   * Calculate the shapes of all the new peaks in one batch.
+   */
+  if(fit_data->nfit > 0){
+    psf_fft_fit = (psfFFTFit *)fit_data->fit_model;
+    psf_size = psf_fft_fit->psf_x * psf_fft_fit->psf_y;
+    psfs = (double *)malloc(sizeof(double)*psf_size*fit_data->nfit);
+    pdx = (double *)malloc(sizeof(double)*fit_data->nfit);
+    pdy = (double *)malloc(sizeof(double)*fit_data->nfit);
+    pdz = (double *)malloc(sizeof(double)*fit_data->nfit);
+
+    for(i=0;i<fit_data->nfit;i++){
+      psf_fft_peak = (psfFFTPeak *)fit_data->fit[i].peak_model;
+      pdx[i] = psf_fft_peak->dx;
+      pdy[i] = psf_fft_peak->dy;
+      pdz[i] = psf_fft_peak->dz;
+    }
+
+    pFTCalcPSFs(psf_fft_fit->psf_fft_data, pdx, pdy, pdz, psfs, NULL, NULL, NULL, fit_data->nfit);
+
+    for(i=0;i<fit_data->nfit;i++){
+      psf_fft_peak = (psfFFTPeak *)fit_data->fit[i].peak_model;
+      for(j=0;j<psf_size;j++){
+	psf_fft_peak->psf[j] = psfs[i*psf_size+j];
+      }
+    }
+
+    free(psfs);
+    free(pdx);
+    free(pdy);
+    free(pdz);
+  }
+
+  /*
+   * Add the peaks to the fit. 
+   */
+  for(i=0;i<fit_data->nfit;i++){
+    peak = &fit_data->fit[i];
     ftFitCopyPeak(peak, fit_data->working_peak);
-    ftFitAddPeak(fit_data);
+    ftFitAddPSF(fit_data);
     ftFitCopyPeak(fit_data->working_peak, peak);    
   }
 
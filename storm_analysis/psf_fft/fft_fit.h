@@ -35,6 +35,7 @@ typedef struct psfFFTFit
 } psfFFTFit;
 
 void ftFitAddPeak(fitData *);
+void ftFitAddPSF(fitData *);
 void ftFitCalcJH3D(fitData *, double *, double *);
 void ftFitCleanup(fitData *);
 void ftFitCopyPeak(peakData *, peakData *);
@@ -11,10 +11,20 @@
  *       position.
  *    D. ...
  *
- * So the PSF will stay at the adjusted position until pFTTranslate() 
+ * So the PSF will stay at the adjusted position until pFTTranslate()
  * is called again.
  *
- * Note: The boundary conditions are periodic, so the size of the 
+ * Alternatively pFTCalcPSFs() will calculate the PSFs (and optionally
+ * their derivatives) for many positions at once.
+ *
+ * Only the middle z plane of the (translated) 3D PSF is ever used, so
+ * rather than doing the full 3D inverse transform the z axis of the FFT
+ * of the PSF is summed (with the appropriate phase) for the middle z
+ * plane and then a 2D inverse transform is done. This is the same as
+ * (but a lot faster than) doing the 3D inverse transform and taking the
+ * middle z plane.
+ *
+ * Note: The boundary conditions are periodic, so the size of the
  *       PSF should be large enough that it goes to zero at the edges.
  *
  * Hazen 10/17.
@@ -30,6 +40,71 @@
 
 /* Functions */
 
+/*
+ * pFTCalcPSFs()
+ *
+ * Calculate the PSF (and optionally it's derivatives) at a number of
+ * positions. The inverse transforms are done in batches with a single
+ * FFTW plan.
+ *
+ * Note: This changes the current position of the PSF.
+ *
+ * pfft - A pointer to a psfFFT structure.
+ * dx - The x translations.
+ * dy - The y translations.
+ * dz - The z translations.
+ * psf - Pre-allocated storage for the PSFs (n x y_size x x_size).
+ * psf_dx - Pre-allocated storage for the x derivatives, or NULL.
+ * psf_dy - Pre-allocated storage for the y derivatives.
+ * psf_dz - Pre-allocated storage for the z derivatives.
+ * n - The number of positions.
+ */
+void pFTCalcPSFs(psfFFT *pfft, double *dx, double *dy, double *dz, double *psf, double *psf_dx, double *psf_dy, double *psf_dz, int n)
+{
+  int i,j,k,l,m,n_planes,xy_size;
+  double *outputs[4];
+
+  xy_size = pfft->xy_size;
+  n_planes = (psf_dx == NULL) ? 1 : 4;
+  outputs[0] = psf;
+  outputs[1] = psf_dx;
+  outputs[2] = psf_dy;
+  outputs[3] = psf_dz;
+
+  i = 0;
+
+  /* Full batches. */
+  while((n - i) >= (PFTBATCH/n_planes)){
+    for(j=0;j<(PFTBATCH/n_planes);j++){
+      pFTTranslate(pfft, dx[i+j], dy[i+j], dz[i+j]);
+      for(k=0;k<n_planes;k++){
+	pFTSetPlane(pfft, j*n_planes+k, k);
+      }
+    }
+
+    fftw_execute(pfft->fft_batch);
+
+    for(j=0;j<(PFTBATCH/n_planes);j++){
+      for(k=0;k<n_planes;k++){
+	l = (j*n_planes+k)*xy_size;
+	for(m=0;m<xy_size;m++){
+	  outputs[k][(i+j)*xy_size+m] = pfft->batch_real[l+m];
+	}
+      }
+    }
+    i += PFTBATCH/n_planes;
+  }
+
+  /* Left over positions. */
+  for(;i<n;i++){
+    pFTTranslate(pfft, dx[i], dy[i], dz[i]);
+    pFTGetPSF(pfft, &(psf[i*xy_size]));
+    if(psf_dx != NULL){
+      pFTGetPSFDerivatives(pfft, &(psf_dx[i*xy_size]), &(psf_dy[i*xy_size]), &(psf_dz[i*xy_size]));
+    }
+  }
+}
+
 /*
  * pFTCalcShiftVector()
  *
@@ -94,13 +169,21 @@ void pFTCleanup(psfFFT *pfft)
   free(pfft->ky_r);
   free(pfft->kz_c);
   free(pfft->kz_r);
-  
+  free(pfft->kx_d);
+  free(pfft->ky_d);
+  free(pfft->kz_d);
+
   fftw_free(pfft->fftw_real);
   fftw_free(pfft->fftw_fft);
   fftw_free(pfft->ws);
+  fftw_free(pfft->ws_dz);
   fftw_free(pfft->psf);
-  
+  fftw_free(pfft->batch_real);
+  fftw_free(pfft->batch_fft);
+
   fftw_destroy_plan(pfft->fft_backward);
+  fftw_destroy_plan(pfft->fft_backward_d);
+  fftw_destroy_plan(pfft->fft_batch);
 }
 
 /*
@@ -114,23 +197,44 @@ void pFTCleanup(psfFFT *pfft)
 void pFTGetPSF(psfFFT *pfft, double *psf)
 {
   int i;
-  int mid_z, size_xy;
 
-  /* Copy current FFT of PSF into FFTW input, */
-  for(i=0;i<pfft->fft_size;i++){
-    pfft->fftw_fft[i][0] = pfft->ws[i][0];
-    pfft->fftw_fft[i][1] = pfft->ws[i][1];
-  }
-  
+  pFTSetPlane(pfft, 0, 0);
+
   /* Do reverse transform. */
   fftw_execute(pfft->fft_backward);
 
-  /* The 2D PSF is the middle plane of the 3D PSF. */
-  size_xy = pfft->x_size*pfft->y_size;
-  mid_z = size_xy * (pfft->z_size/2);
-  
-  for(i=0;i<size_xy;i++){
-    psf[i] = pfft->fftw_real[mid_z+i];
+  for(i=0;i<pfft->xy_size;i++){
+    psf[i] = pfft->batch_real[i];
+  }
+}
+
+/*
+ * pFTGetPSFDerivatives()
+ *
+ * Return the derivatives with respect to x, y and z of the current
+ * PSF. This is faster than calling pFTGetPSFdx(), pFTGetPSFdy() and
+ * pFTGetPSFdz() separately.
+ *
+ * pfft - A pointer to a psfFFT structure.
+ * dx - Pre-allocated storage for the x derivative.
+ * dy - Pre-allocated storage for the y derivative.
+ * dz - Pre-allocated storage for the z derivative.
+ */
+void pFTGetPSFDerivatives(psfFFT *pfft, double *dx, double *dy, double *dz)
+{
+  int i;
+
+  pFTSetPlane(pfft, 0, 1);
+  pFTSetPlane(pfft, 1, 2);
+  pFTSetPlane(pfft, 2, 3);
+
+  /* Do reverse transforms. */
+  fftw_execute(pfft->fft_backward_d);
+
+  for(i=0;i<pfft->xy_size;i++){
+    dx[i] = pfft->batch_real[i];
+    dy[i] = pfft->batch_real[pfft->xy_size+i];
+    dz[i] = pfft->batch_real[2*pfft->xy_size+i];
   }
 }
 
@@ -144,37 +248,15 @@ void pFTGetPSF(psfFFT *pfft, double *psf)
  */
 void pFTGetPSFdx(psfFFT *pfft, double *dx)
 {
-  int i,j,k,t1,t2,t3;
-  int mid_z,size_xy;
-  double *dd;
+  int i;
 
-  /* Calculate FFT derivative vector. */
-  dd = pfft->kx_c;
-  pFTCalcShiftVectorDerivative(dd, pfft->x_size);
+  pFTSetPlane(pfft, 0, 1);
 
-  /* Copy current PF multiplied by kx into FFTW input. */
-  for(i=0;i<pfft->z_size;i++){
-    t1 = i * (pfft->y_size * pfft->fft_x_size);
-    for(j=0;j<pfft->y_size;j++){
-      t2 = j * pfft->fft_x_size;
-      for(k=0;k<pfft->fft_x_size;k++){
-	t3 = t1 + t2 + k;
-
-	pfft->fftw_fft[t3][0] = pfft->ws[t3][1]*dd[k];
-	pfft->fftw_fft[t3][1] = -1.0*pfft->ws[t3][0]*dd[k];
-      }
-    }
-  }
-  
   /* Do reverse transform. */
   fftw_execute(pfft->fft_backward);
 
-  /* The 2D PSF is the middle plane of the 3D PSF. */
-  size_xy = pfft->x_size*pfft->y_size;
-  mid_z = size_xy * (pfft->z_size/2);
-  
-  for(i=0;i<size_xy;i++){
-    dx[i] = pfft->fftw_real[mid_z+i];
+  for(i=0;i<pfft->xy_size;i++){
+    dx[i] = pfft->batch_real[i];
   }
 }
 
@@ -188,37 +270,15 @@ void pFTGetPSFdx(psfFFT *pfft, double *dx)
  */
 void pFTGetPSFdy(psfFFT *pfft, double *dy)
 {
-  int i,j,k,t1,t2,t3;
-  int mid_z,size_xy;
-  double *dd;
-
-  /* Calculate FFT derivative vector. */
-  dd = pfft->ky_c;
-  pFTCalcShiftVectorDerivative(dd, pfft->y_size);
+  int i;
 
-  /* Copy current PF multiplied by ky into FFTW input. */
-  for(i=0;i<pfft->z_size;i++){
-    t1 = i * (pfft->y_size * pfft->fft_x_size);
-    for(j=0;j<pfft->y_size;j++){
-      t2 = j * pfft->fft_x_size;
-      for(k=0;k<pfft->fft_x_size;k++){
-	t3 = t1 + t2 + k;
-
-	pfft->fftw_fft[t3][0] = pfft->ws[t3][1]*dd[j];
-	pfft->fftw_fft[t3][1] = -1.0*pfft->ws[t3][0]*dd[j];
-      }
-    }
-  }
+  pFTSetPlane(pfft, 0, 2);
 
   /* Do reverse transform. */
   fftw_execute(pfft->fft_backward);
 
-  /* The 2D PSF is the middle plane of the 3D PSF. */
-  size_xy = pfft->x_size*pfft->y_size;
-  mid_z = size_xy * (pfft->z_size/2);
-  
-  for(i=0;i<size_xy;i++){
-    dy[i] = pfft->fftw_real[mid_z+i];
+  for(i=0;i<pfft->xy_size;i++){
+    dy[i] = pfft->batch_real[i];
   }
 }
 
@@ -232,37 +292,15 @@ void pFTGetPSFdy(psfFFT *pfft, double *dy)
  */
 void pFTGetPSFdz(psfFFT *pfft, double *dz)
 {
-  int i,j,k,t1,t2,t3;
-  int mid_z,size_xy;
-  double *dd;
-
-  /* Calculate FFT derivative vector. */
-  dd = pfft->kz_c;
-  pFTCalcShiftVectorDerivative(dd, pfft->z_size);
+  int i;
 
-  /* Copy current PF multiplied by ky into FFTW input. */
-  for(i=0;i<pfft->z_size;i++){
-    t1 = i * (pfft->y_size * pfft->fft_x_size);
-    for(j=0;j<pfft->y_size;j++){
-      t2 = j * pfft->fft_x_size;
-      for(k=0;k<pfft->fft_x_size;k++){
-	t3 = t1 + t2 + k;
+  pFTSetPlane(pfft, 0, 3);
 
-	pfft->fftw_fft[t3][0] = pfft->ws[t3][1]*dd[i];
-	pfft->fftw_fft[t3][1] = -1.0*pfft->ws[t3][0]*dd[i];
-      }
-    }
-  }
-  
   /* Do reverse transform. */
   fftw_execute(pfft->fft_backward);
 
-  /* The 2D PSF is the middle plane of the 3D PSF. */
-  size_xy = pfft->x_size*pfft->y_size;
-  mid_z = size_xy * (pfft->z_size/2);
-  
-  for(i=0;i<size_xy;i++){
-    dz[i] = -pfft->fftw_real[mid_z+i];
+  for(i=0;i<pfft->xy_size;i++){
+    dz[i] = pfft->batch_real[i];
   }
 }
 
@@ -271,7 +309,7 @@ void pFTGetPSFdz(psfFFT *pfft, double *dz)
  */
 int pFTGetXSize(psfFFT *pfft)
 {
-  return pfft->x_size;  
+  return pfft->x_size;
 }
 
 /*
@@ -279,7 +317,7 @@ int pFTGetXSize(psfFFT *pfft)
  */
 int pFTGetYSize(psfFFT *pfft)
 {
-  return pfft->y_size;  
+  return pfft->y_size;
 }
 
 /*
@@ -287,7 +325,7 @@ int pFTGetYSize(psfFFT *pfft)
  */
 int pFTGetZSize(psfFFT *pfft)
 {
-  return pfft->z_size;  
+  return pfft->z_size;
 }
 
 /*
@@ -301,27 +339,30 @@ int pFTGetZSize(psfFFT *pfft)
  * psf - The psf (z_size, y_size, x_size).
  * z_size - The size of the psf in z (slowest dimension).
  * y_size - The size of the psf in y.
- * x_size - The size of the psf in x (fastest dimension). 
+ * x_size - The size of the psf in x (fastest dimension).
  *
  * return - A psf_fft structure.
  */
 psfFFT *pFTInitialize(double *psf, int z_size, int y_size, int x_size)
 {
   int i;
+  int n[2];
   double normalization;
   fftw_plan fft_forward;
   psfFFT *pfft;
 
   pfft = (psfFFT *)malloc(sizeof(psfFFT));
-  
+
   /* Initialize some variables. */
   pfft->x_size = x_size;
   pfft->y_size = y_size;
   pfft->z_size = z_size;
   pfft->psf_size = z_size * y_size * x_size;
+  pfft->xy_size = y_size * x_size;
 
   pfft->fft_x_size = (x_size/2 + 1);
   pfft->fft_size = z_size * y_size * (x_size/2 + 1);
+  pfft->fft_xy_size = y_size * (x_size/2 + 1);
 
   normalization = 1.0/((double)(pfft->psf_size));
 
@@ -332,52 +373,130 @@ psfFFT *pFTInitialize(double *psf, int z_size, int y_size, int x_size)
   pfft->ky_r = (double *)malloc(sizeof(double)*y_size);
   pfft->kz_c = (double *)malloc(sizeof(double)*z_size);
   pfft->kz_r = (double *)malloc(sizeof(double)*z_size);
+  pfft->kx_d = (double *)malloc(sizeof(double)*x_size);
+  pfft->ky_d = (double *)malloc(sizeof(double)*y_size);
+  pfft->kz_d = (double *)malloc(sizeof(double)*z_size);
 
   pfft->fftw_real = (double *)fftw_malloc(sizeof(double)*pfft->psf_size);
   pfft->fftw_fft = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*pfft->fft_size);
-  pfft->ws = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*pfft->fft_size);
+  pfft->ws = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*pfft->fft_xy_size);
+  pfft->ws_dz = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*pfft->fft_xy_size);
   pfft->psf = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*pfft->fft_size);
-
-  /* Create FFT plan. */
-  pfft->fft_backward = fftw_plan_dft_c2r_3d(z_size, y_size, x_size, pfft->fftw_fft, pfft->fftw_real, FFTW_MEASURE);
+  pfft->batch_real = (double *)fftw_malloc(sizeof(double)*pfft->xy_size*PFTBATCH);
+  pfft->batch_fft = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*pfft->fft_xy_size*PFTBATCH);
+
+  /* The derivative vectors don't depend on the translation. */
+  pFTCalcShiftVectorDerivative(pfft->kx_d, x_size);
+  pFTCalcShiftVectorDerivative(pfft->ky_d, y_size);
+  pFTCalcShiftVectorDerivative(pfft->kz_d, z_size);
+
+  /*
+   * Create the (2D) inverse FFT plans. These all work on the batch
+   * storage, with one plane for the PSF, three planes for the
+   * derivatives and PFTBATCH planes for batched calculations.
+   */
+  n[0] = y_size;
+  n[1] = x_size;
+  pfft->fft_backward = fftw_plan_many_dft_c2r(2, n, 1,
+					      pfft->batch_fft, NULL, 1, pfft->fft_xy_size,
+					      pfft->batch_real, NULL, 1, pfft->xy_size,
+					      FFTW_MEASURE);
+  pfft->fft_backward_d = fftw_plan_many_dft_c2r(2, n, 3,
+						pfft->batch_fft, NULL, 1, pfft->fft_xy_size,
+						pfft->batch_real, NULL, 1, pfft->xy_size,
+						FFTW_MEASURE);
+  pfft->fft_batch = fftw_plan_many_dft_c2r(2, n, PFTBATCH,
+					   pfft->batch_fft, NULL, 1, pfft->fft_xy_size,
+					   pfft->batch_real, NULL, 1, pfft->xy_size,
+					   FFTW_MEASURE);
 
   /* Compute FFT of psf and save. */
   fft_forward = fftw_plan_dft_r2c_3d(z_size, y_size, x_size, pfft->fftw_real, pfft->fftw_fft, FFTW_ESTIMATE);
-  
+
   for(i=0;i<pfft->psf_size;i++){
     pfft->fftw_real[i] = psf[i] * normalization;
   }
-  
+
   fftw_execute(fft_forward);
-  
+
   for(i=0;i<pfft->fft_size;i++){
     pfft->psf[i][0] = pfft->fftw_fft[i][0];
     pfft->psf[i][1] = pfft->fftw_fft[i][1];
-    pfft->ws[i][0] = pfft->fftw_fft[i][0];
-    pfft->ws[i][1] = pfft->fftw_fft[i][1];
   }
 
   fftw_destroy_plan(fft_forward);
 
+  /* Initial position. */
+  pFTTranslate(pfft, 0.0, 0.0, 0.0);
+
   return pfft;
 }
 
+/*
+ * pFTSetPlane()
+ *
+ * Copy the FFT of the current PSF (or one of it's derivatives) into
+ * one of the planes of the batch storage.
+ *
+ * pfft - A pointer to a psfFFT structure.
+ * plane - The batch plane.
+ * type - 0 = PSF, 1 = dx, 2 = dy, 3 = dz.
+ */
+void pFTSetPlane(psfFFT *pfft, int plane, int type)
+{
+  int i,j,k,t1;
+  fftw_complex *dest;
+
+  dest = &(pfft->batch_fft[plane * pfft->fft_xy_size]);
+
+  if(type == 0){
+    for(i=0;i<pfft->fft_xy_size;i++){
+      dest[i][0] = pfft->ws[i][0];
+      dest[i][1] = pfft->ws[i][1];
+    }
+  }
+  else if(type == 1){
+    for(j=0;j<pfft->y_size;j++){
+      t1 = j * pfft->fft_x_size;
+      for(k=0;k<pfft->fft_x_size;k++){
+	dest[t1+k][0] = pfft->ws[t1+k][1]*pfft->kx_d[k];
+	dest[t1+k][1] = -1.0*pfft->ws[t1+k][0]*pfft->kx_d[k];
+      }
+    }
+  }
+  else if(type == 2){
+    for(j=0;j<pfft->y_size;j++){
+      t1 = j * pfft->fft_x_size;
+      for(k=0;k<pfft->fft_x_size;k++){
+	dest[t1+k][0] = pfft->ws[t1+k][1]*pfft->ky_d[j];
+	dest[t1+k][1] = -1.0*pfft->ws[t1+k][0]*pfft->ky_d[j];
+      }
+    }
+  }
+  else{
+    for(i=0;i<pfft->fft_xy_size;i++){
+      dest[i][0] = pfft->ws_dz[i][0];
+      dest[i][1] = pfft->ws_dz[i][1];
+    }
+  }
+}
+
 /*
  * pFTTranslate()
  *
- * Translate the psf by dx, dy, dz.  
+ * Translate the psf by dx, dy, dz.
  */
 void pFTTranslate(psfFFT *pfft, double dx, double dy, double dz)
 {
-  int i,j,k,t1,t2,t3;
-  double c1,c2,r1,r2;
+  int i,j,k,mid_z,t1,t2,t3;
+  double c1,c2,cz,r1,r2,rz,tc,tr;
   double *sxc,*sxr,*syc,*syr,*szc,*szr;
 
   /* Calculate FFT translation vectors. */
   sxc = pfft->kx_c;
   sxr = pfft->kx_r;
   pFTCalcShiftVector(sxr, sxc, dx, pfft->x_size);
-  
+
   syc = pfft->ky_c;
   syr = pfft->ky_r;
   pFTCalcShiftVector(syr, syc, dy, pfft->y_size);
@@ -387,32 +506,69 @@ void pFTTranslate(psfFFT *pfft, double dx, double dy, double dz)
   szr = pfft->kz_r;
   pFTCalcShiftVector(szr, szc, -dz, pfft->z_size);
 
-  /* Translate */
+  /*
+   * Include the phase for the inverse transform in z at the middle
+   * z plane of the PSF.
+   */
+  mid_z = pfft->z_size/2;
   for(i=0;i<pfft->z_size;i++){
-    t1 = i * (pfft->y_size * pfft->fft_x_size);
-    for(j=0;j<pfft->y_size;j++){
-      t2 = j * pfft->fft_x_size;
-      for(k=0;k<pfft->fft_x_size;k++){
-	t3 = t1 + t2 + k;
-	
-	r1 = pfft->psf[t3][0];
-	c1 = pfft->psf[t3][1];
+    tr = cos(2.0 * M_PI * (double)(i * mid_z)/((double)pfft->z_size));
+    tc = sin(2.0 * M_PI * (double)(i * mid_z)/((double)pfft->z_size));
+    r1 = szr[i];
+    c1 = szc[i];
+    szr[i] = r1 * tr - c1 * tc;
+    szc[i] = r1 * tc + c1 * tr;
+  }
 
-	/* z shift. */
-	r2 = r1 * szr[i] - c1 * szc[i];
-	c2 = r1 * szc[i] + c1 * szr[i];
+  /* Translate in z and sum. */
+  for(i=0;i<pfft->fft_xy_size;i++){
+    pfft->ws[i][0] = 0.0;
+    pfft->ws[i][1] = 0.0;
+    pfft->ws_dz[i][0] = 0.0;
+    pfft->ws_dz[i][1] = 0.0;
+  }
 
-	/* y shift. */
-	r1 = r2 * syr[j] - c2 * syc[j];
-	c1 = r2 * syc[j] + c2 * syr[j];
+  for(i=0;i<pfft->z_size;i++){
+    t1 = i * pfft->fft_xy_size;
 
-	/* x shift. */
-	r2 = r1 * sxr[k] - c1 * sxc[k];
-	c2 = r1 * sxc[k] + c1 * sxr[k];		
+    /*
+     * The z derivative. This has the opposite sign from the x and
+     * y derivatives to match the Z convention.
+     */
+    rz = -szc[i]*pfft->kz_d[i];
+    cz = szr[i]*pfft->kz_d[i];
 
-	pfft->ws[t3][0] = r2;
-	pfft->ws[t3][1] = c2;
-      }
+    for(j=0;j<pfft->fft_xy_size;j++){
+      r1 = pfft->psf[t1+j][0];
+      c1 = pfft->psf[t1+j][1];
+
+      pfft->ws[j][0] += r1 * szr[i] - c1 * szc[i];
+      pfft->ws[j][1] += r1 * szc[i] + c1 * szr[i];
+
+      pfft->ws_dz[j][0] += r1 * rz - c1 * cz;
+      pfft->ws_dz[j][1] += r1 * cz + c1 * rz;
+    }
+  }
+
+  /* Translate in x and y. */
+  for(j=0;j<pfft->y_size;j++){
+    t2 = j * pfft->fft_x_size;
+    for(k=0;k<pfft->fft_x_size;k++){
+      t3 = t2 + k;
+
+      /* xy shift. */
+      tr = syr[j] * sxr[k] - syc[j] * sxc[k];
+      tc = syr[j] * sxc[k] + syc[j] * sxr[k];
+
+      r1 = pfft->ws[t3][0];
+      c1 = pfft->ws[t3][1];
+      pfft->ws[t3][0] = r1 * tr - c1 * tc;
+      pfft->ws[t3][1] = r1 * tc + c1 * tr;
+
+      r2 = pfft->ws_dz[t3][0];
+      c2 = pfft->ws_dz[t3][1];
+      pfft->ws_dz[t3][0] = r2 * tr - c2 * tc;
+      pfft->ws_dz[t3][1] = r2 * tc + c2 * tr;
     }
-  }  
+  }
 }
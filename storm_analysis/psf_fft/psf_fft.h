@@ -15,9 +15,11 @@ typedef struct psfFFT
   int y_size;              /* PSF size in y. */
   int z_size;              /* PSF size in z. */
   int psf_size;            /* x_size * y_size * z_size. */
+  int xy_size;             /* x_size * y_size. */
 
   int fft_x_size;          /* FFT size in x (fast dimension), x_size/2 + 1 */
   int fft_size;            /* (x_size/2 + 1) * y_size * z_size. */
+  int fft_xy_size;         /* (x_size/2 + 1) * y_size. */
   
   double *kx_c;            /* These are all working storage. */
   double *kx_r;
@@ -26,19 +28,34 @@ typedef struct psfFFT
   double *kz_c;
   double *kz_r;
 
-  double *fftw_real;      /* Real space vector for FFTW. */
-  fftw_complex *fftw_fft; /* FFT space vector for FFTW. */
+  double *kx_d;            /* FFT derivative vectors. */
+  double *ky_d;
+  double *kz_d;
+
+  double *fftw_real;       /* Real space vector for FFTW. */
+  fftw_complex *fftw_fft;  /* FFT space vector for FFTW. */
   
-  fftw_complex *ws;       /* Working storage. */
-  fftw_complex *psf;      /* Fourier transform of the PSF. */
+  fftw_complex *ws;        /* FFT of the translated PSF in the z = 0 plane. */
+  fftw_complex *ws_dz;     /* FFT of the z derivative of the translated PSF in the z = 0 plane. */
+  fftw_complex *psf;       /* Fourier transform of the PSF. */
+
+  double *batch_real;      /* Real space planes for batched transforms. */
+  fftw_complex *batch_fft; /* FFT space planes for batched transforms. */
 
-  fftw_plan fft_backward;
+  fftw_plan fft_backward;   /* Single plane inverse transform. */
+  fftw_plan fft_backward_d; /* Inverse transform of the 3 derivative planes. */
+  fftw_plan fft_batch;      /* Inverse transform of PFTBATCH planes. */
 } psfFFT;
 
+/* The number of planes in a batched inverse transform. */
+#define PFTBATCH 64
+
+void pFTCalcPSFs(psfFFT *, double *, double *, double *, double *, double *, double *, double *, int);
 void pFTCalcShiftVector(double *, double *, double, int);
 void pFTCalcShiftVectorDerivative(double *, int);
 void pFTCleanup(psfFFT *);
 void pFTGetPSF(psfFFT *, double *);
+void pFTGetPSFDerivatives(psfFFT *, double *, double *, double *);
 void pFTGetPSFdx(psfFFT *, double *);
 void pFTGetPSFdy(psfFFT *, double *);
 void pFTGetPSFdz(psfFFT *, double *);
@@ -46,6 +63,7 @@ int pFTGetXSize(psfFFT *);
 int pFTGetYSize(psfFFT *);
 int pFTGetZSize(psfFFT *);
 psfFFT *pFTInitialize(double *, int, int, int);
+void pFTSetPlane(psfFFT *, int, int);
 void pFTTranslate(psfFFT *, double, double, double);
 
 #endif
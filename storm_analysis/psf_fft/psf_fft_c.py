@@ -10,15 +10,34 @@ import numpy
 from numpy.ctypeslib import ndpointer
 import os
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.loadclib as loadclib
 
+# Apply the FFTW threads setting from the environment.
+fftwThreadsC.initialize()
+
 psf_fft = loadclib.loadCLibrary("storm_analysis.psf_ftt", "psf_fft")
 
+psf_fft.pFTCalcPSFs.argtypes = [ctypes.c_void_p,
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ctypes.c_void_p,
+                                ctypes.c_void_p,
+                                ctypes.c_void_p,
+                                ctypes.c_int]
+
 psf_fft.pFTCleanup.argtypes = [ctypes.c_void_p]
 
 psf_fft.pFTGetPSF.argtypes = [ctypes.c_void_p,
                               ndpointer(dtype = numpy.float64)]
 
+psf_fft.pFTGetPSFDerivatives.argtypes = [ctypes.c_void_p,
+                                         ndpointer(dtype = numpy.float64),
+                                         ndpointer(dtype = numpy.float64),
+                                         ndpointer(dtype = numpy.float64)]
+
 psf_fft.pFTGetPSFdx.argtypes = [ctypes.c_void_p,
                                 ndpointer(dtype = numpy.float64)]
 
@@ -71,6 +90,47 @@ class PSFFFT(object):
         psf_fft.pFTGetPSF(self.pfft, psf)
         return psf
 
+    def getPSFDerivatives(self):
+        """
+        Returns [dx, dy, dz], the derivatives of the current PSF.
+        """
+        shape = (self.psf_shape[1], self.psf_shape[2])
+        dx = numpy.zeros(shape, dtype = numpy.float64)
+        dy = numpy.zeros(shape, dtype = numpy.float64)
+        dz = numpy.zeros(shape, dtype = numpy.float64)
+        psf_fft.pFTGetPSFDerivatives(self.pfft, dx, dy, dz)
+        return [dx, dy, dz]
+
+    def getPSFs(self, dx, dy, dz, derivatives = False):
+        """
+        Calculate the PSF at many positions at once. See translate()
+        for the conventions.
+
+        Returns an array of PSFs (n, y, x) or, if derivatives is True,
+        [psfs, psfs_dx, psfs_dy, psfs_dz].
+
+        Note: This changes the current position of the PSF.
+        """
+        c_dx = numpy.ascontiguousarray(dx, dtype = numpy.float64)
+        c_dy = numpy.ascontiguousarray(dy, dtype = numpy.float64)
+        c_dz = numpy.ascontiguousarray(dz, dtype = numpy.float64)
+        if (c_dx.size != c_dy.size) or (c_dx.size != c_dz.size):
+            raise PSFFFTException("dx, dy and dz must be the same size.")
+
+        shape = (c_dx.size, self.psf_shape[1], self.psf_shape[2])
+        psfs = numpy.zeros(shape, dtype = numpy.float64)
+        if derivatives:
+            d_psfs = [numpy.zeros(shape, dtype = numpy.float64) for i in range(3)]
+            psf_fft.pFTCalcPSFs(self.pfft, c_dx, c_dy, c_dz, psfs,
+                                d_psfs[0].ctypes.data,
+                                d_psfs[1].ctypes.data,
+                                d_psfs[2].ctypes.data,
+                                c_dx.size)
+            return [psfs] + d_psfs
+        else:
+            psf_fft.pFTCalcPSFs(self.pfft, c_dx, c_dy, c_dz, psfs, None, None, None, c_dx.size)
+            return psfs
+
     def getPSFdx(self):
         dx = numpy.ascontiguousarray(numpy.zeros((self.psf_shape[1], self.psf_shape[2]), dtype = numpy.float64),
                                       dtype = numpy.float64)
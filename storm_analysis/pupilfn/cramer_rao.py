@@ -13,6 +13,7 @@ import pickle
 import storm_analysis.simulator.pupil_math as pupilMath
 import storm_analysis.spliner.cramer_rao as cramerRao
 
+import storm_analysis.pupilfn.pupil_fn_cache as pupilFnCache
 import storm_analysis.pupilfn.pupil_function_c as pupilFnC
 
 class CRPupilFn(cramerRao.CRPSFObject):
@@ -48,6 +49,11 @@ class CRPupilFn(cramerRao.CRPSFObject):
         self.pupil_fn_c = pupilFnC.PupilFunction(geo)
         self.pupil_fn_c.setPF(pf)
 
+        # The same z values are requested repeatedly, so cache the PSFs
+        # and their derivatives.
+        self.psf_cache = pupilFnCache.PupilFunctionCache(pupil_fn_c = self.pupil_fn_c,
+                                                         max_size = 256)
+
         # Additional initializations.
         self.zmax = zmax
         self.zmin = zmin
@@ -74,21 +80,15 @@ class CRPupilFn(cramerRao.CRPSFObject):
         return self.delta_z
                 
     def getDx(self, z_value):
-        self.translate(z_value)
-        psf_c = self.pupil_fn_c.getPSF()
-        psf_c_dx = self.pupil_fn_c.getPSFdx()
+        [psf_c, psf_c_dx, psf_c_dy, psf_c_dz] = self.getPSFs(z_value)
         return -2.0*numpy.transpose(numpy.real(psf_c)*numpy.real(psf_c_dx) + numpy.imag(psf_c)*numpy.imag(psf_c_dx))
 
     def getDy(self, z_value):
-        self.translate(z_value)
-        psf_c = self.pupil_fn_c.getPSF()
-        psf_c_dy = self.pupil_fn_c.getPSFdy()
+        [psf_c, psf_c_dx, psf_c_dy, psf_c_dz] = self.getPSFs(z_value)
         return -2.0*numpy.transpose(numpy.real(psf_c)*numpy.real(psf_c_dy) + numpy.imag(psf_c)*numpy.imag(psf_c_dy))
     
     def getDz(self, z_value):
-        self.translate(z_value)
-        psf_c = self.pupil_fn_c.getPSF()
-        psf_c_dz = self.pupil_fn_c.getPSFdz()
+        [psf_c, psf_c_dx, psf_c_dy, psf_c_dz] = self.getPSFs(z_value)
         return 2.0*numpy.transpose(numpy.real(psf_c)*numpy.real(psf_c_dz) + numpy.imag(psf_c)*numpy.imag(psf_c_dz))
 
     def getNormalization(self):
@@ -98,9 +98,14 @@ class CRPupilFn(cramerRao.CRPSFObject):
         return self.n_zvals
         
     def getPSF(self, z_value):
-        self.translate(z_value)
-        psf_c = self.pupil_fn_c.getPSF()
+        psf_c = self.getPSFs(z_value)[0]
         return numpy.transpose(pupilMath.intensity(psf_c))
+
+    def getPSFs(self, z_value):
+        """
+        Returns the complex PSF and it's derivatives at z_value (in nanometers).
+        """
+        return self.psf_cache.getPSFAndDerivatives(0.0, 0.0, z_value * 1.0e-3)
     
     def getZMax(self):
         return self.zmax
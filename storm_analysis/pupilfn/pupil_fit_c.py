@@ -11,10 +11,14 @@ from numpy.ctypeslib import ndpointer
 import os
 import sys
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.ia_utilities_c as utilC
 import storm_analysis.sa_library.loadclib as loadclib
 import storm_analysis.sa_library.dao_fit_c as daoFitC
 
+# Apply the FFTW threads setting from the environment.
+fftwThreadsC.initialize()
+
 
 def loadPupilFitC():
     pupil_fit = loadclib.loadCLibrary("storm_analysis.pupilfn", "pupil_fit")
@@ -12,15 +12,23 @@ import numpy
 import storm_analysis.sa_library.fitting as fitting
 import storm_analysis.simulator.pupil_math as pupilMath
 
+import storm_analysis.pupilfn.pupil_fn_cache as pupilFnCache
 import storm_analysis.pupilfn.pupil_function_c as pupilFnC
 
 class PupilFunction(fitting.PSFFunction):
 
-    def __init__(self, pf_filename = None, zmin = None, zmax = None, **kwds):
+    def __init__(self, pf_filename = None, zmin = None, zmax = None, cache_size = 64, z_step = None, zstack_dir = None, **kwds):
         """
         Technically a pupil function would cover any z range, but in fitting
         we are limit it to a finite range. Also, zmin and zmax should be 
         specified in nanometers.
+
+        cache_size - The number of PSFs to keep in the (LRU) PSF cache.
+        z_step - If this is specified the PSFs between zmin and zmax are
+                 pre-calculated at this spacing (in nanometers) and
+                 getPSF() interpolates between them.
+        zstack_dir - Directory for saving pre-calculated PSFs so that they
+                     can be shared with other processes.
         """
         super(PupilFunction, self).__init__(**kwds)
         self.zmax = zmax
@@ -49,6 +57,18 @@ class PupilFunction(fitting.PSFFunction):
         self.pupil_fn_c = pupilFnC.PupilFunction(geo)
         self.pupil_fn_c.setPF(pf)
 
+        self.psf_cache = pupilFnCache.PupilFunctionCache(pupil_fn_c = self.pupil_fn_c,
+                                                         max_size = cache_size)
+
+        self.zstack = None
+        if z_step is not None:
+            self.zstack = pupilFnCache.PupilFunctionZStack(pupil_fn_c = self.pupil_fn_c,
+                                                           zmin = 1.0e-3 * zmin,
+                                                           zmax = 1.0e-3 * zmax,
+                                                           z_step = 1.0e-3 * z_step,
+                                                           directory = zstack_dir,
+                                                           key = pupilFnCache.pfKey(pf_data))
+
     def getCPointer(self):
         return self.pupil_fn_c.getCPointer()
 
@@ -61,15 +81,14 @@ class PupilFunction(fitting.PSFFunction):
         """
         # Convert z_value to microns.
         z_value = 1.0e-3 * z_value
-        
-        # Translate to the correct z value.
-        self.pupil_fn_c.translate(0.0, 0.0, z_value)
 
-        # Get the (complex) PSF.
-        psf = self.pupil_fn_c.getPSF()
+        # Use the pre-calculated PSFs if possible.
+        if self.zstack is not None and self.zstack.inRange(z_value):
+            psf = self.zstack.getIntensity(z_value)
 
-        # Convert to intensity
-        psf = pupilMath.intensity(psf)
+        # Otherwise get the (complex) PSF and convert to intensity.
+        else:
+            psf = pupilMath.intensity(self.psf_cache.getPSF(0.0, 0.0, z_value))
 
         # Center into a (larger) array if requested.
         if shape is not None:
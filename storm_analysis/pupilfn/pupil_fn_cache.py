@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Caching of pupil function PSFs.
+
+PupilFunctionCache keeps a least recently used cache of the complex
+PSFs (and optionally their derivatives) keyed on the position
+(dx, dy, z).
+
+PupilFunctionZStack pre-calculates the complex PSFs at evenly spaced
+z values, using batched FFTs, and returns PSFs at intermediate z
+values by linear interpolation. The z-stack can be saved in a file
+in a cache directory, in which case it is memory mapped (read only)
+so that all the processes that use the same pupil function (and z
+range) share the same data and only the first one has to calculate it.
+
+Note: All the positions are in the units of pupil_function_c, i.e.
+      pixels for x/y and microns for z.
+
+Hazen 10/26
+"""
+
+import hashlib
+import numpy
+import os
+
+import storm_analysis.sa_library.lru_cache as lruCache
+import storm_analysis.simulator.pupil_math as pupilMath
+
+
+class PupilFunctionCacheException(Exception):
+    pass
+
+
+class PupilFunctionCache(object):
+    """
+    LRU cache of complex PSFs from a pupil_function_c.PupilFunction object.
+
+    Note: The PSFs that are returned are read only as they are shared
+          with the cache.
+    """
+    def __init__(self, pupil_fn_c = None, max_size = 64, **kwds):
+        super(PupilFunctionCache, self).__init__(**kwds)
+        self.cache = lruCache.LRUCache(max_size = max_size)
+        self.pupil_fn_c = pupil_fn_c
+
+    def getPSF(self, dx, dy, z):
+        """
+        Returns the complex PSF.
+        """
+        key = (dx, dy, z, False)
+        psf = self.cache.get(key)
+        if psf is None:
+            self.pupil_fn_c.translate(dx, dy, z)
+            psf = self.pupil_fn_c.getPSF()
+            psf.flags.writeable = False
+            self.cache.put(key, psf)
+        return psf
+
+    def getPSFAndDerivatives(self, dx, dy, z):
+        """
+        Returns [psf, psf_dx, psf_dy, psf_dz], all complex.
+        """
+        key = (dx, dy, z, True)
+        psfs = self.cache.get(key)
+        if psfs is None:
+            self.pupil_fn_c.translate(dx, dy, z)
+            psfs = [self.pupil_fn_c.getPSF(),
+                    self.pupil_fn_c.getPSFdx(),
+                    self.pupil_fn_c.getPSFdy(),
+                    self.pupil_fn_c.getPSFdz()]
+            for elt in psfs:
+                elt.flags.writeable = False
+            self.cache.put(key, psfs)
+        return psfs
+
+    def getStats(self):
+        return self.cache.getStats()
+
+
+class PupilFunctionZStack(object):
+    """
+    The complex PSFs of a pupil function at evenly spaced z values.
+    """
+    def __init__(self, pupil_fn_c = None, zmin = None, zmax = None, z_step = None, directory = None, key = None, **kwds):
+        """
+        pupil_fn_c - A pupil_function_c.PupilFunction object.
+        zmin, zmax, z_step - The z range and spacing (in microns).
+        directory - Directory to save the z-stack in, or None to keep it in memory.
+        key - A string that uniquely identifies the pupil function (and the
+              geometry), this is required if directory is not None.
+        """
+        super(PupilFunctionZStack, self).__init__(**kwds)
+
+        self.n_z = int(round((zmax - zmin)/z_step)) + 1
+        self.z_step = z_step
+        self.zmin = zmin
+        self.zmax = zmin + (self.n_z - 1) * z_step
+
+        if directory is None:
+            self.zstack = self.calculate(pupil_fn_c)
+        else:
+            if key is None:
+                raise PupilFunctionCacheException("A key is required to save the z-stack.")
+            self.zstack = self.loadOrCalculate(pupil_fn_c, directory, key)
+
+    def calculate(self, pupil_fn_c, zstack = None):
+        """
+        Calculate the z-stack, using batched FFTs.
+        """
+        z_values = self.getZValues()
+        zeros = numpy.zeros(self.n_z)
+        psfs = pupil_fn_c.getPSFs(zeros, zeros, z_values)
+        if zstack is None:
+            return psfs
+        zstack[:] = psfs
+        return zstack
+
+    def getIndex(self, z):
+        """
+        Returns [index, fraction] for linear interpolation.
+        """
+        if not self.inRange(z):
+            raise PupilFunctionCacheException("z value " + str(z) + " is outside of the z-stack.")
+        t = (z - self.zmin)/self.z_step
+        i = min(int(t), self.n_z - 2)
+        return [i, t - i]
+
+    def getIntensity(self, z):
+        """
+        Returns the PSF intensity at z, this is interpolated from the
+        intensities of the two nearest planes.
+        """
+        if (self.n_z == 1):
+            return pupilMath.intensity(self.zstack[0])
+        [i, t] = self.getIndex(z)
+        return (1.0 - t) * pupilMath.intensity(self.zstack[i]) + t * pupilMath.intensity(self.zstack[i+1])
+
+    def getPSF(self, z):
+        """
+        Returns the complex PSF at z, this is interpolated from the two
+        nearest planes.
+        """
+        if (self.n_z == 1):
+            return numpy.array(self.zstack[0])
+        [i, t] = self.getIndex(z)
+        return (1.0 - t) * self.zstack[i] + t * self.zstack[i+1]
+
+    def getZValues(self):
+        return self.zmin + self.z_step * numpy.arange(self.n_z)
+
+    def inRange(self, z):
+        return ((z >= self.zmin) and (z <= self.zmax))
+
+    def loadOrCalculate(self, pupil_fn_c, directory, key):
+        """
+        Load the z-stack from directory if it exists, otherwise calculate
+        it and save it in directory.
+        """
+        stack_key = hashlib.sha1((key + str([self.zmin, self.n_z, self.z_step])).encode()).hexdigest()
+        filename = os.path.join(directory, "pf_zstack_" + stack_key + ".npy")
+
+        if not os.path.exists(filename):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+            # Calculate in a temporary file that is renamed when complete so
+            # that other processes never see a partially written z-stack.
+            tmp_filename = filename + "." + str(os.getpid()) + ".tmp"
+            zstack = numpy.lib.format.open_memmap(tmp_filename,
+                                                  mode = "w+",
+                                                  dtype = numpy.complex128,
+                                                  shape = (self.n_z, pupil_fn_c.size, pupil_fn_c.size))
+            self.calculate(pupil_fn_c, zstack = zstack)
+            zstack.flush()
+            del zstack
+            os.replace(tmp_filename, filename)
+
+        return numpy.load(filename, mmap_mode = "r")
+
+
+def pfKey(pf_data):
+    """
+    Returns a key that identifies a pupil function (and it's geometry)
+    from the contents of a pupil function file.
+    """
+    hasher = hashlib.sha1()
+    hasher.update(numpy.ascontiguousarray(pf_data['pf']).tobytes())
+    hasher.update(str([pf_data['pixel_size'],
+                       pf_data['wavelength'],
+                       pf_data['immersion_index'],
+                       pf_data['numerical_aperture']]).encode())
+    return hasher.hexdigest()
@@ -15,6 +15,9 @@
  * So the PSF will stay at the adjusted position until pfTranslate() 
  * is called again.
  *
+ * Alternatively pfnGetPSFs() will calculate the PSFs at many positions
+ * using batches of inverse FFTs.
+ *
  * Note: 
  *  1. The boundary conditions are periodic, so the size of the 
  *     pupil function in pixels should be at least 1 pixel larger 
@@ -55,6 +58,12 @@ void pfnCleanup(pupilData *pupil_data)
   fftw_free(pupil_data->fftw_psf);
 
   fftw_destroy_plan(pupil_data->fft_backward);
+
+  if(pupil_data->fft_batch != NULL){
+    fftw_free(pupil_data->batch_pf);
+    fftw_free(pupil_data->batch_psf);
+    fftw_destroy_plan(pupil_data->fft_batch);
+  }
   
   free(pupil_data);
 }
@@ -159,6 +168,69 @@ void pfnGetPSFdz(pupilData *pupil_data, double *psf_dz_r, double *psf_dz_c)
   }
 }
 
+/*
+ * pfnGetPSFs()
+ *
+ * Get the PSF at many positions. This is the same as calling
+ * pfnTranslate() and pfnGetPSF() for each position, but the
+ * inverse FFTs are done in batches.
+ *
+ * Note: This changes the current position of the PF.
+ *
+ * dx, dy, dz - The positions, same units as pfnTranslate().
+ * psf_r, psf_c - Storage for the results (n x size x size).
+ * n - The number of positions.
+ */
+void pfnGetPSFs(pupilData *pupil_data, double *dx, double *dy, double *dz, double *psf_r, double *psf_c, int n)
+{
+  int i,j,k,l,m,size2;
+  int dims[2];
+
+  size2 = pupil_data->size*pupil_data->size;
+
+  /* Create the batch plan the first time it is needed. */
+  if(pupil_data->fft_batch == NULL){
+    pupil_data->batch_pf = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*size2*PFNBATCH);
+    pupil_data->batch_psf = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*size2*PFNBATCH);
+    dims[0] = pupil_data->size;
+    dims[1] = pupil_data->size;
+    pupil_data->fft_batch = fftw_plan_many_dft(2, dims, PFNBATCH,
+					       pupil_data->batch_pf, NULL, 1, size2,
+					       pupil_data->batch_psf, NULL, 1, size2,
+					       FFTW_BACKWARD, FFTW_MEASURE);
+  }
+
+  i = 0;
+
+  /* Full batches. */
+  while((n - i) >= PFNBATCH){
+    for(j=0;j<PFNBATCH;j++){
+      pfnTranslate(pupil_data, dx[i+j], dy[i+j], dz[i+j]);
+      l = j*size2;
+      for(k=0;k<size2;k++){
+	pupil_data->batch_pf[l+k][0] = pupil_data->ws[k][0];
+	pupil_data->batch_pf[l+k][1] = pupil_data->ws[k][1];
+      }
+    }
+
+    fftw_execute(pupil_data->fft_batch);
+
+    l = i*size2;
+    m = PFNBATCH*size2;
+    for(k=0;k<m;k++){
+      psf_r[l+k] = pupil_data->batch_psf[k][0];
+      psf_c[l+k] = pupil_data->batch_psf[k][1];
+    }
+    i += PFNBATCH;
+  }
+
+  /* Left over positions. */
+  for(;i<n;i++){
+    pfnTranslate(pupil_data, dx[i], dy[i], dz[i]);
+    pfnGetPSF(pupil_data, &(psf_r[i*size2]), &(psf_c[i*size2]));
+  }
+}
+
 /*
  * pfnGetSize()
  *
@@ -209,6 +281,11 @@ pupilData *pfnInitialize(double *kx, double *ky, double *kz, int size)
 
   pupil_data->fft_backward = fftw_plan_dft_2d(size, size, pupil_data->fftw_pf, pupil_data->fftw_psf, FFTW_BACKWARD, FFTW_MEASURE);
 
+  /* The batch FFT is only created if it is used. */
+  pupil_data->batch_pf = NULL;
+  pupil_data->batch_psf = NULL;
+  pupil_data->fft_batch = NULL;
+
   return pupil_data;
 }
 
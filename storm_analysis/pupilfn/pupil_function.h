@@ -9,6 +9,9 @@
 
 #include <fftw3.h>
 
+/* The number of PSFs to calculate at once in pfnGetPSFs(). */
+#define PFNBATCH 16
+
 typedef struct pupilData
 {
   int size;      /* The size of pupil function in X/Y in pixels. */
@@ -30,7 +33,11 @@ typedef struct pupilData
   fftw_complex *fftw_pf;
   fftw_complex *fftw_psf;
 
+  fftw_complex *batch_pf;   /* Batch FFT input, only allocated if needed. */
+  fftw_complex *batch_psf;  /* Batch FFT output. */
+
   fftw_plan fft_backward;
+  fftw_plan fft_batch;      /* Batch FFT plan, NULL if not created yet. */
 } pupilData;
 
 void pfnCleanup(pupilData *);
@@ -38,6 +45,7 @@ void pfnGetPSF(pupilData *, double *, double *);
 void pfnGetPSFdx(pupilData *, double *, double *);
 void pfnGetPSFdy(pupilData *, double *, double *);
 void pfnGetPSFdz(pupilData *, double *, double *);
+void pfnGetPSFs(pupilData *, double *, double *, double *, double *, double *, int);
 int pfnGetSize(pupilData *);
 pupilData *pfnInitialize(double *, double *, double *, int);
 void pfnSetPF(pupilData *, double *, double *);
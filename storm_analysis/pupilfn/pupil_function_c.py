@@ -9,12 +9,16 @@ import numpy
 from numpy.ctypeslib import ndpointer
 import os
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.loadclib as loadclib
 
 import storm_analysis.simulator.pupil_math as pupilMath
 
 #import storm_analysis.sa_library.recenter_psf as recenterPSF
 
+# Apply the FFTW threads setting from the environment.
+fftwThreadsC.initialize()
+
 pupil_fn = loadclib.loadCLibrary("storm_analysis.sa_library", "pupil_function")
 
 pupil_fn.pfnCleanup.argtypes = [ctypes.c_void_p]
@@ -35,6 +39,14 @@ pupil_fn.pfnGetPSFdz.argtypes = [ctypes.c_void_p,
                                  ndpointer(dtype = numpy.float64),
                                  ndpointer(dtype = numpy.float64)]
 
+pupil_fn.pfnGetPSFs.argtypes = [ctypes.c_void_p,
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64),
+                                ctypes.c_int]
+
 pupil_fn.pfnInitialize.argtypes = [ndpointer(dtype = numpy.float64),
                                    ndpointer(dtype = numpy.float64),
                                    ndpointer(dtype = numpy.float64),
@@ -94,6 +106,23 @@ class PupilFunction(object):
     def getPSFdz(self):
         return self.getXX(pupil_fn.pfnGetPSFdz)
 
+    def getPSFs(self, dx, dy, dz):
+        """
+        Returns the (complex) PSFs at many positions as a (n, size, size)
+        array. The units are the same as for translate().
+
+        Note: This changes the current position of the PF.
+        """
+        c_dx = numpy.ascontiguousarray(dx, dtype = numpy.float64)
+        c_dy = numpy.ascontiguousarray(dy, dtype = numpy.float64)
+        c_dz = numpy.ascontiguousarray(dz, dtype = numpy.float64)
+        assert (c_dx.size == c_dy.size) and (c_dx.size == c_dz.size)
+
+        r = numpy.zeros((c_dx.size, self.size, self.size), dtype = numpy.float64)
+        c = numpy.zeros((c_dx.size, self.size, self.size), dtype = numpy.float64)
+        pupil_fn.pfnGetPSFs(self.pfn, c_dx, c_dy, c_dz, r, c, c_dx.size)
+        return r + 1j*c
+
     def getXX(self, fn):
         r = numpy.zeros((self.size, self.size), dtype = numpy.float64)
         c = numpy.zeros((self.size, self.size), dtype = numpy.float64)
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+"""
+Ripley's K, L and H functions and the pair-correlation function g(r)
+for (2D) localization data, with Monte-Carlo envelopes for complete
+spatial randomness (CSR).
+
+Pair counting uses a KD tree and the translation edge correction of
+Ohser & Stoyan for a rectangular observation window. The counting is
+split into blocks of query localizations which are processed by a
+pool of threads.
+
+If two categories are specified the cross-K function is calculated,
+i.e. the second category is indexed and the localizations in the
+first category are used as the query points.
+
+Hazen 10/26
+"""
+
+import math
+import multiprocessing.pool
+import numpy
+import scipy
+import scipy.spatial
+
+import storm_analysis.sa_library.readinsight3 as readinsight3
+
+
+class RipleyException(Exception):
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+class PairCounter(object):
+    """
+    Counts (edge corrected) pairs between query localizations and a
+    fixed set of indexed localizations as a function of distance.
+
+    The index is built once and can be queried as many times as
+    needed, for example for a CSR envelope. The indexed localizations
+    can also be changed with setPoints(), this re-uses the position
+    buffer and only re-builds the KD tree.
+    """
+    def __init__(self, x = None, y = None, bounds = None, block_size = 20000, max_pairs = 2000000, n_threads = 4, **kwds):
+        """
+        x, y - The localizations to index (in nanometers).
+        bounds - The observation window [xmin, xmax, ymin, ymax], if not
+                 specified this is the bounding box of x, y.
+        max_pairs - The maximum number of pairs to store at any one time
+                    (per thread).
+        """
+        super(PairCounter, self).__init__(**kwds)
+
+        if bounds is None:
+            bounds = [numpy.min(x), numpy.max(x), numpy.min(y), numpy.max(y)]
+
+        self.block_size = block_size
+        self.bounds = bounds
+        self.height = bounds[3] - bounds[2]
+        self.max_pairs = max_pairs
+        self.n_threads = n_threads
+        self.width = bounds[1] - bounds[0]
+        self.xy = None
+
+        self.setPoints(x, y)
+
+    def countBlock(self, qx, qy, offset, r_edges, exclude_self):
+        """
+        Count pairs for a single block of query localizations.
+
+        If there are too many pairs the block is split in two, this
+        keeps the memory usage reasonable for densely clustered data.
+        The number of pairs is estimated from a sample of the query
+        localizations.
+        """
+        # The indexed localizations don't need a second KD tree.
+        if exclude_self and (offset == 0) and (qx.size == self.x.size):
+            q_kd = self.kd
+        else:
+            q_kd = scipy.spatial.cKDTree(numpy.stack((qx, qy), axis = -1))
+        step = max(1, qx.size//256)
+        n_sample = self.kd.query_ball_point(numpy.stack((qx[::step], qy[::step]), axis = -1),
+                                            r_edges[-1],
+                                            return_length = True)
+        if (qx.size > 1) and ((numpy.sum(n_sample) * step) > self.max_pairs):
+            half = qx.size//2
+            return (self.countBlock(qx[:half], qy[:half], offset, r_edges, exclude_self) +
+                    self.countBlock(qx[half:], qy[half:], offset + half, r_edges, exclude_self))
+
+        pairs = q_kd.sparse_distance_matrix(self.kd, r_edges[-1], output_type = "ndarray")
+
+        i = pairs["i"]
+        j = pairs["j"]
+        d = pairs["v"]
+
+        # Remove the localization itself.
+        if exclude_self:
+            mask = ((i + offset) != j)
+            i = i[mask]
+            j = j[mask]
+            d = d[mask]
+
+        w = edgeWeights(qx[i] - self.x[j], qy[i] - self.y[j], self.width, self.height)
+        [counts, edges] = numpy.histogram(d, bins = r_edges, weights = w)
+        return counts
+
+    def count(self, qx, qy, r_edges, exclude_self = False):
+        """
+        Returns the edge corrected number of pairs in each of the
+        distance bins specified by r_edges.
+
+        qx, qy - The query localizations (in nanometers).
+        r_edges - The distance bin edges (in nanometers).
+        exclude_self - The query localizations are the indexed localizations.
+        """
+        # The edge correction weights are not defined for distances
+        # larger than the size of the observation window.
+        if (r_edges[-1] >= self.width) or (r_edges[-1] >= self.height):
+            raise RipleyException("The maximum distance " + str(r_edges[-1]) + " must be smaller than the window width and height.")
+
+        qx = numpy.ascontiguousarray(qx, dtype = numpy.float64)
+        qy = numpy.ascontiguousarray(qy, dtype = numpy.float64)
+
+        starts = list(range(0, qx.size, self.block_size))
+        def countStart(start):
+            stop = start + self.block_size
+            return self.countBlock(qx[start:stop], qy[start:stop], start, r_edges, exclude_self)
+
+        if (self.n_threads > 1) and (len(starts) > 1):
+            pool = multiprocessing.pool.ThreadPool(min(self.n_threads, len(starts)))
+            try:
+                results = pool.map(countStart, starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = list(map(countStart, starts))
+
+        counts = numpy.zeros(r_edges.size - 1)
+        for elt in results:
+            counts += elt
+        return counts
+
+    def getArea(self):
+        return self.width * self.height
+
+    def setPoints(self, x, y):
+        """
+        Change the indexed localizations. The position buffer is
+        only re-allocated if the number of localizations changes.
+        """
+        if (self.xy is None) or (self.xy.shape[0] != numpy.size(x)):
+            self.xy = numpy.zeros((numpy.size(x), 2))
+        self.xy[:,0] = x
+        self.xy[:,1] = y
+        self.x = self.xy[:,0]
+        self.y = self.xy[:,1]
+
+        self.kd = scipy.spatial.cKDTree(self.xy)
+
+    def randomPoints(self, n_points, rand_state):
+        """
+        Returns n_points uniformly distributed in the observation window.
+        """
+        x = rand_state.uniform(low = self.bounds[0], high = self.bounds[1], size = n_points)
+        y = rand_state.uniform(low = self.bounds[2], high = self.bounds[3], size = n_points)
+        return [x, y]
+
+
+def countsToG(counts, r_edges, area, n1, n2):
+    """
+    Convert pair counts to the pair-correlation function g(r),
+    evaluated at the centers of the distance bins.
+    """
+    ring_area = math.pi * (r_edges[1:]*r_edges[1:] - r_edges[:-1]*r_edges[:-1])
+    return (area * counts)/(float(n1) * float(n2) * ring_area)
+
+def countsToK(counts, area, n1, n2):
+    """
+    Convert pair counts to Ripley's K, evaluated at the upper
+    edges of the distance bins.
+    """
+    return (area * numpy.cumsum(counts))/(float(n1) * float(n2))
+
+def csrEnvelope(counter, n_points, r_edges, cross = False, n_sims = 99, seed = None):
+    """
+    Calculate the Monte-Carlo envelopes of K and g for CSR.
+
+    If cross is True the counter indexes a second category and each simulation
+    draws n_points uniformly distributed localizations and counts
+    pairs against the (unchanged) index, i.e. the test is for
+    independence of the two categories.
+
+    For the univariate case each simulation draws a new CSR pattern
+    of n_points localizations and counts the pairs within it. A single
+    PairCounter is used for all the simulations, only its KD tree is
+    re-built for each pattern.
+
+    Returns [k_low, k_high, g_low, g_high].
+    """
+    rand_state = numpy.random.RandomState(seed)
+    area = counter.getArea()
+    sim_counter = None
+
+    k_sims = numpy.zeros((n_sims, r_edges.size - 1))
+    g_sims = numpy.zeros((n_sims, r_edges.size - 1))
+    for i in range(n_sims):
+        [sx, sy] = counter.randomPoints(n_points, rand_state)
+        if cross:
+            counts = counter.count(sx, sy, r_edges)
+            n2 = counter.x.size
+        else:
+            if sim_counter is None:
+                sim_counter = PairCounter(x = sx,
+                                          y = sy,
+                                          bounds = counter.bounds,
+                                          block_size = counter.block_size,
+                                          max_pairs = counter.max_pairs,
+                                          n_threads = counter.n_threads)
+            else:
+                sim_counter.setPoints(sx, sy)
+            counts = sim_counter.count(sx, sy, r_edges, exclude_self = True)
+            n2 = n_points - 1
+        k_sims[i,:] = countsToK(counts, area, n_points, n2)
+        g_sims[i,:] = countsToG(counts, r_edges, area, n_points, n2)
+
+    return [numpy.min(k_sims, axis = 0),
+            numpy.max(k_sims, axis = 0),
+            numpy.min(g_sims, axis = 0),
+            numpy.max(g_sims, axis = 0)]
+
+def edgeWeights(dx, dy, width, height):
+    """
+    Translation edge correction weights for a rectangular window.
+
+    Note: The distances must be smaller than the window width and
+          height, PairCounter.count() checks this.
+    """
+    return (width * height)/((width - numpy.abs(dx)) * (height - numpy.abs(dy)))
+
+def kToH(k, r):
+    return kToL(k) - r
+
+def kToL(k):
+    return numpy.sqrt(k/math.pi)
+
+def ripley(x1, y1, r_edges, x2 = None, y2 = None, bounds = None, n_sims = 0, n_threads = 4, seed = None):
+    """
+    Calculate K, L, H and g for the localizations x1, y1, or the
+    cross functions between x1, y1 and x2, y2 if these are specified.
+
+    All positions and distances are in nanometers.
+
+    Returns a dictionary of numpy arrays. K, L and H are evaluated
+    at r_edges[1:] and g is evaluated at the centers of the bins.
+    """
+    r_edges = numpy.asarray(r_edges, dtype = numpy.float64)
+
+    if bounds is None:
+        if x2 is None:
+            bounds = [numpy.min(x1), numpy.max(x1), numpy.min(y1), numpy.max(y1)]
+        else:
+            bounds = [min(numpy.min(x1), numpy.min(x2)),
+                      max(numpy.max(x1), numpy.max(x2)),
+                      min(numpy.min(y1), numpy.min(y2)),
+                      max(numpy.max(y1), numpy.max(y2))]
+
+    if x2 is None:
+        counter = PairCounter(x = x1, y = y1, bounds = bounds, n_threads = n_threads)
+        counts = counter.count(x1, y1, r_edges, exclude_self = True)
+        n1 = x1.size
+        n2 = x1.size - 1
+    else:
+        counter = PairCounter(x = x2, y = y2, bounds = bounds, n_threads = n_threads)
+        counts = counter.count(x1, y1, r_edges)
+        n1 = x1.size
+        n2 = x2.size
+
+    area = counter.getArea()
+    r = r_edges[1:]
+    k = countsToK(counts, area, n1, n2)
+
+    results = {"r" : r,
+               "r_center" : 0.5*(r_edges[1:] + r_edges[:-1]),
+               "k" : k,
+               "l" : kToL(k),
+               "h" : kToH(k, r),
+               "g" : countsToG(counts, r_edges, area, n1, n2)}
+
+    if (n_sims > 0):
+        [k_low, k_high, g_low, g_high] = csrEnvelope(counter,
+                                                        x1.size,
+                                                        r_edges,
+                                                        cross = (x2 is not None),
+                                                        n_sims = n_sims,
+                                                        seed = seed)
+        results["k_low"] = k_low
+        results["k_high"] = k_high
+        results["l_low"] = kToL(k_low)
+        results["l_high"] = kToL(k_high)
+        results["g_low"] = g_low
+        results["g_high"] = g_high
+
+    return results
+
+def ripleyAnalysis(mlist_name, output_name, max_r, n_bins, cat1 = None, cat2 = None, n_sims = 0, n_threads = 4, pix_to_nm = 160.0):
+    """
+    Calculate Ripley's functions for an Insight3 file and save the
+    results as a text file.
+
+    cat1 - The category to analyze, None for all localizations.
+    cat2 - The second category for cross-K, None for univariate.
+    """
+    i3_data = readinsight3.loadI3GoodOnly(mlist_name)
+
+    x = i3_data['xc']*pix_to_nm
+    y = i3_data['yc']*pix_to_nm
+    c = i3_data['c']
+
+    # Use the same window for all the categories.
+    bounds = [numpy.min(x), numpy.max(x), numpy.min(y), numpy.max(y)]
+
+    if cat1 is None:
+        mask1 = numpy.ones(x.size, dtype = bool)
+    else:
+        mask1 = (c == cat1)
+
+    if cat2 is None:
+        results = ripley(x[mask1], y[mask1], numpy.linspace(0.0, max_r, n_bins + 1),
+                         bounds = bounds,
+                         n_sims = n_sims,
+                         n_threads = n_threads)
+    else:
+        mask2 = (c == cat2)
+        results = ripley(x[mask1], y[mask1], numpy.linspace(0.0, max_r, n_bins + 1),
+                         x2 = x[mask2],
+                         y2 = y[mask2],
+                         bounds = bounds,
+                         n_sims = n_sims,
+                         n_threads = n_threads)
+
+    saveResults(output_name, results)
+    return results
+
+def saveResults(output_name, results):
+    """
+    Save the results of ripley() as a text file.
+    """
+    header = ["r", "K", "L", "H", "r_center", "g"]
+    fields = ["r", "k", "l", "h", "r_center", "g"]
+    if "k_low" in results:
+        header += ["K_low", "K_high", "L_low", "L_high", "g_low", "g_high"]
+        fields += ["k_low", "k_high", "l_low", "l_high", "g_low", "g_high"]
+
+    with open(output_name, "w") as fp:
+        fp.write(" ".join(header) + "\n")
+        for i in range(results["r"].size):
+            fp.write(" ".join(map(lambda x: "{0:.6g}".format(results[x][i]), fields)) + "\n")
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Ripley's K and pair-correlation analysis.")
+
+    parser.add_argument('--bin', dest='mlist', type=str, required=True,
+                        help = "The name of the localizations input file. This is a binary file in Insight3 format.")
+    parser.add_argument('--output', dest='output', type=str, required=True,
+                        help = "The name of the text file to save the results in.")
+    parser.add_argument('--max_r', dest='max_r', type=float, required=False, default=500.0,
+                        help = "The maximum distance in nanometers. The default is 500nm.")
+    parser.add_argument('--bins', dest='bins', type=int, required=False, default=50,
+                        help = "The number of distance bins. The default is 50.")
+    parser.add_argument('--cat1', dest='cat1', type=int, required=False,
+                        help = "The category to analyze. The default is all the localizations.")
+    parser.add_argument('--cat2', dest='cat2', type=int, required=False,
+                        help = "The second category for cross-K analysis.")
+    parser.add_argument('--sims', dest='sims', type=int, required=False, default=0,
+                        help = "The number of CSR simulations to use for the envelope. The default is 0.")
+    parser.add_argument('--threads', dest='threads', type=int, required=False, default=4,
+                        help = "The number of threads to use. The default is 4.")
+
+    args = parser.parse_args()
+
+    ripleyAnalysis(args.mlist,
+                   args.output,
+                   args.max_r,
+                   args.bins,
+                   cat1 = args.cat1,
+                   cat2 = args.cat2,
+                   n_sims = args.sims,
+                   n_threads = args.threads)
@@ -2,17 +2,26 @@
  * C library for the affine transform.
  *
  * Hazen 05/17
+ *
+ * Added lookup tables and the batched (z, plane) transform. For a fixed
+ * mapping and image size the source pixel indices and the bilinear
+ * weights of the output pixels that are inside the overlap region are
+ * calculated once, so transforming an image is just a weighted sum of
+ * 4 pixels. The output rows are distributed across threads if OpenMP
+ * is available.
+ *
+ * Hazen 10/26
  * 
  * Compilation instructions:
  *
  * Linux:
- *  gcc -fPIC -g -c -Wall affine_transform.c
- *  gcc -shared -Wl,-soname,affine_transform.so.1 -o affine_transform.so.1.0.1 affine_transform.o -lc
+ *  gcc -fPIC -g -c -Wall -fopenmp affine_transform.c
+ *  gcc -shared -fopenmp -Wl,-soname,affine_transform.so.1 -o affine_transform.so.1.0.1 affine_transform.o -lc
  *  ln -s affine_transform.so.1.0.1 affine_transform.so
  *
  * Windows:
- *  gcc -c -O3 affine_transform.c
- *  gcc -shared -o affine_transform.dll affine_transform.o
+ *  gcc -c -O3 -fopenmp affine_transform.c
+ *  gcc -shared -fopenmp -o affine_transform.dll affine_transform.o
  */
 
 #include <stdlib.h>
@@ -25,10 +34,29 @@ struct atrans_struct {
 };
 typedef struct atrans_struct atrans;
 
+/*
+ * Pre-calculated transform for a particular image size. The
+ * pixels are stored in output row order, the pixels of row i
+ * are row_start[i] to row_start[i+1] - 1.
+ */
+struct atrans_table_struct {
+  int n_pixels;     /* Number of output pixels inside the overlap region. */
+  int sx;           /* Image size in x. */
+  int sy;           /* Image size in y. */
+  int *dst;         /* Output pixel indices. */
+  int *row_start;   /* Index of the first pixel in each output row. */
+  int *src;         /* Source pixel indices (of the upper left pixel). */
+  double *w;        /* Bilinear weights, 4 per pixel. */
+};
+typedef struct atrans_table_struct atrans_table;
+
 
 void cleanup(atrans *);
+void cleanupTable(atrans_table *);
 atrans *initialize(double *, double *);
+atrans_table *initializeTable(atrans *, int, int);
 void transform(atrans *, double *, double *, int, int);
+void transformStack(atrans_table **, double *, double *, int, int);
 
 
 void cleanup(atrans *at)
@@ -37,6 +65,16 @@ void cleanup(atrans *at)
 }
 
 
+void cleanupTable(atrans_table *att)
+{
+  free(att->dst);
+  free(att->row_start);
+  free(att->src);
+  free(att->w);
+  free(att);
+}
+
+
 atrans *initialize(double *xt, double *yt)
 {
   int i;
@@ -52,6 +90,57 @@ atrans *initialize(double *xt, double *yt)
   return at;
 }
 
+/*
+ * Create the lookup table for a (sx, sy) image. This uses
+ * the same pixel mapping and boundary test as transform().
+ */
+atrans_table *initializeTable(atrans *at, int sx, int sy)
+{
+  int i,j,k,xi,yi;
+  double dx,dy,xf,yf;
+  double *xt, *yt;
+  atrans_table *att;
+
+  xt = at->xt;
+  yt = at->yt;
+
+  att = (atrans_table *)malloc(sizeof(atrans_table));
+  att->sx = sx;
+  att->sy = sy;
+  att->dst = (int *)malloc(sizeof(int)*sx*sy);
+  att->row_start = (int *)malloc(sizeof(int)*(sx+1));
+  att->src = (int *)malloc(sizeof(int)*sx*sy);
+  att->w = (double *)malloc(sizeof(double)*4*sx*sy);
+
+  k = 0;
+  for(i=0;i<sx;i++){
+    att->row_start[i] = k;
+    for(j=0;j<sy;j++){
+      xf = xt[0] + xt[1]*i + xt[2]*j;
+      yf = yt[0] + yt[1]*i + yt[2]*j;
+      xi = (int)xf;
+      yi = (int)yf;
+
+      if ((xi>0) && (xi < (sx-1)) && (yi>0) && (yi < (sy-1))){
+	dx = xf - xi;
+	dy = yf - yi;
+
+	att->dst[k] = i*sy+j;
+	att->src[k] = xi*sy+yi;
+	att->w[4*k] = (1.0-dx)*(1.0-dy);
+	att->w[4*k+1] = (1.0-dx)*dy;
+	att->w[4*k+2] = dx*(1.0-dy);
+	att->w[4*k+3] = dx*dy;
+	k++;
+      }
+    }
+  }
+  att->row_start[sx] = k;
+  att->n_pixels = k;
+
+  return att;
+}
+
 void transform(atrans *at, double *im, double *im_trans, int sx, int sy)
 {
   int i,j,xi,yi;
@@ -86,3 +175,64 @@ void transform(atrans *at, double *im, double *im_trans, int sx, int sy)
     }
   }
 }
+
+/*
+ * Transform and sum a stack of images.
+ *
+ * tables - The lookup tables for each plane, NULL means no
+ *          transform (i.e. the reference plane).
+ * ims - The images, (n_z, n_planes, sx, sy).
+ * ims_trans - The transformed images summed over the planes (n_z, sx, sy).
+ * n_planes - The number of planes.
+ * n_z - The number of z values.
+ *
+ * All of the tables must be for the same image size.
+ */
+void transformStack(atrans_table **tables, double *ims, double *ims_trans, int n_planes, int n_z)
+{
+  int i,j,k,l,m,sx,sy,src;
+  double *im,*im_trans,*w;
+  atrans_table *att;
+
+  sx = -1;
+  sy = -1;
+  for(i=0;i<n_planes;i++){
+    if(tables[i] != NULL){
+      sx = tables[i]->sx;
+      sy = tables[i]->sy;
+      break;
+    }
+  }
+  if(sx < 0){
+    printf("transformStack: at least one table is required.\n");
+    return;
+  }
+
+  #pragma omp parallel for private(i,j,k,l,m,src,im,im_trans,w,att) schedule(static)
+  for(m=0;m<(n_z*sx);m++){
+    i = m/sx;
+    j = m - i*sx;
+    im_trans = ims_trans + i*sx*sy;
+
+    for(k=0;k<sy;k++){
+      im_trans[j*sy+k] = 0.0;
+    }
+
+    for(k=0;k<n_planes;k++){
+      im = ims + (i*n_planes+k)*sx*sy;
+      att = tables[k];
+      if(att == NULL){
+	for(l=0;l<sy;l++){
+	  im_trans[j*sy+l] += im[j*sy+l];
+	}
+      }
+      else{
+	for(l=att->row_start[j];l<att->row_start[j+1];l++){
+	  src = att->src[l];
+	  w = att->w + 4*l;
+	  im_trans[att->dst[l]] += w[0]*im[src] + w[1]*im[src+1] + w[2]*im[src+sy] + w[3]*im[src+sy+1];
+	}
+      }
+    }
+  }
+}
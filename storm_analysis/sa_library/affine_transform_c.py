@@ -15,6 +15,7 @@ import storm_analysis.sa_library.loadclib as loadclib
 a_trans = loadclib.loadCLibrary("storm_analysis.sa_library", "affine_transform")
 
 a_trans.cleanup.argtypes = [ctypes.c_void_p]
+a_trans.cleanupTable.argtypes = [ctypes.c_void_p]
 a_trans.transform.argtypes = [ctypes.c_void_p,
                               ndpointer(dtype = numpy.float64),
                               ndpointer(dtype = numpy.float64),
@@ -23,6 +24,15 @@ a_trans.transform.argtypes = [ctypes.c_void_p,
 a_trans.initialize.argtypes = [ndpointer(dtype = numpy.float64),
                                ndpointer(dtype = numpy.float64)]
 a_trans.initialize.restype = ctypes.c_void_p
+a_trans.initializeTable.argtypes = [ctypes.c_void_p,
+                                    ctypes.c_int,
+                                    ctypes.c_int]
+a_trans.initializeTable.restype = ctypes.c_void_p
+a_trans.transformStack.argtypes = [ctypes.c_void_p,
+                                   ndpointer(dtype = numpy.float64),
+                                   ndpointer(dtype = numpy.float64),
+                                   ctypes.c_int,
+                                   ctypes.c_int]
 
 
 class AffineTransform(object):
@@ -55,6 +65,64 @@ class AffineTransform(object):
         return trans_image
 
 
+class AffineTransformStack(object):
+    """
+    Transforms a (z, plane) stack of images into the frame of the
+    reference plane and sums them over the planes in a single call.
+
+    The source pixel indices and the interpolation weights are calculated
+    once for each plane, and only the pixels inside the overlap region
+    are processed.
+    """
+    def __init__(self, atrans = None, shape = None, **kwds):
+        """
+        atrans - A list of AffineTransform objects, one for each plane.
+                 None means no transform, i.e. the reference plane.
+        shape - The image shape.
+        """
+        super(AffineTransformStack, self).__init__(**kwds)
+
+        self.n_planes = len(atrans)
+        self.shape = tuple(shape)
+
+        self.tables = []
+        for at in atrans:
+            if at is None:
+                self.tables.append(None)
+            else:
+                self.tables.append(a_trans.initializeTable(at.atrans, self.shape[0], self.shape[1]))
+
+        self.c_tables = (ctypes.c_void_p * self.n_planes)(*self.tables)
+        self.has_transform = any(table is not None for table in self.tables)
+
+    def cleanup(self):
+        for table in self.tables:
+            if table is not None:
+                a_trans.cleanupTable(table)
+        self.tables = []
+
+    def transform(self, images):
+        """
+        images - A (n_z, n_planes, x, y) array.
+
+        Returns a (n_z, x, y) array with the sum of the transformed images.
+        """
+        assert (images.shape[1] == self.n_planes)
+        assert (images.shape[2:] == self.shape)
+
+        if not self.has_transform:
+            return numpy.sum(images, axis = 1)
+
+        images = numpy.ascontiguousarray(images, dtype = numpy.float64)
+        trans_images = numpy.zeros((images.shape[0],) + self.shape, dtype = numpy.float64)
+        a_trans.transformStack(self.c_tables,
+                               images,
+                               trans_images,
+                               self.n_planes,
+                               images.shape[0])
+        return trans_images
+
+
 if (__name__ == "__main__"):
 
     import tifffile
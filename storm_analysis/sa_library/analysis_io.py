@@ -26,33 +26,10 @@ class DataWriter(object):
         self.inverted = (parameters.getAttr("orientation", "normal") == "inverted")
         self.pixel_size = parameters.getAttr("pixel_size")
         self.n_added = 0
-                
-        #
-        # If the i3 file already exists, read it in, write it
-        # out to prepare for starting the analysis from the
-        # end of what currently exists.
-        #
-        # FIXME: If the existing file is really large there
-        #        could be problems here as we're going to load
-        #        the whole thing into memory.
-        #
+        self.start_frame = 0
         self.total_peaks = 0
-        if(os.path.exists(data_file)):
-            print("Found", data_file)
-            i3data_in = readinsight3.loadI3File(data_file)
-            if i3data_in is None:
-                self.start_frame = 0
-            else:
-                self.start_frame = int(numpy.max(i3data_in['fr']))
 
-            print(" Starting analysis at frame:", self.start_frame)
-            self.i3data = writeinsight3.I3Writer(data_file)
-            if (self.start_frame > 0):
-                self.i3data.addMolecules(i3data_in)
-                self.total_peaks = i3data_in['x'].size
-        else:
-            self.start_frame = 0
-            self.i3data = writeinsight3.I3Writer(data_file)
+        self.openFile()
 
     def addPeaks(self, peaks, movie_reader):
         self.n_added = peaks.shape[0]
@@ -81,6 +58,34 @@ class DataWriter(object):
         
     def getTotalPeaks(self):
         return self.total_peaks
+
+    def openFile(self):
+        """
+        Open the localization file, this sets self.start_frame and
+        self.total_peaks if we are resuming an analysis. Sub-classes
+        override this to change how existing files are handled.
+
+        If the i3 file already exists, read it in, write it out to
+        prepare for starting the analysis from the end of what
+        currently exists.
+
+        FIXME: If the existing file is really large there could be
+               problems here as we're going to load the whole thing
+               into memory.
+        """
+        if(os.path.exists(self.filename)):
+            print("Found", self.filename)
+            i3data_in = readinsight3.loadI3File(self.filename)
+            if i3data_in is not None:
+                self.start_frame = int(numpy.max(i3data_in['fr']))
+
+            print(" Starting analysis at frame:", self.start_frame)
+            self.i3data = writeinsight3.I3Writer(self.filename)
+            if (self.start_frame > 0):
+                self.i3data.addMolecules(i3data_in)
+                self.total_peaks = i3data_in['x'].size
+        else:
+            self.i3data = writeinsight3.I3Writer(self.filename)
     
 
 class FrameReader(object):
@@ -107,6 +112,17 @@ class FrameReader(object):
         frame = (frame - self.offset) * self.gain
 
         return frame
+
+    def loadAFrameInto(self, frame_number, frame):
+        """
+        Load a frame into a pre-allocated array, the conversion
+        from ADU to photo-electrons is done in place.
+        """
+        frame[:] = self.movie_data.loadAFrame(frame_number)
+        frame -= self.offset
+        frame *= self.gain
+
+        return frame
         
         
 class FrameReaderStd(FrameReader):
@@ -160,6 +176,12 @@ class MovieReader(object):
         [self.movie_x, self.movie_y, self.movie_l] = frame_reader.filmSize()
         self.parameters = parameters
 
+    def close(self):
+        """
+        This is called by peakFinding() when the analysis is done.
+        """
+        pass
+
     def getBackground(self):
         return self.background
 
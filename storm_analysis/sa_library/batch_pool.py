@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Run a Python function on many files in parallel using a persistent
+pool of worker processes.
+
+This is an alternative to batch_run.py for analysis that can be done
+in-process. As the workers are only started once the cost of
+importing modules, loading the C libraries, etc. is only paid once
+per worker rather than once per file.
+
+The FFTW threads (see fftw_threads_c.py) are divided between the
+workers.
+
+Each job is described by a list [name, function, args, kwds]. The
+function must be a module level function so that it can be pickled.
+It is responsible for saving its own results, so these are written
+as soon as each job finishes.
+
+Hazen 10/26
+"""
+
+import multiprocessing
+import time
+import traceback
+
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
+
+
+class BatchJobResult(object):
+    """
+    The outcome of a single batch job.
+    """
+    def __init__(self, name = None, error = None, elapsed = 0.0, value = None, **kwds):
+        super(BatchJobResult, self).__init__(**kwds)
+        self.elapsed = elapsed
+        self.error = error
+        self.name = name
+        self.value = value
+
+    def failed(self):
+        return (self.error is not None)
+
+    def __str__(self):
+        if self.failed():
+            return "Failed '" + str(self.name) + "'"
+        else:
+            return "Finished '" + str(self.name) + "' in {0:.2f} seconds".format(self.elapsed)
+
+
+class BatchSummary(object):
+    """
+    The outcomes of all the jobs in a batch, in the order in
+    which they finished.
+    """
+    def __init__(self, n_jobs = 0, **kwds):
+        super(BatchSummary, self).__init__(**kwds)
+        self.n_jobs = n_jobs
+        self.results = []
+
+    def addResult(self, result):
+        self.results.append(result)
+
+    def getFailed(self):
+        return [x for x in self.results if x.failed()]
+
+    def getSucceeded(self):
+        return [x for x in self.results if not x.failed()]
+
+    def isComplete(self):
+        return (len(self.results) == self.n_jobs)
+
+    def __str__(self):
+        text = "Batch: {0:d} of {1:d} jobs finished, {2:d} failed".format(len(self.results),
+                                                                         self.n_jobs,
+                                                                         len(self.getFailed()))
+        for result in self.getFailed():
+            text += "\n " + str(result.name) + "\n" + result.error
+        return text
+
+
+def batchPool(jobs, max_processes = 2, progress = None):
+    """
+    Run jobs using a pool of max_processes workers.
+
+    jobs - A list of [name, function, args, kwds] lists.
+    max_processes - The number of worker processes.
+    progress - An optional function that is called with (result, summary)
+               as each job finishes. The default is to print the result.
+
+    Returns a BatchSummary object. A KeyboardInterrupt stops the workers
+    and is re-raised.
+    """
+    summary = BatchSummary(n_jobs = len(jobs))
+    if (len(jobs) == 0):
+        return summary
+
+    if progress is None:
+        progress = printProgress
+
+    # Divide the FFTW threads between the workers. If the FFTW threads
+    # library is not available the workers use single threaded FFTW.
+    n_processes = min(max_processes, len(jobs))
+    if fftwThreadsC.isAvailable():
+        pool = multiprocessing.Pool(processes = n_processes,
+                                    initializer = fftwThreadsC.initWorker,
+                                    initargs = (n_processes, fftwThreadsC.getRequestedThreads()))
+    else:
+        pool = multiprocessing.Pool(processes = n_processes)
+    try:
+        for result in pool.imap_unordered(runJob, jobs):
+            summary.addResult(result)
+            progress(result, summary)
+
+    finally:
+        # Stop the workers. This includes a KeyboardInterrupt, which is re-raised.
+        pool.terminate()
+        pool.join()
+
+    return summary
+
+
+def printProgress(result, summary):
+    print(str(result) + " (" + str(len(summary.results)) + "/" + str(summary.n_jobs) + ")")
+
+
+def runJob(job):
+    """
+    Run a single job, this is called in the worker process.
+
+    Exceptions are caught and returned as part of the result so
+    that one bad file does not stop the whole batch.
+    """
+    [name, func, args, kwds] = job
+    start_time = time.time()
+    try:
+        value = func(*args, **kwds)
+    except Exception:
+        return BatchJobResult(name = name,
+                              error = traceback.format_exc(),
+                              elapsed = time.time() - start_time)
+
+    return BatchJobResult(name = name,
+                          elapsed = time.time() - start_time,
+                          value = value)
+
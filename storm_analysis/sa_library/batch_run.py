@@ -5,13 +5,14 @@ Run multiple python scripts in parallel.
 Hazen 02/17
 """
 
-import os
 import multiprocessing
 import signal
 import subprocess
 import sys
 import threading
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
+
 
 def batchRun(cmd_lines, max_processes = 2):
 
@@ -19,6 +20,12 @@ def batchRun(cmd_lines, max_processes = 2):
     process_count = 0
     results = multiprocessing.Queue()
 
+    # Divide the FFTW threads between the processes. If the FFTW threads
+    # library is not available the processes use the current environment.
+    env = None
+    if fftwThreadsC.isAvailable():
+        env = fftwThreadsC.workerEnvironment(max_processes)
+
     # Start processes.
     procs = []
     for cmd_line in cmd_lines:
@@ -31,7 +38,7 @@ def batchRun(cmd_lines, max_processes = 2):
                 print(description)
                 process_count -= 1
             proc = subprocess.Popen(cmd_line,
-                                    env = os.environ.copy())
+                                    env = env)
             procs.append(proc)
             t = threading.Thread(target = processWaiter,
                                  args = (proc, "Finished '" + " ".join(cmd_line) + "'", results))
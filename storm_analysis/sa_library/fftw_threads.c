@@ -0,0 +1,127 @@
+/*
+ * Control of the number of threads that FFTW uses.
+ *
+ * All the FFTW based libraries (matched_filter, fista_fft, psf_fft,
+ * pupil_function, etc.) link to the same FFTW library, and the number
+ * of threads is a property of the FFTW planner, so setting it here
+ * changes it for all of the plans that are created afterwards in
+ * any of them. This includes plans that are re-created from FFTW's
+ * (process wide) wisdom.
+ *
+ * Note: This only changes plans that are created after the number of
+ *       threads is set, existing plans are not affected.
+ *
+ * If FFTW was not built with thread support this library is compiled
+ * with NO_FFTW_THREADS defined and all the plans are single threaded.
+ *
+ * FFTW's wisdom can also be saved and loaded here, so that the (slow)
+ * plan measurements only have to be done once for a given geometry.
+ *
+ * Hazen 10/26
+ */
+
+/* Include */
+#include <stdlib.h>
+#include <stdio.h>
+
+#include <fftw3.h>
+
+/* Global Variables */
+#ifndef NO_FFTW_THREADS
+static int initialized = 0;
+#endif
+static int n_threads = 1;
+
+/* Function Declarations */
+int ftwExportWisdom(char *);
+int ftwGetThreads(void);
+int ftwHasThreads(void);
+int ftwImportWisdom(char *);
+int ftwSetThreads(int);
+
+/* Functions */
+
+/*
+ * ftwExportWisdom()
+ *
+ * Save FFTW's (process wide) wisdom in a file.
+ *
+ * filename - The name of the file.
+ *
+ * Returns 1 on success.
+ */
+int ftwExportWisdom(char *filename)
+{
+  return fftw_export_wisdom_to_filename(filename);
+}
+
+/*
+ * ftwGetThreads()
+ *
+ * Returns the current number of FFTW threads.
+ */
+int ftwGetThreads(void)
+{
+  return n_threads;
+}
+
+/*
+ * ftwHasThreads()
+ *
+ * Returns 1 if FFTW thread support is available.
+ */
+int ftwHasThreads(void)
+{
+#ifdef NO_FFTW_THREADS
+  return 0;
+#else
+  return 1;
+#endif
+}
+
+/*
+ * ftwImportWisdom()
+ *
+ * Add the wisdom in a file to FFTW's (process wide) wisdom.
+ *
+ * filename - The name of the file.
+ *
+ * Returns 1 on success.
+ */
+int ftwImportWisdom(char *filename)
+{
+  return fftw_import_wisdom_from_filename(filename);
+}
+
+/*
+ * ftwSetThreads()
+ *
+ * Set the number of threads to use for new FFTW plans.
+ *
+ * n - The number of threads (1 or more).
+ *
+ * Returns the number of threads that will actually be used.
+ */
+int ftwSetThreads(int n)
+{
+  if(n < 1){
+    n = 1;
+  }
+
+#ifdef NO_FFTW_THREADS
+  n_threads = 1;
+#else
+  if(!initialized){
+    if(fftw_init_threads() == 0){
+      printf("FFTW thread initialization failed.\n");
+      n_threads = 1;
+      return n_threads;
+    }
+    initialized = 1;
+  }
+  fftw_plan_with_nthreads(n);
+  n_threads = n;
+#endif
+
+  return n_threads;
+}
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Python interface to fftw_threads.c, this controls the number of threads
+that FFTW uses in all of the FFTW based C libraries.
+
+There is a single, process wide, setting. It is initialized from the
+STORM_ANALYSIS_FFTW_THREADS environment variable by initialize(), which
+the FFTW based modules call when they are loaded, and can be changed
+later with setThreads() or with the 'fftw_threads' analysis parameter.
+A value of 0 means use all of the available cores. The default is 1,
+i.e. single threaded FFTW. The setting is kept in this module, it is
+not written back to the environment.
+
+The setting only affects FFTW plans that are created after it is
+changed, so it needs to be set before creating the objects (matched
+filters, PSF objects, etc.) that use FFTW.
+
+When analysis is done with several worker processes (batch_pool.py,
+batch_run.py) the requested number of threads is divided between the
+workers so that together they don't use more threads than requested.
+Processes started with batch_run.py get the setting and the number of
+workers from the STORM_ANALYSIS_FFTW_THREADS and STORM_ANALYSIS_FFTW_WORKERS
+environment variables, see workerEnvironment().
+
+FFTW's wisdom can be saved with exportWisdom() and loaded with
+importWisdom(), for example to avoid measuring the same plans
+again in every analysis.
+
+If the fftw_threads library cannot be loaded FFTW is single threaded,
+isAvailable() returns False and wisdom cannot be saved or loaded.
+
+Hazen 10/26
+"""
+
+import ctypes
+import os
+
+import storm_analysis.sa_library.loadclib as loadclib
+
+def loadLibrary():
+    """
+    Returns the fftw_threads library, or None if it could not be loaded.
+    """
+    try:
+        c_lib = loadclib.loadCLibrary("storm_analysis.sa_library", "fftw_threads")
+        c_lib.ftwExportWisdom.argtypes = [ctypes.c_char_p]
+        c_lib.ftwExportWisdom.restype = ctypes.c_int
+        c_lib.ftwGetThreads.restype = ctypes.c_int
+        c_lib.ftwHasThreads.restype = ctypes.c_int
+        c_lib.ftwImportWisdom.argtypes = [ctypes.c_char_p]
+        c_lib.ftwImportWisdom.restype = ctypes.c_int
+        c_lib.ftwSetThreads.argtypes = [ctypes.c_int]
+        c_lib.ftwSetThreads.restype = ctypes.c_int
+    except (AttributeError, OSError):
+        print("Could not load the fftw_threads library, FFTW will be single threaded.")
+        return None
+    return c_lib
+
+fftw_threads = loadLibrary()
+
+initialized = False
+requested_threads = 1
+threads_env_name = "STORM_ANALYSIS_FFTW_THREADS"
+workers = 1
+workers_env_name = "STORM_ANALYSIS_FFTW_WORKERS"
+
+
+def cpuCount():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return (os.cpu_count() or 1)
+
+def envInt(name, default):
+    value = os.environ.get(name, str(default))
+    try:
+        return int(value)
+    except ValueError:
+        print("Invalid", name, "value '" + value + "', using", default)
+        return default
+
+def exportWisdom(filename):
+    """
+    Save FFTW's wisdom in filename. Returns True on success.
+    """
+    if fftw_threads is None:
+        return False
+    return bool(fftw_threads.ftwExportWisdom(filename.encode()))
+
+def getRequestedThreads():
+    """
+    Returns the requested number of threads, before dividing them
+    between the workers. 0 = the number of cores.
+    """
+    initialize()
+    return requested_threads
+
+def getThreads():
+    """
+    Returns the number of threads that FFTW will use for new plans.
+    """
+    if fftw_threads is None:
+        return 1
+    return fftw_threads.ftwGetThreads()
+
+def hasThreads():
+    """
+    Returns True if FFTW was built with thread support.
+    """
+    if fftw_threads is None:
+        return False
+    return bool(fftw_threads.ftwHasThreads())
+
+def importWisdom(filename):
+    """
+    Load FFTW wisdom from filename. Returns True on success.
+    """
+    if fftw_threads is None:
+        return False
+    return bool(fftw_threads.ftwImportWisdom(filename.encode()))
+
+def initialize():
+    """
+    Apply the environment variable settings. Only the first call does
+    anything so that later changes made with setThreads() are kept.
+    """
+    global initialized, workers
+    if not initialized:
+        initialized = True
+        workers = max(1, envInt(workers_env_name, 1))
+        if (envInt(threads_env_name, 1) != 1):
+            setThreads(envInt(threads_env_name, 1))
+
+def initWorker(n_workers, n_threads):
+    """
+    This is called once in each worker process, it updates the number of
+    threads to account for the number of workers.
+
+    n_workers - The number of worker processes.
+    n_threads - The requested number of threads, usually the value of
+                getRequestedThreads() in the parent process.
+    """
+    global workers
+    initialize()
+    workers = nWorkers(n_workers)
+    return setThreads(n_threads)
+
+def isAvailable():
+    """
+    Returns True if the fftw_threads library was loaded.
+    """
+    return (fftw_threads is not None)
+
+def nWorkers(n_workers):
+    """
+    The total number of workers, this process might itself be a worker.
+    """
+    initialize()
+    return workers * max(1, n_workers)
+
+def setThreads(n_threads):
+    """
+    Set the number of FFTW threads, 0 = the number of cores. This is
+    divided by the number of workers, if there is more than one.
+
+    Returns the number of threads that will actually be used.
+    """
+    global requested_threads
+    initialize()
+    requested_threads = n_threads
+
+    if fftw_threads is None:
+        return 1
+    if (n_threads == 0):
+        n_threads = cpuCount()
+    return fftw_threads.ftwSetThreads(max(1, n_threads//workers))
+
+def setThreadsFromParameters(parameters):
+    """
+    Set the number of FFTW threads using the 'fftw_threads' parameter,
+    if it is present. Otherwise the current setting is not changed.
+    """
+    if parameters.hasAttr("fftw_threads"):
+        return setThreads(parameters.getAttr("fftw_threads"))
+    return getThreads()
+
+def workerEnvironment(n_workers):
+    """
+    Returns a copy of the environment for starting n_workers worker
+    processes (with subprocess).
+    """
+    env = os.environ.copy()
+    env[threads_env_name] = str(getRequestedThreads())
+    env[workers_env_name] = str(nWorkers(n_workers))
+    return env
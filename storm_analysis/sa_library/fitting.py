@@ -9,8 +9,10 @@ import os
 import tifffile
 
 import storm_analysis.sa_library.daxwriter as daxwriter
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.i3dtype as i3dtype
 import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.sa_library.incremental_filter as incrementalFilter
 import storm_analysis.sa_library.matched_filter_c as matchedFilterC
 import storm_analysis.sa_library.parameters as params
 import storm_analysis.sa_library.readinsight3 as readinsight3
@@ -147,6 +149,9 @@ class PeakFinder(object):
         parameters - A parameters object.
         """
         super(PeakFinder, self).__init__(**kwds)
+
+        # This needs to be done before any of the FFTW plans are created.
+        fftwThreadsC.setThreadsFromParameters(parameters)
         
         # Initialized from parameters.
         self.find_max_radius = parameters.getAttr("find_max_radius")     # Radius (in pixels) over which the maxima is maximal.
@@ -160,6 +165,9 @@ class PeakFinder(object):
         self.camera_variance = None                                      # Camera variance, only relevant for a sCMOS camera.
         self.check_mode = False                                          # Run in diagnostic mode. Only useful for debugging.
         self.image = None                                                # The original image.
+        self.incremental = False                                         # Incrementally update the filter results.
+        self.incremental_filters = []                                    # IncrementalFilter objects (incremental mode only).
+        self.last_maxima = {}                                            # Last local maxima search images & thresholds (incremental mode only).
         self.margin = PeakFinderFitter.margin                            # Size of the unanalyzed "edge" around the image.
         self.neighborhood = PeakFinder.unconverged_dist * self.sigma     # Radius for marking neighbors as unconverged.
         self.new_peak_radius = PeakFinder.new_peak_dist                  # Minimum allowed distance between new peaks and current peaks.
@@ -170,6 +178,10 @@ class PeakFinder(object):
         # Print warning about check mode
         if self.check_mode:
             print("Warning! Running in check mode!")
+
+        # Incrementally update the convolutions between peak finding iterations?
+        if parameters.hasAttr("incremental_finding"):
+            self.incremental = (parameters.getAttr("incremental_finding") != 0)
             
         # Only do one cycle of peak finding as we'll always return the same locations.
         if parameters.hasAttr("peak_locations"):
@@ -192,6 +204,49 @@ class PeakFinder(object):
     def cleanUp(self):
         pass
 
+    def createFilter(self, psfs):
+        """
+        Create a MatchedFilter object, or a MatchedFilterBank object if psfs
+        is a list of PSFs. In incremental mode this is wrapped in an
+        IncrementalFilter object so that after the first iteration only
+        the parts of the image that changed are re-convolved.
+        """
+        if isinstance(psfs, list):
+            mfilter = matchedFilterC.MatchedFilterBank(psfs)
+        else:
+            mfilter = matchedFilterC.MatchedFilter(psfs)
+
+        if self.incremental:
+            mfilter = incrementalFilter.IncrementalFilter(mfilter = mfilter, psfs = psfs)
+            self.incremental_filters.append(mfilter)
+        return mfilter
+        
+    def findLocalMaxima(self, masked_image, taken, index = 0):
+        """
+        Identify local maxima in masked_image. In incremental mode, if the
+        threshold has not changed, only the parts of the image that changed
+        since the last search are searched for new maxima.
+
+        index - Which image this is, for finders that search several images.
+        """
+        if self.incremental:
+            last = self.last_maxima.get(index)
+            self.last_maxima[index] = [numpy.copy(masked_image), self.cur_threshold]
+            if (last is not None) and (last[1] == self.cur_threshold):
+                region = incrementalFilter.changedRegion(masked_image, last[0], self.find_max_radius)
+                return incrementalFilter.findLocalMaximaInRegion(masked_image,
+                                                                 taken,
+                                                                 self.cur_threshold,
+                                                                 self.find_max_radius,
+                                                                 self.margin,
+                                                                 region)
+
+        return utilC.findLocalMaxima(masked_image,
+                                     taken,
+                                     self.cur_threshold,
+                                     self.find_max_radius,
+                                     self.margin)
+
     def findPeaks(self, fit_peaks_image, peaks):
         """
         Finds the peaks in an image & adds to the current list of peaks.
@@ -253,6 +308,11 @@ class PeakFinder(object):
         # Make a copy of the starting image.
         self.image = numpy.copy(new_image)
 
+        # Reset incremental mode state.
+        self.last_maxima = {}
+        for mfilter in self.incremental_filters:
+            mfilter.reset()
+
         # Initialize new peak minimum threshold. If we are doing more
         # than one iteration we start a bit higher and come down to
         # the specified threshold.
@@ -278,7 +338,7 @@ class PeakFinder(object):
 
             # Create matched filter for background.
             bg_psf = gaussianPSF(new_image.shape, self.parameters.getAttr("background_sigma"))
-            self.bg_filter = matchedFilterC.MatchedFilter(bg_psf)
+            self.bg_filter = self.createFilter(bg_psf)
 
             #
             # Create matched filter for foreground as well as a matched filter
@@ -288,8 +348,8 @@ class PeakFinder(object):
             if self.parameters.hasAttr("foreground_sigma"):
                 if (self.parameters.getAttr("foreground_sigma") > 0.0):
                     fg_psf = gaussianPSF(new_image.shape, self.parameters.getAttr("foreground_sigma"))
-                    self.fg_mfilter = matchedFilterC.MatchedFilter(fg_psf)
-                    self.fg_vfilter = matchedFilterC.MatchedFilter(fg_psf * fg_psf)    
+                    self.fg_mfilter = self.createFilter(fg_psf)
+                    self.fg_vfilter = self.createFilter(fg_psf * fg_psf)
 
     def setVariance(self, camera_variance):
         """
@@ -428,11 +488,7 @@ class PeakFinderGaussian(PeakFinder):
         masked_image = foreground * self.peak_mask
 
         # Identify local maxima in the masked image.
-        [new_peaks, self.taken] = utilC.findLocalMaxima(masked_image,
-                                                        self.taken,
-                                                        self.cur_threshold,
-                                                        self.find_max_radius,
-                                                        self.margin)
+        [new_peaks, self.taken] = self.findLocalMaxima(masked_image, self.taken)
 
         # Fill in initial values for peak height, background and sigma.
         new_peaks = utilC.initializePeaks(new_peaks,         # The new peaks.
@@ -454,9 +510,9 @@ class PeakFinderArbitraryPSF(PeakFinder):
         super(PeakFinderArbitraryPSF, self).__init__(**kwds)
 
         self.height_rescale = []
-        self.fg_mfilter = []
+        self.fg_mfilter = None
         self.fg_mfilter_zval = []
-        self.fg_vfilter = []
+        self.fg_vfilter = None
         self.psf_object = psf_object
         self.taken = []
         self.z_values = []
@@ -490,6 +546,16 @@ class PeakFinderArbitraryPSF(PeakFinder):
                 for i in range(self.peak_locations.shape[0]):
                     self.peak_locations[i,zc_index] = self.psf_object.getScaledZ(self.peak_locations[i,zc_index])
 
+    def cleanUp(self):
+        if self.fg_mfilter is not None:
+            self.fg_mfilter.cleanup()
+            self.fg_vfilter.cleanup()
+            if self.fg_mfilter in self.incremental_filters:
+                self.incremental_filters.remove(self.fg_mfilter)
+                self.incremental_filters.remove(self.fg_vfilter)
+            self.fg_mfilter = None
+            self.fg_vfilter = None
+
     def newImage(self, new_image):
         """
         This is called once at the start of the analysis of a new image.
@@ -499,8 +565,9 @@ class PeakFinderArbitraryPSF(PeakFinder):
         super(PeakFinderArbitraryPSF, self).newImage(new_image)
     
         #
-        # If does not already exist, create filter objects from
-        # the PSF at different z values.
+        # If does not already exist, create filter bank objects from
+        # the PSF at different z values. The filter banks only
+        # transform the image once for all of the z values.
         #
         # As not all PSFs will be maximal in the center we can't just
         # use the image intensity at the center as the starting
@@ -508,14 +575,14 @@ class PeakFinderArbitraryPSF(PeakFinder):
         # peak center of the convolved image, then adjust this
         # value by the height_rescale parameter.
         #
-        if (len(self.fg_mfilter) == 0):
+        if self.fg_mfilter is None:
+            psfs_norm = []
             for zval in self.fg_mfilter_zval:
                 psf = self.psf_object.getPSF(zval,
                                              shape = new_image.shape,
                                              normalize = False)
                 psf_norm = psf/numpy.sum(psf)
-                self.fg_mfilter.append(matchedFilterC.MatchedFilter(psf_norm))
-                self.fg_vfilter.append(matchedFilterC.MatchedFilter(psf_norm * psf_norm))
+                psfs_norm.append(psf_norm)
 
                 #
                 # This is used to convert the height measured in the
@@ -538,8 +605,11 @@ class PeakFinderArbitraryPSF(PeakFinder):
                     filename = "psf_{0:.3f}.tif".format(zval)
                     tifffile.imsave(filename, psf.astype(numpy.float32))
 
+            self.fg_mfilter = self.createFilter(psfs_norm)
+            self.fg_vfilter = self.createFilter([x * x for x in psfs_norm])
+
         self.taken = []
-        for i in range(len(self.fg_mfilter)):
+        for i in range(self.fg_mfilter.getNFilters()):
             self.taken.append(numpy.zeros(new_image.shape, dtype=numpy.int32))
                         
     def peakFinder(self, fit_peaks_image):
@@ -571,49 +641,47 @@ class PeakFinderArbitraryPSF(PeakFinder):
         #
         # Find peaks in image convolved with the PSF at different z values.
         #
-        if self.check_mode:
-            bg_tif = tifffile.TiffWriter("background.tif")
-            fg_tif = tifffile.TiffWriter("foreground.tif")
-            fg_bg_ratio_tif = tifffile.TiffWriter("fg_bg_ratio.tif")
-            
-        for i in range(len(self.fg_mfilter)):
+        # The filter banks return (z, x, y) arrays with the convolution
+        # at every z value.
+        #
 
-            # Estimate background variance at this particular z value.
-            background = self.fg_vfilter[i].convolve(bg_var)
-                
-            # Check for problematic values.
-            #
-            # Note: numpy will also complain when we try to take the sqrt of a negative number.
-            #
-            if self.check_mode:            
-                mask = (background <= 0.0)
-                if (numpy.sum(mask) > 0):
-                    print("Warning! zero and/or negative values detected in background variance!")
-                    
-            # Convert to standard deviation.
-            bg_std = numpy.sqrt(background)
-
-            # Calculate foreground.
-            foreground = self.image - self.background - fit_peaks_image
-            foreground = self.fg_mfilter[i].convolve(foreground)
-                    
-            # Calculate foreground in units of signal to noise.
-            fg_bg_ratio = foreground/bg_std
+        # Estimate background variance at each z value.
+        backgrounds = self.fg_vfilter.convolve(bg_var)
+
+        # Check for problematic values.
+        #
+        # Note: numpy will also complain when we try to take the sqrt of a negative number.
+        #
+        if self.check_mode:            
+            mask = (backgrounds <= 0.0)
+            if (numpy.sum(mask) > 0):
+                print("Warning! zero and/or negative values detected in background variance!")
+
+        # Calculate foreground.
+        foregrounds = self.fg_mfilter.convolve(self.image - self.background - fit_peaks_image)
         
-            if self.check_mode:
-                bg_tif.save(numpy.transpose(background.astype(numpy.float32)))
-                fg_tif.save(numpy.transpose(foreground.astype(numpy.float32)))
-                fg_bg_ratio_tif.save(numpy.transpose(fg_bg_ratio.astype(numpy.float32)))        
+        # Calculate foreground in units of signal to noise.
+        fg_bg_ratios = foregrounds/numpy.sqrt(backgrounds)
 
-            # Mask the image so that peaks are only found in the AOI.
-            masked_image = fg_bg_ratio * self.peak_mask
+        # Mask the images so that peaks are only found in the AOI.
+        masked_images = fg_bg_ratios * self.peak_mask
         
+        if self.check_mode:
+            with tifffile.TiffWriter("background.tif") as bg_tif:
+                for background in backgrounds:
+                    bg_tif.save(numpy.transpose(background.astype(numpy.float32)))
+            with tifffile.TiffWriter("foreground.tif") as fg_tif:
+                for foreground in foregrounds:
+                    fg_tif.save(numpy.transpose(foreground.astype(numpy.float32)))
+            with tifffile.TiffWriter("fg_bg_ratio.tif") as fg_bg_ratio_tif:
+                for fg_bg_ratio in fg_bg_ratios:
+                    fg_bg_ratio_tif.save(numpy.transpose(fg_bg_ratio.astype(numpy.float32)))
+
+        for i in range(masked_images.shape[0]):
+            foreground = foregrounds[i]
+            
             # Identify local maxima in the masked ratio image.
-            [new_peaks, taken] = utilC.findLocalMaxima(masked_image,
-                                                       self.taken[i],
-                                                       self.cur_threshold,
-                                                       self.find_max_radius,
-                                                       self.margin)
+            [new_peaks, taken] = self.findLocalMaxima(masked_images[i], self.taken[i], index = i)
 
             # Fill in initial values for peak height, background and sigma.
             new_peaks = utilC.initializePeaks(new_peaks,                    # The new peaks.
@@ -633,14 +701,10 @@ class PeakFinderArbitraryPSF(PeakFinder):
             else:
                 all_new_peaks = numpy.append(all_new_peaks, new_peaks, axis = 0)
 
-        if self.check_mode:
-            fg_tif.close()
-            fg_bg_ratio_tif.close()
-                
         #
         # Remove the dimmer of two peaks with similar x,y values but different z values.
         #
-        if (len(self.fg_mfilter) > 1):
+        if (self.fg_mfilter.getNFilters() > 1):
 
             if self.check_mode:
                 print("Before peak removal", all_new_peaks.shape)
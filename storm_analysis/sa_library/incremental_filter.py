@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Incremental (tile based) updates of image convolutions for multi-iteration
+peak finding.
+
+Between peak finding iterations the input to the background and foreground
+filters usually only changes in the areas around the peaks that were
+(re)fit. IncrementalFilter keeps the previous input and result of a
+MatchedFilter (or MatchedFilterBank) and, if only a small fraction of the
+image changed, updates the result by convolving the change in the input
+tile by tile and combining the tiles with overlap-add. The convolution is
+circular, as with the FFT based filters.
+
+The PSFs are truncated where they drop below a small fraction of their
+maximum value, so the results are very close to, but not exactly the
+same as, the full image convolution.
+
+Hazen 10/26
+"""
+
+import numpy
+import scipy.ndimage
+
+import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.sa_library.recenter_psf as recenterPSF
+
+
+class TiledConvolution(object):
+    """
+    Circular convolution of a sparse image with one or more (small) kernels.
+    """
+    def __init__(self, psfs = None, tile_size = 32, threshold = 1.0e-8, **kwds):
+        """
+        psfs - A list of PSFs, these are centered in an image the same size
+               as the image to convolve, as for MatchedFilter.
+        tile_size - The tile size in pixels.
+        threshold - Kernel values less than threshold times the kernel maximum
+                    are ignored.
+        """
+        super(TiledConvolution, self).__init__(**kwds)
+
+        self.n_filters = len(psfs)
+        self.shape = psfs[0].shape
+        self.tile_size = tile_size
+
+        # Recenter the PSFs and find the kernel radius in x and y.
+        rc_psfs = []
+        [rx, ry] = [0, 0]
+        for psf in psfs:
+            rc_psf = recenterPSF.recenterPSF(psf)
+            [ix, iy] = numpy.nonzero(numpy.abs(rc_psf) > threshold * numpy.max(numpy.abs(rc_psf)))
+            rx = max(rx, numpy.max(numpy.minimum(ix, self.shape[0] - ix)))
+            ry = max(ry, numpy.max(numpy.minimum(iy, self.shape[1] - iy)))
+            rc_psfs.append(rc_psf)
+        self.rx = int(rx)
+        self.ry = int(ry)
+
+        # The tiles must be small enough that a tile plus the kernel
+        # does not wrap around the image more than once.
+        self.usable = ((self.tile_size + 2*self.rx) <= self.shape[0]) and ((self.tile_size + 2*self.ry) <= self.shape[1])
+        if not self.usable:
+            return
+
+        # The number of tiles in x and y.
+        self.nx = -(-self.shape[0]//self.tile_size)
+        self.ny = -(-self.shape[1]//self.tile_size)
+
+        # FFTs of the kernels at the size of a tile plus the kernel.
+        self.fft_shape = (self.tile_size + 2*self.rx, self.tile_size + 2*self.ry)
+        kx = numpy.arange(-self.rx, self.rx + 1) % self.shape[0]
+        ky = numpy.arange(-self.ry, self.ry + 1) % self.shape[1]
+        self.kernel_ffts = numpy.array([numpy.fft.rfft2(rc_psf[numpy.ix_(kx, ky)], s = self.fft_shape) for rc_psf in rc_psfs])
+
+    def convolve(self, image, tiles):
+        """
+        Returns the convolution of image with the kernels, only the tiles
+        in tiles are used, the image is assumed to be zero elsewhere.
+
+        image - The image to convolve.
+        tiles - A (n, 2) array of tile indices.
+
+        The result has shape (n_filters, shape[0], shape[1]).
+        """
+        ts = self.tile_size
+        [fx, fy] = self.fft_shape
+
+        # Extract the tiles.
+        padded = numpy.zeros((self.nx * ts, self.ny * ts))
+        padded[:self.shape[0],:self.shape[1]] = image
+        blocks = padded.reshape(self.nx, ts, self.ny, ts).transpose(0, 2, 1, 3)[tiles[:,0], tiles[:,1]]
+
+        # Convolve all the tiles with all the kernels.
+        blocks_fft = numpy.fft.rfft2(blocks, s = self.fft_shape)
+        results = numpy.fft.irfft2(blocks_fft[:,None,:,:] * self.kernel_ffts[None,:,:,:], s = self.fft_shape)
+
+        # Overlap-add.
+        acc = numpy.zeros((self.n_filters, self.nx * ts + 2*self.rx, self.ny * ts + 2*self.ry))
+        for i in range(tiles.shape[0]):
+            x = tiles[i,0] * ts
+            y = tiles[i,1] * ts
+            acc[:, x:x+fx, y:y+fy] += results[i]
+
+        # Wrap around the edges of the image.
+        acc = foldAxis(acc, self.rx, self.shape[0], 1)
+        return foldAxis(acc, self.ry, self.shape[1], 2)
+
+    def dirtyTiles(self, image):
+        """
+        Returns the indices of the tiles that contain non-zero values as a (n, 2) array.
+        """
+        ts = self.tile_size
+        padded = numpy.zeros((self.nx * ts, self.ny * ts), dtype = bool)
+        padded[:self.shape[0],:self.shape[1]] = (image != 0.0)
+        return numpy.transpose(numpy.nonzero(padded.reshape(self.nx, ts, self.ny, ts).any(axis = (1, 3))))
+
+    def getNTiles(self):
+        return self.nx * self.ny
+
+
+class IncrementalFilter(object):
+    """
+    Wraps a MatchedFilter or a MatchedFilterBank object so that when the
+    input only changes in a few places the result is updated instead of
+    being recalculated.
+    """
+    def __init__(self, mfilter = None, psfs = None, max_fraction = 0.25, tile_size = 32, **kwds):
+        """
+        mfilter - A MatchedFilter or MatchedFilterBank object.
+        psfs - The PSFs that were used to create mfilter (a list for a MatchedFilterBank).
+        max_fraction - If more than this fraction of the tiles have changed the
+                       full convolution is done instead.
+        tile_size - The tile size in pixels.
+        """
+        super(IncrementalFilter, self).__init__(**kwds)
+
+        self.is_bank = isinstance(psfs, list)
+        if not self.is_bank:
+            psfs = [psfs]
+
+        self.max_fraction = max_fraction
+        self.mfilter = mfilter
+        self.n_full = 0
+        self.n_incremental = 0
+        self.tconv = TiledConvolution(psfs = psfs, tile_size = tile_size)
+
+        self.reset()
+
+    def cleanup(self):
+        self.mfilter.cleanup()
+
+    def convolve(self, image):
+        """
+        Returns the convolution of image with the PSF(s).
+        """
+        result = None
+        if self.tconv.usable and (self.last_input is not None):
+            delta = image - self.last_input
+            tiles = self.tconv.dirtyTiles(delta)
+            if (tiles.shape[0] == 0):
+                result = self.last_result
+            elif (tiles.shape[0] <= self.max_fraction * self.tconv.getNTiles()):
+                delta_result = self.tconv.convolve(delta, tiles)
+                if not self.is_bank:
+                    delta_result = delta_result[0]
+                result = self.last_result + delta_result
+            if result is not None:
+                self.n_incremental += 1
+
+        if result is None:
+            result = self.mfilter.convolve(image)
+            self.n_full += 1
+
+        self.last_input = numpy.copy(image)
+        self.last_result = result
+        return numpy.copy(result)
+
+    def getNFilters(self):
+        return self.mfilter.getNFilters()
+
+    def getStats(self):
+        """
+        Returns [number of full convolutions, number of incremental updates].
+        """
+        return [self.n_full, self.n_incremental]
+
+    def reset(self):
+        """
+        Call this at the start of a new image.
+        """
+        self.last_input = None
+        self.last_result = None
+
+
+def changedRegion(image, last_image, radius):
+    """
+    Returns a mask of the pixels whose local maxima status could have
+    changed between last_image and image.
+    """
+    size = 2*int(radius + 0.5) + 1
+    return scipy.ndimage.binary_dilation(image != last_image, structure = numpy.ones((size, size), dtype = bool))
+
+def findLocalMaximaInRegion(image, taken, threshold, radius, margin, region):
+    """
+    utilC.findLocalMaxima() that only adds peaks in region. The rest of
+    the image is still used to decide whether a pixel is a local maximum.
+    """
+    # findLocalMaxima() won't add a peak where taken is 2 or more.
+    region_taken = numpy.copy(taken)
+    region_taken[numpy.logical_not(region)] = 2
+
+    [new_peaks, region_taken] = utilC.findLocalMaxima(image,
+                                                      region_taken,
+                                                      threshold,
+                                                      radius,
+                                                      margin)
+    taken[region] = region_taken[region]
+    return [new_peaks, taken]
+
+def foldAxis(acc, offset, size, axis):
+    """
+    Add the parts of acc that are before offset or after offset + size
+    along axis to the other end of the result, i.e. wrap them around.
+    """
+    acc = numpy.moveaxis(acc, axis, -1)
+    result = numpy.copy(acc[...,offset:offset+size])
+    result[...,size-offset:] += acc[...,:offset]
+    extra = acc.shape[-1] - offset - size
+    if (extra > 0):
+        result[...,:extra] += acc[...,offset+size:]
+    return numpy.moveaxis(result, -1, axis)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+A simple least recently used (LRU) cache. This is used to cache
+expensive to calculate results, such as PSFs, that are requested
+repeatedly with the same arguments.
+
+Hazen 10/26
+"""
+
+import collections
+
+
+class LRUCache(object):
+    """
+    A dictionary like object with a maximum size. When the cache is
+    full the entry that was used least recently is discarded.
+    """
+    def __init__(self, max_size = 128, **kwds):
+        """
+        max_size - The maximum number of entries, 0 disables the cache.
+        """
+        super(LRUCache, self).__init__(**kwds)
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.max_size = max_size
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def clear(self):
+        self.cache.clear()
+
+    def get(self, key):
+        """
+        Returns the value for key or None if key is not in the cache.
+        """
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        return None
+
+    def getStats(self):
+        """
+        Returns [hits, misses].
+        """
+        return [self.hits, self.misses]
+
+    def put(self, key, value):
+        if (self.max_size <= 0):
+            return
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while (len(self.cache) > self.max_size):
+            self.cache.popitem(last = False)
@@ -5,6 +5,11 @@
  * This uses an FFT to do the convolution so there will
  * be edge effects.
  *
+ * There is also a filter bank version for convolving an image
+ * with several PSFs (for example the PSF at different z values).
+ * This only does a single forward FFT of the image and then does
+ * all the inverse FFTs with a single (batched) FFTW plan.
+ *
  * Hazen 3/16
  * 
  * Compilation instructions:
@@ -44,9 +49,32 @@ struct filter_struct {
 };
 typedef struct filter_struct filter;
 
+struct filter_bank_struct {
+  int fft_size;
+  int image_size;
+  int n_filters;
+  int x_size;
+  int y_size;
+  double normalization;
+
+  double *fft_vector;
+  double *results;
+
+  fftw_plan fft_backward;
+  fftw_plan fft_forward;
+
+  fftw_complex *fft_vector_fft;
+  fftw_complex *psf_ffts;
+  fftw_complex *results_fft;
+};
+typedef struct filter_bank_struct filter_bank;
+
 /* Function Declarations */
 void cleanup(filter *);
 void convolve(filter *, double *, double *);
+void fbCleanup(filter_bank *);
+void fbConvolve(filter_bank *, double *, double *);
+filter_bank *fbInitialize(double *, int, int, int, int);
 filter *initialize(double *, int, int, int);
 
 /* Functions */
@@ -102,6 +130,134 @@ void convolve(filter *flt, double *image, double *result)
   }  
 }
 
+/*
+ * fbCleanup()
+ *
+ * fb - A pointer to a filter_bank structure.
+ */
+void fbCleanup(filter_bank *fb)
+{
+  fftw_destroy_plan(fb->fft_backward);
+  fftw_destroy_plan(fb->fft_forward);
+
+  fftw_free(fb->fft_vector);
+  fftw_free(fb->fft_vector_fft);
+  fftw_free(fb->psf_ffts);
+  fftw_free(fb->results);
+  fftw_free(fb->results_fft);
+
+  free(fb);
+}
+
+/*
+ * fbConvolve()
+ *
+ * Convolve image with all of the psfs in the filter bank.
+ *
+ * fb - A pointer to a filter_bank structure.
+ * image - The image (must be the same size as the original psf images).
+ * results - Pre-allocated storage for the results of the convolutions 
+ *           (n_filters, x_size, y_size).
+ */
+void fbConvolve(filter_bank *fb, double *image, double *results)
+{
+  int i,j;
+  double c,r;
+  fftw_complex *psf_fft, *result_fft;
+
+  /* Compute FFT of the image. */
+  for(i=0;i<fb->image_size;i++){
+    fb->fft_vector[i] = image[i];
+  }
+  fftw_execute(fb->fft_forward);
+
+  /* Multiple by the FFT of each PSF. */
+  for(i=0;i<fb->n_filters;i++){
+    psf_fft = fb->psf_ffts + i*fb->fft_size;
+    result_fft = fb->results_fft + i*fb->fft_size;
+    for(j=0;j<fb->fft_size;j++){
+      r = fb->fft_vector_fft[j][0] * psf_fft[j][0] - fb->fft_vector_fft[j][1] * psf_fft[j][1];
+      c = fb->fft_vector_fft[j][0] * psf_fft[j][1] + fb->fft_vector_fft[j][1] * psf_fft[j][0];
+      result_fft[j][0] = r;
+      result_fft[j][1] = c;
+    }
+  }
+
+  /* Compute all the inverse FFTs. */
+  fftw_execute(fb->fft_backward);
+
+  /* Copy into results. */
+  for(i=0;i<(fb->n_filters*fb->image_size);i++){
+    results[i] = fb->results[i] * fb->normalization;
+  }
+}
+
+/*
+ * fbInitialize()
+ *
+ * Set things up for FFT convolution with a bank of filters.
+ *
+ * psfs - the psfs (n_filters, x_size, y_size).
+ * n_filters - the number of psfs.
+ * x_size - the size of the psfs in x (slow dimension).
+ * y_size - the size of the psfs in y (fast dimension).
+ * estimate - 0/1 to just use an estimated FFT plan.
+ */
+filter_bank *fbInitialize(double *psfs, int n_filters, int x_size, int y_size, int estimate)
+{
+  int i,j;
+  int n[2];
+  unsigned flags;
+  filter_bank *fb;
+
+  fb = (filter_bank *)malloc(sizeof(filter_bank));
+  
+  /* Initialize some variables. */
+  fb->fft_size = x_size * (y_size/2 + 1);
+  fb->image_size = x_size * y_size;
+  fb->n_filters = n_filters;
+  
+  fb->x_size = x_size;
+  fb->y_size = y_size;
+  fb->normalization = 1.0/((double)(x_size * y_size));
+
+  /* Allocate storage. */
+  fb->fft_vector = (double *)fftw_malloc(sizeof(double)*fb->image_size);
+  fb->fft_vector_fft = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*fb->fft_size);
+  fb->psf_ffts = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*fb->fft_size*n_filters);
+  fb->results = (double *)fftw_malloc(sizeof(double)*fb->image_size*n_filters);
+  fb->results_fft = (fftw_complex *)fftw_malloc(sizeof(fftw_complex)*fb->fft_size*n_filters);
+
+  /* Create FFT plans. */
+  flags = FFTW_MEASURE;
+  if (estimate){
+    flags = FFTW_ESTIMATE;
+  }
+  n[0] = x_size;
+  n[1] = y_size;
+  fb->fft_forward = fftw_plan_dft_r2c_2d(x_size, y_size, fb->fft_vector, fb->fft_vector_fft, flags);
+  fb->fft_backward = fftw_plan_many_dft_c2r(2, n, n_filters,
+					    fb->results_fft, NULL, 1, fb->fft_size,
+					    fb->results, NULL, 1, fb->image_size,
+					    flags);
+
+  /* Compute FFTs of the psfs and save. */
+  for(i=0;i<n_filters;i++){
+    for(j=0;j<fb->image_size;j++){
+      fb->fft_vector[j] = psfs[i*fb->image_size + j];
+    }
+  
+    fftw_execute(fb->fft_forward);
+  
+    for(j=0;j<fb->fft_size;j++){
+      fb->psf_ffts[i*fb->fft_size + j][0] = fb->fft_vector_fft[j][0];
+      fb->psf_ffts[i*fb->fft_size + j][1] = fb->fft_vector_fft[j][1];
+    }
+  }
+
+  return fb;
+}
+
 /*
  * initialize()
  *
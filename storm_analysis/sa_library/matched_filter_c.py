@@ -10,15 +10,29 @@ import numpy
 from numpy.ctypeslib import ndpointer
 import os
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.loadclib as loadclib
 import storm_analysis.sa_library.recenter_psf as recenterPSF
 
+# Apply the FFTW threads setting from the environment.
+fftwThreadsC.initialize()
+
 m_filter = loadclib.loadCLibrary("storm_analysis.sa_library", "matched_filter")
 
 m_filter.cleanup.argtypes = [ctypes.c_void_p]
 m_filter.convolve.argtypes = [ctypes.c_void_p,
                               ndpointer(dtype = numpy.float64),
                               ndpointer(dtype = numpy.float64)]
+m_filter.fbCleanup.argtypes = [ctypes.c_void_p]
+m_filter.fbConvolve.argtypes = [ctypes.c_void_p,
+                                ndpointer(dtype = numpy.float64),
+                                ndpointer(dtype = numpy.float64)]
+m_filter.fbInitialize.argtypes = [ndpointer(dtype = numpy.float64),
+                                  ctypes.c_int,
+                                  ctypes.c_int,
+                                  ctypes.c_int,
+                                  ctypes.c_int]
+m_filter.fbInitialize.restype = ctypes.c_void_p
 m_filter.initialize.argtypes = [ndpointer(dtype = numpy.float64),
                                 ctypes.c_int,
                                 ctypes.c_int,
@@ -58,6 +72,52 @@ class MatchedFilter(object):
         m_filter.convolve(self.mfilter, image, result)
 
         return result
+
+
+class MatchedFilterBank(object):
+    """
+    Convolve an image with several PSFs. The image is only transformed
+    once and all the inverse transforms are done together.
+    """
+    def __init__(self, psfs, estimate_fft_plan = False):
+        """
+        psfs - A list of PSFs, these must all have the same shape.
+        """
+        self.n_filters = len(psfs)
+        self.psf_shape = psfs[0].shape
+
+        rc_psfs = numpy.zeros((self.n_filters, self.psf_shape[0], self.psf_shape[1]))
+        for i, psf in enumerate(psfs):
+            if (psf.shape[0] != self.psf_shape[0]) or (psf.shape[1] != self.psf_shape[1]):
+                raise MatchedFilterException("All the psfs must have the same shape! " + str(psf.shape) + " != " + str(self.psf_shape))
+            rc_psfs[i,:,:] = recenterPSF.recenterPSF(psf)
+
+        self.mfilter = m_filter.fbInitialize(rc_psfs,
+                                             self.n_filters,
+                                             self.psf_shape[0],
+                                             self.psf_shape[1],
+                                             int(estimate_fft_plan))
+
+    def cleanup(self):
+        m_filter.fbCleanup(self.mfilter)
+        self.mfilter = None
+
+    def convolve(self, image):
+        """
+        Returns the convolution of image with each of the PSFs as a
+        (n_filters, image.shape[0], image.shape[1]) array.
+        """
+        if (image.shape[0] != self.psf_shape[0]) or (image.shape[1] != self.psf_shape[1]):
+            raise MatchedFilterException("Image shape must match psf shape! " + str(image.shape) + " != " + str(self.psf_shape))
+        
+        image = numpy.ascontiguousarray(image, dtype = numpy.float64)
+        results = numpy.zeros((self.n_filters, self.psf_shape[0], self.psf_shape[1]), dtype = numpy.float64)
+        m_filter.fbConvolve(self.mfilter, image, results)
+
+        return results
+
+    def getNFilters(self):
+        return self.n_filters
         
 
 if (__name__ == "__main__"):
@@ -186,6 +186,12 @@ class ParametersCommon(Parameters):
             # not specified then the analysis parameters will not
             # be appended. 0 = No.
             "append_metadata" : ["int", None],
+
+            # The number of threads to use for FFTs, 0 = use all the cores. The
+            # default is to use the STORM_ANALYSIS_FFTW_THREADS environment variable
+            # if it is set, otherwise 1. Note that this is for all the FFTW based
+            # C libraries, not just the ones used in a particular analysis.
+            "fftw_threads" : ["int", None],
             
             ##
             # Analysis parameters.
@@ -301,6 +307,13 @@ class ParametersFitters(ParametersCommon):
             # To be a peak it must be the maximum value within this radius (in pixels).
             "find_max_radius" : [("int", "float"), None],
 
+            # Incrementally update the background and foreground filter results
+            # between peak finding iterations. When set to 1, only the parts of the
+            # image that changed since the last iteration are re-convolved and
+            # searched for new peaks. This is faster for sparse images. The results
+            # are very close to, but not exactly the same as, the default (0).
+            "incremental_finding" : ["int", None],
+            
             # Maximum number of iterations for new peak finding.
             "iterations" : ["int", None],            
             
@@ -540,9 +553,28 @@ class ParametersMultiplane(ParametersFitters):
             "channel6_offset" : ["int", None],
             "channel7_offset" : ["int", None],
 
+            # Save the localizations for all the channels in a single combined file,
+            # 0 = No (the default, one file per channel). See multi_plane/channel_join.py
+            # for the layout of this file. Note that tracking, averaging and drift
+            # correction are not done during the analysis of combined files, these
+            # are done by multi_plane/batch_heights.py.
+            "combined_channels" : ["int", None],
+
             # To be a peak it must be the maximum value within this radius (in pixels).
             "find_max_radius" : [("int", "float"), None],
 
+            # Directory for caching the results of the (static) part of the peak finder
+            # initialization, i.e. the convolved and transformed camera variances and
+            # the FFTW plans for the filters. These only depend on the camera calibration,
+            # the mapping and the PSFs, so batch analysis of movies that share these
+            # starts faster.
+            "finder_cache" : ["filename", None],
+
+            # The number of threads to use for fitting, the calculations for the different
+            # channels / planes of each localization are done in parallel. 0 = use all the
+            # cores, the maximum is the number of planes. The default is 1.
+            "fit_threads" : ["int", None],
+
             # Channel heights are independent, 0 = No. For multi-plane fitting you want
             # this to be 0, for multi-color fitting you want this to be 1.
             "independent_heights" : ["int", None],
@@ -595,6 +627,10 @@ class ParametersMultiplane(ParametersFitters):
             # for each parameter from each plane as a function of z. If this is not
             # specified all planes will get equal weight.
             "weights" : ["filename", None],
+
+            # The number of localizations (per channel) to buffer before writing them
+            # to the localization file(s). The default is 20000.
+            "write_buffer" : ["int", None],
             
             # Z value(s) in nanometers at which we will perform convolution with the PSF for
             # the purposes of peak finding. If this is not specified the default value is
@@ -733,6 +769,20 @@ class ParametersSpliner(ParametersFitters):
             # spline is 3D.
             "spline" : ["filename", None],
 
+            # Evaluate the spline in single precision (1), this is faster and (for fitting)
+            # should be just as accurate. The default is double precision (0).
+            "spline_single_precision" : ["int", None],
+
+            # If this is set the spline and it's derivatives will be pre-computed on a lattice
+            # and then linearly interpolated during fitting, which is faster than evaluating
+            # the spline. The lattice spacing is chosen so that the interpolation error
+            # relative to the peak of the PSF is less than this value, 1.0e-3 is a reasonable
+            # choice. If it is not set the spline is evaluated exactly.
+            "spline_table_accuracy" : ["float", None],
+
+            # The maximum size of the spline lattice in megabytes, the default is 256MB.
+            "spline_table_memory" : ["float", None],
+
             # Use FISTA deconvolution for peak finding. If this is not set then the analysis
             # will be done using a matched filter for peak finding. This is much faster, but
             # possibly less accurate at higher densities.
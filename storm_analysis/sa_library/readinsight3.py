@@ -33,6 +33,20 @@ def checkStatus(filename):
         [frames, molecules, version, status] = readHeader(fp, False)
     return (status == 6) and (molecules >= 0) and (version == "M425")
 
+def countLocalizations(filename):
+    """
+    Returns the number of (complete) localizations in a file without
+    loading them. This also works for files that were not closed
+    properly, in which case the number in the header is not valid.
+    """
+    with open(filename, "rb") as fp:
+        file_size = os.fstat(fp.fileno()).st_size
+        [frames, molecules, version, status] = readHeader(fp, False)
+    if (status == 6):
+        return molecules
+    else:
+        return max(0, (file_size - 16)//recordSize())
+
 def loadI3File(filename, verbose = True):
     return loadI3FileNumpy(filename, verbose = verbose)
 
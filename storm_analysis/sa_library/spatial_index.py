@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+A KD tree based spatial index for localizations.
+
+The index is built once from the localization positions (and
+optionally the frame numbers) and supports radius, k nearest
+neighbor and per-frame queries. When created from an Insight3
+file the index arrays can optionally be cached in a directory so
+that subsequent uses only have to load them and build the KD tree.
+
+Note: Unless noted otherwise all the indices returned by the
+      queries refer to the order of the localizations that were
+      used to create the index. Following the scipy.spatial
+      convention, missing neighbors have an infinite distance
+      and an index equal to the number of localizations.
+
+Hazen 10/26
+"""
+
+import hashlib
+import numpy
+import os
+import scipy
+import scipy.spatial
+
+import storm_analysis.sa_library.readinsight3 as readinsight3
+
+
+class SpatialIndex(object):
+    """
+    Spatial index for localizations.
+    """
+    def __init__(self, x = None, y = None, z = None, frame = None, data = None, **kwds):
+        """
+        x, y, z - The localization positions, z is optional. These
+                  should all be in the same units.
+        frame - The localization frame numbers, optional.
+        data - A dictionary from getData(), this is used instead
+               of x, y, z and frame.
+        """
+        super(SpatialIndex, self).__init__(**kwds)
+
+        self.frames = None
+        if data is not None:
+            self.data = data["data"]
+            if "frames" in data:
+                self.frame_order = data["frame_order"]
+                self.frames = data["frames"]
+                self.frame_starts = data["frame_starts"]
+
+        else:
+            if z is None:
+                self.data = numpy.stack((x, y), axis = -1).astype(numpy.float64)
+            else:
+                self.data = numpy.stack((x, y, z), axis = -1).astype(numpy.float64)
+
+            if frame is not None:
+                self.frame_order = numpy.argsort(frame, kind = "mergesort")
+                [self.frames, self.frame_starts] = numpy.unique(numpy.asarray(frame)[self.frame_order],
+                                                                return_index = True)
+
+        self.kd = scipy.spatial.cKDTree(self.data)
+        self.n = self.data.shape[0]
+
+        # Per frame indexing. The frame KD trees are created as needed.
+        self.frame_kds = {}
+        if self.frames is not None:
+            self.frame_stops = numpy.append(self.frame_starts[1:], self.n)
+
+    def getData(self):
+        """
+        Returns a dictionary with the index arrays, the KD trees are
+        not included.
+        """
+        data = {"data" : self.data}
+        if self.frames is not None:
+            data["frame_order"] = self.frame_order
+            data["frames"] = self.frames
+            data["frame_starts"] = self.frame_starts
+        return data
+
+    def getFrameIndices(self, frame):
+        """
+        Returns the indices of the localizations in a frame.
+        """
+        if self.frames is None:
+            raise SpatialIndexException("Index was created without frame information.")
+
+        i = numpy.searchsorted(self.frames, frame)
+        if (i == self.frames.size) or (self.frames[i] != frame):
+            return numpy.zeros(0, dtype = numpy.int64)
+        return self.frame_order[self.frame_starts[i]:self.frame_stops[i]]
+
+    def getFrameKDTree(self, frame):
+        """
+        Returns [kd tree, localization indices] for a frame. The kd tree
+        is None if there are no localizations in this frame.
+        """
+        if not frame in self.frame_kds:
+            indices = self.getFrameIndices(frame)
+            if (indices.size > 0):
+                self.frame_kds[frame] = [scipy.spatial.cKDTree(self.data[indices,:]), indices]
+            else:
+                self.frame_kds[frame] = [None, indices]
+        return self.frame_kds[frame]
+
+    def getNumberFrames(self):
+        """
+        Returns the number of frames that have localizations.
+        """
+        if self.frames is None:
+            return 0
+        return self.frames.size
+
+    def query(self, points, k = 1, distance_upper_bound = numpy.inf):
+        """
+        Returns [distances, indices] of the k nearest neighbors of points.
+        """
+        return self.kd.query(points, k = k, distance_upper_bound = distance_upper_bound)
+
+    def queryFrame(self, frame, points, k = 1, distance_upper_bound = numpy.inf):
+        """
+        Returns [distances, indices] of the k nearest neighbors of points
+        considering only the localizations in the specified frame.
+        """
+        [kd, indices] = self.getFrameKDTree(frame)
+        points = numpy.asarray(points)
+        if kd is None:
+            shape = points.shape[:-1]
+            if (k > 1):
+                shape = shape + (k,)
+            return [numpy.full(shape, numpy.inf), numpy.full(shape, self.n, dtype = numpy.int64)]
+
+        [dist, index] = kd.query(points, k = k, distance_upper_bound = distance_upper_bound)
+
+        # Convert to global indices.
+        found = (index < indices.size)
+        g_index = numpy.full(numpy.shape(index), self.n, dtype = numpy.int64)
+        g_index[found] = indices[numpy.asarray(index)[found]]
+        return [dist, g_index]
+
+    def queryRadius(self, points, r):
+        """
+        Returns the indices of all the localizations within r of points.
+        """
+        return self.kd.query_ball_point(points, r)
+
+    def queryRadiusFrame(self, frame, points, r):
+        """
+        Returns the indices of all the localizations in the specified frame
+        that are within r of points.
+        """
+        [kd, indices] = self.getFrameKDTree(frame)
+        points = numpy.asarray(points)
+        if (points.ndim == 1):
+            if kd is None:
+                return []
+            return list(indices[kd.query_ball_point(points, r)])
+
+        if kd is None:
+            return [[] for i in range(points.shape[0])]
+        return [list(indices[elt]) for elt in kd.query_ball_point(points, r)]
+
+
+class SpatialIndexException(Exception):
+    pass
+
+
+def indexFromI3Data(i3_data, xy_fields = ["xc", "yc"], z_scale = None):
+    """
+    Create a SpatialIndex from Insight3 data.
+
+    xy_fields - The fields to use for the x and y positions.
+    z_scale - If not None, the localization z position is multiplied by
+              this value and included in the index. For example if
+              xy_fields are in pixels and z is in nanometers this would
+              be 1/pixel size.
+    """
+    z = None
+    if z_scale is not None:
+        z = z_scale * i3_data['zc']
+    return SpatialIndex(x = i3_data[xy_fields[0]],
+                        y = i3_data[xy_fields[1]],
+                        z = z,
+                        frame = i3_data['fr'])
+
+def indexKey(bin_name, good_only, xy_fields, z_scale):
+    """
+    Returns a key for the index of an Insight3 file, this is a hash of
+    the file name, size and modification time and the index options.
+    """
+    bin_stat = os.stat(bin_name)
+    hasher = hashlib.sha1()
+    hasher.update(str([os.path.abspath(bin_name),
+                       bin_stat.st_mtime,
+                       bin_stat.st_size,
+                       good_only,
+                       list(xy_fields),
+                       z_scale]).encode())
+    return hasher.hexdigest()
+
+def loadI3Index(bin_name, good_only = False, xy_fields = ["xc", "yc"], z_scale = None, cache_dir = None, verbose = True):
+    """
+    Load an Insight3 file and create (or load) the spatial index.
+
+    If cache_dir is not None the index arrays are cached in this
+    directory. The cached index is re-created if the Insight3 file
+    changes or if the index options are different.
+
+    Returns [i3_data, index].
+    """
+    if good_only:
+        i3_data = readinsight3.loadI3GoodOnly(bin_name, verbose = verbose)
+    else:
+        i3_data = readinsight3.loadI3File(bin_name, verbose = verbose)
+
+    if cache_dir is None:
+        return [i3_data, indexFromI3Data(i3_data, xy_fields = xy_fields, z_scale = z_scale)]
+
+    filename = os.path.join(cache_dir, "index_" + indexKey(bin_name, good_only, xy_fields, z_scale) + ".npz")
+    if os.path.exists(filename):
+        with numpy.load(filename) as data:
+            return [i3_data, SpatialIndex(data = dict(data))]
+
+    index = indexFromI3Data(i3_data, xy_fields = xy_fields, z_scale = z_scale)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Write to a temporary file first so that other processes never
+    # see a partially written file.
+    tmp_name = filename + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_name, "wb") as fp:
+        numpy.savez(fp, **index.getData())
+    os.replace(tmp_name, filename)
+
+    return [i3_data, index]
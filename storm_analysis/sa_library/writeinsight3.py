@@ -254,6 +254,25 @@ class I3Writer(object):
         _putV(self.fp, "i", self.molecules)
 
         self.fp.close()
+
+
+class I3Appender(I3Writer):
+    """
+    Appends localizations to an existing file. The file is first
+    truncated to its first 'molecules' localizations, this also
+    removes the metadata (if any).
+    """
+    def __init__(self, filename, molecules):
+        self.molecules = molecules
+        self.fp = open(filename, "r+b")
+
+        # Status & number of localizations, these are updated by close().
+        self.fp.seek(8)
+        _putV(self.fp, "i", 0)
+        _putV(self.fp, "i", 0)
+
+        self.fp.truncate(16 + molecules * i3dtype.i3DataType().itemsize)
+        self.fp.seek(0, 2)
         
 
 #
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+"""
+Streaming application of a drift correction to the localizations
+in an Insight3 format file.
+
+This is a (numpy) replacement for apply-drift-correction.c. The
+localizations are memory mapped and processed in large blocks. The
+drift for each localization is linearly interpolated from the drift
+samples, so the drift file does not need to have a sample for every
+frame and the samples can be at fractional frame numbers. Frames
+outside of the range of the drift samples use the drift of the
+nearest sample.
+
+The corrected localizations are either written back into the
+Insight3 file (in place), to a copy of the Insight3 file or to a
+directory of .npy files, one per field (columnar).
+
+As the localizations are sorted by frame the drift can also be
+applied while the drift is still being estimated. Localizations
+are only processed once there is a drift sample at or after their
+frame and update() can be called as often as necessary as more
+drift samples become available.
+
+Hazen 10/26
+"""
+
+import numpy
+import os
+import shutil
+import time
+
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.readinsight3 as readinsight3
+
+
+class DriftApplierException(Exception):
+    pass
+
+
+class DriftApplier(object):
+    """
+    Applies a drift correction to an Insight3 file in blocks.
+    """
+    def __init__(self, mlist_filename = None, output = None, columnar = False, block_size = 1000000, **kwds):
+        """
+        mlist_filename - The Insight3 file to drift correct.
+        output - The output file (or directory if columnar is True). If this
+                 is None the drift correction is applied in place.
+        columnar - Save the localizations as one .npy file per field.
+        block_size - The number of localizations to process at a time.
+        """
+        super(DriftApplier, self).__init__(**kwds)
+
+        self.block_size = block_size
+        self.columns = None
+        self.cursor = 0
+        self.d_frames = None
+        self.drift_stat = None
+
+        with open(mlist_filename, "rb") as fp:
+            [frames, molecules, version, status] = readinsight3.readHeader(fp, False)
+        if (status != 6):
+            raise DriftApplierException(mlist_filename + " was not closed properly.")
+        self.n_molecules = molecules
+
+        dtype = i3dtype.i3DataType()
+        if (output is None):
+            self.i3_data = self.memmap(mlist_filename, "r+")
+            self.out_data = self.i3_data
+
+        elif columnar:
+            self.i3_data = self.memmap(mlist_filename, "r")
+            self.out_data = None
+            if not os.path.exists(output):
+                os.makedirs(output)
+            self.columns = {}
+            for name in dtype.names:
+                self.columns[name] = numpy.lib.format.open_memmap(os.path.join(output, name + ".npy"),
+                                                                  mode = "w+",
+                                                                  dtype = dtype[name],
+                                                                  shape = (self.n_molecules,))
+
+        else:
+            # Copying the file also preserves the header and the meta-data.
+            shutil.copyfile(mlist_filename, output)
+            self.i3_data = self.memmap(output, "r+")
+            self.out_data = self.i3_data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.columns = None
+        self.i3_data = None
+        self.out_data = None
+
+    def flush(self):
+        if self.columns is not None:
+            for name in self.columns:
+                self.columns[name].flush()
+        elif (self.out_data is not None) and (self.n_molecules > 0):
+            self.out_data.flush()
+
+    def getDrift(self, frames):
+        """
+        Returns [dx, dy, dz] at frames (which can be fractional).
+        """
+        if self.d_frames is None:
+            raise DriftApplierException("No drift data available.")
+        return [numpy.interp(frames, self.d_frames, self.d_dx),
+                numpy.interp(frames, self.d_frames, self.d_dy),
+                numpy.interp(frames, self.d_frames, self.d_dz)]
+
+    def getNumberProcessed(self):
+        return self.cursor
+
+    def isDone(self):
+        return (self.cursor >= self.n_molecules)
+
+    def loadDrift(self, drift_filename):
+        """
+        (Re)load the drift samples from a drift file if it has changed
+        since it was last loaded. Returns True if new samples were loaded.
+        """
+        if not os.path.exists(drift_filename):
+            return False
+
+        stat = os.stat(drift_filename)
+        key = [drift_filename, stat.st_mtime, stat.st_size]
+        if (key == self.drift_stat):
+            return False
+        self.drift_stat = key
+
+        drift = loadDriftData(drift_filename)
+        if (drift.shape[0] == 0):
+            return False
+        self.setDrift(drift[:,0], drift[:,1], drift[:,2], drift[:,3])
+        return True
+
+    def memmap(self, filename, mode):
+        if (self.n_molecules == 0):
+            return numpy.zeros(0, dtype = i3dtype.i3DataType())
+        return numpy.memmap(filename,
+                            dtype = i3dtype.i3DataType(),
+                            mode = mode,
+                            offset = 16,
+                            shape = (self.n_molecules,))
+
+    def setDrift(self, frames, dx, dy, dz):
+        """
+        Set the drift samples. These are in the same units as the
+        drift file, i.e. the drift is subtracted from the localization
+        positions.
+        """
+        frames = numpy.asarray(frames, dtype = numpy.float64)
+        order = numpy.argsort(frames, kind = "mergesort")
+        self.d_frames = frames[order]
+        self.d_dx = numpy.asarray(dx, dtype = numpy.float64)[order]
+        self.d_dy = numpy.asarray(dy, dtype = numpy.float64)[order]
+        self.d_dz = numpy.asarray(dz, dtype = numpy.float64)[order]
+
+    def update(self, final = False):
+        """
+        Apply the drift correction to all the localizations that are
+        covered by the current drift samples. If final is True then
+        all the remaining localizations are processed.
+
+        Returns the number of localizations that were processed.
+        """
+        if self.d_frames is None:
+            return 0
+
+        start = self.cursor
+        while (self.cursor < self.n_molecules):
+            i1 = self.cursor
+            i2 = min(i1 + self.block_size, self.n_molecules)
+            block = numpy.array(self.i3_data[i1:i2])
+
+            # Stop at the first localization that is past the end of
+            # the drift samples.
+            if not final:
+                past = numpy.nonzero(block['fr'] > self.d_frames[-1])[0]
+                if (past.size > 0):
+                    i2 = i1 + past[0]
+                    block = block[:past[0]]
+
+            if (block.size > 0):
+                [dx, dy, dz] = self.getDrift(block['fr'])
+                block['xc'] = block['x'] - dx
+                block['yc'] = block['y'] - dy
+                block['zc'] = block['z'] - dz
+
+                if self.columns is not None:
+                    for name in self.columns:
+                        self.columns[name][i1:i2] = block[name]
+                else:
+                    self.out_data[i1:i2] = block
+
+            self.cursor = i2
+            if (i2 - i1) < self.block_size:
+                break
+
+        self.flush()
+        return (self.cursor - start)
+
+
+def applyDriftCorrection(mlist_filename, drift_filename, output = None, columnar = False, block_size = 1000000):
+    """
+    Apply the drift correction in drift_filename to mlist_filename.
+
+    This is the equivalent of apply_drift_correction_c.applyDriftCorrection()
+    when output is None.
+    """
+    with DriftApplier(mlist_filename = mlist_filename,
+                      output = output,
+                      columnar = columnar,
+                      block_size = block_size) as applier:
+        if not applier.loadDrift(drift_filename):
+            raise DriftApplierException("No drift data in " + drift_filename)
+        applier.update(final = True)
+
+def loadDriftData(drift_filename):
+    """
+    Load the drift samples as a N x 4 array with the columns
+    frame, dx, dy and dz.
+
+    Only complete lines are used as the file might still be in
+    the process of being written.
+    """
+    with open(drift_filename) as fp:
+        text = fp.read()
+
+    drift = []
+    for line in text.splitlines(True):
+        if not line.endswith("\n"):
+            break
+        values = line.split()
+        if (len(values) == 4):
+            drift.append(list(map(float, values)))
+    return numpy.array(drift, dtype = numpy.float64).reshape(-1, 4)
+
+def streamDriftCorrection(mlist_filename, drift_filename, output = None, columnar = False, block_size = 1000000, is_finished = None, poll_interval = 1.0, timeout = None):
+    """
+    Apply the drift correction while the drift file is still being
+    written.
+
+    is_finished - An optional function that returns True when the drift
+                  estimation is done. Once this is True any remaining
+                  localizations are processed with the final drift.
+    poll_interval - How often (in seconds) to check the drift file.
+    timeout - Give up waiting for new drift samples after this many
+              seconds. The default is to wait indefinitely.
+
+    Returns the number of localizations that were processed.
+    """
+    start_time = time.time()
+    with DriftApplier(mlist_filename = mlist_filename,
+                      output = output,
+                      columnar = columnar,
+                      block_size = block_size) as applier:
+        while not applier.isDone():
+            applier.loadDrift(drift_filename)
+            applier.update()
+
+            if (is_finished is not None) and is_finished():
+                applier.loadDrift(drift_filename)
+                applier.update(final = True)
+                break
+
+            if applier.isDone():
+                break
+
+            if (timeout is not None) and ((time.time() - start_time) > timeout):
+                print("Timed out waiting for drift data,", applier.getNumberProcessed(), "of", applier.n_molecules, "localizations corrected.")
+                break
+
+            time.sleep(poll_interval)
+
+        return applier.getNumberProcessed()
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Apply drift correction to localization binary file.')
+
+    parser.add_argument('--bin', dest='mlist', type=str, required=True,
+                        help = "Localizations binary file to apply drift correction to.")
+    parser.add_argument('--drift', dest='drift', type=str, required=True,
+                        help = "Text file to with drift correction values.")
+    parser.add_argument('--output', dest='output', type=str, required=False,
+                        help = "Output file (or directory with --columnar), the default is to correct the input file in place.")
+    parser.add_argument('--columnar', dest='columnar', action='store_true', default=False,
+                        help = "Save the localizations as one .npy file per field.")
+    parser.add_argument('--follow', dest='follow', type=float, required=False,
+                        help = "Follow a drift file that is still being written, giving up after this many seconds without completion.")
+
+    args = parser.parse_args()
+
+    if args.follow is not None:
+        streamDriftCorrection(args.mlist,
+                              args.drift,
+                              output = args.output,
+                              columnar = args.columnar,
+                              timeout = args.follow)
+    else:
+        applyDriftCorrection(args.mlist,
+                             args.drift,
+                             output = args.output,
+                             columnar = args.columnar)
@@ -7,14 +7,11 @@ Note: This measures the error and *not* the recall. If only 1
 in 100 peaks is found but their locations agree exactly with
 the known locations then this will be considered good.
 
-One assumption here is that neither of these files has a
-particularly large number of localizations.
-
 Hazen 01/16
 """
 import numpy
 
-import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.sa_utilities.match_localizations as matchLocalizations
 
 def findingFittingError(truth_i3, measured_i3, pixel_size = 160.0, max_distance = None, good_only = False):
     """
@@ -27,34 +24,26 @@ def findingFittingError(truth_i3, measured_i3, pixel_size = 160.0, max_distance
     if (measured_i3.getNumberMolecules() == 0):
         return [None, None, None]
     
-    md_sqr = None
+    [t_data, m_data] = matchLocalizations.readTruthAndMeasured(truth_i3,
+                                                               measured_i3,
+                                                               good_only = good_only)
+
+    # Ignore localizations in frames without any truth localizations.
+    [dist, t_index] = matchLocalizations.nearestInFrame(m_data, t_data)
+    m_index = numpy.nonzero(t_index < t_data.size)[0]
+    t_index = t_index[m_index]
+
+    all_dx = pixel_size * (m_data['xc'][m_index] - t_data['xc'][t_index])
+    all_dy = pixel_size * (m_data['yc'][m_index] - t_data['yc'][t_index])
+    all_dz = m_data['zc'][m_index] - t_data['zc'][t_index]
+
     if max_distance is not None:
-        md_sqr = max_distance * max_distance
-        
-    all_dx = []
-    all_dy = []
-    all_dz = []
-    for i in range(truth_i3.getNumberFrames()):
-        t_locs = truth_i3.getMoleculesInFrame(i+1)
-        m_locs = measured_i3.getMoleculesInFrame(i+1, good_only = good_only)
-
-        p_index = utilC.peakToPeakIndex(m_locs['xc'], m_locs['yc'], t_locs['xc'], t_locs['yc'])
-        for i in range(m_locs.size):
-            dx = pixel_size * (m_locs['xc'][i] - t_locs['xc'][p_index[i]])
-            dy = pixel_size * (m_locs['yc'][i] - t_locs['yc'][p_index[i]])
-            dz = m_locs['zc'][i] - t_locs['zc'][p_index[i]]
-            if md_sqr is not None:
-                if ((dx*dx + dy*dy + dz*dz) < md_sqr):
-                    all_dx.append(dx)
-                    all_dy.append(dy)
-                    all_dz.append(dz)
-            else:
-                all_dx.append(dx)
-                all_dy.append(dy)
-                all_dz.append(dz)
-
-    return [numpy.array(all_dx), numpy.array(all_dy), numpy.array(all_dz)]
+        mask = ((all_dx*all_dx + all_dy*all_dy + all_dz*all_dz) < (max_distance * max_distance))
+        all_dx = all_dx[mask]
+        all_dy = all_dy[mask]
+        all_dz = all_dz[mask]
 
+    return [all_dx, all_dy, all_dz]
 
 if (__name__ == "__main__"):
     import argparse
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Vectorized matching of measured localizations to ground truth
+localizations (for simulations).
+
+Localizations are only matched to localizations in the same frame,
+this uses the per frame queries of sa_library.spatial_index.SpatialIndex.
+
+Matching is either nearest neighbor, in which case a truth
+localization can be matched to more than one measured localization,
+or one-to-one using the Hungarian algorithm.
+
+All the XY positions and the tolerance are in pixels.
+
+Hazen 10/26
+"""
+import math
+import numpy
+import scipy
+import scipy.optimize
+
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.spatial_index as spatialIndex
+
+
+def hungarianMatch(data1, data2, tolerance, index1 = None, index2 = None):
+    """
+    One-to-one matching of the localizations in data1 and data2 that
+    are within tolerance of each other, minimizing the total distance.
+
+    index1, index2 - Optional SpatialIndex objects for data1 and data2.
+
+    Returns [index1, index2, distance] for the matched pairs.
+    """
+    m1 = [numpy.zeros(0, dtype = numpy.int64)]
+    m2 = [numpy.zeros(0, dtype = numpy.int64)]
+    md = [numpy.zeros(0)]
+    if (data1.size == 0) or (data2.size == 0):
+        return [m1[0], m2[0], md[0]]
+
+    if index1 is None:
+        index1 = spatialIndex.indexFromI3Data(data1)
+    if index2 is None:
+        index2 = spatialIndex.indexFromI3Data(data2)
+
+    for frame in index1.frames:
+        locs = index1.getFrameIndices(frame)
+        neighbors = index2.queryRadiusFrame(frame, index1.data[locs,:], tolerance)
+        counts = numpy.array([len(elt) for elt in neighbors], dtype = numpy.int64)
+        if (numpy.sum(counts) == 0):
+            continue
+
+        i1 = numpy.repeat(locs, counts)
+        i2 = numpy.concatenate([numpy.asarray(elt, dtype = numpy.int64) for elt in neighbors])
+        dd = numpy.linalg.norm(index1.data[i1,:] - index2.data[i2,:], axis = 1)
+        mask = (dd < tolerance)
+        [i1, i2, dd] = [i1[mask], i2[mask], dd[mask]]
+
+        [u1, r1] = numpy.unique(i1, return_inverse = True)
+        [u2, r2] = numpy.unique(i2, return_inverse = True)
+
+        # If no localization is part of more than one pair we don't
+        # need the Hungarian algorithm.
+        if (u1.size == i1.size) and (u2.size == i2.size):
+            m1.append(i1)
+            m2.append(i2)
+            md.append(dd)
+            continue
+
+        # Pairs that are not within tolerance get a large cost.
+        cost = numpy.full((u1.size, u2.size), 1.0e6 * (tolerance + 1.0))
+        cost[r1, r2] = dd
+        [rows, cols] = scipy.optimize.linear_sum_assignment(cost)
+        mask = (cost[rows, cols] < tolerance)
+        m1.append(u1[rows[mask]])
+        m2.append(u2[cols[mask]])
+        md.append(cost[rows[mask], cols[mask]])
+
+    return [numpy.concatenate(m1), numpy.concatenate(m2), numpy.concatenate(md)]
+
+def loadTruthAndMeasured(truth_name, measured_name, good_only = False):
+    """
+    Load the truth (good localizations only) and measured localizations,
+    only measured localizations in the same frame range as the truth
+    localizations are kept.
+    """
+    with readinsight3.I3Reader(truth_name) as truth_i3:
+        with readinsight3.I3Reader(measured_name) as measured_i3:
+            return readTruthAndMeasured(truth_i3, measured_i3, good_only = good_only)
+
+def nearestInFrame(data1, data2, max_distance = numpy.inf, index1 = None, index2 = None):
+    """
+    Find the nearest localization in data2 for each localization in
+    data1 (in the same frame).
+
+    index1, index2 - Optional SpatialIndex objects for data1 and data2.
+
+    Returns [distance, index], localizations without a match have a
+    distance of infinity and an index of data2.size.
+    """
+    dist = numpy.full(data1.size, numpy.inf)
+    index = numpy.full(data1.size, data2.size, dtype = numpy.int64)
+    if (data1.size == 0) or (data2.size == 0):
+        return [dist, index]
+
+    if index1 is None:
+        index1 = spatialIndex.indexFromI3Data(data1)
+    if index2 is None:
+        index2 = spatialIndex.indexFromI3Data(data2)
+
+    for frame in index1.frames:
+        locs = index1.getFrameIndices(frame)
+        [dist[locs], index[locs]] = index2.queryFrame(frame,
+                                                      index1.data[locs,:],
+                                                      distance_upper_bound = max_distance)
+
+    return [dist, index]
+
+def readTruthAndMeasured(truth_i3, measured_i3, good_only = False):
+    """
+    Same as loadTruthAndMeasured() but using already opened
+    readinsight3.I3Reader objects.
+    """
+    if (truth_i3.getNumberMolecules() == 0):
+        return [i3dtype.createDefaultI3Data(0), i3dtype.createDefaultI3Data(0)]
+
+    n_frames = truth_i3.getNumberFrames()
+    t_data = truth_i3.getMoleculesInFrameRange(0, n_frames + 1, good_only = True)
+    if (measured_i3.getNumberMolecules() == 0):
+        m_data = i3dtype.createDefaultI3Data(0)
+    else:
+        m_data = measured_i3.getMoleculesInFrameRange(1, n_frames + 1, good_only = good_only)
+    return [t_data, m_data]
+
+def scoreFiles(truth_name, measured_name, tolerance, good_only = False, **kwds):
+    """
+    Score the localizations in a measured file against a truth file. See
+    scoreLocalizations() for the keyword arguments.
+    """
+    [t_data, m_data] = loadTruthAndMeasured(truth_name, measured_name, good_only = good_only)
+    return scoreLocalizations(t_data, m_data, tolerance, **kwds)
+
+def scoreLocalizations(t_data, m_data, tolerance, hungarian = False, pixel_size = 160.0, n_bins = 30, xy_range = 100.0, z_range = 200.0):
+    """
+    Score measured localizations (m_data) against truth localizations (t_data).
+
+    tolerance - The XY matching radius in pixels.
+    hungarian - Use one-to-one matching, otherwise measured localizations
+                are matched to the nearest truth localization.
+    pixel_size - Pixel size in nanometers.
+    n_bins, xy_range, z_range - Error histogram settings (nanometers).
+
+    Returns a dictionary with the recall and noise fractions, the
+    RMS error and the error histograms. Errors are in nanometers.
+    """
+    t_sindex = None
+    m_sindex = None
+    if (t_data.size > 0) and (m_data.size > 0):
+        t_sindex = spatialIndex.indexFromI3Data(t_data)
+        m_sindex = spatialIndex.indexFromI3Data(m_data)
+
+    if hungarian:
+        [t_index, m_index, dist] = hungarianMatch(t_data, m_data, tolerance, index1 = t_sindex, index2 = m_sindex)
+        n_recalled = t_index.size
+        n_noise = m_data.size - m_index.size
+    else:
+        [t_dist, t_nearest] = nearestInFrame(t_data, m_data, max_distance = tolerance, index1 = t_sindex, index2 = m_sindex)
+        [m_dist, m_nearest] = nearestInFrame(m_data, t_data, max_distance = tolerance, index1 = m_sindex, index2 = t_sindex)
+        n_recalled = numpy.count_nonzero(t_dist < tolerance)
+        n_noise = numpy.count_nonzero(m_dist > tolerance)
+        m_index = numpy.nonzero(m_dist < tolerance)[0]
+        t_index = m_nearest[m_index]
+
+    dx = pixel_size * (m_data['xc'][m_index] - t_data['xc'][t_index])
+    dy = pixel_size * (m_data['yc'][m_index] - t_data['yc'][t_index])
+    dz = m_data['zc'][m_index] - t_data['zc'][t_index]
+
+    results = {"n_truth" : t_data.size,
+               "n_measured" : m_data.size,
+               "n_matched" : m_index.size,
+               "n_noise" : n_noise,
+               "n_recalled" : n_recalled,
+               "noise" : float(n_noise)/float(max(m_data.size, 1)),
+               "recall" : float(n_recalled)/float(max(t_data.size, 1)),
+               "dx" : dx,
+               "dy" : dy,
+               "dz" : dz}
+
+    for [name, err, h_range] in [["x", dx, xy_range], ["y", dy, xy_range], ["z", dz, z_range]]:
+        if (err.size > 0):
+            results["rmse_" + name] = math.sqrt(numpy.mean(err*err))
+        else:
+            results["rmse_" + name] = None
+        [hist, bins] = numpy.histogram(err, bins = n_bins, range = (-h_range, h_range))
+        results["hist_d" + name] = hist
+        results["bins_d" + name] = bins
+
+    if (dx.size > 0):
+        results["rmse_xy"] = math.sqrt(numpy.mean(dx*dx + dy*dy))
+    else:
+        results["rmse_xy"] = None
+
+    return results
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Score localizations against the ground truth.')
+
+    parser.add_argument('--truth_bin', dest='truth_bin', type=str, required=True,
+                        help = "Ground truth localization file.")
+    parser.add_argument('--measured_bin', dest='measured_bin', type=str, required=True,
+                        help = "Measured localization file.")
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default = 0.2, required=False,
+                        help = "Tolerance in position difference in pixels.")
+    parser.add_argument('--pixel_size', dest='pixel_size', type=float, required=False, default = 160.0,
+                        help = "Camera pixel size in nanometers.")
+    parser.add_argument('--hungarian', dest='hungarian', action='store_true', default=False,
+                        help = "Use one-to-one (Hungarian) matching.")
+
+    args = parser.parse_args()
+
+    results = scoreFiles(args.truth_bin,
+                         args.measured_bin,
+                         args.tolerance,
+                         hungarian = args.hungarian,
+                         pixel_size = args.pixel_size)
+
+    print("Recall fraction {0:.5f}".format(results["recall"]))
+    print("Noise fraction {0:.5f}".format(results["noise"]))
+    if results["rmse_xy"] is not None:
+        print("RMSE (nm) x {0:.2f} y {1:.2f} z {2:.2f}".format(results["rmse_x"], results["rmse_y"], results["rmse_z"]))
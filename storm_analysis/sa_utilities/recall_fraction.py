@@ -7,7 +7,8 @@ Hazen 09/17
 import numpy
 
 import storm_analysis.sa_library.readinsight3 as readinsight3
-import storm_analysis.sa_library.ia_utilities_c as utilC
+
+import storm_analysis.sa_utilities.match_localizations as matchLocalizations
 
 
 def recallFraction(truth_i3, measured_i3, tolerance):
@@ -22,18 +23,9 @@ def recallFraction(truth_i3, measured_i3, tolerance):
     if (measured_i3.getNumberMolecules() == 0):
         return [0, truth_i3.getNumberMolecules()]
     
-    recalled_locs = 0
-    total_locs = 0
-    for i in range(truth_i3.getNumberFrames()):
-        t_locs = truth_i3.getMoleculesInFrame(i+1)
-        m_locs = measured_i3.getMoleculesInFrame(i+1, good_only = False)
-        
-        dist = utilC.peakToPeakDist(t_locs['xc'], t_locs['yc'], m_locs['xc'], m_locs['yc'])
-
-        recalled_locs += numpy.count_nonzero((dist < tolerance))
-        total_locs += dist.size
-
-    return [recalled_locs, total_locs]
+    [t_data, m_data] = matchLocalizations.readTruthAndMeasured(truth_i3, measured_i3)
+    [dist, index] = matchLocalizations.nearestInFrame(t_data, m_data, max_distance = tolerance)
+    return [numpy.count_nonzero((dist < tolerance)), dist.size]
 
 
 def noiseFraction(truth_i3, measured_i3, tolerance):
@@ -50,18 +42,9 @@ def noiseFraction(truth_i3, measured_i3, tolerance):
     if (measured_i3.getNumberMolecules() == 0):
         return [0, truth_i3.getNumberMolecules()]
     
-    noise_locs = 0
-    total_locs = 0
-    for i in range(truth_i3.getNumberFrames()):
-        t_locs = truth_i3.getMoleculesInFrame(i+1)
-        m_locs = measured_i3.getMoleculesInFrame(i+1, good_only = False)
-        
-        dist = utilC.peakToPeakDist(m_locs['xc'], m_locs['yc'], t_locs['xc'], t_locs['yc'])
-
-        noise_locs += numpy.count_nonzero((dist > tolerance))
-        total_locs += dist.size
-
-    return [noise_locs, total_locs]
+    [t_data, m_data] = matchLocalizations.readTruthAndMeasured(truth_i3, measured_i3)
+    [dist, index] = matchLocalizations.nearestInFrame(m_data, t_data, max_distance = tolerance)
+    return [numpy.count_nonzero((dist > tolerance)), dist.size]
 
 
 if (__name__ == "__main__"):
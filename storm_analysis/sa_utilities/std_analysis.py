@@ -10,7 +10,7 @@ import os
 
 from xml.etree import ElementTree
 
-import storm_analysis.sa_utilities.apply_drift_correction_c as applyDriftCorrectionC
+import storm_analysis.sa_utilities.apply_drift_correction as applyDriftCorrection
 import storm_analysis.sa_utilities.avemlist_c as avemlistC
 import storm_analysis.sa_utilities.fitz_c as fitzC
 import storm_analysis.sa_utilities.tracker_c as trackerC
@@ -23,11 +23,15 @@ def averaging(mol_list_filename, ave_list_filename):
     """
     avemlistC.avemlist(mol_list_filename, ave_list_filename)
 
-def driftCorrection(list_files, parameters):
+def driftCorrection(list_files, parameters, drift_name = None):
     """
     Performs drift correction.
+
+    drift_name - The name of the drift file, the default is based
+                 on the name of the first file in list_files.
     """
-    drift_name = list_files[0][:-9] + "drift.txt"
+    if drift_name is None:
+        drift_name = list_files[0][:-9] + "drift.txt"
 
     # Check if we have been asked not to do z drift correction.
     # The default is to do the correction.
@@ -51,7 +55,7 @@ def driftCorrection(list_files, parameters):
 
     if (os.path.exists(drift_name)):
         for list_file in list_files:
-            applyDriftCorrectionC.applyDriftCorrection(list_file, drift_name)
+            applyDriftCorrection.applyDriftCorrection(list_file, drift_name)
 
 def peakFinding(find_peaks, movie_reader, data_writer, parameters):
     """
@@ -121,6 +125,9 @@ def peakFinding(find_peaks, movie_reader, data_writer, parameters):
         find_peaks.cleanUp()
         return False
 
+    finally:
+        movie_reader.close()
+
 def standardAnalysis(find_peaks, movie_reader, data_writer, parameters):
     """
     Perform standard analysis.
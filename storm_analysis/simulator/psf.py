@@ -13,6 +13,7 @@ import numpy
 import pickle
 import random
 
+import storm_analysis.sa_library.lru_cache as lruCache
 import storm_analysis.spliner.spline_to_psf as splineToPSF
 
 import storm_analysis.simulator.draw_gaussians_c as dg
@@ -70,11 +71,14 @@ class PupilFunction(PSF):
     PSF using the pupil function approach.
     """
     def __init__(self, sim_fp, x_size, y_size, i3_data, nm_per_pixel, zmn, wavelength = pf_wavelength,
-                 refractive_index = pf_refractive_index, numerical_aperture = pf_numerical_aperture):
+                 refractive_index = pf_refractive_index, numerical_aperture = pf_numerical_aperture,
+                 cache_size = 2000):
         """
         zmn is a list of lists containing the zernike mode terms, e.g.
             [[1.3, 2, 2]] for pure astigmatism.
         wavelength is the mean emission wavelength in nm.
+        cache_size is the number of PSFs to cache. Emitters usually appear in
+            many frames at the same position so they can re-use the PSF.
         """
         PSF.__init__(self, sim_fp, x_size, y_size, i3_data, nm_per_pixel)
         self.saveJSON({"psf" : {"class" : "PupilFunction",
@@ -90,6 +94,7 @@ class PupilFunction(PSF):
                                       refractive_index,
                                       numerical_aperture)
         self.pf = self.geo.createFromZernike(1.0, zmn)
+        self.psf_cache = lruCache.LRUCache(max_size = cache_size)
         self.psf_size = self.geo.r.shape[0]
 
         if ((self.psf_size%2)==0):
@@ -122,15 +127,22 @@ class PupilFunction(PSF):
             
             if (ix >= 0.0) and (ix < self.x_size) and (iy >= 0.0) and (iy < self.y_size):
 
-                # Shift to the desired z value.
-                defocused = self.geo.changeFocus(self.pf, z[i])
+                key = (dx[i], dy[i], z[i])
+                psf = self.psf_cache.get(key)
+                if psf is None:
 
-                # Translate to the correct sub-pixel position.
-                #translated = defocused
-                translated = self.geo.translatePf(defocused, dx[i], dy[i])
+                    # Shift to the desired z value.
+                    defocused = self.geo.changeFocus(self.pf, z[i])
 
-                # Get real-space intensity.
-                psf = pupilMath.intensity(pupilMath.toRealSpace(translated)) * a[i]
+                    # Translate to the correct sub-pixel position.
+                    #translated = defocused
+                    translated = self.geo.translatePf(defocused, dx[i], dy[i])
+
+                    # Get real-space intensity.
+                    psf = pupilMath.intensity(pupilMath.toRealSpace(translated))
+                    self.psf_cache.put(key, psf)
+
+                psf = psf * a[i]
                 i3_data['h'][i] = numpy.max(psf)
                 
                 image[ix:ix+self.psf_size,iy:iy+self.psf_size] += psf
@@ -138,6 +150,17 @@ class PupilFunction(PSF):
         return image[self.margin:self.margin+self.x_size,self.margin:self.margin+self.y_size]
 
 
+def splineOffsetPositions(psf_size, dx, dy):
+    """
+    Returns the [y, x] positions in the spline of the PSF pixels
+    for a PSF with non-zero offsets in x, y.
+    """
+    pos = 2.0*numpy.arange(psf_size)
+    if(((psf_size+1)%2) != 0):
+        pos += 1.0
+    return [pos + 2.0*dy, pos + 2.0*dx]
+
+
 class Spline2D(splineToPSF.SplineToPSF2D):
     """
     2D spline with non-zero offsets in x, y.
@@ -153,19 +176,8 @@ class Spline2D(splineToPSF.SplineToPSF2D):
 
         dx, dy are in the range 0.0 - 1.0.
         """
-        psf = numpy.zeros((self.psf_size, self.psf_size))
-        if(((self.psf_size+1)%2) == 0):
-            for x in range(self.psf_size):
-                for y in range(self.psf_size):
-                    psf[y,x] = self.spline.f(float(2*(y+dy)),
-                                             float(2*(x+dx)))
-        else:
-            for x in range(self.psf_size):
-                for y in range(self.psf_size):
-                    psf[y,x] = self.spline.f(float(2*(y+dy)) + 1.0,
-                                             float(2*(x+dx)) + 1.0)
-            
-        return psf
+        [ys, xs] = splineOffsetPositions(self.psf_size, dx, dy)
+        return self.c_spline.fGrid(ys, xs)
 
 
 class Spline3D(splineToPSF.SplineToPSF3D):
@@ -185,21 +197,8 @@ class Spline3D(splineToPSF.SplineToPSF3D):
         """
         scaled_z = self.getScaledZ(z_value)
                 
-        psf = numpy.zeros((self.psf_size, self.psf_size))
-        if(((self.psf_size+1)%2) == 0):
-            for x in range(self.psf_size):
-                for y in range(self.psf_size):
-                    psf[y,x] = self.spline.f(scaled_z,
-                                             float(2*(y+dy)),
-                                             float(2*(x+dx)))
-        else:
-            for x in range(self.psf_size):
-                for y in range(self.psf_size):
-                    psf[y,x] = self.spline.f(scaled_z,
-                                             float(2*(y+dy)) + 1.0,
-                                             float(2*(x+dx)) + 1.0)
-            
-        return psf
+        [ys, xs] = splineOffsetPositions(self.psf_size, dx, dy)
+        return self.c_spline.fGrid(scaled_z, ys, xs)
 
     
 class Spline(PSF):
@@ -10,11 +10,21 @@ and Keith A. Lidke, Optics Express 2013.
 Note: Tested against Pupil Function and PSF FFT with 
       storm_analysis/diagnostics/cramer_rao/
 
+CRStack holds the (normalized) PSF and it's derivatives for a range
+of z values. This is all that is needed to calculate the bounds for
+any background and number of photons, so the stacks can be cached
+on disk (keyed by a hash of the PSF file) and the bounds for a grid
+of z, background and photon values are calculated in one call.
+
 Hazen 02/17
 """
+import hashlib
 import numpy
+import os
 import pickle
 
+import storm_analysis.spliner.cubic_spline_c as cubicSplineC
+
 import storm_analysis.spliner.spline3D as spline3D
 
 # FIXME: Also handle 2D splines.
@@ -29,6 +39,7 @@ class CRPSFObject(object):
     def __init__(self, psf_filename = None, pixel_size = None, **kwds):
         super(CRPSFObject, self).__init__(**kwds)
         self.pixel_size = pixel_size
+        self.psf_filename = psf_filename
         
         # Get normalization constant (if any).
         with open(psf_filename, 'rb') as fp:
@@ -45,6 +56,21 @@ class CRPSFObject(object):
         This useful for C library based implementations.
         """
         pass
+
+    def getPSFAndDerivatives(self, z_values):
+        """
+        Returns [psfs, dxs, dys, dzs], (n_z, y, x) arrays of the PSF and
+        it's derivatives at each of the z values (in nanometers).
+
+        Sub-classes should override this if they can do it faster.
+        """
+        stacks = [[], [], [], []]
+        for z_value in z_values:
+            stacks[0].append(self.getPSF(z_value))
+            stacks[1].append(self.getDx(z_value))
+            stacks[2].append(self.getDy(z_value))
+            stacks[3].append(self.getDz(z_value))
+        return [numpy.array(elt) for elt in stacks]
     
 
 class CRSplineToPSF3D(CRPSFObject):
@@ -66,6 +92,15 @@ class CRSplineToPSF3D(CRPSFObject):
         self.delta_xy = 0.5*self.pixel_size # Splines are 2x up-sampled.
         self.delta_z = (self.getZMax() - self.getZMin())/float(self.spline.getSize())
 
+        # The C spline, for calculating the PSF and it's derivatives in
+        # a single call for each z value.
+        self.c_spline = None
+
+    def cleanup(self):
+        if self.c_spline is not None:
+            self.c_spline.cleanup()
+            self.c_spline = None
+
     def getDeltaXY(self):
         """
         Return delta XY scaling term (in nanometers).
@@ -96,6 +131,29 @@ class CRSplineToPSF3D(CRPSFObject):
     def getPSF(self, z_value):
         return self.getSplineVals(self.spline.f, z_value)
 
+    def getPSFAndDerivatives(self, z_values):
+        """
+        Same as the Python getSplineVals() but using the C spline to
+        calculate the PSF and all of it's derivatives on the grid at once.
+        """
+        if self.c_spline is None:
+            self.c_spline = cubicSplineC.CSpline3D(self.spline)
+
+        vals_size = int((self.spline.getSize() - 1)/2)
+        pos = 2.0*numpy.arange(vals_size)
+        if((vals_size%2) == 1):
+            pos += 1.0
+
+        stacks = [[], [], [], []]
+        for z_value in z_values:
+            scaled_z = float(self.spline.getSize()) * (z_value - self.zmin) / (self.zmax - self.zmin)
+            [f, dxf, dyf, dzf] = self.c_spline.dfGrid(scaled_z, pos, pos)
+            stacks[0].append(f)
+            stacks[1].append(dxf)
+            stacks[2].append(dyf)
+            stacks[3].append(dzf)
+        return [numpy.array(elt) for elt in stacks]
+
     def getSplineVals(self, spline_method, z_value):
         """
         Return the spline values of a given method such as:
@@ -138,6 +196,73 @@ class CRSplineToPSF3D(CRPSFObject):
         return self.zmin
 
     
+class CRStack(object):
+    """
+    The normalized PSF and it's (photon independent) derivatives at
+    different z values, as used in calcCRBound3D().
+    """
+    def __init__(self, cr_psf_object = None, z_values = None, data = None, **kwds):
+        """
+        Either cr_psf_object and z_values (in nanometers), or data, a
+        dictionary as returned by getData().
+        """
+        super(CRStack, self).__init__(**kwds)
+
+        if data is not None:
+            self.drvs = data["drvs"]
+            self.z_values = data["z_values"]
+            return
+
+        self.z_values = numpy.array(z_values, dtype = numpy.float64)
+        [psfs, dxs, dys, dzs] = cr_psf_object.getPSFAndDerivatives(self.z_values)
+
+        # Normalize to unity & multiply by normalization constant, see calcCRBound3D().
+        psf_norm = cr_psf_object.getNormalization()/numpy.sum(psfs, axis = (1,2))
+
+        # The Fisher matrix terms are [h, x, y, z, bg]. The derivatives
+        # for x, y and z are missing the photons term.
+        n_z = self.z_values.size
+        self.drvs = numpy.zeros((n_z, 5, psfs[0].size))
+        self.drvs[:,0,:] = (psfs * psf_norm[:,None,None]).reshape(n_z, -1)
+        self.drvs[:,1,:] = (-dxs * psf_norm[:,None,None] / cr_psf_object.getDeltaXY()).reshape(n_z, -1)
+        self.drvs[:,2,:] = (-dys * psf_norm[:,None,None] / cr_psf_object.getDeltaXY()).reshape(n_z, -1)
+        self.drvs[:,3,:] = (dzs * psf_norm[:,None,None] / cr_psf_object.getDeltaZ()).reshape(n_z, -1)
+        self.drvs[:,4,:] = 1.0
+
+    def calcCRBounds(self, backgrounds, photons):
+        """
+        Calculate the Cramer-Rao bounds (variances) for all the combinations
+        of z value, background and photons.
+
+        Returns a (n_z, n_backgrounds, n_photons, 5) array, the last axis
+        is [h, x, y, z, bg] as with calcCRBound3D().
+        """
+        backgrounds = numpy.atleast_1d(numpy.asarray(backgrounds, dtype = numpy.float64))
+        photons = numpy.atleast_1d(numpy.asarray(photons, dtype = numpy.float64))
+
+        # Products of the derivatives, (n_z, 5, 5, n_pixels).
+        d_prods = self.drvs[:,:,None,:] * self.drvs[:,None,:,:]
+
+        # Photon scaling of the x, y and z derivatives.
+        scale = numpy.ones((photons.size, 5))
+        scale[:,1:4] = photons[:,None]
+        scale = scale[:,:,None] * scale[:,None,:]
+
+        crlbs = numpy.zeros((self.z_values.size, backgrounds.size, photons.size, 5))
+        for i, background in enumerate(backgrounds):
+            psf_inv = 1.0/(self.drvs[:,None,0,:] * photons[None,:,None] + background)
+            fmat = numpy.einsum("zklp,znp->znkl", d_prods, psf_inv, optimize = True) * scale[None,:,:,:]
+            crlbs[:,i,:,:] = numpy.diagonal(numpy.linalg.inv(fmat), axis1 = 2, axis2 = 3)
+
+        return crlbs
+
+    def getData(self):
+        return {"drvs" : self.drvs, "z_values" : self.z_values}
+
+    def getZValues(self):
+        return self.z_values
+
+    
 class CRBound3D(object):
     """
     Class for calculating a 3D Cramer-Rao bounds given a spline.
@@ -208,6 +333,49 @@ def calcCRBound3D(cr_psf_object, background, photons, z_value):
         
     return crlb
 
+
+def crStackKey(cr_psf_object, z_values):
+    """
+    Returns a key for a CRStack, this is a hash of the PSF file and the
+    other parameters that determine the stack.
+    """
+    hasher = hashlib.sha1()
+    with open(cr_psf_object.psf_filename, "rb") as fp:
+        hasher.update(fp.read())
+    hasher.update(str([type(cr_psf_object).__name__,
+                       cr_psf_object.pixel_size,
+                       cr_psf_object.getDeltaXY(),
+                       cr_psf_object.getDeltaZ()]).encode())
+    hasher.update(numpy.ascontiguousarray(z_values, dtype = numpy.float64).tobytes())
+    return hasher.hexdigest()
+
+def loadCRStack(cr_psf_object, z_values, cache_dir = None):
+    """
+    Returns a CRStack, loaded from cache_dir if it is available there,
+    otherwise it is calculated and (if cache_dir is not None) saved.
+    """
+    if cache_dir is None:
+        return CRStack(cr_psf_object = cr_psf_object, z_values = z_values)
+
+    filename = os.path.join(cache_dir, "cr_" + crStackKey(cr_psf_object, z_values) + ".npz")
+    if os.path.exists(filename):
+        with numpy.load(filename) as data:
+            return CRStack(data = dict(data))
+
+    cr_stack = CRStack(cr_psf_object = cr_psf_object, z_values = z_values)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Write to a temporary file first so that other processes never
+    # see a partially written file.
+    tmp_name = filename + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_name, "wb") as fp:
+        numpy.savez(fp, **cr_stack.getData())
+    os.replace(tmp_name, filename)
+
+    return cr_stack
+
     
 if (__name__ == "__main__"):
 
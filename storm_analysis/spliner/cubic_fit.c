@@ -25,6 +25,7 @@ void cfAddPeak(fitData *fit_data)
 {
   int j,k,l,m,psx,psy,x_start,y_start;
   double bg,height,xd,yd,zd;
+  double tv[4];
   peakData *peak;
   splinePeak *spline_peak;
   splineFit *spline_fit;
@@ -83,7 +84,19 @@ void cfAddPeak(fitData *fit_data)
    *        calculating derivatives. A possible optimization would be to
    *        have a flag so that this does not happen.
    */
-  if(spline_fit->fit_type == S3D){
+  if(spline_fit->table != NULL){
+    cfTableDelta(spline_fit, spline_peak);
+    for(j=0;j<psy;j++){
+      for(k=0;k<psx;k++){
+	cfTableValues(spline_fit, spline_peak, j, k, tv);
+	spline_peak->peak_values[j*psx+k] = tv[0];
+      }
+    }
+  }
+  else if(spline_fit->spline_data->use_float){
+    cfSplineAOI(fit_data, spline_peak->peak_values, NULL, NULL, NULL);
+  }
+  else if(spline_fit->fit_type == S3D){
     computeDelta3D(spline_fit->spline_data, zd, yd, xd);
     for(j=0;j<psy;j++){
       for(k=0;k<psx;k++){
@@ -129,7 +142,7 @@ void cfCalcJH2D(fitData *fit_data, double *jacobian, double *hessian)
   int i,j,k,l,m,n;
   int x_start, y_start;
   double height,fi,t1,t2,xi;
-  double jt[4];
+  double jt[4],tv[3];
   peakData *peak;
   splinePeak *spline_peak;
   splineFit *spline_fit;
@@ -149,7 +162,14 @@ void cfCalcJH2D(fitData *fit_data, double *jacobian, double *hessian)
   }
 
   /* Calculate values x, y, xx, xy, yy, etc. terms for a 2D spline. */
-  computeDelta2D(spline_fit->spline_data, spline_peak->y_delta, spline_peak->x_delta);
+  if(spline_fit->table == NULL){
+    if(spline_fit->spline_data->use_float){
+      cfSplineAOI(fit_data, NULL, spline_fit->aoi_dxf, spline_fit->aoi_dyf, NULL);
+    }
+    else{
+      computeDelta2D(spline_fit->spline_data, spline_peak->y_delta, spline_peak->x_delta);
+    }
+  }
 
   /*
    * Calculate jacobian and hessian.
@@ -167,8 +187,19 @@ void cfCalcJH2D(fitData *fit_data, double *jacobian, double *hessian)
        * this is 1.0/(spline up-sampling, i.e. 2x).
        */
       jt[0] = spline_peak->peak_values[j*peak->size_x + k];
-      jt[1] = -0.5*height*dxfAt2D(spline_fit->spline_data,2*j+y_start,2*k+x_start);
-      jt[2] = -0.5*height*dyfAt2D(spline_fit->spline_data,2*j+y_start,2*k+x_start);
+      if(spline_fit->table != NULL){
+	cfTableValues(spline_fit, spline_peak, j, k, tv);
+	jt[1] = -0.5*height*tv[1];
+	jt[2] = -0.5*height*tv[2];
+      }
+      else if(spline_fit->spline_data->use_float){
+	jt[1] = -0.5*height*spline_fit->aoi_dxf[j*peak->size_x + k];
+	jt[2] = -0.5*height*spline_fit->aoi_dyf[j*peak->size_x + k];
+      }
+      else{
+	jt[1] = -0.5*height*dxfAt2D(spline_fit->spline_data,2*j+y_start,2*k+x_start);
+	jt[2] = -0.5*height*dyfAt2D(spline_fit->spline_data,2*j+y_start,2*k+x_start);
+      }
       jt[3] = 1.0;
 
       /* Calculate jacobian. */
@@ -203,7 +234,7 @@ void cfCalcJH3D(fitData *fit_data, double *jacobian, double *hessian)
   int i,j,k,l,m,n,zi;
   int x_start, y_start;
   double height,fi,t1,t2,xi;
-  double jt[5];
+  double jt[5],tv[4];
   peakData *peak;
   splinePeak *spline_peak;
   splineFit *spline_fit;
@@ -225,7 +256,14 @@ void cfCalcJH3D(fitData *fit_data, double *jacobian, double *hessian)
   }
 
   /* Calculate values x, y, z, xx, xy, yy, etc. terms for a 3D spline. */
-  computeDelta3D(spline_fit->spline_data, spline_peak->z_delta, spline_peak->y_delta, spline_peak->x_delta);
+  if(spline_fit->table == NULL){
+    if(spline_fit->spline_data->use_float){
+      cfSplineAOI(fit_data, NULL, spline_fit->aoi_dxf, spline_fit->aoi_dyf, spline_fit->aoi_dzf);
+    }
+    else{
+      computeDelta3D(spline_fit->spline_data, spline_peak->z_delta, spline_peak->y_delta, spline_peak->x_delta);
+    }
+  }
 
   /*
    * Calculate jacobian and hessian.
@@ -243,9 +281,22 @@ void cfCalcJH3D(fitData *fit_data, double *jacobian, double *hessian)
        * this is 1.0/(spline up-sampling, i.e. 2x).
        */
       jt[0] = spline_peak->peak_values[j*peak->size_x + k];
-      jt[1] = -0.5*height*dxfAt3D(spline_fit->spline_data,zi,2*j+y_start,2*k+x_start);
-      jt[2] = -0.5*height*dyfAt3D(spline_fit->spline_data,zi,2*j+y_start,2*k+x_start);
-      jt[3] = height*dzfAt3D(spline_fit->spline_data,zi,2*j+y_start,2*k+x_start);
+      if(spline_fit->table != NULL){
+	cfTableValues(spline_fit, spline_peak, j, k, tv);
+	jt[1] = -0.5*height*tv[1];
+	jt[2] = -0.5*height*tv[2];
+	jt[3] = height*tv[3];
+      }
+      else if(spline_fit->spline_data->use_float){
+	jt[1] = -0.5*height*spline_fit->aoi_dxf[j*peak->size_x + k];
+	jt[2] = -0.5*height*spline_fit->aoi_dyf[j*peak->size_x + k];
+	jt[3] = height*spline_fit->aoi_dzf[j*peak->size_x + k];
+      }
+      else{
+	jt[1] = -0.5*height*dxfAt3D(spline_fit->spline_data,zi,2*j+y_start,2*k+x_start);
+	jt[2] = -0.5*height*dyfAt3D(spline_fit->spline_data,zi,2*j+y_start,2*k+x_start);
+	jt[3] = height*dzfAt3D(spline_fit->spline_data,zi,2*j+y_start,2*k+x_start);
+      }
       jt[4] = 1.0;
       
       /* Calculate jacobian. */
@@ -293,6 +344,15 @@ void cfCleanup(fitData *fit_data)
   free(spline_peak);
     
   spline_fit = (splineFit *)fit_data->fit_model;
+  if(spline_fit->table != NULL){
+    free(spline_fit->table);
+  }
+  free(spline_fit->aoi_f);
+  free(spline_fit->aoi_xs);
+  free(spline_fit->aoi_ys);
+  free(spline_fit->aoi_dxf);
+  free(spline_fit->aoi_dyf);
+  free(spline_fit->aoi_dzf);
   splineCleanup(spline_fit->spline_data);
 
   mFitCleanup(fit_data);
@@ -328,6 +388,14 @@ void cfCopyPeak(peakData *original, peakData *copy)
   spline_copy->y_delta = spline_original->y_delta;
   spline_copy->z_delta = spline_original->z_delta;
 
+  spline_copy->table_x = spline_original->table_x;
+  spline_copy->table_y = spline_original->table_y;
+  spline_copy->table_z = spline_original->table_z;
+
+  spline_copy->table_wx = spline_original->table_wx;
+  spline_copy->table_wy = spline_original->table_wy;
+  spline_copy->table_wz = spline_original->table_wz;
+
   for(i=0;i<(copy->size_x*copy->size_y);i++){
     spline_copy->peak_values[i] = spline_original->peak_values[i];
   }
@@ -362,6 +430,7 @@ fitData* cfInitialize(splineData *spline_data, double *scmos_calibration, double
   ((splineFit *)fit_data->fit_model)->fit_type = spline_data->type;
   ((splineFit *)fit_data->fit_model)->spline_size_z = spline_data->zsize;
   ((splineFit *)fit_data->fit_model)->spline_data = spline_data;
+  ((splineFit *)fit_data->fit_model)->table = NULL;
 
   /*
    * Calculate offset to the spline center as XCENTER and YCENTER
@@ -390,6 +459,14 @@ fitData* cfInitialize(splineData *spline_data, double *scmos_calibration, double
    */
   ((splineFit *)fit_data->fit_model)->spline_size_x = sx;
   ((splineFit *)fit_data->fit_model)->spline_size_y = sy;
+
+  /* Allocate storage for single precision AOI evaluation. */
+  ((splineFit *)fit_data->fit_model)->aoi_f = (double *)malloc(sizeof(double)*sx*sy);
+  ((splineFit *)fit_data->fit_model)->aoi_xs = (double *)malloc(sizeof(double)*sx);
+  ((splineFit *)fit_data->fit_model)->aoi_ys = (double *)malloc(sizeof(double)*sy);
+  ((splineFit *)fit_data->fit_model)->aoi_dxf = (double *)malloc(sizeof(double)*sx*sy);
+  ((splineFit *)fit_data->fit_model)->aoi_dyf = (double *)malloc(sizeof(double)*sx*sy);
+  ((splineFit *)fit_data->fit_model)->aoi_dzf = (double *)malloc(sizeof(double)*sx*sy);
   
   /* Allocate storage for the working peak. */
   fit_data->working_peak->peak_model = (splinePeak *)malloc(sizeof(splinePeak));
@@ -437,6 +514,108 @@ void cfInitialize3D(fitData *fit_data)
 }
 
 
+/*
+ * cfInitializeTable()
+ *
+ * Pre-compute the spline and its derivatives on a regular lattice. Once
+ * this is done the peak shapes and derivatives are calculated by linear
+ * interpolation from the lattice instead of evaluating the spline
+ * polynomials. This is a lot faster, at the cost of some accuracy and
+ * (possibly) a lot of memory.
+ *
+ * This should be called after cfInitialize2D() or cfInitialize3D().
+ *
+ * fit_data - pointer to a fitData structure.
+ * n_xy - Number of lattice points per spline unit in x and y.
+ * n_z - Number of lattice points per spline unit in z (ignored for 2D).
+ */
+void cfInitializeTable(fitData *fit_data, int n_xy, int n_z)
+{
+  int i,j,l,n_pts;
+  double *dxf,*dyf,*dzf,*f,*xs,*ys;
+  double *table;
+  splineFit *spline_fit;
+  splineData *spline_data;
+
+  spline_fit = (splineFit *)fit_data->fit_model;
+  spline_data = spline_fit->spline_data;
+
+  if(spline_fit->table != NULL){
+    free(spline_fit->table);
+    spline_fit->table = NULL;
+  }
+
+  if(spline_fit->fit_type != S3D){
+    n_z = 1;
+  }
+  if((n_xy < 1)||(n_z < 1)){
+    return;
+  }
+
+  spline_fit->table_n_xy = n_xy;
+  spline_fit->table_n_z = n_z;
+  spline_fit->table_size_x = spline_data->xsize*n_xy + 1;
+  spline_fit->table_size_y = spline_data->ysize*n_xy + 1;
+  if(spline_fit->fit_type == S3D){
+    spline_fit->table_size_z = spline_data->zsize*n_z + 1;
+    spline_fit->table_stride = 4;
+  }
+  else{
+    spline_fit->table_size_z = 1;
+    spline_fit->table_stride = 3;
+  }
+
+  n_pts = spline_fit->table_size_x*spline_fit->table_size_y;
+  table = (double *)malloc(sizeof(double)*n_pts*spline_fit->table_size_z*spline_fit->table_stride);
+  if(table == NULL){
+    printf("cfInitializeTable: failed to allocate spline table.\n");
+    return;
+  }
+
+  xs = (double *)malloc(sizeof(double)*spline_fit->table_size_x);
+  ys = (double *)malloc(sizeof(double)*spline_fit->table_size_y);
+  f = (double *)malloc(sizeof(double)*n_pts);
+  dxf = (double *)malloc(sizeof(double)*n_pts);
+  dyf = (double *)malloc(sizeof(double)*n_pts);
+  dzf = (double *)malloc(sizeof(double)*n_pts);
+
+  for(i=0;i<spline_fit->table_size_x;i++){
+    xs[i] = ((double)i)/((double)n_xy);
+  }
+  for(i=0;i<spline_fit->table_size_y;i++){
+    ys[i] = ((double)i)/((double)n_xy);
+  }
+
+  /* The table is z major with the values for each lattice point stored together. */
+  for(i=0;i<spline_fit->table_size_z;i++){
+    if(spline_fit->fit_type == S3D){
+      dfGrid3D(spline_data, f, dxf, dyf, dzf, ((double)i)/((double)n_z), ys, xs, spline_fit->table_size_y, spline_fit->table_size_x);
+    }
+    else{
+      dfGrid2D(spline_data, f, dxf, dyf, ys, xs, spline_fit->table_size_y, spline_fit->table_size_x);
+    }
+    for(j=0;j<n_pts;j++){
+      l = (i*n_pts + j)*spline_fit->table_stride;
+      table[l] = f[j];
+      table[l+1] = dxf[j];
+      table[l+2] = dyf[j];
+      if(spline_fit->fit_type == S3D){
+	table[l+3] = dzf[j];
+      }
+    }
+  }
+
+  free(xs);
+  free(ys);
+  free(f);
+  free(dxf);
+  free(dyf);
+  free(dzf);
+
+  spline_fit->table = table;
+}
+
+
 /*
  * cfNewPeaks
  *
@@ -525,6 +704,84 @@ void cfNewPeaks(fitData *fit_data, double *peak_params, int n_peaks)
 }
 
 
+/*
+ * cfSplineAOI()
+ *
+ * Evaluate the spline (and / or it's derivatives) for all the pixels
+ * of the working peak at once using the grid functions in the
+ * cubic_spline library. This is used for single precision fitting.
+ *
+ * The cell indices are range checked in the same way as in fAt2D/3D()
+ * so the results are the same as for double precision fitting.
+ *
+ * fit_data - pointer to a fitData structure.
+ * f - Storage for the spline values, or NULL.
+ * dxf - Storage for the derivative in x, or NULL to only calculate f.
+ * dyf - Storage for the derivative in y.
+ * dzf - Storage for the derivative in z (3D only).
+ */
+void cfSplineAOI(fitData *fit_data, double *f, double *dxf, double *dyf, double *dzf)
+{
+  int i,xc,yc,zi;
+  double z;
+  peakData *peak;
+  splinePeak *spline_peak;
+  splineFit *spline_fit;
+  splineData *spline_data;
+
+  peak = fit_data->working_peak;
+  spline_peak = (splinePeak *)peak->peak_model;
+  spline_fit = (splineFit *)fit_data->fit_model;
+  spline_data = spline_fit->spline_data;
+
+  if(f == NULL){
+    f = spline_fit->aoi_f;
+  }
+  
+  for(i=0;i<peak->size_x;i++){
+    xc = 2*i + spline_peak->x_start;
+    if(xc >= spline_data->xsize){
+      xc = spline_data->xsize - 1;
+    }
+    spline_fit->aoi_xs[i] = (double)xc + spline_peak->x_delta;
+  }
+  for(i=0;i<peak->size_y;i++){
+    yc = 2*i + spline_peak->y_start;
+    if(yc >= spline_data->ysize){
+      yc = spline_data->ysize - 1;
+    }
+    spline_fit->aoi_ys[i] = (double)yc + spline_peak->y_delta;
+  }
+
+  if(spline_fit->fit_type == S3D){
+    zi = spline_peak->zi;
+    if(zi < 0){
+      zi = 0;
+    }
+    if(zi >= spline_data->zsize){
+      zi = spline_data->zsize - 1;
+    }
+    z = spline_peak->z_delta;
+    z = (z < 0.0) ? 0.0 : ((z > 1.0) ? 1.0 : z);
+    z += (double)zi;
+    if(dxf == NULL){
+      fGrid3D(spline_data, f, z, spline_fit->aoi_ys, spline_fit->aoi_xs, peak->size_y, peak->size_x);
+    }
+    else{
+      dfGrid3D(spline_data, f, dxf, dyf, dzf, z, spline_fit->aoi_ys, spline_fit->aoi_xs, peak->size_y, peak->size_x);
+    }
+  }
+  else{
+    if(dxf == NULL){
+      fGrid2D(spline_data, f, spline_fit->aoi_ys, spline_fit->aoi_xs, peak->size_y, peak->size_x);
+    }
+    else{
+      dfGrid2D(spline_data, f, dxf, dyf, spline_fit->aoi_ys, spline_fit->aoi_xs, peak->size_y, peak->size_x);
+    }
+  }
+}
+
+
 /*
  * cfSubtractPeak()
  *
@@ -557,6 +814,120 @@ void cfSubtractPeak(fitData *fit_data)
 }
 
 
+/*
+ * cfTableDelta()
+ *
+ * Calculate the lattice locations and interpolation weights for a
+ * peak. These are the same for each unit cell of the spline so,
+ * as with computeDelta2D/3D(), they only need to be calculated once
+ * per peak.
+ *
+ * spline_fit - pointer to a splineFit structure.
+ * spline_peak - pointer to a splinePeak structure.
+ */
+void cfTableDelta(splineFit *spline_fit, splinePeak *spline_peak)
+{
+  int zi;
+  double t,zd;
+
+  t = spline_peak->x_delta*(double)spline_fit->table_n_xy;
+  t = (t < 0.0) ? 0.0 : t;
+  spline_peak->table_x = (int)t;
+  if(spline_peak->table_x >= spline_fit->table_n_xy){
+    spline_peak->table_x = spline_fit->table_n_xy - 1;
+  }
+  spline_peak->table_wx = t - (double)spline_peak->table_x;
+
+  t = spline_peak->y_delta*(double)spline_fit->table_n_xy;
+  t = (t < 0.0) ? 0.0 : t;
+  spline_peak->table_y = (int)t;
+  if(spline_peak->table_y >= spline_fit->table_n_xy){
+    spline_peak->table_y = spline_fit->table_n_xy - 1;
+  }
+  spline_peak->table_wy = t - (double)spline_peak->table_y;
+
+  spline_peak->table_z = 0;
+  spline_peak->table_wz = 0.0;
+  if(spline_fit->fit_type == S3D){
+    zi = spline_peak->zi;
+    zd = spline_peak->z_delta;
+    if(zi < 0){
+      zi = 0;
+      zd = 0.0;
+    }
+    if(zi >= spline_fit->spline_size_z){
+      zi = spline_fit->spline_size_z - 1;
+      zd = 1.0;
+    }
+    t = zd*(double)spline_fit->table_n_z;
+    t = (t < 0.0) ? 0.0 : t;
+    spline_peak->table_z = (int)t;
+    if(spline_peak->table_z >= spline_fit->table_n_z){
+      spline_peak->table_z = spline_fit->table_n_z - 1;
+    }
+    spline_peak->table_wz = t - (double)spline_peak->table_z;
+    spline_peak->table_z += zi*spline_fit->table_n_z;
+  }
+}
+
+
+/*
+ * cfTableValues()
+ *
+ * Calculate the spline value and derivatives for a peak pixel by
+ * interpolating the table. cfTableDelta() must have already been
+ * called for this peak.
+ *
+ * spline_fit - pointer to a splineFit structure.
+ * spline_peak - pointer to a splinePeak structure.
+ * j - Peak pixel y index.
+ * k - Peak pixel x index.
+ * values - Storage for the result, [f, dxf, dyf] (2D) or [f, dxf, dyf, dzf] (3D).
+ */
+void cfTableValues(splineFit *spline_fit, splinePeak *spline_peak, int j, int k, double *values)
+{
+  int i,n,sx,sxy,tx,ty;
+  double w00,w01,w10,w11,wx,wy,wz;
+  double *t0,*t1;
+
+  n = spline_fit->table_stride;
+  sx = spline_fit->table_size_x*n;
+  sxy = spline_fit->table_size_y*sx;
+  
+  /* Same range checking as fAt2D/3D(). */
+  tx = 2*k + spline_peak->x_start;
+  if(tx >= spline_fit->spline_data->xsize){
+    tx = spline_fit->spline_data->xsize - 1;
+  }
+  ty = 2*j + spline_peak->y_start;
+  if(ty >= spline_fit->spline_data->ysize){
+    ty = spline_fit->spline_data->ysize - 1;
+  }
+  tx = tx*spline_fit->table_n_xy + spline_peak->table_x;
+  ty = ty*spline_fit->table_n_xy + spline_peak->table_y;
+
+  wx = spline_peak->table_wx;
+  wy = spline_peak->table_wy;
+  w00 = (1.0 - wy)*(1.0 - wx);
+  w01 = (1.0 - wy)*wx;
+  w10 = wy*(1.0 - wx);
+  w11 = wy*wx;
+
+  t0 = &(spline_fit->table[spline_peak->table_z*sxy + ty*sx + tx*n]);
+  for(i=0;i<n;i++){
+    values[i] = w00*t0[i] + w01*t0[n+i] + w10*t0[sx+i] + w11*t0[sx+n+i];
+  }
+
+  if(spline_fit->fit_type == S3D){
+    wz = spline_peak->table_wz;
+    t1 = t0 + sxy;
+    for(i=0;i<n;i++){
+      values[i] = (1.0 - wz)*values[i] + wz*(w00*t1[i] + w01*t1[n+i] + w10*t1[sx+i] + w11*t1[sx+n+i]);
+    }
+  }
+}
+
+
 /*
  * cfUpdate()
  *
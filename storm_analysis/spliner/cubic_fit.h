@@ -21,6 +21,14 @@ typedef struct
   double x_delta;             /* Peak x delta (0.0 - 1.0). */
   double y_delta;             /* Peak y delta (0.0 - 1.0). */
   double z_delta;             /* Peak z delta (0.0 - 1.0). */
+
+  int table_x;                /* Lattice offset in x in the spline cell (table mode). */
+  int table_y;                /* Lattice offset in y in the spline cell (table mode). */
+  int table_z;                /* Lattice location in z (table mode). */
+
+  double table_wx;            /* Interpolation weight in x (table mode). */
+  double table_wy;            /* Interpolation weight in y (table mode). */
+  double table_wz;            /* Interpolation weight in z (table mode). */
   
   double *peak_values;        /* The peak shape. */
 } splinePeak;
@@ -33,7 +41,23 @@ typedef struct
   int spline_size_x;          /* The size of the spline in x (in pixels). */
   int spline_size_y;          /* The size of the spline in y (in pixels). */
   int spline_size_z;          /* The size of the spline in z. */
+
+  int table_n_xy;             /* Table lattice points per spline cell in x and y. */
+  int table_n_z;              /* Table lattice points per spline cell in z. */
+  int table_size_x;           /* Table size in x. */
+  int table_size_y;           /* Table size in y. */
+  int table_size_z;           /* Table size in z. */
+  int table_stride;           /* Values per lattice point, f, dxf, dyf (and dzf). */
   
+  double *table;              /* Pre-computed spline values (NULL if not used). */
+
+  double *aoi_f;              /* AOI spline values (single precision mode). */
+  double *aoi_xs;             /* Spline x positions of the AOI pixels (single precision mode). */
+  double *aoi_ys;             /* Spline y positions of the AOI pixels (single precision mode). */
+  double *aoi_dxf;            /* AOI derivative in x (single precision mode). */
+  double *aoi_dyf;            /* AOI derivative in y (single precision mode). */
+  double *aoi_dzf;            /* AOI derivative in z (single precision mode). */
+
   splineData *spline_data;    /* Spline data structure. */
 } splineFit;
 
@@ -47,9 +71,13 @@ void cfCopyPeak(peakData *, peakData *);
 fitData* cfInitialize(splineData *, double *, double *, double, int, int);
 void cfInitialize2D(fitData *);
 void cfInitialize3D(fitData *);
+void cfInitializeTable(fitData *, int, int);
 void cfIterateSpline(fitData *);
 void cfNewPeaks(fitData *, double *, int);
+void cfSplineAOI(fitData *, double *, double *, double *, double *);
 void cfSubtractPeak(fitData *);
+void cfTableDelta(splineFit *, splinePeak *);
+void cfTableValues(splineFit *, splinePeak *, int, int, double *);
 void cfUpdate(peakData *);
 void cfUpdate2D(fitData *, double *);
 void cfUpdate3D(fitData *, double *);
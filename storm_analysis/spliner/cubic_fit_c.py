@@ -68,13 +68,106 @@ def loadCubicFitC():
     cubic_fit.cfInitialize.restype = ctypes.POINTER(daoFitC.fitData)
     cubic_fit.cfInitialize2D.argtypes = [ctypes.c_void_p]
     cubic_fit.cfInitialize3D.argtypes = [ctypes.c_void_p]
+    cubic_fit.cfInitializeTable.argtypes = [ctypes.c_void_p,
+                                            ctypes.c_int,
+                                            ctypes.c_int]
     
     cubic_fit.cfNewPeaks.argtypes = [ctypes.c_void_p,
                                      ndpointer(dtype=numpy.float64),
                                      ctypes.c_int]
 
     return cubic_fit
-    
+
+
+def tableError(spline_fn, n_xy, n_z, n_planes = 5):
+    """
+    Estimate the (relative) error from linear interpolation of the
+    spline on a lattice with n_xy points per spline unit in x and y
+    and n_z points per spline unit in z. This is the largest difference
+    between the spline value at the lattice mid-points and the average
+    of the neighboring lattice points, divided by the spline maximum.
+
+    Returns [xy error, z error], the z error is 0.0 for 2D splines.
+    """
+    c_spline = spline_fn.c_spline
+    size = spline_fn.getSplineSize()
+
+    if (spline_fn.getType() == "2D"):
+        planes = [[]]
+    else:
+        planes = [[z] for z in numpy.linspace(0.0, size, n_planes)]
+
+    # Interpolation error in x and y.
+    pos = numpy.arange(2*size*n_xy + 1)/(2.0*n_xy)
+    [xy_err, f_max] = [0.0, 0.0]
+    for elt in planes:
+        f = c_spline.fGrid(*(elt + [pos, pos]))
+        fc = f[::2,:]
+        dx = numpy.abs(fc[:,1::2] - 0.5*(fc[:,:-1:2] + fc[:,2::2]))
+        fc = f[:,::2]
+        dy = numpy.abs(fc[1::2,:] - 0.5*(fc[:-1:2,:] + fc[2::2,:]))
+        xy_err = max(xy_err, numpy.max(dx), numpy.max(dy))
+        f_max = max(f_max, numpy.max(numpy.abs(f)))
+
+    # Interpolation error in z.
+    z_err = 0.0
+    if (spline_fn.getType() == "3D"):
+        pos = numpy.arange(2*size + 1)/2.0
+        zs = numpy.arange(2*size*n_z + 1)/(2.0*n_z)
+        f = numpy.array([c_spline.fGrid(z, pos, pos) for z in zs])
+        z_err = numpy.max(numpy.abs(f[1::2] - 0.5*(f[:-1:2] + f[2::2])))
+        f_max = max(f_max, numpy.max(numpy.abs(f)))
+
+    if (f_max > 0.0):
+        return [xy_err/f_max, z_err/f_max]
+    else:
+        return [0.0, 0.0]
+
+def tableSize(spline_fn, accuracy, memory = 256.0, verbose = True):
+    """
+    Choose the spline lattice spacing for the fitting table. This is the
+    coarsest lattice for which the (relative) interpolation error is less
+    than accuracy and that uses less than memory megabytes.
+
+    Returns [n_xy, n_z], the number of lattice points per spline unit.
+    """
+    n_values = [1, 2, 4, 8, 16, 32]
+    is_3d = (spline_fn.getType() == "3D")
+
+    # Find the coarsest lattice that meets the accuracy requirement.
+    [n_xy, n_z] = [n_values[-1], n_values[-1] if is_3d else 1]
+    for n in n_values:
+        if (tableError(spline_fn, n, 1)[0] < accuracy):
+            n_xy = n
+            break
+    if is_3d:
+        for n in n_values:
+            if (tableError(spline_fn, 1, n)[1] < accuracy):
+                n_z = n
+                break
+
+    # Reduce the lattice density if the table would be too large.
+    def tableMemory(n_xy, n_z):
+        size = spline_fn.getSplineSize()
+        if is_3d:
+            return 4*8*(size*n_z + 1)*(size*n_xy + 1)*(size*n_xy + 1)/(1024.0*1024.0)
+        else:
+            return 3*8*(size*n_xy + 1)*(size*n_xy + 1)/(1024.0*1024.0)
+
+    while (tableMemory(n_xy, n_z) > memory) and ((n_xy > 1) or (n_z > 1)):
+        if (n_xy >= n_z):
+            n_xy = int(n_xy/2)
+        else:
+            n_z = int(n_z/2)
+
+    if verbose:
+        [xy_err, z_err] = tableError(spline_fn, n_xy, n_z)
+        print("Spline table", n_xy, n_z, "{0:.1f}MB, estimated error {1:.2e} {2:.2e}".format(tableMemory(n_xy, n_z), xy_err, z_err))
+        if (max(xy_err, z_err) > accuracy):
+            print("Warning! Spline table accuracy target not met, try increasing the table memory.")
+
+    return [n_xy, n_z]
+
 
 #
 # Classes.
@@ -82,18 +175,43 @@ def loadCubicFitC():
 
 class CSplineFit(daoFitC.MultiFitterBase):
 
-    def __init__(self, spline_fn = None, **kwds):
+    def __init__(self, spline_fn = None, single_precision = False, table_accuracy = None, table_memory = None, **kwds):
+        """
+        single_precision - Evaluate the spline in single precision. The fitter
+                           uses it's own copy of the C spline for this so the
+                           spline_fn PSFs are not changed.
+        table_accuracy - If this is not None then the spline and it's derivatives 
+                         are pre-computed on a lattice with (relative) linear
+                         interpolation error less than this value.
+        table_memory - The maximum size of the lattice in megabytes.
+        """
         super(CSplineFit, self).__init__(**kwds)
+        self.c_spline = spline_fn.c_spline
+        self.own_c_spline = False
         self.spline_fn = spline_fn
+        self.table_size = None
         
         self.clib = loadCubicFitC()
 
+        if single_precision:
+            self.c_spline = type(spline_fn.c_spline)(spline_fn.spline)
+            self.c_spline.setSinglePrecision(True)
+            self.own_c_spline = True
+
+        if table_accuracy is not None:
+            if table_memory is None:
+                table_memory = 256.0
+            self.table_size = tableSize(self.spline_fn, table_accuracy, table_memory)
+
     def cleanup(self, spacing = "  ", verbose = True):
         super(CSplineFit, self).cleanup(spacing = spacing,
                                         verbose = verbose)
         if self.mfit is not None:
+            # This also frees the C spline.
             self.clib.cfCleanup(self.mfit)
             self.mfit = None
+        elif self.own_c_spline and (self.c_spline is not None):
+            self.c_spline.cleanup()
         self.c_spline = None
 
     def getGoodPeaks(self, peaks, min_width):
@@ -127,13 +245,21 @@ class CSplineFit(daoFitC.MultiFitterBase):
         """
         super(CSplineFit, self).initializeC(image)
         
-        self.mfit = self.clib.cfInitialize(self.spline_fn.getCPointer(),
+        self.mfit = self.clib.cfInitialize(self.c_spline.getCPointer(),
                                            self.scmos_cal,
                                            numpy.ascontiguousarray(self.clamp),
                                            self.default_tol,
                                            self.scmos_cal.shape[1],
                                            self.scmos_cal.shape[0])
 
+    def initializeTable(self):
+        """
+        This is called by the sub-classes after they have initialized
+        the C fitting library.
+        """
+        if self.table_size is not None:
+            self.clib.cfInitializeTable(self.mfit, self.table_size[0], self.table_size[1])
+        
     def iterate(self):
         self.clib.mFitIterateLM(self.mfit)
         #self.clib.mFitIterateOriginal(self.mfit)
@@ -167,6 +293,7 @@ class CSpline2DFit(CSplineFit):
     def initializeC(self, image):
         super(CSpline2DFit, self).initializeC(image)
         self.clib.cfInitialize2D(self.mfit)
+        self.initializeTable()
         
     def rescaleZ(self, peaks):
         return peaks
@@ -194,6 +321,7 @@ class CSpline3DFit(CSplineFit):
     def initializeC(self, image):
         super(CSpline3DFit, self).initializeC(image)
         self.clib.cfInitialize3D(self.mfit)
+        self.initializeTable()
 
     def rescaleZ(self, peaks):
         z_index = utilC.getZCenterIndex()
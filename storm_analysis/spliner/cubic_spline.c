@@ -11,6 +11,11 @@
  *
  *  3. This library is thread safe.. Pretty sure..
  *
+ *  4. The grid evaluation functions (xxGrid2D/3D) have an optional
+ *     single precision path, see splineSetSinglePrecision(). This
+ *     is written so that the compiler can vectorize it (4 floats
+ *     at a time).
+ *
  * Hazen 11/16
  *
  * 
@@ -41,7 +46,13 @@
 
 /* (Local) function declarations */
 
+int cellIndex(double, int, int *, double *);
 double dot(double *, double *, int);
+void gridEval2D(splineData *, double *, double *, double *, double *, double *, int, int);
+void gridEval2DF(splineData *, double *, double *, double *, double *, double *, int, int);
+void gridEval3D(splineData *, double *, double *, double *, double *, double, double *, double *, int, int);
+void gridEval3DF(splineData *, double *, double *, double *, double *, double, double *, double *, int, int);
+void powersF(float, float *, float *);
 
 double rangeCheckD(const char *, double, double, double);
 int rangeCheckI(const char *, int, int, int);
@@ -49,6 +60,36 @@ int rangeCheckI(const char *, int, int, int);
 /* Global variables */
 
 
+/*
+ * cellIndex()
+ *
+ * Find the cell and the delta in the cell for a position. This
+ * matches the Python version, so unlike the xxSpline2D/3D functions
+ * a position exactly at the maximum value is handled correctly.
+ *
+ * x - The position.
+ * size - The number of cells.
+ * xc - The cell index.
+ * x_delta - The delta in the cell (0.0 - 1.0).
+ *
+ * Returns 1 if the position is in range, 0 otherwise.
+ */
+int cellIndex(double x, int size, int *xc, double *x_delta)
+{
+  if((x < 0.0)||(x > (double)size)){
+    return 0;
+  }
+
+  *xc = (int)x;
+  *x_delta = x - (double)*xc;
+  if(*xc >= size){
+    *xc = size - 1;
+    *x_delta = 1.0;
+  }
+
+  return 1;
+}
+
 /*
  * computeDelta2D()
  *
@@ -134,6 +175,47 @@ void computeDelta3D(splineData *spline_data, double z_delta, double y_delta, dou
   }
 }
 
+/*
+ * dfGrid2D()
+ *
+ * Evaluate the spline and its derivatives on a grid of positions.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * f - Storage for the spline values (ny x nx).
+ * dxf - Storage for the derivative in x (ny x nx).
+ * dyf - Storage for the derivative in y (ny x nx).
+ * ys - The y positions of the grid rows.
+ * xs - The x positions of the grid columns.
+ * ny - The number of rows.
+ * nx - The number of columns.
+ */
+void dfGrid2D(splineData *spline_data, double *f, double *dxf, double *dyf, double *ys, double *xs, int ny, int nx)
+{
+  gridEval2D(spline_data, f, dxf, dyf, ys, xs, ny, nx);
+}
+
+/*
+ * dfGrid3D()
+ *
+ * Evaluate the spline and its derivatives on a grid of positions
+ * in a single z plane.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * f - Storage for the spline values (ny x nx).
+ * dxf - Storage for the derivative in x (ny x nx).
+ * dyf - Storage for the derivative in y (ny x nx).
+ * dzf - Storage for the derivative in z (ny x nx).
+ * z - The z position.
+ * ys - The y positions of the grid rows.
+ * xs - The x positions of the grid columns.
+ * ny - The number of rows.
+ * nx - The number of columns.
+ */
+void dfGrid3D(splineData *spline_data, double *f, double *dxf, double *dyf, double *dzf, double z, double *ys, double *xs, int ny, int nx)
+{
+  gridEval3D(spline_data, f, dxf, dyf, dzf, z, ys, xs, ny, nx);
+}
+
 /*
  * dot()
  *
@@ -518,6 +600,41 @@ double fAt3D(splineData *spline_data, int zc, int yc, int xc)
   return yv;
 }
 
+/*
+ * fGrid2D()
+ *
+ * Evaluate the spline on a grid of positions.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * f - Storage for the spline values (ny x nx).
+ * ys - The y positions of the grid rows.
+ * xs - The x positions of the grid columns.
+ * ny - The number of rows.
+ * nx - The number of columns.
+ */
+void fGrid2D(splineData *spline_data, double *f, double *ys, double *xs, int ny, int nx)
+{
+  gridEval2D(spline_data, f, NULL, NULL, ys, xs, ny, nx);
+}
+
+/*
+ * fGrid3D()
+ *
+ * Evaluate the spline on a grid of positions in a single z plane.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * f - Storage for the spline values (ny x nx).
+ * z - The z position.
+ * ys - The y positions of the grid rows.
+ * xs - The x positions of the grid columns.
+ * ny - The number of rows.
+ * nx - The number of columns.
+ */
+void fGrid3D(splineData *spline_data, double *f, double z, double *ys, double *xs, int ny, int nx)
+{
+  gridEval3D(spline_data, f, NULL, NULL, NULL, z, ys, xs, ny, nx);
+}
+
 /*
  * fSpline2D()
  *
@@ -619,6 +736,407 @@ int getZSize(splineData *spline_data)
   return spline_data->zsize;
 }
 
+/*
+ * gridEval2D()
+ *
+ * Evaluate the spline (and optionally its derivatives) on a grid
+ * of positions. The powers of the x and y deltas are only computed
+ * once per column / row. Positions that are out of range are 0.0.
+ *
+ * This does not use the delta arrays in the spline data structure
+ * so it is safe to call from multiple threads.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * f - Storage for the spline values (ny x nx).
+ * dxf - Storage for the derivative in x, or NULL.
+ * dyf - Storage for the derivative in y, or NULL.
+ * ys - The y positions of the grid rows.
+ * xs - The x positions of the grid columns.
+ * ny - The number of rows.
+ * nx - The number of columns.
+ */
+void gridEval2D(splineData *spline_data, double *f, double *dxf, double *dyf, double *ys, double *xs, int ny, int nx)
+{
+  int i,j,k,l,yc;
+  int *xcs,*x_ok;
+  double t,vf,vdx,vdy,y_delta;
+  double py[4],dpy[4];
+  double *a,*px,*dpx;
+
+  if(spline_data->use_float){
+    gridEval2DF(spline_data, f, dxf, dyf, ys, xs, ny, nx);
+    return;
+  }
+
+  xcs = (int *)malloc(sizeof(int)*nx);
+  x_ok = (int *)malloc(sizeof(int)*nx);
+  px = (double *)malloc(sizeof(double)*4*nx);
+  dpx = (double *)malloc(sizeof(double)*4*nx);
+
+  for(j=0;j<nx;j++){
+    t = 0.0;
+    x_ok[j] = cellIndex(xs[j], spline_data->xsize, &xcs[j], &t);
+    px[4*j] = 1.0;
+    dpx[4*j] = 0.0;
+    for(k=1;k<4;k++){
+      px[4*j+k] = px[4*j+k-1]*t;
+      dpx[4*j+k] = ((double)k)*px[4*j+k-1];
+    }
+  }
+
+  for(i=0;i<ny;i++){
+    y_delta = 0.0;
+    if(!cellIndex(ys[i], spline_data->ysize, &yc, &y_delta)){
+      yc = -1;
+    }
+    py[0] = 1.0;
+    dpy[0] = 0.0;
+    for(k=1;k<4;k++){
+      py[k] = py[k-1]*y_delta;
+      dpy[k] = ((double)k)*py[k-1];
+    }
+
+    for(j=0;j<nx;j++){
+      vf = 0.0;
+      vdx = 0.0;
+      vdy = 0.0;
+      if((yc >= 0)&&(x_ok[j])){
+	a = &(spline_data->aij[(xcs[j]*spline_data->ysize+yc)*16]);
+	for(k=0;k<4;k++){
+	  for(l=0;l<4;l++){
+	    vf += a[4*k+l]*px[4*j+k]*py[l];
+	    vdx += a[4*k+l]*dpx[4*j+k]*py[l];
+	    vdy += a[4*k+l]*px[4*j+k]*dpy[l];
+	  }
+	}
+      }
+      f[i*nx+j] = vf;
+      if(dxf != NULL){
+	dxf[i*nx+j] = vdx;
+	dyf[i*nx+j] = vdy;
+      }
+    }
+  }
+
+  free(xcs);
+  free(x_ok);
+  free(px);
+  free(dpx);
+}
+
+/*
+ * gridEval3D()
+ *
+ * Evaluate the spline (and optionally its derivatives) on a grid
+ * of positions in a single z plane. The z terms are summed first
+ * for each cell, then the powers of the x and y deltas are only
+ * computed once per column / row. Positions that are out of range
+ * are 0.0.
+ *
+ * This does not use the delta arrays in the spline data structure
+ * so it is safe to call from multiple threads.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * f - Storage for the spline values (ny x nx).
+ * dxf - Storage for the derivative in x, or NULL.
+ * dyf - Storage for the derivative in y, or NULL.
+ * dzf - Storage for the derivative in z, or NULL.
+ * z - The z position.
+ * ys - The y positions of the grid rows.
+ * xs - The x positions of the grid columns.
+ * ny - The number of rows.
+ * nx - The number of columns.
+ */
+void gridEval3D(splineData *spline_data, double *f, double *dxf, double *dyf, double *dzf, double z, double *ys, double *xs, int ny, int nx)
+{
+  int i,j,k,l,m,yc,zc;
+  int *xcs,*x_ok;
+  double t,tz,vf,vdx,vdy,vdz,y_delta,z_delta;
+  double py[4],dpy[4],pz[4],dpz[4];
+  double *a,*px,*dpx;
+
+  if(spline_data->use_float){
+    gridEval3DF(spline_data, f, dxf, dyf, dzf, z, ys, xs, ny, nx);
+    return;
+  }
+
+  /* Nothing to do if z is out of range. */
+  if(!cellIndex(z, spline_data->zsize, &zc, &z_delta)){
+    for(i=0;i<(nx*ny);i++){
+      f[i] = 0.0;
+      if(dxf != NULL){
+	dxf[i] = 0.0;
+	dyf[i] = 0.0;
+	dzf[i] = 0.0;
+      }
+    }
+    return;
+  }
+
+  pz[0] = 1.0;
+  dpz[0] = 0.0;
+  for(k=1;k<4;k++){
+    pz[k] = pz[k-1]*z_delta;
+    dpz[k] = ((double)k)*pz[k-1];
+  }
+
+  xcs = (int *)malloc(sizeof(int)*nx);
+  x_ok = (int *)malloc(sizeof(int)*nx);
+  px = (double *)malloc(sizeof(double)*4*nx);
+  dpx = (double *)malloc(sizeof(double)*4*nx);
+
+  for(j=0;j<nx;j++){
+    t = 0.0;
+    x_ok[j] = cellIndex(xs[j], spline_data->xsize, &xcs[j], &t);
+    px[4*j] = 1.0;
+    dpx[4*j] = 0.0;
+    for(k=1;k<4;k++){
+      px[4*j+k] = px[4*j+k-1]*t;
+      dpx[4*j+k] = ((double)k)*px[4*j+k-1];
+    }
+  }
+
+  for(i=0;i<ny;i++){
+    y_delta = 0.0;
+    if(!cellIndex(ys[i], spline_data->ysize, &yc, &y_delta)){
+      yc = -1;
+    }
+    py[0] = 1.0;
+    dpy[0] = 0.0;
+    for(k=1;k<4;k++){
+      py[k] = py[k-1]*y_delta;
+      dpy[k] = ((double)k)*py[k-1];
+    }
+
+    for(j=0;j<nx;j++){
+      vf = 0.0;
+      vdx = 0.0;
+      vdy = 0.0;
+      vdz = 0.0;
+      if((yc >= 0)&&(x_ok[j])){
+	a = &(spline_data->aij[(xcs[j]*(spline_data->ysize*spline_data->zsize)+yc*spline_data->zsize+zc)*64]);
+	for(k=0;k<4;k++){
+	  for(l=0;l<4;l++){
+	    t = 0.0;
+	    tz = 0.0;
+	    for(m=0;m<4;m++){
+	      t += a[k*16+l*4+m]*pz[m];
+	      tz += a[k*16+l*4+m]*dpz[m];
+	    }
+	    vf += t*px[4*j+k]*py[l];
+	    vdx += t*dpx[4*j+k]*py[l];
+	    vdy += t*px[4*j+k]*dpy[l];
+	    vdz += tz*px[4*j+k]*py[l];
+	  }
+	}
+      }
+      f[i*nx+j] = vf;
+      if(dxf != NULL){
+	dxf[i*nx+j] = vdx;
+	dyf[i*nx+j] = vdy;
+	dzf[i*nx+j] = vdz;
+      }
+    }
+  }
+
+  free(xcs);
+  free(x_ok);
+  free(px);
+  free(dpx);
+}
+
+/*
+ * gridEval2DF()
+ *
+ * Single precision version of gridEval2D(). For each grid row the
+ * y terms are summed first for each cell, which leaves a cubic
+ * polynomial in x. Adjacent columns in the same cell re-use this
+ * polynomial.
+ */
+void gridEval2DF(splineData *spline_data, double *f, double *dxf, double *dyf, double *ys, double *xs, int ny, int nx)
+{
+  int i,j,k,xc,yc;
+  int *xcs;
+  float y_delta;
+  float c[4],cy[4],px[4],dpx[4],py[4],dpy[4],v[16],vy[16];
+  float *a,*xds;
+  double t;
+
+  for(k=0;k<4;k++){
+    c[k] = 0.0f;
+    cy[k] = 0.0f;
+  }
+
+  xcs = (int *)malloc(sizeof(int)*nx);
+  xds = (float *)malloc(sizeof(float)*nx);
+  for(j=0;j<nx;j++){
+    t = 0.0;
+    if(!cellIndex(xs[j], spline_data->xsize, &xcs[j], &t)){
+      xcs[j] = -1;
+    }
+    xds[j] = (float)t;
+  }
+
+  for(i=0;i<ny;i++){
+    t = 0.0;
+    if(!cellIndex(ys[i], spline_data->ysize, &yc, &t)){
+      yc = -1;
+    }
+    y_delta = (float)t;
+    powersF(y_delta, py, dpy);
+
+    xc = -1;
+    for(j=0;j<nx;j++){
+      f[i*nx+j] = 0.0;
+      if(dxf != NULL){
+	dxf[i*nx+j] = 0.0;
+	dyf[i*nx+j] = 0.0;
+      }
+      if((yc < 0)||(xcs[j] < 0)){
+	continue;
+      }
+
+      /* Sum the y terms if this is a new cell. */
+      if(xcs[j] != xc){
+	xc = xcs[j];
+	a = &(spline_data->aij_f[(xc*spline_data->ysize+yc)*16]);
+	for(k=0;k<16;k++){
+	  v[k] = a[k]*py[k&3];
+	  vy[k] = a[k]*dpy[k&3];
+	}
+	for(k=0;k<4;k++){
+	  c[k] = (v[4*k] + v[4*k+1]) + (v[4*k+2] + v[4*k+3]);
+	  cy[k] = (vy[4*k] + vy[4*k+1]) + (vy[4*k+2] + vy[4*k+3]);
+	}
+      }
+      
+      powersF(xds[j], px, dpx);
+      f[i*nx+j] = (double)(c[0]*px[0] + c[1]*px[1] + c[2]*px[2] + c[3]*px[3]);
+      if(dxf != NULL){
+	dxf[i*nx+j] = (double)(c[1]*dpx[1] + c[2]*dpx[2] + c[3]*dpx[3]);
+	dyf[i*nx+j] = (double)(cy[0]*px[0] + cy[1]*px[1] + cy[2]*px[2] + cy[3]*px[3]);
+      }
+    }
+  }
+
+  free(xcs);
+  free(xds);
+}
+
+/*
+ * gridEval3DF()
+ *
+ * Single precision version of gridEval3D(). For each grid row the
+ * y and z terms are summed first for each cell, which leaves a cubic
+ * polynomial in x. Adjacent columns in the same cell re-use this
+ * polynomial.
+ *
+ * The sums are done 'vertically' in blocks of 4 floats so that they
+ * can be vectorized.
+ */
+void gridEval3DF(splineData *spline_data, double *f, double *dxf, double *dyf, double *dzf, double z, double *ys, double *xs, int ny, int nx)
+{
+  int i,j,k,m,xc,yc,zc;
+  int *xcs;
+  float y_delta,z_delta;
+  float c[4],cy[4],cz[4],px[4],dpx[4],py[4],dpy[4],pz[4],dpz[4];
+  float s[16],sy[16],sz[16],w[16],wy[16],wz[16];
+  float *a,*xds;
+  double t;
+
+  /* Nothing to do if z is out of range. */
+  if(!cellIndex(z, spline_data->zsize, &zc, &t)){
+    for(i=0;i<(nx*ny);i++){
+      f[i] = 0.0;
+      if(dxf != NULL){
+	dxf[i] = 0.0;
+	dyf[i] = 0.0;
+	dzf[i] = 0.0;
+      }
+    }
+    return;
+  }
+  z_delta = (float)t;
+  powersF(z_delta, pz, dpz);
+
+  for(k=0;k<4;k++){
+    c[k] = 0.0f;
+    cy[k] = 0.0f;
+    cz[k] = 0.0f;
+  }
+
+  xcs = (int *)malloc(sizeof(int)*nx);
+  xds = (float *)malloc(sizeof(float)*nx);
+  for(j=0;j<nx;j++){
+    t = 0.0;
+    if(!cellIndex(xs[j], spline_data->xsize, &xcs[j], &t)){
+      xcs[j] = -1;
+    }
+    xds[j] = (float)t;
+  }
+
+  for(i=0;i<ny;i++){
+    t = 0.0;
+    if(!cellIndex(ys[i], spline_data->ysize, &yc, &t)){
+      yc = -1;
+    }
+    y_delta = (float)t;
+    powersF(y_delta, py, dpy);
+
+    /* The y, z weights, the coefficient layout is x^i y^j z^k at i*16+j*4+k. */
+    for(k=0;k<16;k++){
+      w[k] = py[k>>2]*pz[k&3];
+      wy[k] = dpy[k>>2]*pz[k&3];
+      wz[k] = py[k>>2]*dpz[k&3];
+    }
+
+    xc = -1;
+    for(j=0;j<nx;j++){
+      f[i*nx+j] = 0.0;
+      if(dxf != NULL){
+	dxf[i*nx+j] = 0.0;
+	dyf[i*nx+j] = 0.0;
+	dzf[i*nx+j] = 0.0;
+      }
+      if((yc < 0)||(xcs[j] < 0)){
+	continue;
+      }
+
+      /* Sum the y and z terms if this is a new cell. */
+      if(xcs[j] != xc){
+	xc = xcs[j];
+	a = &(spline_data->aij_f[(xc*(spline_data->ysize*spline_data->zsize)+yc*spline_data->zsize+zc)*64]);
+	for(k=0;k<4;k++){
+	  for(m=0;m<16;m++){
+	    s[m] = a[16*k+m]*w[m];
+	    sy[m] = a[16*k+m]*wy[m];
+	    sz[m] = a[16*k+m]*wz[m];
+	  }
+	  for(m=0;m<4;m++){
+	    s[m] = (s[m] + s[m+4]) + (s[m+8] + s[m+12]);
+	    sy[m] = (sy[m] + sy[m+4]) + (sy[m+8] + sy[m+12]);
+	    sz[m] = (sz[m] + sz[m+4]) + (sz[m+8] + sz[m+12]);
+	  }
+	  c[k] = (s[0] + s[1]) + (s[2] + s[3]);
+	  cy[k] = (sy[0] + sy[1]) + (sy[2] + sy[3]);
+	  cz[k] = (sz[0] + sz[1]) + (sz[2] + sz[3]);
+	}
+      }
+
+      powersF(xds[j], px, dpx);
+      f[i*nx+j] = (double)(c[0]*px[0] + c[1]*px[1] + c[2]*px[2] + c[3]*px[3]);
+      if(dxf != NULL){
+	dxf[i*nx+j] = (double)(c[1]*dpx[1] + c[2]*dpx[2] + c[3]*dpx[3]);
+	dyf[i*nx+j] = (double)(cy[0]*px[0] + cy[1]*px[1] + cy[2]*px[2] + cy[3]*px[3]);
+	dzf[i*nx+j] = (double)(cz[0]*px[0] + cz[1]*px[1] + cz[2]*px[2] + cz[3]*px[3]);
+      }
+    }
+  }
+
+  free(xcs);
+  free(xds);
+}
+
 /*
  * initSpline2D()
  *
@@ -642,6 +1160,9 @@ splineData* initSpline2D(double *new_aij, int new_xsize, int new_ysize)
   spline_data->ysize = new_ysize;
   spline_data->zsize = 0;
 
+  spline_data->use_float = 0;
+  spline_data->aij_f = NULL;
+
   /* 
    * Allocate storage for spline data.
    *
@@ -693,6 +1214,8 @@ splineData* initSpline3D(double *new_aij, int new_xsize, int new_ysize, int new_
   spline_data->ysize = new_ysize;
   spline_data->zsize = new_zsize;
 
+  spline_data->use_float = 0;
+  spline_data->aij_f = NULL;
 
   /* Allocate storage for spline data. */
   spline_data->aij = (double *)malloc(sizeof(double)*tsize);
@@ -717,6 +1240,27 @@ splineData* initSpline3D(double *new_aij, int new_xsize, int new_ysize, int new_
   return spline_data;
 }
 
+/*
+ * powersF()
+ *
+ * Calculate the powers of a delta and of it's derivative (single precision).
+ *
+ * delta - The delta (0.0 - 1.0).
+ * p - Storage for 1, delta, delta^2, delta^3.
+ * dp - Storage for 0, 1, 2*delta, 3*delta^2.
+ */
+void powersF(float delta, float *p, float *dp)
+{
+  p[0] = 1.0f;
+  p[1] = delta;
+  p[2] = delta*delta;
+  p[3] = p[2]*delta;
+  dp[0] = 0.0f;
+  dp[1] = 1.0f;
+  dp[2] = 2.0f*delta;
+  dp[3] = 3.0f*p[2];
+}
+
 /*
  * rangeCheckD()
  *
@@ -793,5 +1337,37 @@ void splineCleanup(splineData *spline_data)
     free(spline_data->delta_dyf);
     free(spline_data->delta_dzf);
   }
+  if (spline_data->aij_f != NULL){
+    free(spline_data->aij_f);
+  }
   free(spline_data);
 }
+
+/*
+ * splineSetSinglePrecision()
+ *
+ * Switch the grid evaluation functions (xxGrid2D/3D) between double 
+ * and single precision. The single precision path is faster, and
+ * is still accurate to about 1 part in 10^6.
+ *
+ * spline_data - Pointer to a spline data structure.
+ * use_float - 1 for single precision, 0 for double precision.
+ */
+void splineSetSinglePrecision(splineData *spline_data, int use_float)
+{
+  int i,tsize;
+
+  if(use_float && (spline_data->aij_f == NULL)){
+    if(spline_data->type == S3D){
+      tsize = spline_data->xsize*spline_data->ysize*spline_data->zsize*64;
+    }
+    else{
+      tsize = spline_data->xsize*spline_data->ysize*16;
+    }
+    spline_data->aij_f = (float *)malloc(sizeof(float)*tsize);
+    for(i=0;i<tsize;i++){
+      spline_data->aij_f[i] = (float)spline_data->aij[i];
+    }
+  }
+  spline_data->use_float = use_float;
+}
@@ -23,12 +23,17 @@ typedef struct{
   double *delta_dxf;
   double *delta_dyf;
   double *delta_dzf;
+  int use_float;     /* Use the single precision grid evaluation path. */
+  float *aij_f;      /* Single precision copy of aij (NULL if not used). */
 } splineData;
 
 /* Function Declarations */
 void computeDelta2D(splineData *, double, double);
 void computeDelta3D(splineData *, double, double, double);
 
+void dfGrid2D(splineData *, double *, double *, double *, double *, double *, int, int);
+void dfGrid3D(splineData *, double *, double *, double *, double *, double, double *, double *, int, int);
+
 double dxfAt2D(splineData *, int, int);
 double dxfAt3D(splineData *, int, int, int);
 double dxfSpline2D(splineData *,double, double);
@@ -44,6 +49,8 @@ double dzfSpline3D(splineData *, double, double, double);
 
 double fAt2D(splineData *, int, int);
 double fAt3D(splineData *, int, int, int);
+void fGrid2D(splineData *, double *, double *, double *, int, int);
+void fGrid3D(splineData *, double *, double, double *, double *, int, int);
 double fSpline2D(splineData *, double, double);
 double fSpline3D(splineData *, double, double, double);
 
@@ -55,5 +62,6 @@ splineData* initSpline2D(double *, int, int);
 splineData* initSpline3D(double *, int, int, int);
 
 void splineCleanup(splineData *);
+void splineSetSinglePrecision(splineData *, int);
 
 #endif
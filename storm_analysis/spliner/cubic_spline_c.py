@@ -31,6 +31,26 @@ cubic.computeDelta3D.argtypes = [ctypes.c_void_p,
                                  ctypes.c_double,
                                  ctypes.c_double]
 
+cubic.dfGrid2D.argtypes = [ctypes.c_void_p,
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ctypes.c_int,
+                           ctypes.c_int]
+
+cubic.dfGrid3D.argtypes = [ctypes.c_void_p,
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ctypes.c_double,
+                           ndpointer(dtype=numpy.float64),
+                           ndpointer(dtype=numpy.float64),
+                           ctypes.c_int,
+                           ctypes.c_int]
+
 cubic.dxfSpline2D.argtypes = [ctypes.c_void_p,
                               ctypes.c_double,
                               ctypes.c_double]
@@ -59,6 +79,21 @@ cubic.dzfSpline3D.argtypes = [ctypes.c_void_p,
                               ctypes.c_double]
 cubic.dzfSpline3D.restype = ctypes.c_double
 
+cubic.fGrid2D.argtypes = [ctypes.c_void_p,
+                          ndpointer(dtype=numpy.float64),
+                          ndpointer(dtype=numpy.float64),
+                          ndpointer(dtype=numpy.float64),
+                          ctypes.c_int,
+                          ctypes.c_int]
+
+cubic.fGrid3D.argtypes = [ctypes.c_void_p,
+                          ndpointer(dtype=numpy.float64),
+                          ctypes.c_double,
+                          ndpointer(dtype=numpy.float64),
+                          ndpointer(dtype=numpy.float64),
+                          ctypes.c_int,
+                          ctypes.c_int]
+
 cubic.fSpline2D.argtypes = [ctypes.c_void_p,
                             ctypes.c_double,
                             ctypes.c_double]
@@ -83,6 +118,9 @@ cubic.initSpline3D.restype = ctypes.c_void_p
 
 cubic.splineCleanup.argtypes = [ctypes.c_void_p]
 
+cubic.splineSetSinglePrecision.argtypes = [ctypes.c_void_p,
+                                           ctypes.c_int]
+
 
 class CubicSplineCException(Exception):
     pass
@@ -103,6 +141,18 @@ class CSpline(object):
 
     def getCPointer(self):
         return self.c_spline
+
+    def setSinglePrecision(self, use_float):
+        """
+        Switch the grid functions (fGrid, dfGrid) and the fitters that
+        use this spline between double and single precision.
+        """
+        self.checkCSpline()
+        cubic.splineSetSinglePrecision(self.c_spline, int(use_float))
+
+    def gridPositions(self, y, x):
+        return [numpy.ascontiguousarray(y, dtype = numpy.float64),
+                numpy.ascontiguousarray(x, dtype = numpy.float64)]
         
         
 class CSpline2D(CSpline):
@@ -113,6 +163,17 @@ class CSpline2D(CSpline):
                                            self.py_spline.max_i,
                                            self.py_spline.max_i)
 
+    def dfGrid(self, y, x):
+        """
+        Returns [f, dxf, dyf] on the grid defined by the y (rows)
+        and x (columns) positions.
+        """
+        self.checkCSpline()
+        [y, x] = self.gridPositions(y, x)
+        vals = [numpy.zeros((y.size, x.size)) for i in range(3)]
+        cubic.dfGrid2D(self.c_spline, vals[0], vals[1], vals[2], y, x, y.size, x.size)
+        return vals
+
     def dxf(self, y, x):
         self.checkCSpline()
         return cubic.dxfSpline2D(self.c_spline, y, x)
@@ -124,6 +185,17 @@ class CSpline2D(CSpline):
     def f(self, y, x):
         self.checkCSpline()
         return cubic.fSpline2D(self.c_spline, y, x)
+
+    def fGrid(self, y, x):
+        """
+        Returns the spline values on the grid defined by the y (rows)
+        and x (columns) positions.
+        """
+        self.checkCSpline()
+        [y, x] = self.gridPositions(y, x)
+        vals = numpy.zeros((y.size, x.size))
+        cubic.fGrid2D(self.c_spline, vals, y, x, y.size, x.size)
+        return vals
         
     def py_f(self, y, x):
         return self.py_spline.f(x, y)
@@ -138,6 +210,17 @@ class CSpline3D(CSpline):
                                            self.py_spline.max_i,
                                            self.py_spline.max_i)
         
+    def dfGrid(self, z, y, x):
+        """
+        Returns [f, dxf, dyf, dzf] on the grid defined by the y (rows)
+        and x (columns) positions in the z plane.
+        """
+        self.checkCSpline()
+        [y, x] = self.gridPositions(y, x)
+        vals = [numpy.zeros((y.size, x.size)) for i in range(4)]
+        cubic.dfGrid3D(self.c_spline, vals[0], vals[1], vals[2], vals[3], z, y, x, y.size, x.size)
+        return vals
+
     def dxf(self, z, y, x):
         self.checkCSpline() 
         return cubic.dxfSpline3D(self.c_spline, z, y, x)
@@ -153,6 +236,17 @@ class CSpline3D(CSpline):
     def f(self, z, y, x):
         self.checkCSpline()
         return cubic.fSpline3D(self.c_spline, z, y, x)
+
+    def fGrid(self, z, y, x):
+        """
+        Returns the spline values on the grid defined by the y (rows)
+        and x (columns) positions in the z plane.
+        """
+        self.checkCSpline()
+        [y, x] = self.gridPositions(y, x)
+        vals = numpy.zeros((y.size, x.size))
+        cubic.fGrid3D(self.c_spline, vals, z, y, x, y.size, x.size)
+        return vals
         
     def py_f(self, z, y, x):
         return self.py_spline.f(z, y, x)
@@ -13,6 +13,7 @@ import numpy
 
 import storm_analysis.fista.fista_decon as fistaDecon
 import storm_analysis.rolling_ball_bgr.rolling_ball as rollingBall
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
 import storm_analysis.sa_library.fitting as fitting
 import storm_analysis.sa_library.ia_utilities_c as utilC
 import storm_analysis.wavelet_bgr.wavelet_bgr as waveletBGR
@@ -32,6 +33,8 @@ class SplinerFISTAPeakFinder(object):
     """
     def __init__(self, parameters = None, psf_object = None, **kwds):
         super(SplinerFISTAPeakFinder, self).__init__(**kwds)
+
+        fftwThreadsC.setThreadsFromParameters(parameters)
         
         self.fista_iterations = parameters.getAttr("fista_iterations")
         self.fista_lambda = parameters.getAttr("fista_lambda")
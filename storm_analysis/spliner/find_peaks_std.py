@@ -37,12 +37,17 @@ def initFitter(finder, parameters, spline_fn):
         variance = finder.setVariance(variance)
     
     # Create C fitter object.
+    kwds = {"scmos_cal" : variance,
+            "spline_fn" : spline_fn}
+    if parameters.hasAttr("spline_single_precision"):
+        kwds["single_precision"] = (parameters.getAttr("spline_single_precision") != 0)
+    if parameters.hasAttr("spline_table_accuracy"):
+        kwds["table_accuracy"] = parameters.getAttr("spline_table_accuracy")
+        kwds["table_memory"] = parameters.getAttr("spline_table_memory", 256.0)
     if (spline_fn.getType() == "2D"):
-        return cubicFitC.CSpline2DFit(scmos_cal = variance,
-                                      spline_fn = spline_fn)
+        return cubicFitC.CSpline2DFit(**kwds)
     else:
-        return cubicFitC.CSpline3DFit(scmos_cal = variance,
-                                      spline_fn = spline_fn)
+        return cubicFitC.CSpline3DFit(**kwds)
     
 def initFindAndFit(parameters):
     """
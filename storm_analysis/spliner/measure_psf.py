@@ -28,14 +28,14 @@ Hazen 03/16
 import pickle
 import numpy
 import os
-import scipy
-import scipy.ndimage
 import tifffile
 
 import storm_analysis.sa_library.ia_utilities_c as util_c
 import storm_analysis.sa_library.datareader as datareader
 import storm_analysis.sa_library.readinsight3 as readinsight3
 
+import storm_analysis.spliner.measure_psf_utils as measurePSFUtils
+
 
 def measurePSF(movie_name, zfile_name, movie_mlist, psf_name, want2d = False, aoi_size = 12, z_range = 750.0, z_step = 50.0):
     """
@@ -63,31 +63,38 @@ def measurePSF(movie_name, zfile_name, movie_mlist, psf_name, want2d = False, ao
     # to the average psf. For 3D molecule z positions are rounded to 
     # the nearest 50nm.
     #
-    z_mid = int(z_range/z_step)
-    max_z = 2 * z_mid + 1
+    psf_acc = measurePSFUtils.PSFAccumulator(aoi_size = aoi_size,
+                                             z_range = z_range,
+                                             z_step = z_step,
+                                             want2d = want2d)
+    max_z = psf_acc.max_z
+
+    # Use the z offset file if it was specified, otherwise use localization z positions.
+    if z_offsets is None:
+        print("Using fit z locations.")
+    else:
+        print("Using z offset file.")
 
-    average_psf = numpy.zeros((max_z,4*aoi_size,4*aoi_size))
-    peaks_used = 0
-    totals = numpy.zeros(max_z)
+    # Select localizations that are not near the edges and group them by frame.
     [dax_x, dax_y, dax_l] = dax_data.filmSize()
-    for curf in range(dax_l):
-
-        # Select localizations in current frame & not near the edges.
-        mask = (i3_data['fr'] == curf+1) & (i3_data['x'] > aoi_size) & (i3_data['x'] < (dax_x - aoi_size - 1)) & (i3_data['y'] > aoi_size) & (i3_data['y'] < (dax_y - aoi_size - 1))
-        xr = i3_data['x'][mask]
-        yr = i3_data['y'][mask]
+    mask = (i3_data['x'] > aoi_size) & (i3_data['x'] < (dax_x - aoi_size - 1)) & (i3_data['y'] > aoi_size) & (i3_data['y'] < (dax_y - aoi_size - 1))
+    index = numpy.nonzero(mask)[0]
+    frames = measurePSFUtils.groupByFrame(i3_data['fr'][mask] - 1)
+    
+    for curf in sorted(frames):
+        if (curf < 0) or (curf >= dax_l):
+            continue
+        
+        locs = index[frames[curf]]
+        xr = i3_data['x'][locs]
+        yr = i3_data['y'][locs]
 
-        # Use the z offset file if it was specified, otherwise use localization z positions.
         if z_offsets is None:
-            if (curf == 0):
-                print("Using fit z locations.")
-            zr = i3_data['z'][mask]
+            zr = i3_data['z'][locs]
         else:
-            if (curf == 0):
-                print("Using z offset file.")
             zr = numpy.ones(xr.size) * z_offsets[curf]
 
-        ht = i3_data['h'][mask]
+        ht = i3_data['h'][locs]
 
         # Remove localizations that are too close to each other.
         in_peaks = numpy.zeros((xr.size,util_c.getNPeakPar()))
@@ -104,57 +111,18 @@ def measurePSF(movie_name, zfile_name, movie_mlist, psf_name, want2d = False, ao
         # Use remaining localizations to calculate spline.
         image = dax_data.loadAFrame(curf).astype(numpy.float64)
 
-        xr = out_peaks[:,util_c.getXCenterIndex()]
-        yr = out_peaks[:,util_c.getYCenterIndex()]
-        zr = out_peaks[:,util_c.getZCenterIndex()]
-        ht = out_peaks[:,util_c.getHeightIndex()]
-
-        for i in range(xr.size):
-            xf = xr[i]
-            yf = yr[i]
-            zf = zr[i]
-            xi = int(xf)
-            yi = int(yf)
-            if want2d:
-                zi = 0
-            else:
-                zi = int(round(zf/z_step) + z_mid)
-
-            # check the z is in range
-            if (zi > -1) and (zi < max_z):
-
-                # get localization image
-                mat = image[xi-aoi_size:xi+aoi_size,
-                            yi-aoi_size:yi+aoi_size]
+        psf_acc.addAOIs(image,
+                        out_peaks[:,util_c.getXCenterIndex()],
+                        out_peaks[:,util_c.getYCenterIndex()],
+                        out_peaks[:,util_c.getZCenterIndex()])
 
-                # zoom in by 2x
-                psf = scipy.ndimage.interpolation.zoom(mat, 2.0)
-
-                # re-center image
-                psf = scipy.ndimage.interpolation.shift(psf, (-2.0*(xf-xi), -2.0*(yf-yi)), mode='nearest')
-
-                # add to average psf accumulator
-                average_psf[zi,:,:] += psf
-                totals[zi] += 1
-
-    # Force PSF to be zero (on average) at the boundaries.
-    for i in range(max_z):
-        edge = numpy.concatenate((average_psf[i,0,:],
-                                  average_psf[i,-1,:],
-                                  average_psf[i,:,0],
-                                  average_psf[i,:,-1]))
-        average_psf[i,:,:] -= numpy.mean(edge)
-
-    # Normalize the PSF.
+    [average_psf, totals] = psf_acc.getPSF()
+    
     if want2d:
         max_z = 1
 
     for i in range(max_z):
         print(i, totals[i])
-        if (totals[i] > 0.0):
-            average_psf[i,:,:] = average_psf[i,:,:]/numpy.sum(numpy.abs(average_psf[i,:,:]))
-
-    average_psf = average_psf/numpy.max(average_psf)
 
     # Save PSF (in image form).
     if True:
@@ -168,11 +136,7 @@ def measurePSF(movie_name, zfile_name, movie_mlist, psf_name, want2d = False, ao
                     "type" : "2D"}
 
     else:
-        cur_z = -z_range
-        z_vals = []
-        for i in range(max_z):
-            z_vals.append(cur_z)
-            cur_z += z_step
+        z_vals = psf_acc.getZValues()
 
         psf_dict = {"psf" : average_psf,
                     "pixel_size" : 0.080, # 1/2 the camera pixel size in nm.
@@ -19,13 +19,13 @@ FIXME: Should also handle measuring 2D splines.
 
 import pickle
 import numpy
-import scipy
-import scipy.ndimage
 import sys
 import tifffile
 
 import storm_analysis.sa_library.datareader as datareader
 
+import storm_analysis.spliner.measure_psf_utils as measurePSFUtils
+
 
 def measurePSFBeads(movie_name, zfile_name, beads_file, psf_name, want2d = False, aoi_size = 12, z_range = 600.0, z_step = 50.0):
 
@@ -63,10 +63,10 @@ def measurePSFBeads(movie_name, zfile_name, beads_file, psf_name, want2d = False
     # positions are rounded to the nearest 50nm. You might need to 
     # adjust z_range depending on your experiment.
     #
-    z_mid = int(z_range/z_step)
-    max_z = 2 * z_mid + 1
-    average_psf = numpy.zeros((max_z,4*aoi_size,4*aoi_size))
-    totals = numpy.zeros(max_z)
+    psf_acc = measurePSFUtils.PSFAccumulator(aoi_size = aoi_size,
+                                             z_range = z_range,
+                                             z_step = z_step)
+    max_z = psf_acc.max_z
     [dax_x, dax_y, dax_l] = movie_data.filmSize()
     for curf in range(dax_l):
 
@@ -77,49 +77,16 @@ def measurePSFBeads(movie_name, zfile_name, beads_file, psf_name, want2d = False
             #    print "skipping", valid[curf]
             continue
 
-        # Use bead localization to calculate spline.
-        image = movie_data.loadAFrame(curf).astype(numpy.float64)
-
         # Get frame z and check that it is in range.
         zf = z_off[curf]
-        zi = int(round(zf/z_step)) + z_mid
+        zi = int(round(zf/z_step)) + psf_acc.z_mid
         if (zi > -1) and (zi < max_z):
 
-            for i in range(bead_x.size):
-
-                xf = bead_x[i]
-                yf = bead_y[i]
-                xi = int(xf)
-                yi = int(yf)
-
-                # Get localization image.
-                mat = image[xi-aoi_size:xi+aoi_size,
-                            yi-aoi_size:yi+aoi_size]
-                
-                # Zoom in by 2x.
-                psf = scipy.ndimage.interpolation.zoom(mat, 2.0)
-
-                # Re-center image.
-                psf = scipy.ndimage.interpolation.shift(psf, (-2.0*(xf-xi), -2.0*(yf-yi)), mode='nearest')
-
-                # Add to average psf accumulator.
-                average_psf[zi,:,:] += psf
-                totals[zi] += 1
-
-    # Force PSF to be zero (on average) at the boundaries.
-    for i in range(max_z):
-        edge = numpy.concatenate((average_psf[i,0,:],
-                                  average_psf[i,-1,:],
-                                  average_psf[i,:,0],
-                                  average_psf[i,:,-1]))
-        average_psf[i,:,:] -= numpy.mean(edge)
-
-    # Normalize PSF.
-    for i in range(max_z):
-        if (totals[i] > 0.0):
-            average_psf[i,:,:] = average_psf[i,:,:]/numpy.sum(numpy.abs(average_psf[i,:,:]))
-
-    average_psf = average_psf/numpy.max(average_psf)
+            # Use bead localization to calculate spline.
+            image = movie_data.loadAFrame(curf).astype(numpy.float64)
+            psf_acc.addAOIs(image, bead_x, bead_y, numpy.ones(bead_x.size) * zf)
+
+    [average_psf, totals] = psf_acc.getPSF()
     
     # Save PSF (in image form).
     if True:
@@ -128,11 +95,7 @@ def measurePSFBeads(movie_name, zfile_name, beads_file, psf_name, want2d = False
                 tf.save(average_psf[i,:,:].astype(numpy.float32))
 
     # Save PSF. 
-    cur_z = -z_range
-    z_vals = []
-    for i in range(max_z):
-        z_vals.append(cur_z)
-        cur_z += z_step
+    z_vals = psf_acc.getZValues()
 
     dict = {"psf" : average_psf,
             "pixel_size" : 0.080, # 1/2 the camera pixel size in nm.
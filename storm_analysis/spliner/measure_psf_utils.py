@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Utility functions and classes for PSF measurement. These are
+used by measure_psf.py and measure_psf_beads.py.
+
+The localizations are grouped by frame with a single sort, the
+AOIs around the localizations are extracted from each frame with
+a strided view of the image. Then the AOIs are upsampled and
+re-centered in batches with the same spline interpolation as the
+original per AOI scipy.ndimage zoom and shift, and added to the
+z bins of the PSF.
+
+Hazen 10/26
+"""
+
+import numpy
+import scipy
+import scipy.ndimage
+
+
+class PSFAccumulator(object):
+    """
+    Accumulates upsampled, re-centered, AOIs into z bins.
+    """
+    def __init__(self, aoi_size = None, z_range = None, z_step = None, want2d = False, upsample = 2, block_size = 1000, **kwds):
+        """
+        aoi_size - The AOI half-size in pixels.
+        z_range - The z range is -z_range to z_range (in nanometers).
+        z_step - The z bin size (in nanometers).
+        want2d - Put everything in a single z bin.
+        upsample - The upsampling factor.
+        block_size - The number of AOIs to process at once.
+        """
+        super(PSFAccumulator, self).__init__(**kwds)
+
+        self.aoi_size = aoi_size
+        self.block_size = block_size
+        self.upsample = upsample
+        self.want2d = want2d
+        self.z_mid = int(z_range/z_step)
+        self.z_step = z_step
+        self.max_z = 2 * self.z_mid + 1
+
+        psf_size = 2 * upsample * aoi_size
+        self.average_psf = numpy.zeros((self.max_z, psf_size, psf_size))
+        self.totals = numpy.zeros(self.max_z)
+
+        self.buffer = []
+        self.n_buffer = 0
+
+    def addAOIs(self, image, xf, yf, zf):
+        """
+        Add the AOIs centered on (xf, yf) in image. Localizations whose
+        AOIs are not completely inside the image, or whose z value is
+        out of range are ignored.
+
+        Returns the number of AOIs that were added.
+        """
+        xf = numpy.asarray(xf, dtype = numpy.float64)
+        yf = numpy.asarray(yf, dtype = numpy.float64)
+        zf = numpy.asarray(zf, dtype = numpy.float64)
+
+        xi = xf.astype(numpy.int64)
+        yi = yf.astype(numpy.int64)
+        if self.want2d:
+            zi = numpy.zeros(xf.size, dtype = numpy.int64)
+        else:
+            zi = numpy.round(zf/self.z_step).astype(numpy.int64) + self.z_mid
+
+        a = self.aoi_size
+        mask = (zi > -1) & (zi < self.max_z)
+        mask = mask & (xi >= a) & (xi + a <= image.shape[0]) & (yi >= a) & (yi + a <= image.shape[1])
+        if (numpy.count_nonzero(mask) == 0):
+            return 0
+
+        [xf, yf, xi, yi, zi] = [xf[mask], yf[mask], xi[mask], yi[mask], zi[mask]]
+        aois = extractAOIs(image, xi, yi, a)
+        self.buffer.append([aois, xf - xi, yf - yi, zi])
+        self.n_buffer += xf.size
+
+        if (self.n_buffer >= self.block_size):
+            self.flush()
+
+        return xf.size
+
+    def flush(self):
+        """
+        Upsample, re-center and accumulate the buffered AOIs.
+        """
+        if (self.n_buffer == 0):
+            return
+
+        aois = numpy.concatenate([elt[0] for elt in self.buffer])
+        dx = numpy.concatenate([elt[1] for elt in self.buffer])
+        dy = numpy.concatenate([elt[2] for elt in self.buffer])
+        zi = numpy.concatenate([elt[3] for elt in self.buffer])
+        self.buffer = []
+        self.n_buffer = 0
+
+        psfs = upsampleAndShift(aois, dx, dy, self.upsample)
+        numpy.add.at(self.average_psf, zi, psfs)
+        self.totals += numpy.bincount(zi, minlength = self.max_z)
+
+    def getPSF(self):
+        """
+        Returns [average_psf, totals]. The average PSF is zero (on average)
+        at the edges and normalized so that the maximum is 1.0.
+        """
+        self.flush()
+
+        average_psf = numpy.copy(self.average_psf)
+
+        # Force PSF to be zero (on average) at the boundaries.
+        edge = numpy.concatenate((average_psf[:,0,:],
+                                  average_psf[:,-1,:],
+                                  average_psf[:,:,0],
+                                  average_psf[:,:,-1]), axis = 1)
+        average_psf -= numpy.mean(edge, axis = 1)[:,None,None]
+
+        # Normalize the PSF.
+        max_z = self.max_z
+        if self.want2d:
+            max_z = 1
+
+        for i in range(max_z):
+            if (self.totals[i] > 0.0):
+                average_psf[i,:,:] = average_psf[i,:,:]/numpy.sum(numpy.abs(average_psf[i,:,:]))
+
+        average_psf = average_psf/numpy.max(average_psf)
+
+        return [average_psf, numpy.copy(self.totals)]
+
+    def getZValues(self):
+        return [self.z_step * (i - self.z_mid) for i in range(self.max_z)]
+
+
+def extractAOIs(image, xi, yi, aoi_size):
+    """
+    Returns an array of the (2*aoi_size, 2*aoi_size) AOIs in image
+    starting at (xi - aoi_size, yi - aoi_size). All the AOIs must be
+    inside the image.
+    """
+    size = 2 * aoi_size
+    view = numpy.lib.stride_tricks.as_strided(image,
+                                              shape = (image.shape[0] - size + 1, image.shape[1] - size + 1, size, size),
+                                              strides = image.strides + image.strides,
+                                              writeable = False)
+    return view[numpy.asarray(xi) - aoi_size, numpy.asarray(yi) - aoi_size]
+
+def groupByFrame(frames):
+    """
+    Group localizations by frame with a single sort.
+
+    Returns a dictionary keyed by frame number with the indices of the
+    localizations in that frame.
+    """
+    frames = numpy.asarray(frames)
+    order = numpy.argsort(frames, kind = "mergesort")
+    [u_frames, starts] = numpy.unique(frames[order], return_index = True)
+    stops = numpy.append(starts[1:], frames.size)
+    groups = {}
+    for i in range(u_frames.size):
+        groups[u_frames[i]] = order[starts[i]:stops[i]]
+    return groups
+
+def upsampleAndShift(aois, dx, dy, upsample):
+    """
+    Upsample a stack of AOIs (n, sx, sy) and shift them so that a
+    peak at (sx/2 + dx, sy/2 + dy) ends up in the same place as a
+    peak at (sx/2, sy/2) in the upsampled AOI.
+
+    This gives the same result as zooming each AOI by upsample and
+    then shifting it by (-upsample*dx, -upsample*dy) with mode='nearest'.
+    The spline interpolation along the first axis is only evaluated
+    at integer positions so the AOIs do not mix.
+    """
+    psfs = scipy.ndimage.zoom(aois.astype(numpy.float64), (1.0, upsample, upsample))
+
+    coords = numpy.indices(psfs.shape, dtype = numpy.float64)
+    coords[1] += upsample * numpy.asarray(dx)[:,None,None]
+    coords[2] += upsample * numpy.asarray(dy)[:,None,None]
+    return scipy.ndimage.map_coordinates(psfs, coords, mode = 'nearest')
@@ -30,23 +30,18 @@ def psfToSpline(psf_name, spline_name, s_size):
     spline = False
     start = np_psf.shape[1]/2.0 - s_size - 0.5
 
+    #
+    # The splines are linear in their values, so rather than creating
+    # the PSF splines and evaluating them one point at a time we use
+    # a matrix that evaluates a 1D spline at the spline sample points.
+    #
+    s_size = 2*s_size
+    xy_em = spline1D.evaluationMatrix(np_psf.shape[1], start + numpy.arange(s_size))
+
     # 2D spline
     if (len(np_psf.shape) == 2):
         print("Generating 2D spline.")
-        s_size = 2*s_size
-
-        np_spline = numpy.zeros((s_size, s_size))
-        #np_psf = np_psf/numpy.max(np_psf)
-        xy_spline = spline2D.Spline2D(np_psf)
-        
-        x = start
-        for i in range(s_size):
-            y = start
-            for j in range(s_size):
-                np_spline[j,i] = xy_spline.f(y,x)
-            
-                y += 1.0
-            x += 1.0
+        np_spline = numpy.dot(xy_em, numpy.dot(np_psf, xy_em.transpose()))
 
         print("Calculating spline coefficients.")
         spline = spline2D.Spline2D(np_spline)
@@ -60,36 +55,15 @@ def psfToSpline(psf_name, spline_name, s_size):
     # 3D spline
     else:
         print("Generating 3D spline.")
-        s_size = 2*s_size
-
-        np_spline = numpy.zeros((s_size, s_size, s_size))
-        xy_splines = []
-
-        print("Generating XY splines.")
-        for i in range(np_psf.shape[0]):
-            xy_splines.append(spline2D.Spline2D(np_psf[i,:,:]))
 
         print("Generating fitting spline.")
-        x = start
-        for i in range(s_size):
-            y = start
-            for j in range(s_size):
-
-                zvals = numpy.zeros(np_psf.shape[0])
-                for k in range(np_psf.shape[0]):
-                    zvals[k] = xy_splines[k].f(y,x)
-                    z_spline = spline1D.Spline1D(zvals)
-
-                max_z = float(np_psf.shape[0]) - 1.0
-                inc = max_z/(float(s_size)-1.0)
-                for k in range(s_size):
-                    z = float(k)*inc
-                    if (z > max_z):
-                        z = max_z
-                    np_spline[k,j,i] = z_spline.f(z)
-
-                y += 1.0
-            x += 1.0
+        max_z = float(np_psf.shape[0]) - 1.0
+        inc = max_z/(float(s_size)-1.0)
+        z_em = spline1D.evaluationMatrix(np_psf.shape[0], numpy.minimum(numpy.arange(s_size)*inc, max_z))
+
+        np_spline = numpy.tensordot(np_psf, xy_em, axes = ([2],[1]))
+        np_spline = numpy.tensordot(np_spline, xy_em, axes = ([1],[1])).transpose(0,2,1)
+        np_spline = numpy.tensordot(z_em, np_spline, axes = ([1],[0]))
 
         print("Calculating spline coefficients.")
         spline = spline3D.Spline3D(np_spline, verbose = True)
@@ -9,6 +9,64 @@ import math
 import numpy
 import numpy.linalg
 
+def coefficientMatrix(size):
+    """
+    Returns the (size-1, 4, size) array that maps the values that
+    a 1D spline goes through to its coefficients, i.e. for each
+    cell Spline1D(y).coeff[i,:] = numpy.dot(cm[i,:,:], y).
+
+    All the splines are linear in the input values so this lets us
+    work with many splines (or with 2D / 3D splines) as arrays.
+    """
+    A = numpy.zeros((size,size))
+    A[0,0] = 1.0
+    A[-1,-1] = 1.0
+    for i in range(size-2):
+        A[i+1,i] = 1.0
+        A[i+1,i+1] = 4.0
+        A[i+1,i+2] = 1.0
+
+    # M as a function of y.
+    B = numpy.zeros((size,size))
+    for i in range(size-2):
+        B[i+1,i] = 6.0
+        B[i+1,i+1] = -12.0
+        B[i+1,i+2] = 6.0
+    M = numpy.linalg.solve(A,B)
+
+    Y = numpy.identity(size)
+    cm = numpy.zeros((size-1, 4, size))
+    cm[:,3,:] = (M[1:,:] - M[:-1,:])/6.0
+    cm[:,2,:] = M[:-1,:]/2.0
+    cm[:,1,:] = (Y[1:,:] - Y[:-1,:]) - (M[1:,:] + 2.0*M[:-1,:])/6.0
+    cm[:,0,:] = Y[:-1,:]
+    return cm
+
+def evaluationMatrix(size, x):
+    """
+    Returns the (x.size, size) matrix that evaluates a 1D spline at
+    the positions x, i.e. numpy.dot(em, y) is the same as calling
+    Spline1D(y).f() at each of the positions. Positions that are
+    out of range give 0.0.
+    """
+    x = numpy.asarray(x, dtype = numpy.float64)
+    max_x = size - 1
+
+    # Vectorized version of roundAndCheck().
+    ix = numpy.floor(x).astype(numpy.int64)
+    x_diff = x - ix
+    at_max = (x == max_x)
+    ix[at_max] = max_x - 1
+    x_diff[at_max] = 1.0
+    valid = (x >= 0.0) & (x <= max_x)
+    ix[~valid] = 0
+
+    cm = coefficientMatrix(size)
+    powers = numpy.vander(x_diff, 4, increasing = True)
+    em = numpy.einsum("pk,pkj->pj", powers, cm[ix,:,:])
+    em[~valid,:] = 0.0
+    return em
+
 def roundAndCheck(x, max_x):
 
     if (x < 0.0) or (x > max_x):
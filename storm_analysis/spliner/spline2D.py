@@ -34,53 +34,30 @@ class Spline2D(spline1D.Spline):
             print("Calculating spline coefficients.")
 
         #
-        # Create splines along y axis.
+        # Evaluate the spline through d at sub-integer (1/3) spacing
+        # on both axises. This is the same as creating splines along
+        # the y axis, using these to create splines on the x axis with
+        # sub-integer spacing and then evaluating these. As splines
+        # are linear in their values this is just two matrix products.
         #
-        ys = []
-        for i in range(size):
-            ys.append(spline1D.Spline1D(d[i,:]))
-
-        #
-        # Use splines on y axis to create splines on the
-        # x axis with sub-integer spacing.
+        # sv[p,q] is the value at x = p/3, y = q/3.
         #
-        xs = []
-        cx = 0.0
-        while(cx <= (float(self.max_i) + 0.01)):
-            if (cx > float(self.max_i)):
-                cx = float(self.max_i)
-            xv = numpy.zeros(size)
-            for i in range(size):
-                xv[i] = ys[i].f(cx)
-            xs.append(spline1D.Spline1D(xv))
-            cx += 1.0/3.0
+        em = spline1D.evaluationMatrix(size, numpy.arange(3*self.max_i + 1)/3.0)
+        sv = numpy.dot(em, numpy.dot(d.transpose(), em.transpose()))
 
         #
-        # Compute spline coefficients using the x axis splines
-        # to generate 16 values per grid cell and then solving
-        # for the coefficients.
+        # Compute spline coefficients using the 16 values per grid
+        # cell. A is the same for every cell so we solve for all of
+        # the cells at once.
         #
-        self.coeff = numpy.zeros((self.max_i, self.max_i, 16))
+        V = numpy.vander(numpy.arange(4)/3.0, 4, increasing = True)
 
-        A = numpy.zeros((16,16))
-        for i in range(4):
-            dx = float(i)/3.0
-            for j in range(4):
-                dy = float(j)/3.0
-                for k in range(4):
-                    for l in range(4):
-                        # This is the indicing that is necessary to get d(out) to equal d(in) when printed.
-                        A[i*4+j,k*4+l] = math.pow(dx,k) * math.pow(dy,l)
-
-        b = numpy.zeros(16)
-        for i in range(self.max_i):
-            for j in range(self.max_i):
-                for k in range(4):
-                    sp = xs[3*i + k]
-                    for l in range(4):
-                        cy = float(j) + float(l)/3.0
-                        b[k*4+l] = sp.f(cy)
-                self.coeff[i,j,:] = numpy.linalg.solve(A,b)
+        # This is the indicing that is necessary to get d(out) to equal d(in) when printed.
+        A = numpy.kron(V, V)
+
+        ci = 3*numpy.arange(self.max_i)[:,None] + numpy.arange(4)[None,:]
+        b = sv[ci[:,None,:,None], ci[None,:,None,:]].reshape(-1, 16)
+        self.coeff = numpy.linalg.solve(A, b.transpose()).transpose().reshape(self.max_i, self.max_i, 16)
 
         if verbose:
             print("Finished calculating spline coefficients.")
@@ -10,6 +10,7 @@ import pickle
 import numpy
 
 import storm_analysis.sa_library.fitting as fitting
+import storm_analysis.sa_library.lru_cache as lruCache
 
 import storm_analysis.spliner.cubic_spline_c as cubicSplineC
 import storm_analysis.spliner.spline2D as spline2D
@@ -18,12 +19,65 @@ import storm_analysis.spliner.spline3D as spline3D
 
 class SplineToPSF(fitting.PSFFunction):
 
+    def __init__(self, psf_cache_size = 64, **kwds):
+        """
+        psf_cache_size - The maximum number of PSFs to keep in the
+                         getPSF() cache, 0 disables the cache.
+        """
+        super(SplineToPSF, self).__init__(**kwds)
+        self.psf_cache = lruCache.LRUCache(max_size = psf_cache_size)
+
+    def calcPSF(self, z_value, up_sample):
+        """
+        Calculate the (not upsized or normalized) PSF, this is
+        implemented by the sub-classes.
+        """
+        assert False
+
     def getCPointer(self):
         return self.c_spline.getCPointer()
         
     def getMargin(self):
         return int(self.getSize()/2 + 2)
 
+    def getPSF(self, z_value, shape = None, up_sample = 1, normalize = True):
+        """
+        Return an image of the PSF at z_value, in an array of size
+        shape (if specified).
+
+        The PSFs are often requested many times for the same z value
+        so the most recently used ones are cached.
+        """
+        if shape is not None:
+            shape = tuple(shape)
+        key = (z_value, shape, up_sample, normalize)
+
+        psf = self.psf_cache.get(key)
+        if psf is None:
+            psf = self.calcPSF(z_value, up_sample)
+
+            if shape is not None:
+                psf = self.upsize(psf, shape, up_sample)
+
+            # Normalize if requested.
+            if normalize:
+                psf = psf/numpy.sum(psf)
+
+            self.psf_cache.put(key, psf)
+
+        return psf.copy()
+
+    def getPSFPositions(self, up_sample):
+        """
+        Returns the positions in the spline (in both X and Y) of
+        the PSF pixels.
+        """
+        psf_size = int(up_sample * (self.spline_size - 1)/2)
+        pos = 2.0*numpy.arange(psf_size)/float(up_sample)
+        if((psf_size%2) != 0):
+            pos += 1.0
+        return pos
+
     def getSize(self):
         """
         This returns the X/Y size in pixels covered by the spline.
@@ -86,40 +140,20 @@ class SplineToPSF2D(SplineToPSF):
         self.spline = spline2D.Spline2D(spline_data["spline"], spline_data["coeff"])
         self.spline_size = self.spline.getSize()
 
-        # The C representation of the spline. This class does not use
-        # this, but it keeps track of it for the C fitting library.
+        # The C representation of the spline. This is used to calculate
+        # the PSF, and we also keep track of it for the C fitting library.
         self.c_spline = cubicSplineC.CSpline2D(self.spline)
 
-    def getPSF(self, z_value, shape = None, up_sample = 1, normalize = True):
+    def calcPSF(self, z_value, up_sample):
         """
         This has the same arguments as the 3D version for convenience. 
         The z_value is ignored as long it is 0.0.
         """
         if (z_value != 0.0):
             print("Warning!! SplineToPSF2D got a non-zero z_value", z_value)
-            
-        psf_size = int(up_sample * (self.spline_size - 1)/2)
-                
-        psf = numpy.zeros((psf_size, psf_size))
-        if((psf_size%2) == 0):
-            for x in range(psf_size):
-                for y in range(psf_size):
-                    psf[y,x] = self.spline.f(float(2*y)/float(up_sample),
-                                             float(2*x)/float(up_sample))
-        else:
-            for x in range(psf_size):
-                for y in range(psf_size):
-                    psf[y,x] = self.spline.f(float(2*y)/float(up_sample) + 1.0,
-                                             float(2*x)/float(up_sample) + 1.0)
-
-        if shape is not None:
-            psf = self.upsize(psf, shape, up_sample)
 
-        # Normalize if requested.
-        if normalize:
-            psf = psf/numpy.sum(psf)
-            
-        return psf
+        pos = self.getPSFPositions(up_sample)
+        return self.c_spline.fGrid(pos, pos)
 
     def getScaledZ(self, z_value):
         return 0.0
@@ -141,42 +175,17 @@ class SplineToPSF3D(SplineToPSF):
         self.spline = spline3D.Spline3D(spline_data["spline"], spline_data["coeff"])
         self.spline_size = self.spline.getSize()
 
-        # The C representation of the spline. This class does not use
-        # this, but it keeps track of it for the C fitting library.
+        # The C representation of the spline. This is used to calculate
+        # the PSF, and we also keep track of it for the C fitting library.
         self.c_spline = cubicSplineC.CSpline3D(self.spline)
         
-    def getPSF(self, z_value, shape = None, up_sample = 1, normalize = True):
+    def calcPSF(self, z_value, up_sample):
         """
         z_value needs to be inside the z range covered by the spline.
         z_value should be in nanometers.
         """
-        # Calculate PSF at requested z value.
-        scaled_z = self.getScaledZ(z_value)
-        
-        psf_size = int(up_sample * (self.spline_size - 1)/2)
-                
-        psf = numpy.zeros((psf_size, psf_size))
-        if((psf_size%2) == 0):
-            for x in range(psf_size):
-                for y in range(psf_size):
-                    psf[y,x] = self.spline.f(scaled_z,
-                                             float(2*y)/float(up_sample),
-                                             float(2*x)/float(up_sample))
-        else:
-            for x in range(psf_size):
-                for y in range(psf_size):
-                    psf[y,x] = self.spline.f(scaled_z,
-                                             float(2*y)/float(up_sample) + 1.0,
-                                             float(2*x)/float(up_sample) + 1.0)
-
-        if shape is not None:
-            psf = self.upsize(psf, shape, up_sample)
-
-        # Normalize if requested.
-        if normalize:
-            psf = psf/numpy.sum(psf)
-            
-        return psf
+        pos = self.getPSFPositions(up_sample)
+        return self.c_spline.fGrid(self.getScaledZ(z_value), pos, pos)
 
     def getScaledZ(self, z_value):
         return float(self.spline_size) * (z_value - self.zmin) / (self.zmax - self.zmin)
@@ -57,6 +57,24 @@ def test_3ddao_2d_fixed_gt_text():
         raise Exception("3D-DAOSTORM 2D fixed ground truth did not find the expected number of localizations.")    
     
     
+def test_3ddao_2d_fixed_incremental():
+    """
+    Incremental filter updates between peak finding iterations.
+    """
+    movie_name = storm_analysis.getData("test/data/test.dax")
+    settings = storm_analysis.getData("test/data/test_3d_2d_fixed_incremental.xml")
+    mlist = storm_analysis.getPathOutputTest("test_3d_2d_fixed_incremental.bin")
+    storm_analysis.removeFile(mlist)
+
+    from storm_analysis.daostorm_3d.mufit_analysis import analyze
+    analyze(movie_name, mlist, settings)
+
+    # Verify number of localizations found.
+    num_locs = veri.verifyNumberLocalizations(mlist)
+    if not veri.verifyIsCloseEnough(num_locs, 1998):
+        raise Exception("3D-DAOSTORM 2D fixed incremental did not find the expected number of localizations.")
+
+    
 def test_3ddao_2d_fixed_low_snr():
 
     movie_name = storm_analysis.getData("test/data/test_low_snr.dax")
@@ -141,6 +159,7 @@ if (__name__ == "__main__"):
     test_3ddao_2d_fixed()
     test_3ddao_2d_fixed_gt()
     test_3ddao_2d_fixed_gt_text()
+    test_3ddao_2d_fixed_incremental()
     test_3ddao_2d_fixed_low_snr()
     test_3ddao_2d_fixed_non_square()
     test_3ddao_2d()
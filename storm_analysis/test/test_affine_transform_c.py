@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Tests for sa_library.affine_transform_c
+"""
+import numpy
+
+import storm_analysis.sa_library.affine_transform_c as affineTransformC
+
+
+def test_affine_transform_stack_1():
+    """
+    Test that the stack transform matches transforming and summing
+    the images one at a time.
+    """
+    shape = (60, 50)
+    n_z = 3
+
+    atrans = [None,
+              affineTransformC.AffineTransform(xt = [-5.0, 0.95, 0.1], yt = [2.0, -0.1, 1.05]),
+              affineTransformC.AffineTransform(xt = [3.5, 1.0, 0.0], yt = [-1.5, 0.0, 1.0])]
+    at_stack = affineTransformC.AffineTransformStack(atrans = atrans, shape = shape)
+
+    images = numpy.random.uniform(size = (n_z, len(atrans)) + shape)
+    trans_images = at_stack.transform(images)
+    assert (trans_images.shape == (n_z,) + shape)
+
+    for i in range(n_z):
+        expected = numpy.copy(images[i,0])
+        for j in range(1, len(atrans)):
+            expected += atrans[j].transform(images[i,j])
+        assert numpy.allclose(trans_images[i], expected)
+
+    at_stack.cleanup()
+    for at in atrans[1:]:
+        at.cleanup()
+
+def test_affine_transform_stack_2():
+    """
+    Test the stack transform with only the reference plane.
+    """
+    shape = (20, 30)
+    at_stack = affineTransformC.AffineTransformStack(atrans = [None], shape = shape)
+
+    images = numpy.random.uniform(size = (2, 1) + shape)
+    assert numpy.allclose(at_stack.transform(images), images[:,0])
+
+    at_stack.cleanup()
+
+
+if (__name__ == "__main__"):
+    test_affine_transform_stack_1()
+    test_affine_transform_stack_2()
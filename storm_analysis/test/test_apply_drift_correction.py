@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import numpy
+import os
+import shutil
+
+import storm_analysis
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_utilities.apply_drift_correction as applyDriftCorrection
+import storm_analysis.sa_utilities.apply_drift_correction_c as applyDriftCorrectionC
+
+
+def test_apply_drift_1():
+    """
+    Test that the streaming version matches the C version.
+    """
+    mlist_name = storm_analysis.getData("test/data/test_drift_mlist.bin")
+    drift_name = storm_analysis.getData("test/data/test_drift.txt")
+
+    c_name = storm_analysis.getPathOutputTest("test_apply_drift_c.bin")
+    py_name = storm_analysis.getPathOutputTest("test_apply_drift_py.bin")
+    shutil.copyfile(mlist_name, c_name)
+    shutil.copyfile(mlist_name, py_name)
+
+    applyDriftCorrectionC.applyDriftCorrection(c_name, drift_name)
+    applyDriftCorrection.applyDriftCorrection(py_name, drift_name, block_size = 1000)
+
+    c_data = readinsight3.loadI3File(c_name, verbose = False)
+    py_data = readinsight3.loadI3File(py_name, verbose = False)
+    assert (c_data.size == py_data.size)
+    for field in ["xc", "yc", "zc"]:
+        assert numpy.allclose(c_data[field], py_data[field], atol = 1.0e-4)
+
+    # Check that the other fields are unchanged.
+    for field in ["x", "y", "z", "fr", "c"]:
+        assert numpy.array_equal(c_data[field], py_data[field])
+
+def test_apply_drift_2():
+    """
+    Test streaming with a drift file that is still being written.
+    """
+    mlist_name = storm_analysis.getData("test/data/test_drift_mlist.bin")
+    drift = numpy.loadtxt(storm_analysis.getData("test/data/test_drift.txt"))
+
+    drift_name = storm_analysis.getPathOutputTest("test_apply_drift_partial.txt")
+    out_name = storm_analysis.getPathOutputTest("test_apply_drift_stream.bin")
+
+    i3_data = readinsight3.loadI3File(mlist_name, verbose = False)
+
+    half = int(drift.shape[0]/2)
+    with open(drift_name, "w") as fp:
+        for i in range(half):
+            fp.write("{0:d}\t{1:.3f}\t{2:.3f}\t{3:.3f}\n".format(int(drift[i,0]), drift[i,1], drift[i,2], drift[i,3]))
+
+        # Partial last line.
+        fp.write("{0:d}\t{1:.3f}".format(half + 1, drift[half,1]))
+
+    with applyDriftCorrection.DriftApplier(mlist_filename = mlist_name, output = out_name, block_size = 500) as applier:
+        assert applier.loadDrift(drift_name)
+        applier.update()
+        assert not applier.isDone()
+        assert (applier.getNumberProcessed() == numpy.count_nonzero(i3_data['fr'] <= half))
+
+        # Nothing changed, nothing more to do.
+        assert not applier.loadDrift(drift_name)
+        assert (applier.update() == 0)
+
+        # Add the rest of the drift samples.
+        applier.setDrift(drift[:,0], drift[:,1], drift[:,2], drift[:,3])
+        applier.update()
+        assert applier.isDone()
+
+    out_data = readinsight3.loadI3File(out_name, verbose = False)
+    index = i3_data['fr'] - 1
+    assert numpy.allclose(out_data['xc'], i3_data['x'] - drift[index,1], atol = 1.0e-4)
+    assert numpy.allclose(out_data['yc'], i3_data['y'] - drift[index,2], atol = 1.0e-4)
+    assert numpy.allclose(out_data['zc'], i3_data['z'] - drift[index,3], atol = 1.0e-3)
+
+def test_apply_drift_3():
+    """
+    Test interpolation of sparse drift samples and columnar output.
+    """
+    mlist_name = storm_analysis.getData("test/data/test_drift_mlist.bin")
+    drift_name = storm_analysis.getPathOutputTest("test_apply_drift_sparse.txt")
+    out_dir = storm_analysis.getPathOutputTest("test_apply_drift_columns")
+
+    i3_data = readinsight3.loadI3File(mlist_name, verbose = False)
+
+    # Drift samples every 10.5 frames.
+    frames = numpy.arange(1.0, numpy.max(i3_data['fr']) + 10.5, 10.5)
+    dx = 0.01 * frames
+    dy = -0.02 * frames
+    dz = 0.5 * frames
+    numpy.savetxt(drift_name, numpy.column_stack((frames, dx, dy, dz)), fmt = "%.2f\t%.3f\t%.3f\t%.3f")
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    applyDriftCorrection.applyDriftCorrection(mlist_name, drift_name, output = out_dir, columnar = True)
+
+    # The drift is linear in frame number.
+    fr = i3_data['fr']
+    assert numpy.array_equal(numpy.load(os.path.join(out_dir, "fr.npy")), fr)
+    assert numpy.allclose(numpy.load(os.path.join(out_dir, "xc.npy")), i3_data['x'] - 0.01 * fr, atol = 1.0e-4)
+    assert numpy.allclose(numpy.load(os.path.join(out_dir, "yc.npy")), i3_data['y'] + 0.02 * fr, atol = 1.0e-4)
+    assert numpy.allclose(numpy.load(os.path.join(out_dir, "zc.npy")), i3_data['z'] - 0.5 * fr, atol = 1.0e-2)
+
+
+if (__name__ == "__main__"):
+    test_apply_drift_1()
+    test_apply_drift_2()
+    test_apply_drift_3()
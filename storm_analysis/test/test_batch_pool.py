@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Tests for sa_library.batch_pool
+"""
+
+import storm_analysis.sa_library.batch_pool as batchPool
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
+
+
+def interrupt(result, summary):
+    raise KeyboardInterrupt
+
+def test_batch_pool_1():
+    """
+    Test running some jobs.
+    """
+    jobs = [[str(i), max, [i, 2], {}] for i in range(4)]
+    summary = batchPool.batchPool(jobs, max_processes = 2, progress = lambda r, s : None)
+    assert summary.isComplete()
+    assert (sorted([x.value for x in summary.getSucceeded()]) == [2, 2, 2, 3])
+
+def test_batch_pool_2():
+    """
+    Test that a KeyboardInterrupt stops the batch.
+    """
+    jobs = [[str(i), max, [i, 2], {}] for i in range(4)]
+    try:
+        batchPool.batchPool(jobs, max_processes = 2, progress = interrupt)
+    except KeyboardInterrupt:
+        return
+    assert False, "KeyboardInterrupt was not re-raised."
+
+def test_batch_pool_3():
+    """
+    Test running jobs without the FFTW threads library.
+    """
+    fftw_threads = fftwThreadsC.fftw_threads
+    fftwThreadsC.fftw_threads = None
+    try:
+        jobs = [[str(i), max, [i, 2], {}] for i in range(4)]
+        summary = batchPool.batchPool(jobs, max_processes = 2, progress = lambda r, s : None)
+        assert (len(summary.getSucceeded()) == 4)
+    finally:
+        fftwThreadsC.fftw_threads = fftw_threads
+
+
+if (__name__ == "__main__"):
+    test_batch_pool_1()
+    test_batch_pool_2()
+    test_batch_pool_3()
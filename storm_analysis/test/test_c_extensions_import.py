@@ -21,6 +21,7 @@ def test_c_extensions_import():
     import storm_analysis.rolling_ball_bgr.rolling_ball_lib_c
 
     import storm_analysis.sa_library.dao_fit_c
+    import storm_analysis.sa_library.fftw_threads_c
     import storm_analysis.sa_library.grid_c
     import storm_analysis.sa_library.ia_utilities_c
     import storm_analysis.sa_library.matched_filter_c
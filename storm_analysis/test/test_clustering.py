@@ -55,7 +55,51 @@ def test_voronoi_clustering():
     clusterImages(clist_name, "Voronoi Clustering", 50, 20, image_name, [256, 256])
     
 
+def test_batch_clustering():
+
+    # Test batch dbscan and voronoi.
+    import os
+    import shutil
+
+    batch_dir = storm_analysis.getPathOutputTest("batch/")
+    if not os.path.exists(batch_dir):
+        os.makedirs(batch_dir)
+
+    alist_data = storm_analysis.getData("test/data/test_clustering_list.bin")
+    for i in range(2):
+        shutil.copyfile(alist_data, batch_dir + "test_batch_" + str(i) + "_alist.bin")
+
+    # A file that can't be analyzed.
+    with open(batch_dir + "test_batch_bad_alist.bin", "w") as fp:
+        fp.write("not a bin file")
+
+    from storm_analysis.dbscan.batch_analysis import batchAnalysis as dbscanBatchAnalysis
+    summary = dbscanBatchAnalysis(batch_dir, 0)
+
+    assert summary.isComplete()
+    assert (len(summary.getSucceeded()) == 2)
+    assert (len(summary.getFailed()) == 1)
+    assert (summary.getFailed()[0].name == batch_dir + "test_batch_bad_alist.bin")
+    
+    for i in range(2):
+        stats_file = batch_dir + "test_batch_" + str(i) + "_aclusters_stats.txt"
+        with open(stats_file) as fp:
+            assert (len(fp.readlines()) == 99)
+
+    from storm_analysis.voronoi.batch_analysis import batchAnalysis as voronoiBatchAnalysis
+    summary = voronoiBatchAnalysis(batch_dir, batch_dir, 0.1)
+
+    assert (len(summary.getSucceeded()) == 2)
+    assert (len(summary.getFailed()) == 1)
+
+    for i in range(2):
+        stats_file = batch_dir + "test_batch_" + str(i) + "_asrt_stats.txt"
+        with open(stats_file) as fp:
+            assert (len(fp.readlines()) == 100)
+    
+
 if (__name__ == "__main__"):
     test_dbscan_clustering()
     test_voronoi_clustering()
+    test_batch_clustering()
     
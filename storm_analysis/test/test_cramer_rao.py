@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Tests for the Cramer-Rao bounds calculations.
+"""
+
+import numpy
+import os
+import pickle
+
+import storm_analysis
+
+import storm_analysis.psf_fft.cramer_rao as psfFFTCramerRao
+import storm_analysis.spliner.cramer_rao as splinerCramerRao
+import storm_analysis.spliner.spline3D as spline3D
+
+
+def gaussianPSFs(size, n_z):
+    """
+    A stack of Gaussian PSFs whose width changes with z.
+    """
+    xv = numpy.arange(size) - 0.5*(size - 1)
+    [xx, yy] = numpy.meshgrid(xv, xv, indexing = "ij")
+    psfs = numpy.zeros((n_z, size, size))
+    for i, z in enumerate(numpy.linspace(-1.0, 1.0, n_z)):
+        sx = 2.0 + 0.5*z
+        sy = 2.0 - 0.5*z
+        psfs[i,:,:] = numpy.exp(-xx*xx/(2.0*sx*sx) - yy*yy/(2.0*sy*sy))
+    return psfs/numpy.max(psfs)
+
+def makePSFFFT():
+    psf_name = storm_analysis.getPathOutputTest("test_cr_psf_fft.psf")
+    psf_dict = {"psf" : gaussianPSFs(21, 21),
+                "pixel_size" : 0.1,
+                "zmin" : -500.0,
+                "zmax" : 500.0}
+    with open(psf_name, "wb") as fp:
+        pickle.dump(psf_dict, fp)
+    return psfFFTCramerRao.CRPSFFn(psf_filename = psf_name, pixel_size = 100.0)
+
+def makeSpline():
+    spline_name = storm_analysis.getPathOutputTest("test_cr_spline.spline")
+    spline = spline3D.Spline3D(gaussianPSFs(21, 21))
+    spline_dict = {"spline" : gaussianPSFs(21, 21),
+                   "coeff" : spline.coeff,
+                   "zmin" : -500.0,
+                   "zmax" : 500.0,
+                   "type" : "3D"}
+    with open(spline_name, "wb") as fp:
+        pickle.dump(spline_dict, fp)
+    return splinerCramerRao.CRSplineToPSF3D(psf_filename = spline_name, pixel_size = 100.0)
+
+def checkBounds(cr_psf_object):
+    """
+    Check that the CRStack bounds match calcCRBound3D().
+    """
+    z_values = [-250.0, 0.0, 150.0]
+    backgrounds = [5.0, 20.0]
+    photons = [500.0, 2000.0]
+
+    cr_stack = splinerCramerRao.CRStack(cr_psf_object = cr_psf_object, z_values = z_values)
+    crlbs = cr_stack.calcCRBounds(backgrounds, photons)
+    assert (crlbs.shape == (3, 2, 2, 5))
+
+    for i, z in enumerate(z_values):
+        for j, bg in enumerate(backgrounds):
+            for k, ph in enumerate(photons):
+                crlb = splinerCramerRao.calcCRBound3D(cr_psf_object, bg, ph, z)
+                assert numpy.allclose(crlbs[i,j,k,:], crlb, rtol = 1.0e-6)
+
+def test_cr_stack_psf_fft_1():
+    """
+    Test the PSF FFT CRStack against calcCRBound3D().
+    """
+    cr_psf_object = makePSFFFT()
+    checkBounds(cr_psf_object)
+    cr_psf_object.cleanup()
+
+def test_cr_stack_spline_1():
+    """
+    Test that the C spline grid values match the Python spline values.
+    """
+    cr_psf_object = makeSpline()
+    [psfs, dxs, dys, dzs] = cr_psf_object.getPSFAndDerivatives([-100.0, 200.0])
+    for i, z in enumerate([-100.0, 200.0]):
+        assert numpy.allclose(psfs[i], cr_psf_object.getPSF(z))
+        assert numpy.allclose(dxs[i], cr_psf_object.getDx(z))
+        assert numpy.allclose(dys[i], cr_psf_object.getDy(z))
+        assert numpy.allclose(dzs[i], cr_psf_object.getDz(z))
+    cr_psf_object.cleanup()
+
+def test_cr_stack_spline_2():
+    """
+    Test the spline CRStack against calcCRBound3D().
+    """
+    cr_psf_object = makeSpline()
+    checkBounds(cr_psf_object)
+    cr_psf_object.cleanup()
+
+def test_cr_stack_cache_1():
+    """
+    Test caching CRStacks.
+    """
+    cache_dir = storm_analysis.getPathOutputTest("test_cr_cache")
+    if os.path.exists(cache_dir):
+        for elt in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, elt))
+
+    cr_psf_object = makePSFFFT()
+    z_values = numpy.linspace(-400.0, 400.0, 9)
+    cr_stack1 = splinerCramerRao.loadCRStack(cr_psf_object, z_values, cache_dir = cache_dir)
+    assert (len(os.listdir(cache_dir)) == 1)
+
+    cr_stack2 = splinerCramerRao.loadCRStack(cr_psf_object, z_values, cache_dir = cache_dir)
+    assert numpy.allclose(cr_stack1.getZValues(), cr_stack2.getZValues())
+    assert numpy.allclose(cr_stack1.calcCRBounds([10.0], [1000.0]),
+                          cr_stack2.calcCRBounds([10.0], [1000.0]))
+
+    # Different z values are a different entry.
+    splinerCramerRao.loadCRStack(cr_psf_object, z_values[1:], cache_dir = cache_dir)
+    assert (len(os.listdir(cache_dir)) == 2)
+    cr_psf_object.cleanup()
+
+
+if (__name__ == "__main__"):
+    test_cr_stack_psf_fft_1()
+    test_cr_stack_spline_1()
+    test_cr_stack_spline_2()
+    test_cr_stack_cache_1()
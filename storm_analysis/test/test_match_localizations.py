@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Tests of ground truth matching and scoring.
+"""
+import numpy
+
+import storm_analysis
+
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.writeinsight3 as writeinsight3
+
+import storm_analysis.sa_utilities.finding_fitting_error as ffe
+import storm_analysis.sa_utilities.match_localizations as matchLocalizations
+import storm_analysis.sa_utilities.recall_fraction as rfrac
+
+
+def makeTestData(truth_name, measured_name):
+    """
+    Measured localizations are the truth localizations plus some
+    noise, with some localizations missing and some false positives.
+    """
+    numpy.random.seed(0)
+    n_frames = 20
+    n_locs = 50
+
+    t_data = i3dtype.createDefaultI3Data(n_frames * n_locs)
+    i3dtype.posSet(t_data, "x", numpy.random.uniform(high = 100.0, size = t_data.size))
+    i3dtype.posSet(t_data, "y", numpy.random.uniform(high = 100.0, size = t_data.size))
+    i3dtype.posSet(t_data, "z", numpy.random.uniform(low = -200.0, high = 200.0, size = t_data.size))
+    i3dtype.setI3Field(t_data, "fr", numpy.arange(t_data.size)//n_locs + 1)
+
+    mask = (numpy.random.uniform(size = t_data.size) > 0.2)
+    m_data = i3dtype.maskData(t_data.copy(), mask)
+    for elt in ["x", "y"]:
+        i3dtype.posSet(m_data, elt, m_data[elt] + numpy.random.normal(scale = 0.1, size = m_data.size))
+
+    n_fp = 100
+    fp_data = i3dtype.createDefaultI3Data(n_fp)
+    i3dtype.posSet(fp_data, "x", numpy.random.uniform(high = 100.0, size = n_fp))
+    i3dtype.posSet(fp_data, "y", numpy.random.uniform(high = 100.0, size = n_fp))
+    i3dtype.setI3Field(fp_data, "fr", numpy.random.randint(1, n_frames + 1, size = n_fp))
+
+    m_data = numpy.concatenate((m_data, fp_data))
+    m_data = m_data[numpy.argsort(m_data['fr'], kind = "mergesort")]
+
+    with writeinsight3.I3Writer(truth_name) as i3w:
+        i3w.addMolecules(t_data)
+    with writeinsight3.I3Writer(measured_name) as i3w:
+        i3w.addMolecules(m_data)
+
+    return [t_data, m_data]
+
+def test_match_1():
+    """
+    Test recall and noise against a frame by frame calculation.
+    """
+    truth_name = storm_analysis.getPathOutputTest("test_match_truth.bin")
+    measured_name = storm_analysis.getPathOutputTest("test_match_measured.bin")
+    [t_data, m_data] = makeTestData(truth_name, measured_name)
+
+    tolerance = 0.5
+    recalled = 0
+    noise = 0
+    for i in range(20):
+        t_locs = t_data[(t_data['fr'] == i+1)]
+        m_locs = m_data[(m_data['fr'] == i+1)]
+        dist = utilC.peakToPeakDist(t_locs['xc'], t_locs['yc'], m_locs['xc'], m_locs['yc'])
+        recalled += numpy.count_nonzero(dist < tolerance)
+        dist = utilC.peakToPeakDist(m_locs['xc'], m_locs['yc'], t_locs['xc'], t_locs['yc'])
+        noise += numpy.count_nonzero(dist > tolerance)
+
+    truth_i3 = readinsight3.I3Reader(truth_name)
+    measured_i3 = readinsight3.I3Reader(measured_name)
+
+    assert (rfrac.recallFraction(truth_i3, measured_i3, tolerance) == [recalled, t_data.size])
+    assert (rfrac.noiseFraction(truth_i3, measured_i3, tolerance) == [noise, m_data.size])
+
+    results = matchLocalizations.scoreFiles(truth_name, measured_name, tolerance)
+    assert (results["n_recalled"] == recalled)
+    assert (results["n_noise"] == noise)
+    assert (abs(results["rmse_x"] - 16.0) < 2.0)
+    assert (abs(results["rmse_y"] - 16.0) < 2.0)
+    assert (numpy.sum(results["hist_dx"]) == results["n_matched"])
+
+def test_match_2():
+    """
+    Test finding fitting error.
+    """
+    truth_name = storm_analysis.getPathOutputTest("test_match_truth.bin")
+    measured_name = storm_analysis.getPathOutputTest("test_match_measured.bin")
+    [t_data, m_data] = makeTestData(truth_name, measured_name)
+
+    all_dx = []
+    all_dy = []
+    all_dz = []
+    for i in range(20):
+        t_locs = t_data[(t_data['fr'] == i+1)]
+        m_locs = m_data[(m_data['fr'] == i+1)]
+        p_index = utilC.peakToPeakIndex(m_locs['xc'], m_locs['yc'], t_locs['xc'], t_locs['yc'])
+        all_dx.append(160.0 * (m_locs['xc'] - t_locs['xc'][p_index]))
+        all_dy.append(160.0 * (m_locs['yc'] - t_locs['yc'][p_index]))
+        all_dz.append(m_locs['zc'] - t_locs['zc'][p_index])
+    all_dx = numpy.concatenate(all_dx)
+    all_dy = numpy.concatenate(all_dy)
+    all_dz = numpy.concatenate(all_dz)
+
+    truth_i3 = readinsight3.I3Reader(truth_name)
+    measured_i3 = readinsight3.I3Reader(measured_name)
+
+    [dx, dy, dz] = ffe.findingFittingError(truth_i3, measured_i3)
+    assert numpy.allclose(dx, all_dx)
+    assert numpy.allclose(dy, all_dy)
+    assert numpy.allclose(dz, all_dz)
+
+    [dx, dy, dz] = ffe.findingFittingError(truth_i3, measured_i3, max_distance = 100.0)
+    mask = ((all_dx*all_dx + all_dy*all_dy + all_dz*all_dz) < 1.0e4)
+    assert (dx.size < all_dx.size)
+    assert numpy.allclose(dx, all_dx[mask])
+
+def test_match_hungarian():
+    """
+    Test one-to-one matching.
+    """
+    t_data = i3dtype.createDefaultI3Data(4)
+    i3dtype.posSet(t_data, "x", numpy.array([10.0, 10.6, 20.0, 10.0]))
+    i3dtype.posSet(t_data, "y", numpy.array([10.0, 10.0, 20.0, 10.0]))
+    i3dtype.setI3Field(t_data, "fr", numpy.array([1, 1, 1, 2]))
+
+    m_data = i3dtype.createDefaultI3Data(3)
+    i3dtype.posSet(m_data, "x", numpy.array([10.2, 10.4, 10.0]))
+    i3dtype.posSet(m_data, "y", numpy.array([10.0, 10.0, 10.0]))
+    i3dtype.setI3Field(m_data, "fr", numpy.array([1, 1, 3]))
+
+    # Nearest neighbor, both measured localizations are matched to the first truth localization.
+    results = matchLocalizations.scoreLocalizations(t_data, m_data, 0.5)
+    assert (results["n_recalled"] == 2)
+    assert (results["n_noise"] == 1)
+
+    [t_index, m_index, dist] = matchLocalizations.hungarianMatch(t_data, m_data, 0.5)
+    order = numpy.argsort(t_index)
+    assert numpy.array_equal(t_index[order], numpy.array([0, 1]))
+    assert numpy.array_equal(m_index[order], numpy.array([0, 1]))
+    assert numpy.allclose(dist[order], numpy.array([0.2, 0.2]))
+
+    results = matchLocalizations.scoreLocalizations(t_data, m_data, 0.5, hungarian = True)
+    assert (results["n_recalled"] == 2)
+    assert (results["n_noise"] == 1)
+    assert (abs(results["recall"] - 0.5) < 1.0e-6)
+
+
+if (__name__ == "__main__"):
+    test_match_1()
+    test_match_2()
+    test_match_hungarian()
@@ -5,7 +5,10 @@ Tests for sa_library.matched_filter_c.py
 Hazen 06/17
 """
 import numpy
+import os
 
+import storm_analysis.sa_library.fftw_threads_c as fftwThreadsC
+import storm_analysis.sa_library.incremental_filter as incrementalFilter
 import storm_analysis.sa_library.matched_filter_c as matchedFilterC
 import storm_analysis.simulator.draw_gaussians_c as dg
 
@@ -58,9 +61,140 @@ def test_matched_filter2():
 
     # Verify that final height is 'close enough'.
     assert (abs(numpy.amax(conv) * rescale - height)/height < 1.0e-2)
+
+def test_matched_filter3():
+    """
+    Test that multi-threaded FFTs give the same results.
+    """
+    x_size = 200
+    y_size = 210
+
+    objects = numpy.zeros((1, 5))
+    objects[0,:] = [x_size/2, y_size/2, 1.0, 1.0, 1.0]
+    psf = dg.drawGaussians((x_size, y_size), objects)
+    psf = psf/numpy.sum(psf)
+
+    image = numpy.random.uniform(size = (x_size, y_size))
+
+    flt1 = matchedFilterC.MatchedFilter(psf, estimate_fft_plan = True)
+    conv1 = flt1.convolve(image)
+
+    old_threads = fftwThreadsC.getRequestedThreads()
+    old_workers = fftwThreadsC.workers
+    old_env = os.environ.copy()
+    try:
+        n_threads = fftwThreadsC.setThreads(4)
+        if fftwThreadsC.hasThreads():
+            assert (n_threads == 4)
+
+            # The threads are divided between the workers.
+            assert (fftwThreadsC.initWorker(2, 4) == 2)
+            assert (fftwThreadsC.setThreads(3) == 1)
+        else:
+            assert (n_threads == 1)
+
+        # The setting is not saved in the environment, it is only
+        # passed to the worker processes.
+        assert (os.environ == old_env)
+        env = fftwThreadsC.workerEnvironment(3)
+        assert (env[fftwThreadsC.threads_env_name] == "3")
+        assert (int(env[fftwThreadsC.workers_env_name]) == 3 * fftwThreadsC.workers)
+
+        fftwThreadsC.workers = old_workers
+        fftwThreadsC.setThreads(4)
+        flt2 = matchedFilterC.MatchedFilter(psf, estimate_fft_plan = True)
+        conv2 = flt2.convolve(image)
+    finally:
+        fftwThreadsC.workers = old_workers
+        fftwThreadsC.setThreads(old_threads)
+
+    assert numpy.allclose(conv1, conv2)
+
+    flt1.cleanup()
+    flt2.cleanup()
+
+def test_matched_filter4():
+    """
+    Test that a filter bank gives the same results as individual filters.
+    """
+    x_size = 80
+    y_size = 90
+
+    objects = numpy.zeros((1, 5))
+
+    psfs = []
+    for sigma in [1.0, 1.5, 2.0]:
+        objects[0,:] = [x_size/2, y_size/2, 1.0, sigma, sigma]
+        psf = dg.drawGaussians((x_size, y_size), objects)
+        psfs.append(psf/numpy.sum(psf))
+
+    image = numpy.random.uniform(size = (x_size, y_size))
+
+    fb = matchedFilterC.MatchedFilterBank(psfs)
+    assert (fb.getNFilters() == 3)
+    
+    convs = fb.convolve(image)
+    assert (convs.shape == (3, x_size, y_size))
+    
+    for i, psf in enumerate(psfs):
+        flt = matchedFilterC.MatchedFilter(psf)
+        assert numpy.allclose(convs[i], flt.convolve(image))
+        flt.cleanup()
+
+    fb.cleanup()
+
+def test_matched_filter5():
+    """
+    Test that incremental filter updates give the same results as the full convolution.
+    """
+    x_size = 120
+    y_size = 130
+
+    objects = numpy.zeros((1, 5))
+
+    psfs = []
+    for sigma in [1.0, 3.0]:
+        objects[0,:] = [x_size/2, y_size/2, 1.0, sigma, sigma]
+        psf = dg.drawGaussians((x_size, y_size), objects)
+        psfs.append(psf/numpy.sum(psf))
+
+    flt = matchedFilterC.MatchedFilter(psfs[0])
+    fb = matchedFilterC.MatchedFilterBank(psfs)
+    i_flt = incrementalFilter.IncrementalFilter(mfilter = matchedFilterC.MatchedFilter(psfs[0]),
+                                                psfs = psfs[0],
+                                                tile_size = 16)
+    i_fb = incrementalFilter.IncrementalFilter(mfilter = matchedFilterC.MatchedFilterBank(psfs),
+                                               psfs = psfs,
+                                               tile_size = 16)
+
+    image = numpy.random.uniform(size = (x_size, y_size))
+    for i in range(4):
+
+        # Change small areas, including at the edges of the image.
+        if (i > 0):
+            image[2:8,120:128] += numpy.random.uniform(size = (6, 8))
+            image[60:70,40:45] += numpy.random.uniform(size = (10, 5))
+            
+        assert numpy.allclose(i_flt.convolve(image), flt.convolve(image))
+        assert numpy.allclose(i_fb.convolve(image), fb.convolve(image))
+
+    # One full convolution, the others were incremental.
+    assert (i_flt.getStats() == [1, 3])
+    assert (i_fb.getStats() == [1, 3])
+
+    # The filters start again with a new image.
+    i_fb.reset()
+    i_fb.convolve(image)
+    assert (i_fb.getStats() == [2, 3])
+
+    for elt in [flt, fb, i_flt, i_fb]:
+        elt.cleanup()
     
 
 if (__name__ == "__main__"):
     test_matched_filter1()
     test_matched_filter2()
+    test_matched_filter3()
+    test_matched_filter4()
+    test_matched_filter5()
 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+Tests for multi_plane.analysis_io
+"""
+
+import numpy
+import os
+
+import storm_analysis
+
+import storm_analysis.sa_library.analysis_io as analysisIO
+import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.sa_library.parameters as params
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.static_background as static_background
+
+import storm_analysis.multi_plane.analysis_io as mpAnalysisIO
+import storm_analysis.multi_plane.channel_join as channelJoin
+
+
+class FakeMovieReader(object):
+    """
+    Just enough of a movie reader for the data writer.
+    """
+    def __init__(self, **kwds):
+        super(FakeMovieReader, self).__init__(**kwds)
+        self.cur_frame = 0
+
+    def getCurrentFrameNumber(self):
+        return self.cur_frame
+
+    def getMovieX(self):
+        return 256
+
+    def getMovieY(self):
+        return 256
+
+
+def createParameters(n_planes):
+    """
+    Create the parameters and calibration files for a multi-plane test
+    using the (256 x 256) test movies as the planes.
+    """
+    base_name = storm_analysis.getData("test/data/test")
+    exts = [".dax", "_bg_sub.dax", "_spliner.dax"]
+    parameters = params.ParametersMultiplane()
+
+    for i in range(n_planes):
+        cal_name = storm_analysis.getPathOutputTest("test_mp_io_cal" + str(i) + ".npy")
+        offset = 100.0 * numpy.ones((256, 256))
+        variance = numpy.ones((256, 256))
+        gain = numpy.random.uniform(low = 1.0, high = 3.0, size = (256, 256))
+        numpy.save(cal_name, [offset, variance, gain])
+
+        parameters.setAttr("channel" + str(i) + "_cal", "filename", cal_name)
+        parameters.setAttr("channel" + str(i) + "_ext", "string", exts[i])
+        parameters.setAttr("channel" + str(i) + "_offset", "int", i)
+
+    return [base_name, parameters]
+
+def checkReader(base_name, parameters, n_planes, prefetch):
+    """
+    Compare the multi-plane reader to loading the planes one at a time.
+    """
+    mp_reader = mpAnalysisIO.MPMovieReader(base_name = base_name,
+                                           parameters = parameters,
+                                           prefetch = prefetch)
+    mp_reader.setup(0)
+
+    readers = []
+    bg_estimators = []
+    for i in range(n_planes):
+        readers.append(analysisIO.FrameReaderSCMOS(movie_file = base_name + parameters.getAttr("channel" + str(i) + "_ext"),
+                                                   calibration_file = parameters.getAttr("channel" + str(i) + "_cal")))
+        if parameters.hasAttr("static_background_estimate"):
+            bg_estimators.append(static_background.StaticBGEstimator(readers[i],
+                                                                     start_frame = i,
+                                                                     sample_size = parameters.getAttr("static_background_estimate")))
+
+    n_frames = 0
+    while mp_reader.nextFrame():
+        cur_frame = mp_reader.getCurrentFrameNumber() - 1
+        for i in range(n_planes):
+            frame = readers[i].loadAFrame(cur_frame + i)
+            frame[(frame < 1.0)] = 1.0
+            assert numpy.allclose(mp_reader.getFrame(i), frame)
+
+            if (len(bg_estimators) > 0):
+                assert numpy.allclose(mp_reader.getBackground(i), bg_estimators[i].estimateBG(cur_frame + i))
+            else:
+                assert (mp_reader.getBackground(i) is None)
+        n_frames += 1
+
+    mp_reader.close()
+    return n_frames
+
+def writeFrames(data_writer, n_planes, start, stop):
+    """
+    Add localizations for frames start to stop, the number of localizations
+    (and their heights) depend on the frame.
+    """
+    movie_reader = FakeMovieReader()
+    for i in range(start, stop):
+        movie_reader.cur_frame = i + 1
+        n_peaks = i % 4
+        peaks = numpy.zeros((n_planes * n_peaks, utilC.getNPeakPar()))
+        peaks[:,utilC.getHeightIndex()] = i + 0.1 * numpy.arange(n_planes * n_peaks)
+        peaks[:,utilC.getXWidthIndex()] = 1.0
+        peaks[:,utilC.getYWidthIndex()] = 1.0
+        data_writer.addPeaks(peaks, movie_reader)
+
+def test_mp_data_writer_1():
+    """
+    Test writing one file per plane and a combined file.
+    """
+    [base_name, parameters] = createParameters(3)
+    parameters.setAttr("pixel_size", "float", 100.0)
+    parameters.setAttr("write_buffer", "int", 5)
+
+    mlist_name = storm_analysis.getPathOutputTest("test_mp_io_mlist.bin")
+    combined_name = storm_analysis.getPathOutputTest("test_mp_io_combined.bin")
+    for fname in [mlist_name, combined_name]:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+    data_writer = mpAnalysisIO.MPDataWriter(data_file = mlist_name, parameters = parameters)
+    writeFrames(data_writer, 3, 0, 20)
+    data_writer.close()
+
+    parameters.setAttr("combined_channels", "int", 1)
+    data_writer = mpAnalysisIO.MPDataWriter(data_file = combined_name, parameters = parameters)
+    writeFrames(data_writer, 3, 0, 20)
+    data_writer.close()
+    assert (data_writer.getTotalPeaks() == 30)
+    assert (channelJoin.combinedChannels(combined_name) == 3)
+    assert (channelJoin.combinedChannels(mlist_name) == 0)
+
+    names = [mlist_name, mlist_name[:-4] + "_ch1.bin", mlist_name[:-4] + "_ch2.bin"]
+    for i, name in enumerate(names):
+        i3_data = readinsight3.loadI3File(name)
+        assert (i3_data.size == 30)
+        assert numpy.allclose(i3_data['fr'] - i, numpy.repeat(numpy.arange(20) + 1, numpy.arange(20) % 4))
+
+    with channelJoin.ChannelJoin([combined_name], block_size = 7) as join:
+        assert (join.getNumberChannels() == 3)
+        for i, elt in enumerate(channelJoin.joinField(join.nextBlock(), 'lk').transpose()):
+            assert numpy.all(elt == i)
+
+    x = []
+    for layout in [names, [combined_name]]:
+        with channelJoin.ChannelJoin(layout, block_size = 30) as join:
+            x.append(channelJoin.joinField(join.nextBlock(), 'h'))
+    assert numpy.allclose(x[0], x[1])
+
+def test_mp_data_writer_2():
+    """
+    Test resuming an analysis.
+    """
+    [base_name, parameters] = createParameters(2)
+    parameters.setAttr("pixel_size", "float", 100.0)
+    parameters.setAttr("write_buffer", "int", 4)
+
+    for combined in [0, 1]:
+        parameters.setAttr("combined_channels", "int", combined)
+
+        ref_name = storm_analysis.getPathOutputTest("test_mp_io_ref.bin")
+        mlist_name = storm_analysis.getPathOutputTest("test_mp_io_mlist.bin")
+        for fname in [ref_name, mlist_name]:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+        data_writer = mpAnalysisIO.MPDataWriter(data_file = ref_name, parameters = parameters)
+        writeFrames(data_writer, 2, 0, 20)
+        data_writer.close()
+
+        data_writer = mpAnalysisIO.MPDataWriter(data_file = mlist_name, parameters = parameters)
+        writeFrames(data_writer, 2, 0, 11)
+        data_writer.close()
+
+        # The last frame with localizations is analyzed again.
+        data_writer = mpAnalysisIO.MPDataWriter(data_file = mlist_name, parameters = parameters)
+        assert (data_writer.getStartFrame() == 10)
+        assert (data_writer.getTotalPeaks() == 13)
+        writeFrames(data_writer, 2, data_writer.getStartFrame(), 20)
+        data_writer.close()
+
+        if combined:
+            pairs = [[ref_name, mlist_name]]
+        else:
+            pairs = [[ref_name, mlist_name], [ref_name[:-4] + "_ch1.bin", mlist_name[:-4] + "_ch1.bin"]]
+        for [name1, name2] in pairs:
+            assert numpy.array_equal(readinsight3.loadI3File(name1), readinsight3.loadI3File(name2))
+
+def test_mp_data_writer_3():
+    """
+    Test resuming from a combined file that was not closed properly.
+    """
+    [base_name, parameters] = createParameters(2)
+    parameters.setAttr("combined_channels", "int", 1)
+    parameters.setAttr("pixel_size", "float", 100.0)
+    parameters.setAttr("write_buffer", "int", 4)
+
+    ref_name = storm_analysis.getPathOutputTest("test_mp_io_ref.bin")
+    mlist_name = storm_analysis.getPathOutputTest("test_mp_io_mlist.bin")
+    for fname in [ref_name, mlist_name]:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+    data_writer = mpAnalysisIO.MPDataWriter(data_file = ref_name, parameters = parameters)
+    writeFrames(data_writer, 2, 0, 20)
+    data_writer.close()
+
+    # Stop without closing the file.
+    data_writer = mpAnalysisIO.MPDataWriter(data_file = mlist_name, parameters = parameters)
+    writeFrames(data_writer, 2, 0, 11)
+    data_writer.flush()
+    data_writer.i3_writers[0].fp.close()
+    assert not readinsight3.checkStatus(mlist_name)
+
+    data_writer = mpAnalysisIO.MPDataWriter(data_file = mlist_name, parameters = parameters)
+    assert (data_writer.getStartFrame() == 10)
+    assert (data_writer.getTotalPeaks() == 13)
+    writeFrames(data_writer, 2, data_writer.getStartFrame(), 20)
+    data_writer.close()
+
+    assert numpy.array_equal(readinsight3.loadI3File(ref_name), readinsight3.loadI3File(mlist_name))
+
+    # Resuming with a different number of channels is an error.
+    parameters.setAttr("channel2_ext", "string", "_spliner.dax")
+    try:
+        mpAnalysisIO.MPDataWriter(data_file = mlist_name, parameters = parameters)
+    except channelJoin.ChannelJoinException:
+        return
+    assert False, "No exception."
+
+def test_mp_movie_reader_1():
+    """
+    Test loading with and without prefetching.
+    """
+    [base_name, parameters] = createParameters(3)
+    parameters.setAttr("max_frame", "int", 3)
+
+    for prefetch in [False, True]:
+        assert (checkReader(base_name, parameters, 3, prefetch) == 3)
+
+def test_mp_movie_reader_2():
+    """
+    Test loading with a static background estimate.
+    """
+    [base_name, parameters] = createParameters(2)
+    parameters.setAttr("max_frame", "int", 4)
+    parameters.setAttr("static_background_estimate", "int", 2)
+
+    assert (checkReader(base_name, parameters, 2, True) == 4)
+
+
+if (__name__ == "__main__"):
+    test_mp_data_writer_1()
+    test_mp_data_writer_2()
+    test_mp_data_writer_3()
+    test_mp_movie_reader_1()
+    test_mp_movie_reader_2()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+Tests for multi_plane.channel_join and the modules that use it.
+"""
+
+import numpy
+import os
+import pickle
+import scipy
+import scipy.cluster
+
+import storm_analysis
+
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.parameters as params
+import storm_analysis.sa_library.readinsight3 as readinsight3
+import storm_analysis.sa_library.writeinsight3 as writeinsight3
+
+import storm_analysis.multi_plane.batch_heights as batchHeights
+import storm_analysis.multi_plane.channel_join as channelJoin
+import storm_analysis.multi_plane.kmeans_classifier as kmeansClassifier
+import storm_analysis.multi_plane.merge_heights as mergeHeights
+import storm_analysis.multi_plane.split_peaks as splitPeaks
+
+
+def makeChannelFiles(basename, extensions, n_localizations, bad = True):
+    """
+    Create aligned localization files with random heights. Some of the
+    localizations in each channel (but not the same ones) are bad.
+    """
+    numpy.random.seed(0)
+    names = []
+    for i, ext in enumerate(extensions):
+        i3_data = i3dtype.createDefaultI3Data(n_localizations)
+        i3dtype.posSet(i3_data, 'x', numpy.arange(n_localizations))
+        i3dtype.setI3Field(i3_data, 'h', numpy.random.uniform(low = 100.0, high = 1000.0, size = n_localizations))
+        if bad:
+            i3_data['c'][(i+1)::7] = 9
+
+        names.append(basename + ext)
+        with writeinsight3.I3Writer(names[-1]) as i3_out:
+            i3_out.addMolecules(i3_data)
+    return names
+
+def test_batch_heights_1():
+    """
+    Test measuring the heights starting from a combined file.
+    """
+    numpy.random.seed(0)
+    n_frames = 20
+    n_molecules = 50
+    x = numpy.random.uniform(low = 10.0, high = 90.0, size = n_molecules)
+    y = numpy.random.uniform(low = 10.0, high = 90.0, size = n_molecules)
+    h = numpy.random.uniform(low = 100.0, high = 1000.0, size = (n_molecules, 2))
+
+    # The same molecules are on in every frame.
+    i3_data = []
+    for i in range(2):
+        data = i3dtype.createDefaultI3Data(n_frames * n_molecules)
+        i3dtype.posSet(data, 'x', numpy.tile(x, n_frames))
+        i3dtype.posSet(data, 'y', numpy.tile(y, n_frames))
+        i3dtype.setI3Field(data, 'fr', numpy.repeat(numpy.arange(n_frames) + 1, n_molecules))
+        i3dtype.setI3Field(data, 'h', numpy.tile(h[:,i], n_frames))
+        i3_data.append(data)
+
+    basename = storm_analysis.getPathOutputTest("test_mp_bh_")
+    with channelJoin.combinedWriter(basename + "mlist.bin", 2) as i3_out:
+        i3_out.addMolecules(channelJoin.combineChannels(i3_data))
+
+    parameters = params.ParametersMultiplane()
+    parameters.setAttr("descriptor", "string", "1")
+    parameters.setAttr("radius", "float", 0.5)
+    parameters.setAttr("drift_correction", "int", 1)
+    parameters.setAttr("frame_step", "int", 5)
+    parameters.setAttr("d_scale", "int", 2)
+
+    drift_name = basename + "drift.txt"
+    if os.path.exists(drift_name):
+        os.remove(drift_name)
+
+    batchHeights.measureColor(basename, 2, parameters = parameters)
+
+    assert os.path.exists(drift_name)
+
+    # Each molecule should be a single track in each channel.
+    for i in range(2):
+        alist = readinsight3.loadI3File(basename + "alist_ch" + str(i) + ".bin")
+        assert (alist.size == n_molecules)
+
+    # Averaging sums the heights of the localizations in a track.
+    heights = numpy.load(basename + "heights.npy")
+    assert (heights.shape == (n_molecules, 2))
+    order = numpy.argsort(heights[:,0])
+    assert numpy.allclose(heights[order], n_frames * h[numpy.argsort(h[:,0])], rtol = 1.0e-5)
+
+def test_batch_heights_2():
+    """
+    Test that combined files require the analysis parameters.
+    """
+    basename = storm_analysis.getPathOutputTest("test_mp_bh_")
+    names = makeChannelFiles(basename, ["_ch0.bin", "_ch1.bin"], 10)
+    with channelJoin.combinedWriter(basename + "mlist.bin", 2) as i3_out:
+        i3_out.addMolecules(channelJoin.combineChannels([readinsight3.loadI3File(name) for name in names]))
+
+    try:
+        batchHeights.measureColor(basename, 2)
+    except ValueError:
+        return
+    assert False, "No exception."
+
+def test_channel_join_1():
+    """
+    Test that the blocks from each channel line up.
+    """
+    extensions = [".bin", "_ch1.bin", "_ch2.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 100)
+
+    good = numpy.ones(100, dtype = bool)
+    for name in names:
+        good = good & (readinsight3.loadI3File(name)['c'] != 9)
+
+    for block_size in [7, 50, 1000]:
+        with channelJoin.ChannelJoin(names, block_size = block_size) as join:
+            assert (join.getNumberChannels() == 3)
+            x = []
+            for i3_data in join:
+                for elt in i3_data:
+                    assert numpy.array_equal(elt['x'], i3_data[0]['x'])
+                x.append(i3_data[0]['x'])
+            assert numpy.allclose(numpy.concatenate(x), numpy.arange(100)[good])
+
+def test_channel_join_2():
+    """
+    Test that files with different numbers of localizations are rejected.
+    """
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, [".bin"], 100)
+    names += makeChannelFiles(basename, ["_ch1.bin"], 99)
+
+    try:
+        channelJoin.ChannelJoin(names)
+    except channelJoin.ChannelJoinException:
+        return
+    assert False, "No exception."
+
+def test_combined_1():
+    """
+    Test reading, merging the heights of and splitting a combined file.
+    """
+    extensions = [".bin", "_ch1.bin", "_ch2.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 100)
+    assert (channelJoin.combinedChannels(names[0]) == 0)
+
+    combined_name = storm_analysis.getPathOutputTest("test_mp_cj_combined.bin")
+    with channelJoin.combinedWriter(combined_name, 3) as i3_out:
+        i3_out.addMolecules(channelJoin.combineChannels([readinsight3.loadI3File(name) for name in names]))
+    assert (channelJoin.combinedChannels(combined_name) == 3)
+
+    # Blocks should match the per channel files (except for 'lk').
+    with channelJoin.ChannelJoin(names, block_size = 30) as join1:
+        with channelJoin.ChannelJoin([combined_name], block_size = 30) as join2:
+            assert (join2.getNumberChannels() == 3)
+            assert (join2.getNumberMolecules() == 100)
+            for [i3_data1, i3_data2] in zip(join1, join2):
+                for f in ['x', 'h', 'c']:
+                    assert numpy.array_equal(channelJoin.joinField(i3_data1, f), channelJoin.joinField(i3_data2, f))
+
+    heights_name = storm_analysis.getPathOutputTest("test_mp_cj_heights.npy")
+    mergeHeights.mergeHeights(heights_name, [combined_name], block_size = 30)
+    heights = numpy.load(heights_name)
+    assert (heights.shape == (100, 3))
+    for i, name in enumerate(names):
+        assert numpy.allclose(heights[:,i], readinsight3.loadI3File(name)['h'])
+
+    split_names = [storm_analysis.getPathOutputTest("test_mp_cj_split" + str(i) + ".bin") for i in range(3)]
+    channelJoin.splitChannels(combined_name, split_names, block_size = 30)
+    for [name1, name2] in zip(names, split_names):
+        assert numpy.array_equal(readinsight3.loadI3File(name1), readinsight3.loadI3File(name2))
+
+def test_combined_2():
+    """
+    Test recognizing combined files.
+    """
+    extensions = [".bin", "_ch1.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 100)
+    i3_data = [readinsight3.loadI3File(name) for name in names]
+
+    # A file that was not closed properly.
+    combined_name = storm_analysis.getPathOutputTest("test_mp_cj_combined.bin")
+    i3_out = channelJoin.combinedWriter(combined_name, 2)
+    i3_out.addMolecules(channelJoin.combineChannels(i3_data))
+    i3_out.fp.flush()
+    assert (channelJoin.combinedChannels(combined_name) == 2)
+    i3_out.close()
+    assert (channelJoin.combinedChannels(combined_name) == 2)
+
+    # A per channel file with labels (for example from clustering) in 'lk'.
+    labels_name = storm_analysis.getPathOutputTest("test_mp_cj_labels.bin")
+    i3_data[0]['lk'] = numpy.arange(100)
+    with writeinsight3.I3Writer(labels_name) as i3_out:
+        i3_out.addMolecules(i3_data[0])
+    assert (channelJoin.combinedChannels(labels_name) == 0)
+
+def test_merge_heights_1():
+    """
+    Test merging heights in blocks.
+    """
+    extensions = [".bin", "_ch1.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 100)
+    heights_name = storm_analysis.getPathOutputTest("test_mp_cj_heights.npy")
+
+    mergeHeights.mergeHeights(heights_name, names, block_size = 30)
+
+    heights = numpy.load(heights_name)
+    assert (heights.shape == (100, 2))
+    for i, name in enumerate(names):
+        assert numpy.allclose(heights[:,i], readinsight3.loadI3File(name)['h'])
+
+def test_merge_heights_2():
+    """
+    Test that the .npy extension is added to the heights file name.
+    """
+    extensions = [".bin", "_ch1.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 100)
+    heights_name = storm_analysis.getPathOutputTest("test_mp_cj_heights_ext")
+    if os.path.exists(heights_name + ".npy"):
+        os.remove(heights_name + ".npy")
+
+    mergeHeights.mergeHeights(heights_name, names)
+
+    assert not os.path.exists(heights_name)
+    heights = numpy.load(heights_name + ".npy")
+    assert (heights.shape == (100, 2))
+
+def test_split_peaks_1():
+    """
+    Test splitting peaks from a per channel file and from a combined file.
+    """
+    extensions = [".bin", "_ch1.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 100)
+
+    mappings = {"0_1_x" : numpy.array([2.0, 1.0, 0.0]),
+                "0_1_y" : numpy.array([0.0, 0.0, 1.0])}
+    mapping_name = storm_analysis.getPathOutputTest("test_mp_cj_map.map")
+    with open(mapping_name, 'wb') as fp:
+        pickle.dump(mappings, fp)
+
+    parameters = params.ParametersMultiplane()
+    parameters.setAttr("mapping", "filename", mapping_name)
+    parameters.setAttr("channel0_offset", "int", 0)
+    parameters.setAttr("channel1_offset", "int", 1)
+    params_name = storm_analysis.getPathOutputTest("test_mp_cj_params.xml")
+    parameters.toXMLFile(params_name)
+
+    # The 'lk' field is 0 in the first localizations of this file, it
+    # should not be mistaken for a combined file.
+    i3_data = readinsight3.loadI3File(names[0])
+    i3_data['lk'] = 0
+    mlist_name = storm_analysis.getPathOutputTest("test_mp_cj_mlist.bin")
+    with writeinsight3.I3Writer(mlist_name) as i3_out:
+        i3_out.addMolecules(i3_data)
+
+    ch0_name = mlist_name[:-4] + "_ch0.bin"
+    ch1_name = mlist_name[:-4] + "_ch1.bin"
+    if os.path.exists(ch0_name):
+        os.remove(ch0_name)
+
+    splitPeaks.splitPeaks(mlist_name, params_name, block_size = 30)
+    assert not os.path.exists(ch0_name)
+    ch1_data = readinsight3.loadI3File(ch1_name)
+    assert numpy.allclose(ch1_data['x'], i3_data['x'] + 2.0)
+    assert numpy.array_equal(ch1_data['fr'], i3_data['fr'] + 1)
+
+    # Combined file, channel 0 is also saved separately.
+    with channelJoin.combinedWriter(mlist_name, 2) as i3_out:
+        i3_out.addMolecules(channelJoin.combineChannels([readinsight3.loadI3File(name) for name in names]))
+
+    splitPeaks.splitPeaks(mlist_name, params_name, block_size = 30)
+    i3_data = readinsight3.loadI3File(names[0])
+    assert numpy.array_equal(readinsight3.loadI3File(ch0_name), i3_data)
+    assert numpy.allclose(readinsight3.loadI3File(ch1_name)['x'], i3_data['x'] + 2.0)
+
+def test_kmeans_classifier_1():
+    """
+    Test that the classification doesn't depend on the block size.
+    """
+    extensions = [".bin", "_ch1.bin", "_ch2.bin"]
+    basename = storm_analysis.getPathOutputTest("test_mp_cj")
+    names = makeChannelFiles(basename, extensions, 200, bad = False)
+    codebook = numpy.array([[1.0, 2.0, 3.0],
+                            [3.0, 2.0, 1.0],
+                            [2.0, 2.0, 2.0]])
+
+    # Expected results, all the data at once.
+    features = numpy.zeros((200, 3))
+    for i, name in enumerate(names):
+        features[:,i] = readinsight3.loadI3File(name)['h']
+    features = scipy.cluster.vq.whiten(kmeansClassifier.normalizeFeatures(features))
+    [category, distance] = scipy.cluster.vq.vq(features, codebook)
+    category[(distance > numpy.percentile(distance, 80))] = 9
+
+    for block_size in [30, 1000]:
+        output_name = storm_analysis.getPathOutputTest("test_mp_cj_kmeans.bin")
+        kmeansClassifier.KMeansClassifier(codebook, basename, output_name, extensions = extensions, block_size = block_size)
+
+        i3_data = readinsight3.loadI3File(output_name)
+        assert numpy.array_equal(i3_data['c'], category)
+        assert numpy.allclose(i3_data['i'], distance, atol = 1.0e-5)
+
+
+if (__name__ == "__main__"):
+    test_batch_heights_1()
+    test_batch_heights_2()
+    test_channel_join_1()
+    test_channel_join_2()
+    test_combined_1()
+    test_combined_2()
+    test_merge_heights_1()
+    test_merge_heights_2()
+    test_split_peaks_1()
+    test_kmeans_classifier_1()
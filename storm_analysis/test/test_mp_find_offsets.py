@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Tests for multi_plane.find_offsets
+"""
+
+import numpy
+
+import storm_analysis.sa_library.matched_filter_c as matchedFilterC
+
+import storm_analysis.multi_plane.find_offsets as findOffsets
+
+import storm_analysis.simulator.draw_gaussians_c as dg
+
+
+def makePSF(size, sigma):
+    psf = dg.drawGaussiansXY((size, size),
+                             numpy.array([0.5*size]),
+                             numpy.array([0.5*size]),
+                             sigma = sigma)
+    return psf/numpy.sum(psf)
+
+def makeFrames(n_frames, size):
+    """
+    Frames with a few bright spots on a varying background.
+    """
+    numpy.random.seed(0)
+    frames = numpy.zeros((n_frames, size, size))
+    for i in range(n_frames):
+        x = numpy.random.uniform(low = 5.0, high = size - 5.0, size = 10)
+        y = numpy.random.uniform(low = 5.0, high = size - 5.0, size = 10)
+        frames[i,:,:] = 20.0 + 500.0 * dg.drawGaussiansXY((size, size), x, y, sigma = 1.5)
+        frames[i,:,:] = numpy.random.poisson(frames[i,:,:] + numpy.linspace(0.0, 20.0, size)[None,:])
+    frames[(frames < 1.0)] = 1.0
+    return frames
+
+def test_stack_background_estimator_1():
+    """
+    Test that the stack background estimator matches estimateBackground().
+    """
+    size = 40
+    bg_psf = makePSF(size, 4.0)
+    fg_psf = makePSF(size, 1.0)
+    frames = makeFrames(3, size)
+
+    bg_filter = matchedFilterC.MatchedFilter(bg_psf)
+    fg_filter = matchedFilterC.MatchedFilter(fg_psf)
+    var_filter = matchedFilterC.MatchedFilter(fg_psf*fg_psf)
+
+    bg_estimator = findOffsets.StackBackgroundEstimator(bg_psf = bg_psf, fg_psf = fg_psf)
+    bgs = bg_estimator.estimateBackground(frames)
+    for i in range(frames.shape[0]):
+        bg = findOffsets.estimateBackground(frames[i], bg_filter, fg_filter, var_filter)
+        assert numpy.allclose(bgs[i], bg)
+
+    bg_filter.cleanup()
+    fg_filter.cleanup()
+    var_filter.cleanup()
+
+def test_limit_tests_1():
+    """
+    Test limiting the number of tests to the movie length.
+    """
+    assert (findOffsets.limitTests([100, 200], 10, 5) == 10)
+    assert (findOffsets.limitTests([100, 15], 10, 5) == 5)
+    assert (findOffsets.limitTests([100, 11], 10, 5) == 1)
+
+    try:
+        findOffsets.limitTests([100, 10], 10, 5)
+    except findOffsets.FindOffsetsException:
+        return
+    assert False, "No exception."
+
+def test_score_offsets_1():
+    """
+    Test that the batched scores match scoring one offset at a time.
+    """
+    n_ref = 4
+    search_range = 2
+    numpy.random.seed(1)
+    ref_frames = numpy.random.normal(size = (n_ref, 10, 12))
+    test_frames = numpy.random.uniform(low = 1.0, high = 2.0, size = (n_ref + 2*search_range, 10, 12))
+
+    scores = findOffsets.scoreOffsets(ref_frames, test_frames, search_range)
+    assert (scores.shape == (n_ref, 2*search_range + 1))
+    for i in range(n_ref):
+        for k in range(-search_range, search_range + 1):
+            test_frame = test_frames[i + k + search_range]
+            corr = numpy.sum(ref_frames[i]*test_frame)/numpy.sum(test_frame)
+            assert numpy.allclose(scores[i, k + search_range], corr)
+
+def test_vote_offsets_1():
+    """
+    Test picking the best offset.
+    """
+    scores = numpy.array([[0.1, 0.5, 0.2],
+                          [-1.0, -0.5, -2.0],
+                          [0.0, 0.0, 3.0]])
+    assert numpy.array_equal(findOffsets.voteOffsets(scores), [1, 0, 2])
+
+
+if (__name__ == "__main__"):
+    test_stack_background_estimator_1()
+    test_limit_tests_1()
+    test_score_offsets_1()
+    test_vote_offsets_1()
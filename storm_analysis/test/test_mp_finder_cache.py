@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Tests for multi_plane.finder_cache
+"""
+import numpy
+import os
+import pickle
+import shutil
+
+import storm_analysis
+
+import storm_analysis.multi_plane.find_peaks_std as findPeaksStd
+import storm_analysis.multi_plane.finder_cache as finderCache
+import storm_analysis.sa_library.fitting as fitting
+import storm_analysis.sa_library.parameters as params
+
+
+class GaussianPSF(object):
+    """
+    A minimal PSF object for creating a MPPeakFinder.
+    """
+    def __init__(self, sigma = None, **kwds):
+        super(GaussianPSF, self).__init__(**kwds)
+        self.sigma = sigma
+
+    def getMargin(self):
+        return 10
+
+    def getPSF(self, z_value, shape = None, normalize = False):
+        return fitting.gaussianPSF(shape, self.sigma + z_value)
+
+    def getScaledZ(self, z_value):
+        return z_value
+
+    def getSize(self):
+        return 20
+
+def noSave(self, **arrays):
+    assert False, "Finder cache miss."
+
+
+def test_finder_cache_1():
+    """
+    Test saving and loading a cache entry.
+    """
+    directory = storm_analysis.getPathOutputTest("mp_finder_cache")
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+
+    variances = [numpy.ones((20, 30)), 2.0 * numpy.ones((20, 30))]
+    xt = [numpy.array([1.0, 1.0, 0.0])]
+    yt = [numpy.array([0.0, 0.0, 1.0])]
+    psfs = [[numpy.ones((20, 30)), numpy.ones((20, 30))]]
+    key = finderCache.finderKey(variances, xt, yt, psfs, 10)
+
+    fcache = finderCache.FinderCache(directory = directory, key = key)
+    assert (fcache.load() is None)
+
+    z_variances = numpy.random.uniform(size = (3, 20, 30))
+    fcache.save(variances = z_variances)
+
+    fcache = finderCache.FinderCache(directory = directory, key = key)
+    data = fcache.load()
+    assert numpy.allclose(data["variances"], z_variances)
+
+def test_finder_cache_2():
+    """
+    Test that the key depends on the calibration, mapping and PSFs.
+    """
+    variances = [numpy.ones((20, 30)), 2.0 * numpy.ones((20, 30))]
+    xt = [numpy.array([1.0, 1.0, 0.0])]
+    yt = [numpy.array([0.0, 0.0, 1.0])]
+    psfs = [[numpy.ones((20, 30)), numpy.ones((20, 30))]]
+    key = finderCache.finderKey(variances, xt, yt, psfs, 10)
+
+    assert (key == finderCache.finderKey(variances, xt, yt, psfs, 10))
+    assert (key != finderCache.finderKey(variances, xt, yt, psfs, 11))
+    assert (key != finderCache.finderKey([variances[0], variances[0]], xt, yt, psfs, 10))
+    assert (key != finderCache.finderKey(variances, [numpy.array([1.5, 1.0, 0.0])], yt, psfs, 10))
+    assert (key != finderCache.finderKey(variances, xt, yt, [[psfs[0][0], 2.0 * psfs[0][1]]], 10))
+
+def test_finder_cache_3():
+    """
+    Test that a second MPPeakFinder with the same setup uses the cache.
+    """
+    directory = storm_analysis.getPathOutputTest("mp_finder_cache")
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+
+    # Identity mapping between the two planes.
+    mappings = {}
+    for elt in ["0_1", "1_0"]:
+        mappings[elt + "_x"] = numpy.array([0.0, 1.0, 0.0])
+        mappings[elt + "_y"] = numpy.array([0.0, 0.0, 1.0])
+
+    mapping_name = storm_analysis.getPathOutputTest("mp_finder_cache_map.map")
+    with open(mapping_name, 'wb') as fp:
+        pickle.dump(mappings, fp)
+
+    parameters = params.ParametersMultiplane()
+    parameters.setAttr("background_sigma", "float", 8.0)
+    parameters.setAttr("find_max_radius", "int", 2)
+    parameters.setAttr("finder_cache", "filename", directory)
+    parameters.setAttr("iterations", "int", 1)
+    parameters.setAttr("mapping", "filename", mapping_name)
+    parameters.setAttr("sigma", "float", 1.5)
+    parameters.setAttr("threshold", "float", 6.0)
+    parameters.setAttr("z_value", "float-array", [-0.2, 0.0, 0.2])
+
+    numpy.random.seed(0)
+    variances = [numpy.random.uniform(low = 1.0, high = 2.0, size = (40, 50)) for i in range(2)]
+    image = numpy.random.uniform(size = (60, 70))
+
+    finders = []
+    for i in range(2):
+        finder = findPeaksStd.MPPeakFinder(parameters = parameters,
+                                           psf_objects = [GaussianPSF(sigma = 1.5), GaussianPSF(sigma = 2.0)])
+
+        # The second finder must load the variances from the cache.
+        if (i == 1):
+            save = finderCache.FinderCache.save
+            finderCache.FinderCache.save = noSave
+        try:
+            finder.setVariances(variances)
+        finally:
+            if (i == 1):
+                finderCache.FinderCache.save = save
+
+        finders.append(finder)
+
+    assert (len(os.listdir(directory)) > 0)
+    for i in range(3):
+        assert numpy.allclose(finders[0].variances[i], finders[1].variances[i])
+    for i in range(2):
+        assert numpy.allclose(finders[0].mfilters[i].convolve(image),
+                              finders[1].mfilters[i].convolve(image))
+        assert numpy.allclose(finders[0].vfilters[i].convolve(image),
+                              finders[1].vfilters[i].convolve(image))
+
+    for finder in finders:
+        finder.cleanUp()
+
+
+if (__name__ == "__main__"):
+    test_finder_cache_1()
+    test_finder_cache_2()
+    test_finder_cache_3()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Tests for multi_plane.mp_fit_c
+"""
+
+import numpy
+
+import storm_analysis
+
+import storm_analysis.diagnostics.multiplane.fit_threads_benchmark as fitThreadsBenchmark
+
+
+def test_mp_fit_threads_1():
+    """
+    Test that threaded fitting gives the same results as serial fitting.
+    """
+    psf_filename = storm_analysis.getPathOutputTest("test_mp_fit_threads.psf")
+    fitThreadsBenchmark.makePSF(psf_filename)
+
+    for n_planes in [2, 3]:
+        [t1, r1, n1] = fitThreadsBenchmark.fitPlanes(psf_filename, n_planes, 1, n_peaks = 16, im_size = 64, reps = 1)
+        [t2, r2, n2] = fitThreadsBenchmark.fitPlanes(psf_filename, n_planes, n_planes, n_peaks = 16, im_size = 64, reps = 1)
+        assert (n1 == 1)
+        assert (n2 >= 1) and (n2 <= n_planes)
+        assert numpy.array_equal(r1, r2, equal_nan = True)
+
+
+if (__name__ == "__main__"):
+    test_mp_fit_threads_1()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Tests for multi_plane.psf_zstack
+"""
+
+import numpy
+import scipy
+import scipy.ndimage
+
+import storm_analysis.multi_plane.psf_zstack as psfZStack
+
+
+def test_aoi_sums_1():
+    """
+    Test extracting, re-centering and summing AOIs with drift.
+    """
+    aoi_size = 8
+    sigma = 1.5
+    driftx = 0.3
+    drifty = -0.2
+    x = numpy.array([20.3, 40.6, 2.0])
+    y = numpy.array([30.7, 15.2, 30.0])
+
+    xv = numpy.arange(64)[:,None]
+    yv = numpy.arange(64)[None,:]
+    frame_numbers = numpy.arange(5, 8)
+    frames = numpy.zeros((frame_numbers.size, 64, 64))
+    for i, fn in enumerate(frame_numbers):
+        for j in range(x.size):
+            xf = x[j] + driftx * fn
+            yf = y[j] + drifty * fn
+            frames[i,:,:] += numpy.exp(-((xv - xf)**2 + (yv - yf)**2)/(2.0*sigma*sigma))
+
+
+    # Add a sloped background so that the AOIs have non-zero edges.
+    frames += 5.0 + 0.05 * xv + 0.02 * yv
+
+    [sums, counts] = psfZStack.aoiSums(frames, frame_numbers, x, y, aoi_size, driftx = driftx, drifty = drifty)
+    assert (sums.shape == (3, 4*aoi_size, 4*aoi_size))
+    assert numpy.array_equal(counts, [2, 2, 2])
+
+    # Compare to zooming and shifting each AOI. The last bead is too
+    # close to the edge of the image.
+    for i, fn in enumerate(frame_numbers):
+        expected = numpy.zeros((4*aoi_size, 4*aoi_size))
+        for j in range(x.size - 1):
+            xf = x[j] + driftx * fn
+            yf = y[j] + drifty * fn
+            xi = int(xf)
+            yi = int(yf)
+            aoi = frames[i, xi - aoi_size:xi + aoi_size, yi - aoi_size:yi + aoi_size]
+            aoi = scipy.ndimage.zoom(aoi, 2.0)
+            expected += scipy.ndimage.shift(aoi, (-2.0*(xf-xi), -2.0*(yf-yi)), mode='nearest')
+        assert numpy.allclose(sums[i], expected, atol = 1.0e-10)
+
+def test_aoi_sums_2():
+    """
+    Test that all the AOIs being outside of the frames is handled.
+    """
+    frames = numpy.ones((2, 20, 20))
+    [sums, counts] = psfZStack.aoiSums(frames, [0, 1], numpy.array([1.0]), numpy.array([1.0]), 4)
+    assert (sums.shape == (2, 16, 16))
+    assert numpy.allclose(sums, 0.0)
+    assert numpy.array_equal(counts, [0, 0])
+
+def test_aoi_sums_3():
+    """
+    Test counting the AOIs in each frame when a bead drifts out of the frames.
+    """
+    frames = numpy.ones((3, 40, 40))
+    x = numpy.array([20.0, 30.0])
+    y = numpy.array([20.0, 20.0])
+    [sums, counts] = psfZStack.aoiSums(frames, [0, 1, 2], x, y, 4, driftx = 4.0)
+    assert numpy.array_equal(counts, [2, 2, 1])
+    for i in range(3):
+        assert numpy.allclose(sums[i]/counts[i], sums[0]/counts[0])
+
+
+if (__name__ == "__main__"):
+    test_aoi_sums_1()
+    test_aoi_sums_2()
+    test_aoi_sums_3()
@@ -264,6 +264,45 @@ def test_psf_fft10():
     assert (numpy.max(numpy.abs(psf_dz_c - psf_dz_py))) < 1.0e-6
 
     pfft_c.cleanup()
+
+def test_psf_fft11():
+    """
+    Test batched PSF and derivative calculation.
+    """
+    [pf_psf, geo, pf] = makePSFAndPF(-0.4, 0.4, 0.05)
+
+    pfft_c = psfFFTC.PSFFFT(pf_psf)
+    pfft_py = psfFFTPy.PSFFFT(pf_psf)
+
+    # More positions than fit in a single batch.
+    n_peaks = 100
+    numpy.random.seed(0)
+    dx = numpy.random.uniform(-1.0, 1.0, n_peaks)
+    dy = numpy.random.uniform(-1.0, 1.0, n_peaks)
+    dz = numpy.random.uniform(-4.0, 4.0, n_peaks)
+
+    psfs = pfft_c.getPSFs(dx, dy, dz)
+    [psfs_d, psfs_dx, psfs_dy, psfs_dz] = pfft_c.getPSFs(dx, dy, dz, derivatives = True)
+
+    assert (numpy.max(numpy.abs(psfs - psfs_d))) < 1.0e-12
+    for i in range(n_peaks):
+        pfft_c.translate(dx[i], dy[i], dz[i])
+        assert (numpy.max(numpy.abs(psfs[i] - pfft_c.getPSF()))) < 1.0e-12
+
+        [psf_dx, psf_dy, psf_dz] = pfft_c.getPSFDerivatives()
+        assert (numpy.max(numpy.abs(psfs_dx[i] - psf_dx))) < 1.0e-12
+        assert (numpy.max(numpy.abs(psfs_dy[i] - psf_dy))) < 1.0e-12
+        assert (numpy.max(numpy.abs(psfs_dz[i] - psf_dz))) < 1.0e-12
+
+    # Check some of the translated derivatives against the Python version.
+    for i in range(5):
+        pfft_py.translate(dx[i], dy[i], dz[i])
+        assert (numpy.max(numpy.abs(psfs[i] - pfft_py.getPSF()))) < 1.0e-6
+        assert (numpy.max(numpy.abs(psfs_dx[i] - pfft_py.getPSFdx()))) < 1.0e-6
+        assert (numpy.max(numpy.abs(psfs_dy[i] - pfft_py.getPSFdy()))) < 1.0e-6
+        assert (numpy.max(numpy.abs(psfs_dz[i] - pfft_py.getPSFdz()))) < 1.0e-6
+
+    pfft_c.cleanup()
     
 if (__name__ == "__main__"):
     test_psf_fft1()
@@ -277,3 +316,4 @@ if (__name__ == "__main__"):
     test_psf_fft9()
     test_psf_fft10()
     
+    test_psf_fft11()
@@ -7,6 +7,7 @@ import storm_analysis
 
 import storm_analysis.simulator.pupil_math as pupilMath
 import storm_analysis.pupilfn.make_pupil_fn as makePupilFn
+import storm_analysis.pupilfn.pupil_fn as pupilFn
 import storm_analysis.pupilfn.pupil_function_c as pfFnC
 
 import tifffile
@@ -281,6 +282,67 @@ def test_pupilfn_9():
     assert (numpy.max(numpy.abs(psf_c - psf_py))) < 1.0e-10
 
     pf_c.cleanup()
+
+def test_pupilfn_10():
+    """
+    Test batched PSF calculation.
+    """
+    geo = pupilMath.Geometry(20, 0.1, 0.6, 1.5, 1.4)
+    pf = geo.createFromZernike(1.0,  [[1.3, -1, 3], [1.3, -2, 2]])
+
+    pf_c = pfFnC.PupilFunction(geometry = geo)
+    pf_c.setPF(pf)
+
+    # More than one batch.
+    n_psfs = 40
+    numpy.random.seed(0)
+    dx = numpy.random.uniform(-1.0, 1.0, n_psfs)
+    dy = numpy.random.uniform(-1.0, 1.0, n_psfs)
+    dz = numpy.random.uniform(-0.5, 0.5, n_psfs)
+
+    psfs = pf_c.getPSFs(dx, dy, dz)
+    for i in range(n_psfs):
+        pf_c.translate(dx[i], dy[i], dz[i])
+        assert (numpy.max(numpy.abs(psfs[i] - pf_c.getPSF()))) < 1.0e-12
+
+    pf_c.cleanup()
+
+def test_pupilfn_11():
+    """
+    Test the PSF cache and the (shared) z-stack.
+    """
+    pf_file = storm_analysis.getPathOutputTest("pf_test.pfn")
+    makePupilFn.makePupilFunction(pf_file, 30, 0.1, [[1.3, 2, 2]])
+
+    zstack_dir = storm_analysis.getPathOutputTest("pf_zstack")
+    
+    pf_exact = pupilFn.PupilFunction(pf_filename = pf_file)
+    pf_zstack = pupilFn.PupilFunction(pf_filename = pf_file,
+                                      zmin = -300.0,
+                                      zmax = 300.0,
+                                      z_step = 5.0,
+                                      zstack_dir = zstack_dir)
+    for z in [-300.0, -152.5, 0.0, 12.5, 300.0]:
+        psf_exact = pf_exact.getPSF(z)
+        psf_zstack = pf_zstack.getPSF(z)
+        assert (numpy.max(numpy.abs(psf_exact - psf_zstack))/numpy.max(psf_exact) < 1.0e-2)
+
+        # Check that the cached PSF is the same.
+        assert numpy.allclose(psf_exact, pf_exact.getPSF(z))
+
+    # Outside of the z-stack.
+    assert numpy.allclose(pf_exact.getPSF(400.0), pf_zstack.getPSF(400.0))
+    
+    assert (pf_exact.psf_cache.getStats() == [5, 6])
+
+    # This should load the z-stack calculated above.
+    pf_shared = pupilFn.PupilFunction(pf_filename = pf_file,
+                                      zmin = -300.0,
+                                      zmax = 300.0,
+                                      z_step = 5.0,
+                                      zstack_dir = zstack_dir)
+    assert isinstance(pf_shared.zstack.zstack, numpy.memmap)
+    assert numpy.allclose(pf_shared.getPSF(12.5), pf_zstack.getPSF(12.5))
         
             
 if (__name__ == "__main__"):
@@ -293,3 +355,5 @@ if (__name__ == "__main__"):
     test_pupilfn_7()
     test_pupilfn_8()
     test_pupilfn_9()
+    test_pupilfn_10()
+    test_pupilfn_11()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Tests of Ripley's K / pair-correlation analysis.
+"""
+import math
+import numpy
+
+import storm_analysis
+
+import storm_analysis.ripley.ripley as ripley
+
+
+def test_ripley_csr():
+    """
+    Test that K(r) is close to pi*r*r for uniformly distributed localizations.
+    """
+    numpy.random.seed(0)
+    x = numpy.random.uniform(high = 10000.0, size = 20000)
+    y = numpy.random.uniform(high = 10000.0, size = 20000)
+
+    r_edges = numpy.linspace(0.0, 200.0, 11)
+    results = ripley.ripley(x, y, r_edges, bounds = [0.0, 10000.0, 0.0, 10000.0])
+
+    csr_k = math.pi * results["r"] * results["r"]
+    assert numpy.allclose(results["k"], csr_k, rtol = 0.1)
+    assert numpy.allclose(results["g"][2:], numpy.ones(8), atol = 0.2)
+    assert (numpy.max(numpy.abs(results["h"])) < 5.0)
+
+def test_ripley_set_points():
+    """
+    Test that changing the indexed localizations gives the same counts
+    as a new PairCounter.
+    """
+    numpy.random.seed(0)
+    bounds = [0.0, 5000.0, 0.0, 5000.0]
+    r_edges = numpy.linspace(0.0, 100.0, 11)
+
+    counter = ripley.PairCounter(x = numpy.random.uniform(high = 5000.0, size = 5000),
+                                 y = numpy.random.uniform(high = 5000.0, size = 5000),
+                                 bounds = bounds,
+                                 block_size = 2000)
+    for size in [5000, 3000]:
+        x = numpy.random.uniform(high = 5000.0, size = size)
+        y = numpy.random.uniform(high = 5000.0, size = size)
+        counter.setPoints(x, y)
+        new_counter = ripley.PairCounter(x = x, y = y, bounds = bounds)
+        assert numpy.allclose(counter.count(x, y, r_edges, exclude_self = True),
+                              new_counter.count(x, y, r_edges, exclude_self = True))
+
+def test_ripley_threads():
+    """
+    Test that the results do not depend on the number of threads.
+    """
+    numpy.random.seed(0)
+    x = numpy.random.uniform(high = 5000.0, size = 50000)
+    y = numpy.random.uniform(high = 5000.0, size = 50000)
+
+    r_edges = numpy.linspace(0.0, 100.0, 11)
+    results1 = ripley.ripley(x, y, r_edges, n_threads = 1)
+    results4 = ripley.ripley(x, y, r_edges, n_threads = 4)
+
+    assert numpy.allclose(results1["k"], results4["k"])
+
+def test_ripley_clustered():
+    """
+    Test that clustered localizations are outside of the CSR envelope.
+    """
+    numpy.random.seed(0)
+    cx = numpy.random.uniform(high = 10000.0, size = 50)
+    cy = numpy.random.uniform(high = 10000.0, size = 50)
+    x = numpy.repeat(cx, 40) + numpy.random.normal(scale = 30.0, size = 2000)
+    y = numpy.repeat(cy, 40) + numpy.random.normal(scale = 30.0, size = 2000)
+
+    r_edges = numpy.linspace(0.0, 200.0, 11)
+    results = ripley.ripley(x, y, r_edges, n_sims = 19, seed = 1)
+
+    assert (results["g"][0] > 10.0)
+    assert numpy.all(results["k"] > results["k_high"])
+
+def test_ripley_cross():
+    """
+    Test cross-K for two independent categories.
+    """
+    numpy.random.seed(0)
+    x1 = numpy.random.uniform(high = 10000.0, size = 5000)
+    y1 = numpy.random.uniform(high = 10000.0, size = 5000)
+    x2 = numpy.random.uniform(high = 10000.0, size = 10000)
+    y2 = numpy.random.uniform(high = 10000.0, size = 10000)
+
+    r_edges = numpy.linspace(0.0, 300.0, 7)
+    results = ripley.ripley(x1, y1, r_edges,
+                            x2 = x2,
+                            y2 = y2,
+                            bounds = [0.0, 10000.0, 0.0, 10000.0],
+                            n_sims = 19,
+                            seed = 1)
+
+    csr_k = math.pi * results["r"] * results["r"]
+    assert numpy.allclose(results["k"][1:], csr_k[1:], rtol = 0.1)
+    assert numpy.all(results["k_low"] < csr_k)
+    assert numpy.all(results["k_high"] > csr_k)
+
+def test_ripley_envelope():
+    """
+    Test that the univariate CSR envelope contains CSR.
+    """
+    r_edges = numpy.linspace(0.0, 300.0, 7)
+    counter = ripley.PairCounter(x = numpy.array([0.0, 10000.0]),
+                                 y = numpy.array([0.0, 10000.0]))
+    [k_low, k_high, g_low, g_high] = ripley.csrEnvelope(counter, 2000, r_edges, n_sims = 19, seed = 1)
+
+    csr_k = math.pi * r_edges[1:] * r_edges[1:]
+    assert numpy.all(k_low < csr_k)
+    assert numpy.all(k_high > csr_k)
+    assert numpy.all(g_low < 1.0)
+    assert numpy.all(g_high > 1.0)
+
+def test_ripley_max_r():
+    """
+    Test that a maximum distance larger than the window is rejected.
+    """
+    x = numpy.array([0.0, 100.0, 200.0])
+    y = numpy.array([0.0, 500.0, 1000.0])
+    try:
+        ripley.ripley(x, y, numpy.linspace(0.0, 300.0, 4))
+    except ripley.RipleyException:
+        return
+    assert False, "No exception."
+
+def test_ripley_analysis():
+    """
+    Test analysis of an Insight3 file.
+    """
+    alist_name = storm_analysis.getData("test/data/test_clustering_list.bin")
+    output_name = storm_analysis.getPathOutputTest("test_ripley.txt")
+
+    results = ripley.ripleyAnalysis(alist_name, output_name, 40.0, 4)
+
+    # This file is strongly clustered.
+    assert (results["g"][0] > 10.0)
+
+    with open(output_name) as fp:
+        assert (len(fp.readlines()) == 5)
+
+
+if (__name__ == "__main__"):
+    test_ripley_csr()
+    test_ripley_set_points()
+    test_ripley_threads()
+    test_ripley_clustered()
+    test_ripley_cross()
+    test_ripley_envelope()
+    test_ripley_max_r()
+    test_ripley_analysis()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Tests of the localization spatial index.
+"""
+import numpy
+import os
+import shutil
+
+import storm_analysis
+
+import storm_analysis.sa_library.i3dtype as i3dtype
+import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.sa_library.spatial_index as spatialIndex
+import storm_analysis.sa_library.writeinsight3 as writeinsight3
+
+
+def test_spatial_index_1():
+    """
+    Test nearest neighbor queries against the (brute force) C library.
+    """
+    numpy.random.seed(0)
+    x1 = numpy.random.uniform(high = 100.0, size = 200)
+    y1 = numpy.random.uniform(high = 100.0, size = 200)
+    x2 = numpy.random.uniform(high = 100.0, size = 300)
+    y2 = numpy.random.uniform(high = 100.0, size = 300)
+
+    index = spatialIndex.SpatialIndex(x = x2, y = y2)
+    [dist, p_index] = index.query(numpy.stack((x1, y1), axis = -1))
+
+    assert numpy.allclose(dist, utilC.peakToPeakDist(x1, y1, x2, y2))
+    assert numpy.array_equal(p_index, utilC.peakToPeakIndex(x1, y1, x2, y2))
+
+def test_spatial_index_2():
+    """
+    Test per frame queries.
+    """
+    numpy.random.seed(0)
+    x = numpy.random.uniform(high = 100.0, size = 500)
+    y = numpy.random.uniform(high = 100.0, size = 500)
+    f = numpy.random.randint(1, 10, size = 500)
+
+    index = spatialIndex.SpatialIndex(x = x, y = y, frame = f)
+
+    for frame in range(1, 11):
+        mask = (f == frame)
+        assert numpy.array_equal(numpy.sort(index.getFrameIndices(frame)), numpy.nonzero(mask)[0])
+
+        [dist, p_index] = index.queryFrame(frame, [50.0, 50.0], distance_upper_bound = 20.0)
+        if (numpy.count_nonzero(mask) > 0):
+            dd = numpy.sqrt((x - 50.0)**2 + (y - 50.0)**2)
+            dd[~mask] = numpy.inf
+            if (numpy.min(dd) < 20.0):
+                assert (p_index == numpy.argmin(dd))
+            else:
+                assert (p_index == index.n)
+        else:
+            assert (p_index == index.n)
+
+        n_close = len(index.queryRadiusFrame(frame, [50.0, 50.0], 20.0))
+        assert (n_close == numpy.count_nonzero(mask & ((x - 50.0)**2 + (y - 50.0)**2 <= 400.0)))
+
+def test_spatial_index_3():
+    """
+    Test loading an index from an Insight3 file and the index cache.
+    """
+    bin_name = storm_analysis.getPathOutputTest("test_spatial_index.bin")
+    cache_dir = storm_analysis.getPathOutputTest("test_spatial_index_cache")
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+
+    numpy.random.seed(0)
+    i3_locs = i3dtype.createDefaultI3Data(100)
+    i3dtype.posSet(i3_locs, "x", numpy.random.uniform(high = 100.0, size = 100))
+    i3dtype.posSet(i3_locs, "y", numpy.random.uniform(high = 100.0, size = 100))
+    i3dtype.posSet(i3_locs, "z", numpy.random.uniform(low = -200.0, high = 200.0, size = 100))
+    i3dtype.setI3Field(i3_locs, "fr", numpy.arange(100)//10 + 1)
+
+    with writeinsight3.I3Writer(bin_name) as i3w:
+        i3w.addMolecules(i3_locs)
+
+    # No caching by default.
+    [i3_data, index0] = spatialIndex.loadI3Index(bin_name)
+    assert not os.path.exists(cache_dir)
+
+    [i3_data, index1] = spatialIndex.loadI3Index(bin_name, z_scale = 1.0/160.0, cache_dir = cache_dir)
+    assert (len(os.listdir(cache_dir)) == 1)
+    assert (index1.data.shape == (100, 3))
+    assert (index1.getNumberFrames() == 10)
+
+    [i3_data, index2] = spatialIndex.loadI3Index(bin_name, z_scale = 1.0/160.0, cache_dir = cache_dir)
+    assert numpy.allclose(index1.data, index2.data)
+    assert numpy.array_equal(index1.getFrameIndices(4), index2.getFrameIndices(4))
+
+    # Different options should not use the cached index.
+    [i3_data, index3] = spatialIndex.loadI3Index(bin_name, cache_dir = cache_dir)
+    assert (len(os.listdir(cache_dir)) == 2)
+    assert (index3.data.shape == (100, 2))
+
+    [dist, p_index] = index3.queryFrame(3, index3.data[20:30,:], k = 2)
+    assert numpy.allclose(dist[:,0], numpy.zeros(10))
+    assert numpy.array_equal(p_index[:,0], numpy.arange(20, 30))
+    
+
+if (__name__ == "__main__"):
+    test_spatial_index_1()
+    test_spatial_index_2()
+    test_spatial_index_3()
@@ -8,9 +8,13 @@ import random
 
 import storm_analysis
 
+import storm_analysis.sa_library.ia_utilities_c as utilC
+import storm_analysis.spliner.cubic_fit_c as cubicFitC
 import storm_analysis.spliner.cubic_spline_c as cubicSplineC
+import storm_analysis.spliner.spline1D as spline1D
 import storm_analysis.spliner.spline2D as spline2D
 import storm_analysis.spliner.spline3D as spline3D
+import storm_analysis.spliner.spline_to_psf as splineToPSF
 
 
 reps = 1000
@@ -139,6 +143,245 @@ def test_psf_3D_dz():
         #print("{0:.3f} {1:.3f}".format(py_spline.dzf(x, y), c_spline.dzf(x, y)))
         assert (abs(py_spline.dzf(x, y, z) - c_spline.dzf(x, y, z)) < 1.0e-6)
 
+def test_spline_1D_matrix():
+    """
+    Test that the spline evaluation matrix matches Spline1D.
+    """
+    y = numpy.random.uniform(size = 11)
+    x = numpy.concatenate((numpy.random.uniform(0.0, 10.0, size = 100), numpy.arange(11.0)))
+
+    sp = spline1D.Spline1D(y)
+    em = spline1D.evaluationMatrix(y.size, x)
+    assert numpy.allclose(numpy.dot(em, y), numpy.array([sp.f(elt) for elt in x]))
+
+def test_spline_2D_coeff():
+    """
+    Test that a 2D spline goes through its values.
+    """
+    d = numpy.random.uniform(size = (9,9))
+    py_spline = spline2D.Spline2D(d)
+    for i in range(d.shape[0]):
+        for j in range(d.shape[1]):
+            assert (abs(py_spline.f(float(i), float(j)) - d[i,j]) < 1.0e-9)
+
+def test_spline_3D_coeff():
+    """
+    Test that a 3D spline goes through its values and matches
+    the 2D spline for data that does not change in z.
+    """
+    d = numpy.random.uniform(size = (7,7,7))
+    py_spline = spline3D.Spline3D(d)
+    for i in range(d.shape[0]):
+        for j in range(d.shape[1]):
+            for k in range(d.shape[2]):
+                assert (abs(py_spline.f(float(i), float(j), float(k)) - d[i,j,k]) < 1.0e-9)
+
+    d2 = numpy.random.uniform(size = (7,7))
+    sp_2d = spline2D.Spline2D(d2)
+    sp_3d = spline3D.Spline3D(numpy.tile(d2, (7,1,1)))
+    for i in range(100):
+        [y, x] = numpy.random.uniform(0.0, 6.0, size = 2)
+        z = random.uniform(0.0, 6.0)
+        assert (abs(sp_2d.f(y, x) - sp_3d.f(z, y, x)) < 1.0e-9)
+
+def test_spline_grid_2D():
+    """
+    Test C grid evaluation of a 2D spline.
+    """
+    spline_filename = storm_analysis.getData("test/data/test_spliner_psf_2d.spline")
+    with open(spline_filename, "rb") as fp:
+        spline_data = pickle.load(fp)
+
+    py_spline = spline2D.Spline2D(spline_data["spline"], spline_data["coeff"])
+    c_spline = cubicSplineC.CSpline2D(py_spline)
+
+    size = py_spline.getSize()
+    ys = numpy.append(numpy.random.uniform(0.0, size, 10), [0.0, size])
+    xs = numpy.append(numpy.random.uniform(0.0, size, 12), [0.0, size])
+
+    vals = c_spline.dfGrid(ys, xs)
+    assert numpy.allclose(vals[0], c_spline.fGrid(ys, xs))
+    for i, y in enumerate(ys):
+        for j, x in enumerate(xs):
+            assert (abs(vals[0][i,j] - py_spline.f(y, x)) < 1.0e-9)
+            assert (abs(vals[1][i,j] - py_spline.dxf(y, x)) < 1.0e-9)
+            assert (abs(vals[2][i,j] - py_spline.dyf(y, x)) < 1.0e-9)
+
+def test_spline_grid_3D():
+    """
+    Test C grid evaluation of a 3D spline.
+    """
+    py_spline = spline3D.Spline3D(numpy.random.uniform(size = (9,9,9)))
+    c_spline = cubicSplineC.CSpline3D(py_spline)
+
+    size = py_spline.getSize()
+    ys = numpy.append(numpy.random.uniform(0.0, size, 10), [0.0, size])
+    xs = numpy.append(numpy.random.uniform(0.0, size, 12), [0.0, size])
+
+    for z in [0.0, random.uniform(0.0, size), float(size)]:
+        vals = c_spline.dfGrid(z, ys, xs)
+        assert numpy.allclose(vals[0], c_spline.fGrid(z, ys, xs))
+        for i, y in enumerate(ys):
+            for j, x in enumerate(xs):
+                assert (abs(vals[0][i,j] - py_spline.f(z, y, x)) < 1.0e-9)
+                assert (abs(vals[1][i,j] - py_spline.dxf(z, y, x)) < 1.0e-9)
+                assert (abs(vals[2][i,j] - py_spline.dyf(z, y, x)) < 1.0e-9)
+                assert (abs(vals[3][i,j] - py_spline.dzf(z, y, x)) < 1.0e-9)
+
+    # Out of range positions are zero.
+    assert (numpy.max(numpy.abs(c_spline.fGrid(-1.0, ys, xs))) == 0.0)
+    assert (numpy.max(numpy.abs(c_spline.fGrid(0.5, numpy.array([-1.0, size + 1.0]), xs))) == 0.0)
+
+def test_spline_to_psf():
+    """
+    Test (cached) PSF generation from a spline.
+    """
+    d = numpy.random.uniform(size = (20,20,20))
+    spline_data = {"spline" : d,
+                   "coeff" : spline3D.Spline3D(d).getCoeff(),
+                   "zmin" : -500.0,
+                   "zmax" : 500.0}
+    s_to_psf = splineToPSF.SplineToPSF3D(spline_file = spline_data, psf_cache_size = 2)
+    py_spline = s_to_psf.spline
+
+    for up_sample in [1, 2]:
+        psf = s_to_psf.getPSF(100.0, up_sample = up_sample, normalize = False)
+        scaled_z = s_to_psf.getScaledZ(100.0)
+        psf_size = int(up_sample * (s_to_psf.getSplineSize() - 1)/2)
+        offset = 0.0 if ((psf_size%2) == 0) else 1.0
+        for y in range(psf_size):
+            for x in range(psf_size):
+                expected = py_spline.f(scaled_z,
+                                       float(2*y)/float(up_sample) + offset,
+                                       float(2*x)/float(up_sample) + offset)
+                assert (abs(psf[y,x] - expected) < 1.0e-9)
+
+    # Check caching.
+    psf = s_to_psf.getPSF(0.0, shape = [30, 30])
+    assert (psf.shape == (30, 30))
+    assert (abs(numpy.sum(psf) - 1.0) < 1.0e-9)
+    psf[:,:] = 0.0
+    assert (abs(numpy.sum(s_to_psf.getPSF(0.0, shape = (30, 30))) - 1.0) < 1.0e-9)
+    assert (len(s_to_psf.psf_cache) == 2)
+
+    # No caching.
+    s_to_psf = splineToPSF.SplineToPSF3D(spline_file = spline_data, psf_cache_size = 0)
+    psf1 = s_to_psf.getPSF(0.0, shape = [30, 30])
+    psf2 = s_to_psf.getPSF(0.0, shape = [30, 30])
+    assert numpy.allclose(psf1, psf2)
+    assert (len(s_to_psf.psf_cache) == 0)
+
+def fitAstigmaticPeaks(**kwds):
+    """
+    Fit two peaks in a test image with a 3D spline fitter, kwds are
+    passed to the fitter. Returns the fit results.
+    """
+    # Astigmatic Gaussian PSF.
+    size = 25
+    c = 0.5*(size - 1)
+    [zz, yy, xx] = numpy.mgrid[0:size,0:size,0:size]
+    wx = 2.0 + 0.1*zz
+    wy = 4.4 - 0.1*zz
+    d = numpy.exp(-(xx-c)*(xx-c)/(2.0*wx*wx) - (yy-c)*(yy-c)/(2.0*wy*wy))
+    spline_data = {"spline" : d,
+                   "coeff" : spline3D.Spline3D(d).getCoeff(),
+                   "zmin" : -500.0,
+                   "zmax" : 500.0}
+
+    # Note: The fitter frees the C spline in cleanup() so each fitter needs it's own spline.
+    s_to_psf = splineToPSF.SplineToPSF3D(spline_file = spline_data, psf_cache_size = 0)
+
+    # Test image.
+    image = numpy.ones((40, 40))*10.0
+    psf = s_to_psf.getPSF(-100.0, normalize = False)
+    image[8:8+psf.shape[0],10:10+psf.shape[1]] += 500.0*psf
+    psf = s_to_psf.getPSF(150.0, normalize = False)
+    image[20:20+psf.shape[0],18:18+psf.shape[1]] += 800.0*psf
+    image = numpy.ascontiguousarray(image)
+
+    peaks = numpy.zeros((2, utilC.getNPeakPar()))
+    peaks[:,utilC.getHeightIndex()] = [400.0, 700.0]
+    peaks[:,utilC.getXCenterIndex()] = [16.2, 23.7]
+    peaks[:,utilC.getYCenterIndex()] = [14.3, 25.8]
+    peaks[:,utilC.getBackgroundIndex()] = 10.0
+    peaks[:,utilC.getZCenterIndex()] = 0.5*size
+
+    fitter = cubicFitC.CSpline3DFit(spline_fn = s_to_psf, **kwds)
+    fitter.newImage(image)
+    results = fitter.doFit(peaks)
+
+    # The fitter should not change the precision of the PSFs.
+    assert numpy.array_equal(psf, s_to_psf.getPSF(150.0, normalize = False))
+
+    fitter.cleanup(verbose = False)
+    return results
+
+def test_spline_float_fit():
+    """
+    Test that single precision fitting gives the same results as double
+    precision fitting.
+    """
+    results = [fitAstigmaticPeaks(), fitAstigmaticPeaks(single_precision = True)]
+    for index in [utilC.getXCenterIndex(), utilC.getYCenterIndex()]:
+        assert numpy.allclose(results[0][:,index], results[1][:,index], atol = 1.0e-4)
+    for index in [utilC.getHeightIndex(), utilC.getZCenterIndex()]:
+        assert numpy.allclose(results[0][:,index], results[1][:,index], rtol = 1.0e-4)
+
+def test_spline_float_grid_2D():
+    """
+    Test single precision C grid evaluation of a 2D spline.
+    """
+    numpy.random.seed(0)
+    py_spline = spline2D.Spline2D(numpy.random.uniform(size = (9,9)))
+    c_spline = cubicSplineC.CSpline2D(py_spline)
+
+    size = py_spline.getSize()
+    ys = numpy.append(numpy.random.uniform(0.0, size, 10), [0.0, size, -1.0])
+    xs = numpy.append(numpy.random.uniform(0.0, size, 12), [0.0, size, size + 1.0])
+
+    d_vals = c_spline.dfGrid(ys, xs)
+    c_spline.setSinglePrecision(True)
+    f_vals = c_spline.dfGrid(ys, xs)
+    assert numpy.allclose(f_vals[0], c_spline.fGrid(ys, xs))
+    for i in range(3):
+        assert numpy.allclose(d_vals[i], f_vals[i], rtol = 0.0, atol = 1.0e-5*numpy.max(numpy.abs(d_vals[i])))
+
+    c_spline.setSinglePrecision(False)
+    assert numpy.allclose(d_vals[0], c_spline.fGrid(ys, xs), rtol = 0.0, atol = 1.0e-12)
+
+def test_spline_float_grid_3D():
+    """
+    Test single precision C grid evaluation of a 3D spline.
+    """
+    numpy.random.seed(0)
+    random.seed(0)
+    py_spline = spline3D.Spline3D(numpy.random.uniform(size = (9,9,9)))
+    c_spline = cubicSplineC.CSpline3D(py_spline)
+
+    size = py_spline.getSize()
+    ys = numpy.append(numpy.random.uniform(0.0, size, 10), [0.0, size, -1.0])
+    xs = numpy.append(numpy.sort(numpy.random.uniform(0.0, size, 20)), [0.0, size, size + 1.0])
+
+    for z in [0.0, random.uniform(0.0, size), float(size), size + 1.0]:
+        c_spline.setSinglePrecision(False)
+        d_vals = c_spline.dfGrid(z, ys, xs)
+        c_spline.setSinglePrecision(True)
+        f_vals = c_spline.dfGrid(z, ys, xs)
+        assert numpy.allclose(f_vals[0], c_spline.fGrid(z, ys, xs))
+        for i in range(4):
+            atol = 1.0e-5*max(numpy.max(numpy.abs(d_vals[i])), 1.0e-6)
+            assert numpy.allclose(d_vals[i], f_vals[i], rtol = 0.0, atol = atol)
+
+def test_spline_table_fit():
+    """
+    Test that fitting with a pre-computed spline table gives (almost) the
+    same results as fitting with the spline.
+    """
+    results = [fitAstigmaticPeaks(), fitAstigmaticPeaks(table_accuracy = 1.0e-3)]
+    for index in [utilC.getXCenterIndex(), utilC.getYCenterIndex()]:
+        assert numpy.allclose(results[0][:,index], results[1][:,index], atol = 1.0e-2)
+    for index in [utilC.getHeightIndex(), utilC.getZCenterIndex()]:
+        assert numpy.allclose(results[0][:,index], results[1][:,index], rtol = 1.0e-2)
 
 if (__name__ == "__main__"):
     test_psf_2D_f()
@@ -148,3 +391,13 @@ if (__name__ == "__main__"):
     test_psf_3D_dx()
     test_psf_3D_dy()
     test_psf_3D_dz()
+    test_spline_1D_matrix()
+    test_spline_2D_coeff()
+    test_spline_3D_coeff()
+    test_spline_grid_2D()
+    test_spline_grid_3D()
+    test_spline_to_psf()
+    test_spline_float_fit()
+    test_spline_float_grid_2D()
+    test_spline_float_grid_3D()
+    test_spline_table_fit()
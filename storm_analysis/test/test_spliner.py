@@ -3,6 +3,8 @@
 Tests for Spliner analysis.
 """
 
+import numpy
+
 import storm_analysis
 
 import storm_analysis.test.verifications as veri
@@ -30,6 +32,101 @@ def _test_measure_psf_2D():
     measurePSF(movie, "", mlist, psf, want2d = True, aoi_size = 5)
 
     
+def test_measure_psf_utils_1():
+    """
+    Test that the PSF accumulator re-centers and upsamples off-center peaks.
+    """
+    import storm_analysis.spliner.measure_psf_utils as measurePSFUtils
+
+    aoi_size = 8
+    sigma = 1.5
+    pos = [[20.3, 30.7, -40.0], [40.6, 15.2, 10.0], [10.1, 50.9, 60.0], [2.0, 30.0, 0.0]]
+
+    x = numpy.arange(64)[:,None]
+    y = numpy.arange(64)[None,:]
+    image = numpy.zeros((64,64))
+    for elt in pos:
+        image += numpy.exp(-((x - elt[0])**2 + (y - elt[1])**2)/(2.0*sigma*sigma))
+
+    psf_acc = measurePSFUtils.PSFAccumulator(aoi_size = aoi_size,
+                                             z_range = 100.0,
+                                             z_step = 50.0)
+    pos = numpy.array(pos)
+    
+    # The last peak is too close to the edge of the image.
+    assert (psf_acc.addAOIs(image, pos[:,0], pos[:,1], pos[:,2]) == 3)
+
+    [average_psf, totals] = psf_acc.getPSF()
+    assert numpy.allclose(totals, numpy.array([0, 1, 1, 1, 0]))
+    assert numpy.allclose(psf_acc.getZValues(), [-100.0, -50.0, 0.0, 50.0, 100.0])
+
+    # Compare to the PSF of a peak centered on a pixel.
+    image = numpy.exp(-((x - 32.0)**2 + (y - 32.0)**2)/(2.0*sigma*sigma))
+    ref_acc = measurePSFUtils.PSFAccumulator(aoi_size = aoi_size,
+                                             z_range = 100.0,
+                                             z_step = 50.0,
+                                             want2d = True)
+    ref_acc.addAOIs(image, [32.0], [32.0], [0.0])
+    expected = ref_acc.getPSF()[0][0]
+    for i in [1,2,3]:
+        assert numpy.allclose(average_psf[i]/numpy.max(average_psf[i]), expected, atol = 2.0e-2)
+
+        
+def test_measure_psf_utils_3():
+    """
+    Test the PSF accumulator against zooming and shifting each AOI for
+    AOIs whose edges are not zero.
+    """
+    import scipy.ndimage
+    import storm_analysis.spliner.measure_psf_utils as measurePSFUtils
+
+    aoi_size = 6
+    numpy.random.seed(0)
+    image = numpy.random.uniform(low = 10.0, high = 20.0, size = (50,50))
+    xf = numpy.array([12.3, 25.8, 30.1, 40.5])
+    yf = numpy.array([20.7, 12.2, 35.9, 25.4])
+    zf = numpy.array([0.0, 0.0, 50.0, 50.0])
+
+    psf_acc = measurePSFUtils.PSFAccumulator(aoi_size = aoi_size,
+                                             z_range = 50.0,
+                                             z_step = 50.0,
+                                             block_size = 3)
+    assert (psf_acc.addAOIs(image, xf, yf, zf) == 4)
+    [average_psf, totals] = psf_acc.getPSF()
+    assert numpy.allclose(totals, numpy.array([0, 2, 2]))
+
+    expected = numpy.zeros(average_psf.shape)
+    for i in range(xf.size):
+        xi = int(xf[i])
+        yi = int(yf[i])
+        zi = int(round(zf[i]/50.0)) + 1
+        psf = scipy.ndimage.zoom(image[xi-aoi_size:xi+aoi_size, yi-aoi_size:yi+aoi_size], 2.0)
+        expected[zi] += scipy.ndimage.shift(psf, (-2.0*(xf[i]-xi), -2.0*(yf[i]-yi)), mode='nearest')
+
+    for i in [1,2]:
+        edge = numpy.concatenate((expected[i,0,:], expected[i,-1,:], expected[i,:,0], expected[i,:,-1]))
+        expected[i] -= numpy.mean(edge)
+        expected[i] = expected[i]/numpy.sum(numpy.abs(expected[i]))
+    expected = expected/numpy.max(expected)
+
+    assert numpy.allclose(average_psf, expected, atol = 1.0e-10)
+
+        
+def test_measure_psf_utils_2():
+    """
+    Test grouping localizations by frame.
+    """
+    import storm_analysis.spliner.measure_psf_utils as measurePSFUtils
+
+    frames = numpy.array([3, 1, 3, 0, 1, 3])
+    groups = measurePSFUtils.groupByFrame(frames)
+
+    assert (sorted(groups.keys()) == [0, 1, 3])
+    assert numpy.allclose(groups[0], [3])
+    assert numpy.allclose(groups[1], [1, 4])
+    assert numpy.allclose(groups[3], [0, 2, 5])
+
+    
 def _test_psf_to_spline():
 
     psf = storm_analysis.getPathOutputTest("test_spliner_psf.psf")
@@ -151,6 +248,9 @@ if (__name__ == "__main__"):
 #    test_measure_psf_2D()
 #    test_psf_to_spline()
 #    test_psf_to_spline_2D()
+    test_measure_psf_utils_1()
+    test_measure_psf_utils_2()
+    test_measure_psf_utils_3()
     
     test_spliner_std()
     test_spliner_std_2D()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Batch Voronoi clustering analysis.
+
+The files are analyzed in-process by a pool of workers (see
+sa_library/batch_pool.py).
+
+Hazen 10/26
+"""
+
+import glob
+import os
+
+import storm_analysis.sa_library.batch_pool as batchPool
+
+import storm_analysis.voronoi.voronoi_analysis as voronoiAnalysis
+
+
+def batchAnalysis(input_directory, output_directory, density_factor, min_size = 30, image_size = None, max_processes = 2):
+    """
+    Returns a batch_pool.BatchSummary object.
+    """
+    # Find appropriate bin files.
+    bin_files = glob.glob(input_directory + "*_alist.bin")
+    if(len(bin_files)==0):
+        bin_files = glob.glob(input_directory + "*_list.bin")
+
+    # Generate jobs.
+    jobs = []
+    for filename in sorted(bin_files):
+
+        # skip clustering related bin files
+        if ("clusters" in filename) or ("srt" in filename):
+            continue
+
+        print("Found:", filename)
+
+        jobs.append([filename,
+                     voronoiJob,
+                     [filename, density_factor, output_directory],
+                     {"min_size" : min_size,
+                      "image_size" : image_size}])
+
+    summary = batchPool.batchPool(jobs, max_processes = max_processes)
+    print(summary)
+    return summary
+
+
+def voronoiJob(bin_file, density_factor, output_directory, min_size = 30, image_size = None):
+    """
+    Cluster a single file, and optionally make the cluster images.
+    """
+    voronoiAnalysis.voronoiAnalysis(bin_file, density_factor, output_directory, min_size = min_size)
+
+    if image_size is not None:
+        import storm_analysis.dbscan.cluster_images as clusterImages
+
+        root_name = output_directory + os.path.basename(bin_file)[:-8] + "srt"
+        clusterImages.clusterImages(root_name + "_size_list.bin",
+                                    "Voronoi Clustering",
+                                    min_size,
+                                    20,
+                                    root_name,
+                                    [image_size, image_size])
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Batch Voronoi based clustering.')
+
+    parser.add_argument('--dir', dest='directory', type=str, required=True,
+                        help = "The name of the directory containing the Insight3 format files to analyze.")
+    parser.add_argument('--density', dest='density', type=float, required=True,
+                        help = "The density multiplier to be in a cluster. The median polygon size is multiplied by this value to give a threshold for polygon size to be in a cluster.")
+    parser.add_argument('--output_dir', dest='output_dir', type=str, required=True,
+                        help = "The directory to save the clustering results files in.")
+    parser.add_argument('--min_size', dest='min_size', type=int, required=False, default=30,
+                        help = "The minimum cluster size to include when calculating cluster statistics.")
+    parser.add_argument('--image_size', dest='image_size', type=int, required=False,
+                        help = "The size of the original STORM image in pixels. If this is specified cluster images will also be made.")
+    parser.add_argument('--processes', dest='processes', type=int, required=False, default=2,
+                        help = "The number of worker processes to use. The default is 2.")
+
+    args = parser.parse_args()
+
+    batchAnalysis(args.directory,
+                  args.output_dir,
+                  args.density,
+                  min_size = args.min_size,
+                  image_size = args.image_size,
+                  max_processes = args.processes)